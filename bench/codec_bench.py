@@ -0,0 +1,112 @@
+# bench/codec_bench.py
+"""
+序列化与传输开销基准 (Codec Benchmark)
+
+用灵感库中的真实 p5.js 代码构造本服务典型的大载荷 (/timing 会话快照、/merge 请求、/chat 响应)，比较：
+- 解析: 标准库 json.loads vs orjson.loads
+- 序列化: Starlette JSONResponse 的 json.dumps vs orjson.dumps
+- 传输字节数: 原始 JSON vs 不同等级的 gzip，以及压缩 / 解压耗时
+
+用法:
+    python -m bench.codec_bench --versions 30 --messages 10
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import timeit
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+
+import orjson
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(__file__), "..", "services", "data", "p5_examples.json")
+
+
+def build_payloads(examples: List[Dict], versions: int, messages: int, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    codes = {}
+    for i in range(versions):
+        lines = rng.choice(examples)["code"].splitlines()
+        lines.insert(rng.randrange(len(lines) + 1), f"  // 版本 {i} 的修改")
+        codes[f"node-{i}"] = "\n".join(lines)
+    conversations = {
+        node: [
+            {"role": "user" if j % 2 == 0 else "assistant",
+             "content": "能不能让画面更有呼吸感？颜色随鼠标变化。" * (1 + j % 3)}
+            for j in range(messages)
+        ]
+        for node in codes
+    }
+    timing = {
+        "session_id": "bench", "user_id": "u1", "task": "TaskA",
+        "timingData": {"canvas": [{"start": 1000 * i, "end": 1000 * i + 900, "duration": 900} for i in range(200)]},
+        "usageData": {
+            "totalVersions": versions, "versionConversations": conversations, "previewClicks": 42,
+            "actionCounts": {"delete": 1, "modify": 3, "merge": 2, "duplicate": 1}, "versionCodes": codes,
+        },
+    }
+    code_1, code_2 = list(codes.values())[:2]
+    merge_request = {
+        "session_id": "bench", "version_id_1": "a", "code_1": code_1, "description_1": "版本一",
+        "version_id_2": "b", "code_2": code_2, "description_2": "版本二",
+        "instruction": "把两个版本的视觉效果融合在一起", "mode": "explorative",
+    }
+    chat_response = {
+        "code": code_1,
+        "rationale": "- ✨ 引入基于时间的 `sin()` 振荡，让网格拥有呼吸感。\n" * 4,
+        "reflection": "- 💬 这种呼吸节奏想传达怎样的情绪？\n" * 3,
+    }
+    return {"timing": timing, "merge_request": merge_request, "chat_response": chat_response}
+
+
+def stdlib_dumps(content: Any) -> bytes:
+    """与 Starlette JSONResponse.render 相同的参数。"""
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def measure(func: Callable[[], Any]) -> float:
+    """返回单次调用的最优耗时 (微秒)。"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=5, number=number)) / number * 1e6
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="比较 JSON 编解码耗时和 gzip 前后的传输字节数。")
+    parser.add_argument("--versions", type=int, default=30, help="/timing 会话中的版本数")
+    parser.add_argument("--messages", type=int, default=10, help="每个版本的对话消息数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--examples", default=EXAMPLES_PATH)
+    args = parser.parse_args(argv)
+
+    with open(args.examples, "r", encoding="utf-8") as f:
+        examples = [ex for ex in json.load(f) if "code" in ex]
+    payloads = build_payloads(examples, args.versions, args.messages, args.seed)
+
+    print(f"{'payload':<15}{'bytes':>10}{'json.loads':>12}{'orjson':>10}{'speedup':>9}"
+          f"{'json.dumps':>12}{'orjson':>10}{'speedup':>9}   (µs)")
+    for name, payload in payloads.items():
+        raw = stdlib_dumps(payload)
+        loads_std = measure(lambda: json.loads(raw))
+        loads_fast = measure(lambda: orjson.loads(raw))
+        dumps_std = measure(lambda: stdlib_dumps(payload))
+        dumps_fast = measure(lambda: orjson.dumps(payload))
+        print(f"{name:<15}{len(raw):>10}{loads_std:>12.1f}{loads_fast:>10.1f}{loads_std / loads_fast:>8.1f}x"
+              f"{dumps_std:>12.1f}{dumps_fast:>10.1f}{dumps_std / dumps_fast:>8.1f}x")
+
+    print(f"\n{'payload':<15}{'level':>6}{'bytes':>10}{'ratio':>8}{'compress µs':>13}{'decompress µs':>15}")
+    for name, payload in payloads.items():
+        raw = orjson.dumps(payload)
+        print(f"{name:<15}{'-':>6}{len(raw):>10}{1.0:>8.2f}{0.0:>13.1f}{0.0:>15.1f}")
+        for level in (1, 5, 9):
+            compressed = gzip.compress(raw, compresslevel=level)
+            compress_us = measure(lambda: gzip.compress(raw, compresslevel=level))
+            decompress_us = measure(lambda: zlib.decompress(compressed, 16 + zlib.MAX_WBITS))
+            print(f"{'':<15}{level:>6}{len(compressed):>10}{len(compressed) / len(raw):>8.2f}"
+                  f"{compress_us:>13.1f}{decompress_us:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+# bench/loadgen.py
+"""
+压测负载生成器 (Load Generator)
+
+以固定并发度驱动 /chat、/add_version_node、/merge 和 /modify 的混合请求，
+结束后按端点报告吞吐量和延迟分位数 (p50 / p90 / p95 / p99) 以及错误数。
+请求体取自灵感库 services/data/p5_examples.json 中的真实 p5.js 代码，并模拟会话内的版本演进。
+
+通常与 bench.mock_azure 搭配使用，见其文档中的启动方式。
+
+用法:
+    python -m bench.loadgen --base-url http://127.0.0.1:8000 --duration 60 --concurrency 16 \
+        --mix chat=0.5,add_version_node=0.3,merge=0.1,modify=0.1
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(__file__), "..", "services", "data", "p5_examples.json")
+MODES = ("explainable", "explorative", "transformative", "general")
+QUESTIONS = (
+    "我想让画面更有呼吸感，应该怎么改？",
+    "能不能让颜色随着鼠标变化？",
+    "现在的动画太僵硬了，像个机器人。",
+    "我想加入一些随机性，让它更自然。",
+)
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+@dataclass
+class EndpointStats:
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    status_counts: Dict[int, int] = field(default_factory=lambda: defaultdict(int))
+
+
+def print_report(stats: Dict[str, EndpointStats], elapsed: float) -> None:
+    """按端点打印吞吐量和延迟分位数。"""
+    header = f"{'endpoint':<22}{'ok':>7}{'err':>6}{'rps':>8}{'p50 ms':>10}{'p90 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for name in sorted(stats):
+        s = stats[name]
+        values = sorted(s.latencies)
+        print(
+            f"{name:<22}{len(values):>7}{s.errors:>6}{len(values) / elapsed:>8.2f}"
+            f"{percentile(values, 50) * 1000:>10.0f}{percentile(values, 90) * 1000:>10.0f}"
+            f"{percentile(values, 95) * 1000:>10.0f}{percentile(values, 99) * 1000:>10.0f}"
+            f"{(values[-1] if values else float('nan')) * 1000:>10.0f}"
+        )
+        failures = {code: count for code, count in s.status_counts.items() if code >= 400 or code == 0}
+        if failures:
+            print(f"{'':<22}failures by status: {dict(failures)}")
+
+
+class Session:
+    """一个模拟的用户会话：持有自己的版本列表和聊天轮次。"""
+
+    def __init__(self, index: int, examples: List[Dict], rng: random.Random):
+        self.session_id = f"load-{os.getpid()}-{index}"
+        self.rng = rng
+        self.examples = examples
+        self.versions: List[Tuple[str, str, str]] = []
+        self.interaction_count = 0
+        self.mode = rng.choice(MODES)
+
+    def _variant(self, code: str) -> str:
+        """在原代码上做一处小修改，模拟用户的迭代，使两个版本共享大部分代码。"""
+        lines = code.splitlines()
+        if not lines:
+            return code
+        i = self.rng.randrange(len(lines))
+        lines.insert(i, f"  // tweak {self.rng.randrange(10_000)}")
+        return "\n".join(lines)
+
+    def next_version(self) -> Tuple[str, str, str]:
+        if self.versions and self.rng.random() < 0.7:
+            _, base_code, description = self.rng.choice(self.versions)
+            code = self._variant(base_code)
+        else:
+            example = self.rng.choice(self.examples)
+            code, description = example["code"], example["tag"]
+        version = (f"v{len(self.versions) + 1}", code, description)
+        self.versions.append(version)
+        return version
+
+
+async def run_request(client: httpx.AsyncClient, session: Session, endpoint: str) -> Tuple[str, int]:
+    """发出一次请求，返回 (统计用的端点名, 状态码)。"""
+    rng = session.rng
+    if endpoint == "add_version_node" or not session.versions:
+        version_id, code, description = session.next_version()
+        r = await client.post("/add_version_node", json={
+            "session_id": session.session_id, "version_id": version_id,
+            "code": code, "description": description,
+        })
+        return "add_version_node", r.status_code
+
+    if endpoint == "chat":
+        version_id, code, description = session.versions[-1]
+        session.interaction_count += 1
+        r = await client.post("/chat", json={
+            "session_id": session.session_id, "version_id": version_id, "code": code,
+            "code_description": description, "short_term_history": [],
+            "user_question": rng.choice(QUESTIONS), "type": session.mode,
+            "interaction_count": session.interaction_count,
+        })
+        return "chat", r.status_code
+
+    if endpoint == "merge":
+        if len(session.versions) < 2:
+            session.next_version()
+        (id_1, code_1, desc_1), (id_2, code_2, desc_2) = rng.sample(session.versions, 2)
+        r = await client.post("/merge", json={
+            "session_id": session.session_id, "version_id_1": id_1, "code_1": code_1, "description_1": desc_1,
+            "version_id_2": id_2, "code_2": code_2, "description_2": desc_2,
+            "instruction": "把两个版本的视觉效果融合在一起", "mode": session.mode,
+        })
+        return "merge", r.status_code
+
+    # modify: 先获取推荐风格，再应用其中一个
+    r = await client.post("/modify/recommend-styles")
+    if r.status_code != 200 or not r.json():
+        return "modify/recommend", r.status_code
+    tag = rng.choice(r.json())["tag"]
+    r = await client.post("/modify/apply-style", json={
+        "style_tag": tag, "code": session.versions[-1][1], "mode": session.mode,
+    })
+    return "modify/apply-style", r.status_code
+
+
+async def worker(client: httpx.AsyncClient, session: Session, mix: List[Tuple[str, float]],
+                 stats: Dict[str, EndpointStats], deadline: float, think_time: float) -> None:
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    while time.monotonic() < deadline:
+        endpoint = session.rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            name, status_code = await run_request(client, session, endpoint)
+        except httpx.HTTPError as e:
+            name, status_code = endpoint, 0
+            print(f"request error on {endpoint}: {type(e).__name__}: {e}")
+        elapsed = time.perf_counter() - start
+        s = stats[name]
+        s.status_counts[status_code] += 1
+        if 200 <= status_code < 300:
+            s.latencies.append(elapsed)
+        else:
+            s.errors += 1
+        if think_time:
+            await asyncio.sleep(session.rng.expovariate(1 / think_time))
+
+
+def parse_mix(value: str) -> List[Tuple[str, float]]:
+    mix = []
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ("chat", "add_version_node", "merge", "modify"):
+            raise argparse.ArgumentTypeError(f"unknown endpoint in mix: {name}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+async def run(args: argparse.Namespace) -> None:
+    with open(args.examples, "r", encoding="utf-8") as f:
+        examples = [ex for ex in json.load(f) if "code" in ex and "tag" in ex]
+
+    stats: Dict[str, EndpointStats] = defaultdict(EndpointStats)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        sessions = [Session(i, examples, random.Random(args.seed + i)) for i in range(args.concurrency)]
+        # 预热：每个会话先保存一个版本，使 /chat 和 /merge 有可检索的历史
+        if args.warmup:
+            await asyncio.gather(*(run_request(client, s, "add_version_node") for s in sessions))
+        start = time.monotonic()
+        deadline = start + args.duration
+        await asyncio.gather(*(
+            worker(client, s, args.mix, stats, deadline, args.think_time) for s in sessions
+        ))
+        elapsed = time.monotonic() - start
+
+    print(f"\n{args.concurrency} concurrent sessions, {elapsed:.1f}s\n")
+    print_report(stats, elapsed)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({name: {"latencies": s.latencies, "errors": s.errors} for name, s in stats.items()}, f)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="对后端驱动混合负载并报告各端点的吞吐量和延迟分位数。")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--duration", type=float, default=60.0, help="压测时长 (秒)")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发会话数")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("chat=0.5,add_version_node=0.3,merge=0.1,modify=0.1"))
+    parser.add_argument("--think-time", type=float, default=0.0, help="每次请求后的平均思考时间 (秒，指数分布)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--examples", default=EXAMPLES_PATH)
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false")
+    parser.add_argument("--json-out", default=None, help="把原始延迟数据写入该 JSON 文件")
+    asyncio.run(run(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# bench/logging_overhead.py
+"""
+日志开销基准 (Logging Overhead Benchmark)
+
+模拟一次 /chat 请求的日志量（若干状态行 + 一份完整的 LLM 响应），
+比较原来的同步 print 与新的队列化结构化日志在请求路径上的耗时。
+
+用法:
+    python -m bench.logging_overhead --requests 2000 > /dev/null
+结果打印到 stderr，避免与被测的 stdout 输出混在一起。
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+# 基准不会调用 Azure，只需要让配置能够加载
+for _key in ("AZURE_OPENAI_API_KEY", "AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_API_VERSION",
+             "AZURE_OPENAI_MODEL_NAME", "AZURE_OPENAI_EMBEDDING_MODEL"):
+    os.environ.setdefault(_key, "bench")
+
+from utility.logging_config import log_payload, setup_logging, shutdown_logging  # noqa: E402
+
+RESPONSE = {
+    "code": "function setup() {\n  createCanvas(400, 400);\n}\n" * 200,
+    "rationale": "- ✨ 说明" * 50,
+    "reflection": "💬 反思问题" * 20,
+}
+
+
+def run_print(requests: int) -> float:
+    start = time.perf_counter()
+    for i in range(requests):
+        print(f"💬 [会话: s{i}] 普通聊天模式 (第 1 次)。")
+        print(f"✅ [会话: s{i}] 普通聊天响应已生成。")
+        print(RESPONSE)
+    sys.stdout.flush()
+    return time.perf_counter() - start
+
+
+def run_logging(requests: int) -> float:
+    logger = logging.getLogger("bench.chat")
+    start = time.perf_counter()
+    for i in range(requests):
+        logger.info("💬 [会话: s%s] 普通聊天模式 (第 1 次)。", i)
+        logger.info("✅ [会话: s%s] 普通聊天响应已生成。", i)
+        log_payload(logger, "chat response", RESPONSE)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="比较 print 与队列化结构化日志在请求路径上的开销。")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    print_seconds = run_print(args.requests)
+    setup_logging()
+    logging_seconds = run_logging(args.requests)
+    shutdown_logging()
+
+    per_print = print_seconds / args.requests * 1e6
+    per_logging = logging_seconds / args.requests * 1e6
+    sys.stderr.write(
+        f"print:              {per_print:10.1f} µs / request\n"
+        f"structured logging: {per_logging:10.1f} µs / request (caller side)\n"
+        f"speed-up:           {per_print / per_logging:10.1f}x\n"
+    )
+
+
+if __name__ == "__main__":
+    main()
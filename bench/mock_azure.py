@@ -0,0 +1,465 @@
+# bench/mock_azure.py
+"""
+本地 Azure OpenAI 模拟服务 (Mock Azure OpenAI)
+
+在没有 Azure 凭据的情况下对后端做压测。它实现了 Azure OpenAI 的
+chat-completions (含 stream=true 的 SSE 流式返回) 和 embeddings 接口，并支持：
+- 可配置的延迟分布：对数正态分布的首 token 延迟 + 按 token 速率计算的生成时间；
+  --deployment-speed 按部署缩放延迟 (例如 mini=0.35 表示该部署的首 token 和生成耗时为默认的 35%)，
+  用于比较任务级模型路由；
+- 按概率注入 429 (带 Retry-After 响应头)；
+- 模拟部署配额：--tpm / --rpm 为 chat 和 embedding 共用的每分钟 token / 请求数，超出时返回 429 和
+  等到额度恢复所需的 Retry-After，成功响应带 x-ratelimit-remaining-tokens / -requests 响应头；
+- 按 Prompt 的输出格式返回固定的 JSON 答案 (code / rationale / reflection / summary / hunks ...)，
+  使后端的 JsonOutputParser 和字段校验都能正常通过；合批摘要按片段数返回 JSON 数组，
+  --batch-summary-error-rate 按概率把其中的元素置空；
+- 录制/回放 (cassette)：--record 把请求转发到真实的 Azure OpenAI 并把响应和耗时写入 JSONL 文件，
+  --replay 按请求体哈希返回录制的响应并按录制耗时等待；未命中的请求退回到固定答案并计入 cassette_miss。
+  流式请求 (stream=true) 不参与录制/回放。
+
+用法:
+    python -m bench.mock_azure --port 8100 --latency-median-ms 800 --tokens-per-sec 80 --rate-429 0.02
+
+    # 录制真实响应 (后端仍使用真实的 API key，模拟服务原样转发)
+    python -m bench.mock_azure --record cassette.jsonl --upstream https://<resource>.openai.azure.com
+    # 回放
+    python -m bench.mock_azure --replay cassette.jsonl
+
+    # 在另一个终端让后端指向模拟服务
+    AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8100 AZURE_OPENAI_API_KEY=mock \
+    AZURE_OPENAI_API_VERSION=2024-06-01 AZURE_OPENAI_MODEL_NAME=mock-gpt \
+    AZURE_OPENAI_EMBEDDING_MODEL=mock-embedding EMBEDDING_CHECK_CTX_LENGTH=false \
+    uvicorn main:app --port 8000
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+@dataclass
+class MockConfig:
+    latency_median_ms: float = 800.0
+    latency_sigma: float = 0.5
+    tokens_per_sec: float = 80.0
+    rate_429: float = 0.0
+    retry_after_s: float = 1.0
+    # 部署配额 (每分钟)，0 表示不限
+    tpm: int = 0
+    rpm: int = 0
+    # 部署名 -> 延迟缩放系数，未列出的部署为 1
+    deployment_speed: Optional[Dict[str, float]] = None
+    embedding_latency_ms: float = 40.0
+    embedding_dim: int = 1536
+    # 合批摘要响应中每个元素被置空的概率，用于验证后端的逐个回退
+    batch_summary_error_rate: float = 0.0
+    seed: int = 0
+    # 录制模式下转发的目标，例如 https://<resource>.openai.azure.com
+    upstream: Optional[str] = None
+
+
+config = MockConfig()
+_rng = random.Random(0)
+stats: Dict[str, int] = {
+    "chat": 0, "chat_stream": 0, "embeddings": 0, "throttled": 0, "quota_throttled": 0,
+    "cassette_hit": 0, "cassette_miss": 0, "recorded": 0,
+}
+
+
+class Cassette:
+    """录制的 LLM / Embedding 响应，以请求体的哈希为键，存为 JSONL。"""
+
+    def __init__(self, path: str, recording: bool):
+        self.path = path
+        self.recording = recording
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+        except FileNotFoundError:
+            if not recording:
+                raise
+
+    @staticmethod
+    def key(kind: str, deployment: str, body: Dict[str, Any]) -> str:
+        canonical = json.dumps(body, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(f"{kind}|{deployment}|{canonical}".encode("utf-8")).hexdigest()
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.entries.get(key)
+
+    def save(self, key: str, response: Dict[str, Any], latency_s: float) -> None:
+        entry = {"key": key, "latency_s": round(latency_s, 4), "response": response}
+        self.entries[key] = entry
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+cassette: Optional[Cassette] = None
+
+
+async def _from_cassette(kind: str, deployment: str, request: Request, body: Dict[str, Any]) -> Optional[Any]:
+    """录制/回放模式下返回响应；未启用 cassette 或回放未命中时返回 None，由调用方生成固定答案。"""
+    if cassette is None:
+        return None
+    key = Cassette.key(kind, deployment, body)
+    if not cassette.recording:
+        entry = cassette.lookup(key)
+        if entry is None:
+            stats["cassette_miss"] += 1
+            return None
+        stats["cassette_hit"] += 1
+        await asyncio.sleep(entry["latency_s"])
+        return entry["response"]
+
+    url = f"{config.upstream.rstrip('/')}{request.url.path}"
+    headers = {name: value for name, value in request.headers.items() if name in ("api-key", "authorization")}
+    start = time.perf_counter()
+    async with httpx.AsyncClient(timeout=120) as client:
+        upstream = await client.post(url, params=dict(request.query_params), headers=headers, json=body)
+    latency = time.perf_counter() - start
+    if upstream.status_code != 200:
+        # 上游的错误 (含 429) 原样返回，不录制
+        return JSONResponse(status_code=upstream.status_code, content=upstream.json(),
+                            headers={k: v for k, v in upstream.headers.items() if k.lower().startswith("retry-after")})
+    response = upstream.json()
+    cassette.save(key, response, latency)
+    stats["recorded"] += 1
+    return response
+
+app = FastAPI(title="Mock Azure OpenAI")
+
+# --- 固定答案 ---
+CANNED_CODE = """let t = 0;
+
+function setup() {
+  createCanvas(400, 400);
+  noStroke();
+}
+
+function draw() {
+  background(10, 20, 40);
+  for (let x = 0; x <= width; x += 40) {
+    for (let y = 0; y <= height; y += 40) {
+      let d = map(sin(t + (x + y) * 0.02), -1, 1, 5, 30);
+      fill(255, 200, 100);
+      ellipse(x, y, d, d);
+    }
+  }
+  t += 0.05;
+}
+"""
+CANNED_TEXT = {
+    "rationale": "- ✨ 引入基于时间的 `sin()` 振荡，让网格拥有呼吸感。\n- 🌀 位置参与相位计算，形成涟漪。",
+    "reflection": "- 💬 这种呼吸节奏想传达怎样的情绪？如果让鼠标位置影响涟漪强度，会不会更贴近你的意图？",
+    "summary": "- ✨ 让静态网格随时间呼吸并形成涟漪。",
+    "exploration": "- 🧩 节奏与颜色之间可以建立怎样的联系？",
+    "advice": "- 🚀 尝试打破网格秩序，让随机性介入。",
+}
+_JSON_KEYS = ("code", "rationale", "reflection", "summary", "exploration", "advice")
+_CODE_BLOCK = re.compile(r"```(?:javascript)?\n(.*?)```", re.S)
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文约 1 字 1 token，其余约 4 字符 1 token。"""
+    cjk = sum(1 for ch in text if "一" <= ch <= "鿿")
+    return max(1, cjk + (len(text) - cjk) // 4)
+
+
+def _message_text(content: Any) -> str:
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+def build_answer(messages: List[Dict[str, Any]]) -> str:
+    """根据 Prompt 的输出要求构造一个固定答案。"""
+    system = "\n".join(_message_text(m.get("content")) for m in messages if m.get("role") == "system")
+    user = "\n".join(_message_text(m.get("content")) for m in messages if m.get("role") != "system")
+
+    # 差异块合并模式：返回每个差异块的合并结果
+    if "差异块合并模式" in user:
+        hunk_ids = sorted(set(re.findall(r"^### (H\d+)$", user, re.M)), key=lambda h: int(h[1:]))
+        blocks = _CODE_BLOCK.findall(user)
+        # 代码块顺序: 骨架, H1 版本1, H1 版本2, H2 版本1, ...；这里总是采用版本2的写法
+        resolved = {}
+        for i, hunk_id in enumerate(hunk_ids):
+            code = blocks[2 + 2 * i] if len(blocks) > 2 + 2 * i else ""
+            resolved[hunk_id] = "" if code.strip() == "(此处无代码)" else code.rstrip("\n")
+        answer = {
+            "hunks": resolved,
+            "additions": "",
+            "rationale": CANNED_TEXT["rationale"],
+            "reflection": CANNED_TEXT["reflection"],
+        }
+        return json.dumps(answer, ensure_ascii=False)
+
+    # 合批摘要：每个 "### 片段 N" 返回一个摘要
+    if "JSON 数组" in system and "摘要" in system:
+        snippets = re.findall(r"^### 片段 (\d+)$", user, re.M)
+        return json.dumps([
+            "" if _rng.random() < config.batch_summary_error_rate else f"动态网格随时间呼吸，形成柔和涟漪 ({n})。"
+            for n in snippets
+        ], ensure_ascii=False)
+
+    keys = [key for key in _JSON_KEYS if f'"{key}"' in system or f"`{key}`" in system]
+    if not keys or "JSON" not in system.upper():
+        # 非 JSON 输出：版本摘要、主题提取等
+        return "动态网格随时间呼吸，形成柔和涟漪。" if "摘要" in system else "呼吸感的涟漪"
+
+    answer: Dict[str, str] = {}
+    for key in keys:
+        if key == "code":
+            # 尽量回显用户提供的代码，使输出长度接近真实场景
+            blocks = _CODE_BLOCK.findall(user)
+            answer["code"] = max(blocks, key=len) if blocks else CANNED_CODE
+        else:
+            answer[key] = CANNED_TEXT[key]
+    if "code" in answer and "rationale" not in answer:
+        answer["rationale"] = CANNED_TEXT["rationale"]
+    return json.dumps(answer, ensure_ascii=False)
+
+
+def _throttled(retry_after: Optional[float] = None) -> JSONResponse:
+    stats["throttled"] += 1
+    retry_after = config.retry_after_s if retry_after is None else retry_after
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(math.ceil(retry_after)), "retry-after-ms": str(int(retry_after * 1000))},
+        content={"error": {"code": "429", "message": "Requests to the deployment have exceeded the rate limit (mock)."}},
+    )
+
+
+class Quota:
+    """
+    部署配额：chat 和 embedding 共用的每分钟 token / 请求数。
+    与 Azure 一样按 10 秒窗口允许突发 (桶容量为 1/6 分钟的配额)，额度连续恢复；请求在到达时按
+    Prompt + 实际 completion token 数扣除。
+    """
+
+    WINDOW_S = 10.0
+
+    def __init__(self):
+        self._levels: Dict[str, float] = {}
+        self._updated = time.monotonic()
+
+    def _limits(self) -> Dict[str, float]:
+        return {name: limit for name, limit in (("tokens", config.tpm), ("requests", config.rpm)) if limit > 0}
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        for name, limit in self._limits().items():
+            capacity = limit * self.WINDOW_S / 60
+            level = self._levels.get(name, capacity)
+            self._levels[name] = min(capacity, level + (now - self._updated) * limit / 60)
+        self._updated = now
+
+    def admit(self, tokens: int) -> Optional[float]:
+        """额度足够时扣除并返回 None，否则返回需要等待的秒数。"""
+        self._refill()
+        cost = {"tokens": tokens, "requests": 1}
+        limits = self._limits()
+        waits = [(cost[name] - self._levels[name]) * 60 / limit
+                 for name, limit in limits.items() if self._levels[name] < cost[name]]
+        if waits:
+            stats["quota_throttled"] += 1
+            return max(waits)
+        for name in limits:
+            self._levels[name] -= cost[name]
+        return None
+
+    def headers(self) -> Dict[str, str]:
+        return {f"x-ratelimit-remaining-{name}": str(int(level)) for name, level in self._levels.items()}
+
+
+quota = Quota()
+
+
+def _speed(deployment: str) -> float:
+    return (config.deployment_speed or {}).get(deployment, 1.0)
+
+
+def _first_token_delay() -> float:
+    return _rng.lognormvariate(math.log(config.latency_median_ms / 1000), config.latency_sigma)
+
+
+@app.post("/openai/deployments/{deployment}/chat/completions")
+async def chat_completions(deployment: str, request: Request):
+    body = await request.json()
+    if _rng.random() < config.rate_429:
+        return _throttled()
+    if not body.get("stream"):
+        recorded = await _from_cassette("chat", deployment, request, body)
+        if recorded is not None:
+            stats["chat"] += 1
+            return recorded
+
+    messages = body.get("messages", [])
+    answer = build_answer(messages)
+    prompt_tokens = sum(estimate_tokens(_message_text(m.get("content"))) for m in messages)
+    completion_tokens = estimate_tokens(answer)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+             "total_tokens": prompt_tokens + completion_tokens}
+    retry_after = quota.admit(usage["total_tokens"])
+    if retry_after is not None:
+        return _throttled(retry_after)
+
+    if body.get("stream"):
+        stats["chat_stream"] += 1
+
+        async def events():
+            await asyncio.sleep(_first_token_delay() * _speed(deployment))
+            chunk_chars = 16
+            per_chunk = estimate_tokens(answer[:chunk_chars]) / config.tokens_per_sec * _speed(deployment)
+            for start in range(0, len(answer), chunk_chars):
+                delta = {"content": answer[start:start + chunk_chars]}
+                if start == 0:
+                    delta["role"] = "assistant"
+                yield "data: " + json.dumps({
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created,
+                    "model": deployment,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+                }, ensure_ascii=False) + "\n\n"
+                await asyncio.sleep(per_chunk)
+            yield "data: " + json.dumps({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": deployment,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                "usage": usage,
+            }) + "\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers=quota.headers())
+
+    stats["chat"] += 1
+    await asyncio.sleep((_first_token_delay() + completion_tokens / config.tokens_per_sec) * _speed(deployment))
+    return JSONResponse(headers=quota.headers(), content={
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": deployment,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": answer},
+            "finish_reason": "stop",
+        }],
+        "usage": usage,
+    })
+
+
+def fake_embedding(text: str, dim: int) -> List[float]:
+    """由文本哈希确定的单位向量：相同文本总是得到相同向量。"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    rng = random.Random(seed)
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dim)]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+@app.post("/openai/deployments/{deployment}/embeddings")
+async def embeddings(deployment: str, request: Request):
+    body = await request.json()
+    if _rng.random() < config.rate_429:
+        return _throttled()
+    recorded = await _from_cassette("embeddings", deployment, request, body)
+    if recorded is not None:
+        stats["embeddings"] += 1
+        return recorded
+
+    inputs = body.get("input", [])
+    if not isinstance(inputs, list) or (inputs and isinstance(inputs[0], int)):
+        inputs = [inputs]
+    tokens = sum(len(item) if isinstance(item, list) else estimate_tokens(str(item)) for item in inputs)
+    retry_after = quota.admit(tokens)
+    if retry_after is not None:
+        return _throttled(retry_after)
+    stats["embeddings"] += 1
+    dim = int(body.get("dimensions") or config.embedding_dim)
+    await asyncio.sleep(config.embedding_latency_ms / 1000)
+    data = [
+        {"object": "embedding", "index": i, "embedding": fake_embedding(json.dumps(item, ensure_ascii=False), dim)}
+        for i, item in enumerate(inputs)
+    ]
+    return JSONResponse(headers=quota.headers(), content={
+        "object": "list", "data": data, "model": deployment,
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+
+@app.get("/mock/stats")
+async def mock_stats():
+    """返回模拟服务收到的请求计数，便于核对压测结果。"""
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="本地 Azure OpenAI 模拟服务。")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-median-ms", type=float, default=config.latency_median_ms,
+                        help="首 token 延迟的中位数 (对数正态分布)")
+    parser.add_argument("--latency-sigma", type=float, default=config.latency_sigma,
+                        help="首 token 延迟对数正态分布的 sigma，越大长尾越明显")
+    parser.add_argument("--tokens-per-sec", type=float, default=config.tokens_per_sec,
+                        help="completion 生成速率")
+    parser.add_argument("--rate-429", type=float, default=config.rate_429, help="返回 429 的概率")
+    parser.add_argument("--retry-after", type=float, default=config.retry_after_s, help="429 的 Retry-After 秒数")
+    parser.add_argument("--tpm", type=int, default=config.tpm, help="部署的每分钟 token 配额，0 表示不限")
+    parser.add_argument("--rpm", type=int, default=config.rpm, help="部署的每分钟请求配额，0 表示不限")
+    parser.add_argument("--deployment-speed", action="append", default=[], metavar="NAME=FACTOR",
+                        help="按部署缩放 chat 延迟，可重复，例如 --deployment-speed mini=0.35")
+    parser.add_argument("--embedding-latency-ms", type=float, default=config.embedding_latency_ms)
+    parser.add_argument("--embedding-dim", type=int, default=config.embedding_dim)
+    parser.add_argument("--batch-summary-error-rate", type=float, default=config.batch_summary_error_rate,
+                        help="合批摘要响应中每个元素被置空的概率")
+    parser.add_argument("--seed", type=int, default=config.seed)
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument("--record", metavar="PATH", help="把请求转发到 --upstream 并录制响应到该文件")
+    cassette_group.add_argument("--replay", metavar="PATH", help="从该文件回放录制的响应")
+    parser.add_argument("--upstream", help="录制模式下真实 Azure OpenAI 的地址")
+    args = parser.parse_args()
+    if args.record and not args.upstream:
+        parser.error("--record requires --upstream")
+
+    config.latency_median_ms = args.latency_median_ms
+    config.latency_sigma = args.latency_sigma
+    config.tokens_per_sec = args.tokens_per_sec
+    config.rate_429 = args.rate_429
+    config.retry_after_s = args.retry_after
+    config.tpm = args.tpm
+    config.rpm = args.rpm
+    config.deployment_speed = {}
+    for spec in args.deployment_speed:
+        name, _, factor = spec.partition("=")
+        config.deployment_speed[name] = float(factor)
+    config.embedding_latency_ms = args.embedding_latency_ms
+    config.embedding_dim = args.embedding_dim
+    config.batch_summary_error_rate = args.batch_summary_error_rate
+    config.seed = args.seed
+    config.upstream = args.upstream
+    _rng.seed(args.seed)
+
+    global cassette
+    if args.record or args.replay:
+        cassette = Cassette(args.record or args.replay, recording=bool(args.record))
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
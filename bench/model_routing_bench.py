@@ -0,0 +1,171 @@
+# bench/model_routing_bench.py
+"""
+任务级模型路由基准 (Model Routing Benchmark)
+
+按各任务的真实 Prompt (版本摘要、过渡层回复、模糊意图反思、普通聊天、风格融合、代码合并) 构造调用，
+以相同的混合负载依次在不同的路由表下运行，报告每类任务使用的部署、p50 / p95 延迟和平均 token 数，
+用来判断把哪些任务交给小而快的部署划算。调用经过 invoke_chain，与线上一样受调度器和配额限流约束。
+代码片段取自灵感库 services/data/p5_examples.json。
+
+路由表:
+- single: 所有任务都使用 AZURE_OPENAI_MODEL_NAME (不做路由时的行为)；
+- routed: services.model_routing.DEFAULT_TASK_ROUTES (摘要、过渡层回复使用 --fast-deployment)；
+- 以及 --table NAME=JSON 给出的自定义路由表，格式与 LLM_TASK_ROUTES 相同。
+
+用法:
+    python -m bench.mock_azure --port 8100 --latency-median-ms 800 --deployment-speed mini=0.35
+    # 另一个终端 (AZURE_OPENAI_* 指向模拟服务，见 bench.mock_azure)
+    python -m bench.model_routing_bench --fast-deployment mini --calls 40 --concurrency 8 \\
+        --table 'all-fast={"reflection": {"model": "fast"}, "chat": {"model": "fast"}}'
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
+from langchain.schema.messages import HumanMessage, SystemMessage
+from langchain_community.callbacks import get_openai_callback
+from langchain_core.output_parsers import JsonOutputParser
+
+from bench.loadgen import percentile
+from routes import merge, modify
+from services.llm_runtime import BACKGROUND, invoke_chain
+from services.model_routing import DEFAULT_TASK_ROUTES, chat_model, task_route
+from services.services import SUMMARY_PROPMT
+from utility import prompt
+from utility.config import settings
+from utility.deep_chat import generate_transition_response, generate_vague_deep_reflection_response
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "services", "data", "p5_examples.json")
+
+HISTORY = "用户: 我想让网格动起来。\nAI: 可以让每个格子的大小随时间变化。"
+MEMORY = "版本 v1: 静态的彩色网格。\n版本 v2: 网格随鼠标位置改变颜色。"
+QUESTION = "为什么现在的动画看起来有点僵硬？"
+
+
+async def _templated(task: str, system: str, human: str, inputs: Dict[str, Any]) -> Any:
+    chain = ChatPromptTemplate.from_messages([
+        SystemMessagePromptTemplate.from_template(system),
+        HumanMessagePromptTemplate.from_template(human),
+    ]) | chat_model(task) | JsonOutputParser()
+    return await invoke_chain(chain, inputs)
+
+
+def _task_calls(codes: List[str]) -> Dict[str, Callable[[random.Random], Awaitable[Any]]]:
+    """每类任务一个调用构造器，输入取自线上路由实际使用的 Prompt。"""
+    return {
+        "summary": lambda rng: invoke_chain(chat_model("summary"), [
+            SystemMessage(content=SUMMARY_PROPMT),
+            HumanMessage(content=f"请为以下代码生成摘要:\n\n```javascript\n{rng.choice(codes)}\n```"),
+        ], priority=BACKGROUND),
+        "transition": lambda rng: generate_transition_response(
+            user_question=QUESTION, current_code=rng.choice(codes), memory=MEMORY, history=HISTORY,
+            llm=chat_model("transition")),
+        "reflection": lambda rng: generate_vague_deep_reflection_response(
+            user_question=QUESTION, current_code=rng.choice(codes), mode="explainable",
+            llm=chat_model("reflection"), history=HISTORY, memory=MEMORY),
+        "chat": lambda rng: _templated("chat", prompt.GENERAL_SYSTEM_PROMPT, prompt.USER_PROMPT, {
+            "retrieved_memories": MEMORY, "short_term_history": HISTORY, "code_description": "动态网格",
+            "current_code": rng.choice(codes), "user_question": QUESTION}),
+        "style": lambda rng: _templated("style", modify.GENE_SYSTEM_PROMPT, modify.USER_PROMPT_TEMPLATE, {
+            "anchor_code": rng.choice(codes), "style_tag": "柔和的粒子", "inspiration_code": rng.choice(codes)}),
+        "merge": lambda rng: _templated("merge", merge.GENE_SYSTEM_PROMPT, merge.USER_PROMPT_TEMPLATE, {
+            "version_id_1": "v1", "description_1": "静态网格", "code_1": rng.choice(codes),
+            "version_id_2": "v2", "description_2": "粒子效果", "code_2": rng.choice(codes),
+            "instruction": "保留网格布局，加入粒子效果。"}),
+    }
+
+
+async def run_once(table: Dict[str, Dict[str, Any]], codes: List[str],
+                   args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    settings.LLM_TASK_ROUTES = table
+    calls = _task_calls(codes)
+    rng = random.Random(args.seed)
+    # 每类任务 --calls 次，打乱顺序后以 --concurrency 并发执行，模拟混合负载
+    jobs = [task for task in calls for _ in range(args.calls)]
+    rng.shuffle(jobs)
+    latencies: Dict[str, List[float]] = {task: [] for task in calls}
+    tokens: Dict[str, int] = {task: 0 for task in calls}
+    failures: Dict[str, int] = {task: 0 for task in calls}
+    queue = asyncio.Queue()
+    for task in jobs:
+        queue.put_nowait(task)
+
+    async def worker() -> None:
+        while not queue.empty():
+            task = queue.get_nowait()
+            with get_openai_callback() as usage:
+                start = time.perf_counter()
+                try:
+                    await calls[task](rng)
+                except Exception:
+                    failures[task] += 1
+                    continue
+                latencies[task].append(time.perf_counter() - start)
+            tokens[task] += usage.total_tokens
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for task, values in latencies.items():
+        values.sort()
+        results[task] = {
+            "deployment": task_route(task)[0],
+            "calls": len(values),
+            "failures": failures[task],
+            "p50": percentile(values, 50) if values else 0.0,
+            "p95": percentile(values, 95) if values else 0.0,
+            "tokens": tokens[task] / len(values) if values else 0.0,
+        }
+    results["*"] = {"elapsed": elapsed}
+    return results
+
+
+def _parse_tables(specs: List[str]) -> List[Tuple[str, Dict[str, Dict[str, Any]]]]:
+    tables = [
+        ("single", {task: {"model": "default"} for task in DEFAULT_TASK_ROUTES}),
+        ("routed", {}),
+    ]
+    for spec in specs:
+        name, _, table = spec.partition("=")
+        tables.append((name, json.loads(table)))
+    return tables
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="比较不同任务级模型路由表下各类 LLM 任务的延迟。")
+    parser.add_argument("--fast-deployment", default=settings.AZURE_OPENAI_FAST_MODEL_NAME or "mini",
+                        help="路由表中 \"fast\" 对应的部署 (AZURE_OPENAI_FAST_MODEL_NAME)")
+    parser.add_argument("--table", action="append", default=[], metavar="NAME=JSON",
+                        help="额外的路由表，格式与 LLM_TASK_ROUTES 相同，可重复")
+    parser.add_argument("--calls", type=int, default=40, help="每个路由表下每类任务的调用次数")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    settings.AZURE_OPENAI_FAST_MODEL_NAME = args.fast_deployment
+
+    with open(EXAMPLES_PATH, "r", encoding="utf-8") as f:
+        codes = [example["code"] for example in json.load(f)]
+
+    async def run_all() -> None:
+        for name, table in _parse_tables(args.table):
+            results = await run_once(table, codes, args)
+            print(f"\n== {name}: {results['*']['elapsed']:.1f}s")
+            print(f"{'task':>11}{'deployment':>16}{'calls':>7}{'fail':>6}{'p50 s':>8}{'p95 s':>8}{'tokens':>8}")
+            for task in DEFAULT_TASK_ROUTES:
+                row = results[task]
+                print(f"{task:>11}{row['deployment']:>16}{row['calls']:>7}{row['failures']:>6}"
+                      f"{row['p50']:>8.2f}{row['p95']:>8.2f}{row['tokens']:>8.0f}")
+
+    asyncio.run(run_all())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# bench/quantization_bench.py
+"""
+向量量化与降维基准 (Quantization Benchmark)
+
+对比版本记忆的几种存储方式与当前配置 (Chroma 中 1536 维 float32 + HNSW) 的内存、磁盘和 recall@k：
+- 降维 (EMBEDDING_DIMENSIONS): 截断前 d 维后重新归一化，与 text-embedding-3 的 dimensions 参数做法相同；
+  每种维度各建一个 Chroma 集合，报告其磁盘占用和带会话过滤的检索 recall；
+- 量化 (SESSION_INDEX_QUANTIZATION): 会话矩阵以 float32 / float16 / int8 存储，报告每个版本占用的内存、
+  检索延迟和 recall；可选用 Chroma 中的全精度向量对 k * RERANK 个候选重新排序 (SESSION_INDEX_RERANK)。
+  会话矩阵不落盘 (Chroma 是持久化数据源)，所以磁盘占用只随维度变化。
+Chroma 行的内存是加载到内存中的 HNSW 索引文件大小，磁盘是整个数据目录 (含 sqlite 中的文档和元数据)。
+recall@k 的基准答案是全维 float32 向量上的精确 top-k (同会话、排除当前版本，与 /chat 相同)。
+
+默认使用合成向量：各维方差按幂律衰减 (模拟靠前维度信息量更大的 Matryoshka 式嵌入)，按会话聚类，
+查询是会话中某个版本加噪声。可以用 --embeddings 传入真实嵌入 (N x D 的 .npy，按顺序每 --versions-per-session 行为一个会话)。
+
+用法:
+    python -m bench.quantization_bench --sessions 200 --dims 1536,512,256 --rerank 4
+    python -m bench.quantization_bench --embeddings real.npy --versions-per-session 30
+"""
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from typing import Dict, List, Optional, Set
+
+import chromadb
+import numpy as np
+
+from services.session_index import QUANTIZATION_MODES, SessionVectorIndex, _SessionMatrix
+
+
+class _Store:
+    """SessionVectorIndex 只用到 vector_store._collection。"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def synthetic(rng: np.random.Generator, sessions: int, per_session: int, dim: int) -> np.ndarray:
+    spectrum = (1.0 + np.arange(dim)) ** -0.5
+    centroids = rng.standard_normal((sessions, 1, dim)) * spectrum
+    vectors = centroids + 0.5 * rng.standard_normal((sessions, per_session, dim)) * spectrum
+    return _normalize(vectors.reshape(-1, dim)).astype(np.float32)
+
+
+# Chroma 加载到内存中的 HNSW 索引文件 (向量 + 邻接表)
+_HNSW_MEMORY_FILES = ("data_level0.bin", "link_lists.bin")
+
+
+def _dir_size(path: str, names_filter=None) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+        if names_filter is None or name in names_filter
+    )
+
+
+def _recall(found: List[List[str]], truth: List[Set[str]]) -> float:
+    return statistics.mean(len(set(f) & t) / max(1, len(t)) for f, t in zip(found, truth))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="比较量化和降维存储的内存、磁盘和 recall@k。")
+    parser.add_argument("--embeddings", help="真实嵌入 (.npy, N x D)；不提供时使用合成向量")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--versions-per-session", type=int, default=30)
+    parser.add_argument("--dim", type=int, default=1536, help="合成向量的维度")
+    parser.add_argument("--dims", default="1536,512,256", help="要比较的降维维度")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--rerank", type=int, default=4, help="重新排序的候选倍数 (k * RERANK)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    per_session = args.versions_per_session
+    if args.embeddings:
+        full = np.load(args.embeddings).astype(np.float32)
+        full = _normalize(full[: len(full) // per_session * per_session])
+    else:
+        full = synthetic(rng, args.sessions, per_session, args.dim)
+    sessions = len(full) // per_session
+    full_dim = full.shape[1]
+    dims = [d for d in (int(x) for x in args.dims.split(",")) if d <= full_dim]
+    ids = [f"s{i // per_session}_v{i % per_session}" for i in range(len(full))]
+    metadatas = [{"session_id": f"s{i // per_session}", "version_id": f"v{i % per_session}"} for i in range(len(full))]
+
+    # 查询：会话中随机一个版本加噪声，排除另一个随机版本 (模拟 /chat 排除当前版本)
+    q_session = rng.integers(0, sessions, args.queries)
+    q_source = q_session * per_session + rng.integers(0, per_session, args.queries)
+    queries = _normalize(full[q_source] + 0.5 * _normalize(rng.standard_normal(full[q_source].shape))).astype(np.float32)
+    q_exclude = [f"v{v}" for v in rng.integers(0, per_session, args.queries)]
+
+    def exact_top_k(vectors: np.ndarray, q: np.ndarray, s: int, exclude: str, k: int) -> List[str]:
+        rows = np.arange(s * per_session, (s + 1) * per_session)
+        rows = rows[[metadatas[r]["version_id"] != exclude for r in rows]]
+        distances = np.sum((vectors[rows] - q) ** 2, axis=1)
+        return [ids[r] for r in rows[np.argsort(distances, kind="stable")[:k]]]
+
+    truth = [set(exact_top_k(full, q, s, ex, args.k)) for q, s, ex in zip(queries, q_session, q_exclude)]
+
+    print(f"{len(full)} versions in {sessions} sessions, full dim {full_dim}, k={args.k}, {args.queries} queries")
+    print(f"\n{'storage':<30}{'memory B/ver':>13}{'disk B/ver':>11}{'query µs':>10}{'recall@k':>10}")
+    workdir = tempfile.mkdtemp(prefix="quantization-bench-")
+    try:
+        for dim in dims:
+            vectors = _normalize(full[:, :dim])
+            q_dim = _normalize(queries[:, :dim])
+
+            # 当前方案：Chroma 集合 (float32 + HNSW)，带会话过滤检索
+            path = os.path.join(workdir, f"d{dim}")
+            client = chromadb.PersistentClient(path=path)
+            collection = client.create_collection("version_graph_memory")
+            for start in range(0, len(vectors), 1000):
+                collection.add(ids=ids[start:start + 1000], embeddings=vectors[start:start + 1000],
+                               metadatas=metadatas[start:start + 1000])
+            found, latencies = [], []
+            for q, s, ex in zip(q_dim, q_session, q_exclude):
+                where = {"$and": [{"session_id": {"$eq": f"s{s}"}}, {"version_id": {"$ne": ex}}]}
+                start = time.perf_counter()
+                result = collection.query(query_embeddings=[q], n_results=args.k, where=where, include=[])
+                latencies.append((time.perf_counter() - start) * 1e6)
+                found.append(result["ids"][0])
+            memory, disk = _dir_size(path, _HNSW_MEMORY_FILES), _dir_size(path)
+            print(f"{f'chroma d={dim} float32':<30}{memory / len(vectors):>13.0f}{disk / len(vectors):>11.0f}"
+                  f"{statistics.median(latencies):>10.0f}{_recall(found, truth):>10.3f}")
+
+            # 每会话矩阵：不同量化精度，可选全精度重新排序
+            store = _Store(collection)
+            for mode in QUANTIZATION_MODES:
+                entries: Dict[int, _SessionMatrix] = {}
+                for s in range(sessions):
+                    rows = slice(s * per_session, (s + 1) * per_session)
+                    entries[s] = _SessionMatrix(ids[rows], vectors[rows].copy(), metadatas[rows],
+                                                [""] * per_session, mode=mode)
+                per_version = sum(entry.nbytes for entry in entries.values()) / len(vectors)
+                for rerank in ((0, args.rerank) if mode != "none" and args.rerank > 1 else (0,)):
+                    found, latencies = [], []
+                    for q, s, ex in zip(q_dim, q_session, q_exclude):
+                        entry = entries[s]
+                        start = time.perf_counter()
+                        if rerank:
+                            rows = SessionVectorIndex._rerank(store, entry, q, entry.top_k(q, args.k * rerank, ex),
+                                                              args.k)
+                        else:
+                            rows = entry.top_k(q, args.k, ex)
+                        latencies.append((time.perf_counter() - start) * 1e6)
+                        found.append([entry.ids[row] for row in rows])
+                    label = f"index d={dim} {'float32' if mode == 'none' else mode}" + (f" +rerank{rerank}" if rerank else "")
+                    print(f"{label:<30}{per_version:>13.0f}{'-':>11}{statistics.median(latencies):>10.1f}"
+                          f"{_recall(found, truth):>10.3f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
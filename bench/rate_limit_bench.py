@@ -0,0 +1,144 @@
+# bench/rate_limit_bench.py
+"""
+配额限流基准 (Rate Limit Benchmark)
+
+以固定并发持续发送 chat 和 embedding 请求，把负载压在部署配额之上，比较:
+- baseline: 默认的 openai 客户端，429 由每个调用各自按 Retry-After 重试；
+- limited: services.rate_limiter 的共享令牌桶 (chat 和 embedding 共用 TPM / RPM 预算)。
+报告成功调用数、429 次数、最终失败数、p50 / p95 延迟，以及按 --bucket 秒分桶的 token 吞吐量
+(均值、变异系数)；吞吐量贴近配额且变异系数小，说明没有在"冲上去 → 被 429 → 一起退避"之间振荡。
+
+用法:
+    python -m bench.mock_azure --port 8100 --tpm 60000 --rpm 600 --latency-median-ms 300
+    # 另一个终端 (AZURE_OPENAI_* 指向模拟服务，见 bench.mock_azure)
+    python -m bench.rate_limit_bench --tpm 60000 --rpm 600 --concurrency 32 --duration 60
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from typing import Dict, List, Optional
+
+import httpx
+from langchain.schema.messages import HumanMessage, SystemMessage
+from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
+
+from bench.loadgen import percentile
+from services import rate_limiter as rate_limiter_module
+from services.rate_limiter import AzureRateLimiter, azure_http_clients
+from services.services import SUMMARY_PROPMT
+from utility.config import settings
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "services", "data", "p5_examples.json")
+
+
+def _clients(limited: bool) -> Dict[str, object]:
+    common = {"api_key": settings.AZURE_OPENAI_API_KEY, "azure_endpoint": settings.AZURE_OPENAI_ENDPOINT}
+    http = azure_http_clients() if limited else {}
+    return {
+        "chat": AzureChatOpenAI(openai_api_version=settings.AZURE_OPENAI_API_VERSION,
+                                azure_deployment=settings.AZURE_OPENAI_MODEL_NAME, temperature=0.2,
+                                **common, **http),
+        "embeddings": AzureOpenAIEmbeddings(model=settings.AZURE_OPENAI_EMBEDDING_MODEL,
+                                            api_version=settings.AZURE_OPENAI_API_VERSION,
+                                            check_embedding_ctx_length=settings.EMBEDDING_CHECK_CTX_LENGTH,
+                                            **common, **http),
+    }
+
+
+async def run_once(limited: bool, codes: List[str], args: argparse.Namespace) -> Dict[str, float]:
+    if limited:
+        rate_limiter_module.rate_limiter = AzureRateLimiter(args.tpm, args.rpm, settings.RATE_LIMIT_BURST_SECONDS)
+    clients = _clients(limited)
+    rng = random.Random(args.seed)
+    latencies: List[float] = []
+    # 每次成功调用的 (完成时刻, token 数)
+    completed: List[tuple] = []
+    failures = 0
+    started = time.perf_counter()
+    deadline = started + args.duration
+
+    async def worker() -> None:
+        nonlocal failures
+        while time.perf_counter() < deadline:
+            code = rng.choice(codes)
+            start = time.perf_counter()
+            try:
+                if rng.random() < args.embedding_share:
+                    await clients["embeddings"].aembed_documents([code])
+                    tokens = None
+                else:
+                    response = await clients["chat"].ainvoke(
+                        [SystemMessage(content=SUMMARY_PROPMT), HumanMessage(content=f"请总结这个代码:\n\n```\n{code}\n```")])
+                    tokens = response.response_metadata.get("token_usage", {}).get("total_tokens")
+            except Exception:
+                failures += 1
+                continue
+            now = time.perf_counter()
+            latencies.append(now - start)
+            completed.append((now - started, tokens if tokens is not None else len(code) // 4))
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    buckets = [0.0] * max(1, int(args.duration // args.bucket))
+    for at, tokens in completed:
+        index = int(at // args.bucket)
+        if index < len(buckets):
+            buckets[index] += tokens / args.bucket * 60
+    # 第一个桶包含初始突发，不计入稳定性
+    steady = buckets[1:] or buckets
+    mean = statistics.fmean(steady)
+    latencies.sort()
+    return {
+        "calls": len(completed),
+        "failures": failures,
+        "p50": percentile(latencies, 50) if latencies else 0.0,
+        "p95": percentile(latencies, 95) if latencies else 0.0,
+        "tpm": mean,
+        "cv": statistics.pstdev(steady) / mean if mean else 0.0,
+        "elapsed": elapsed,
+    }
+
+
+def _throttled() -> float:
+    # 模拟服务返回的 429 数 (baseline 的 429 由 openai 客户端自行重试，不经过本进程的限流器)
+    return httpx.get(f"{settings.AZURE_OPENAI_ENDPOINT.rstrip('/')}/mock/stats").json()["throttled"]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="比较默认 429 重试与共享令牌桶限流在配额上限处的吞吐量。")
+    parser.add_argument("--tpm", type=int, default=60000, help="部署的每分钟 token 配额 (与 mock_azure --tpm 一致)")
+    parser.add_argument("--rpm", type=int, default=600, help="部署的每分钟请求配额 (与 mock_azure --rpm 一致)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=60.0, help="每种配置运行的秒数")
+    parser.add_argument("--bucket", type=float, default=5.0, help="吞吐量分桶的秒数")
+    parser.add_argument("--embedding-share", type=float, default=0.3, help="embedding 请求所占比例")
+    parser.add_argument("--cooldown", type=float, default=10.0, help="两次运行之间等待配额恢复的秒数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    with open(EXAMPLES_PATH, "r", encoding="utf-8") as f:
+        codes = [example["code"] for example in json.load(f)]
+
+    print(f"quota {args.tpm} TPM / {args.rpm} RPM, concurrency {args.concurrency}, {args.duration:.0f}s per run")
+    print(f"{'mode':>9}{'calls':>7}{'fail':>6}{'429':>6}{'p50 s':>8}{'p95 s':>8}{'tok/min':>10}{'cv':>7}")
+
+    async def run_all() -> None:
+        for limited in (False, True):
+            if limited:
+                await asyncio.sleep(args.cooldown)
+            throttled_before = _throttled()
+            result = await run_once(limited, codes, args)
+            print(f"{'limited' if limited else 'baseline':>9}{result['calls']:>7}{result['failures']:>6}"
+                  f"{_throttled() - throttled_before:>6.0f}{result['p50']:>8.2f}{result['p95']:>8.2f}"
+                  f"{result['tpm']:>10.0f}{result['cv']:>7.2f}")
+
+    asyncio.run(run_all())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+# bench/replay.py
+"""
+会话日志回放 (Session Replay Benchmark)
+
+把 /timing 记录在 session_logs.jsonl 中的真实课堂会话，还原为按时间缩放的 API 调用流，
+对一个运行中的后端实例重放，并输出可复现的性能回归报告。
+
+还原规则 (每个会话):
+- versionCodes 中的每个版本按顺序产生一次 /add_version_node；
+- versionConversations 中该版本下的每条用户消息产生一次 /chat，之前的对话作为 short_term_history；
+- actionCounts 中的 merge / modify 次数产生对应次数的 /merge 和 /modify，
+  插入位置由 --seed 和 session_id 决定，且总在至少保存了两个版本之后；
+- 所有事件均匀分布在会话的实际时长 (timingData 中最早的 start 到最晚的 end) 内，再除以 --time-scale。
+同一会话内的请求依次发出 (用户会等待回复)，落后于时间表时立即发出，并记录调度滞后。
+
+LLM 和 Embedding 后端由 bench.mock_azure 提供：固定答案模式，或用 --replay 回放录制的真实响应。
+
+用法:
+    python -m bench.replay --log session_logs.jsonl --time-scale 30 --json-out run.json
+    # 与上一次的结果比较，p50/p95 变慢超过阈值时以非零状态退出
+    python -m bench.replay --log session_logs.jsonl --time-scale 30 --baseline run.json --threshold 0.1
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from bench.loadgen import MODES, EndpointStats, percentile, print_report
+
+DEFAULT_SESSION_SECONDS = 600.0
+
+
+@dataclass
+class ReplayEvent:
+    offset: float
+    endpoint: str
+    payload: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class ReplaySession:
+    session_id: str
+    start: float
+    events: List[ReplayEvent]
+
+
+def _session_span(entry: Dict[str, Any]) -> Tuple[Optional[float], float]:
+    """从 timingData 中取出会话的开始时间和时长 (秒)。"""
+    segments = [seg for segs in (entry.get("timingData") or {}).values() for seg in segs]
+    if not segments:
+        return None, DEFAULT_SESSION_SECONDS
+    start = min(seg["start"] for seg in segments) / 1000
+    end = max(seg["end"] for seg in segments) / 1000
+    return start, max(end - start, 1.0)
+
+
+def build_session(entry: Dict[str, Any], prefix: str, seed: int, history_turns: int) -> ReplaySession:
+    """把一条会话日志还原为带时间偏移的事件序列。"""
+    original_id = entry["session_id"]
+    session_id = f"{prefix}-{original_id}"
+    rng = random.Random(f"{seed}:{original_id}")
+    usage = entry.get("usageData") or {}
+    codes: Dict[str, str] = usage.get("versionCodes") or {}
+    conversations: Dict[str, List[Dict[str, Any]]] = usage.get("versionConversations") or {}
+    counts = usage.get("actionCounts") or {}
+    session_mode = rng.choice(MODES)
+
+    events: List[ReplayEvent] = []
+    for version_id, code in codes.items():
+        description = f"版本 {version_id}"
+        events.append(ReplayEvent(0.0, "add_version_node", {
+            "session_id": session_id, "version_id": version_id, "code": code, "description": description,
+        }))
+        history: List[Dict[str, str]] = []
+        interaction_count = 0
+        for message in conversations.get(version_id, []):
+            role, content = message.get("role"), message.get("content")
+            if not isinstance(content, str):
+                continue
+            if role == "user":
+                interaction_count += 1
+                events.append(ReplayEvent(0.0, "chat", {
+                    "session_id": session_id, "version_id": version_id, "code": code,
+                    "code_description": description,
+                    "short_term_history": history[-history_turns:] if history_turns else [],
+                    "user_question": content,
+                    "type": message.get("type") or message.get("mode") or session_mode,
+                    "interaction_count": interaction_count,
+                }))
+            history.append({"role": str(role), "content": content})
+
+    # merge / modify 插入到已保存至少两个版本之后的随机位置
+    version_ids = list(codes)
+    if len(version_ids) >= 2:
+        first_slot = next(i for i, e in enumerate(events)
+                          if e.endpoint == "add_version_node" and e.payload["version_id"] == version_ids[1]) + 1
+        extra = ["merge"] * int(counts.get("merge") or 0) + ["modify"] * int(counts.get("modify") or 0)
+        for endpoint in extra:
+            position = rng.randint(first_slot, len(events))
+            saved = {e.payload["version_id"] for e in events[:position] if e.endpoint == "add_version_node"}
+            candidates = [vid for vid in version_ids if vid in saved]
+            if endpoint == "merge":
+                id_1, id_2 = rng.sample(candidates, 2)
+                payload = {
+                    "session_id": session_id,
+                    "version_id_1": id_1, "code_1": codes[id_1], "description_1": f"版本 {id_1}",
+                    "version_id_2": id_2, "code_2": codes[id_2], "description_2": f"版本 {id_2}",
+                    "instruction": "把两个版本的视觉效果融合在一起", "mode": session_mode,
+                }
+            else:
+                payload = {"code": codes[rng.choice(candidates)], "mode": session_mode}
+            events.insert(position, ReplayEvent(0.0, endpoint, payload))
+
+    start, duration = _session_span(entry)
+    for i, event in enumerate(events):
+        event.offset = duration * i / max(len(events), 1)
+    return ReplaySession(session_id, start or 0.0, events)
+
+
+def load_sessions(path: str, prefix: str, seed: int, history_turns: int,
+                  task: Optional[str], limit: Optional[int]) -> List[ReplaySession]:
+    sessions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if task and entry.get("task") != task:
+                continue
+            sessions.append(build_session(entry, prefix, seed, history_turns))
+            if limit and len(sessions) >= limit:
+                break
+    return sessions
+
+
+async def send_event(client: httpx.AsyncClient, event: ReplayEvent, rng: random.Random) -> Tuple[str, int]:
+    """发出一个事件对应的请求，返回 (统计用的端点名, 状态码)。"""
+    if event.endpoint != "modify":
+        r = await client.post(f"/{event.endpoint}", json=event.payload)
+        return event.endpoint, r.status_code
+    r = await client.post("/modify/recommend-styles")
+    if r.status_code != 200 or not r.json():
+        return "modify/recommend", r.status_code
+    r = await client.post("/modify/apply-style", json={
+        "style_tag": rng.choice(r.json())["tag"], **event.payload,
+    })
+    return "modify/apply-style", r.status_code
+
+
+async def replay_session(client: httpx.AsyncClient, session: ReplaySession, run_start: float,
+                         delay: float, time_scale: float, stats: Dict[str, EndpointStats],
+                         lag: List[float], seed: int) -> None:
+    rng = random.Random(f"{seed}:{session.session_id}:modify")
+    for event in session.events:
+        due = run_start + (delay + event.offset) / time_scale
+        now = time.monotonic()
+        if due > now:
+            await asyncio.sleep(due - now)
+        else:
+            lag.append(now - due)
+        start = time.perf_counter()
+        try:
+            name, status_code = await send_event(client, event, rng)
+        except httpx.HTTPError as e:
+            name, status_code = event.endpoint, 0
+            print(f"request error on {event.endpoint}: {type(e).__name__}: {e}")
+        elapsed = time.perf_counter() - start
+        s = stats[name]
+        s.status_counts[status_code] += 1
+        if 200 <= status_code < 300:
+            s.latencies.append(elapsed)
+        else:
+            s.errors += 1
+
+
+def summarize(stats: Dict[str, EndpointStats]) -> Dict[str, Dict[str, float]]:
+    summary = {}
+    for name, s in stats.items():
+        values = sorted(s.latencies)
+        summary[name] = {
+            "ok": len(values),
+            "errors": s.errors,
+            **{f"p{q}_ms": round(percentile(values, q) * 1000, 1) for q in (50, 90, 95, 99)},
+        }
+    return summary
+
+
+def compare(current: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            threshold: float) -> List[str]:
+    """逐端点比较 p50 / p95 和错误数，返回回归项；同时打印对比表。"""
+    regressions = []
+    print(f"\n{'endpoint':<22}{'metric':>8}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name in sorted(set(current) | set(baseline)):
+        cur, base = current.get(name), baseline.get(name)
+        if cur is None or base is None:
+            print(f"{name:<22}{'':>8}{'missing in ' + ('current' if cur is None else 'baseline'):>34}")
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            before, after = base[metric], cur[metric]
+            change = (after - before) / before if before else 0.0
+            flag = "  REGRESSION" if change > threshold else ""
+            print(f"{name:<22}{metric[:3]:>8}{before:>12.1f}{after:>12.1f}{change:>+10.1%}{flag}")
+            if flag:
+                regressions.append(f"{name} {metric[:3]} {before:.1f} -> {after:.1f} ms ({change:+.1%})")
+        if cur["errors"] > base["errors"]:
+            regressions.append(f"{name} errors {base['errors']} -> {cur['errors']}")
+    return regressions
+
+
+def _file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+async def run(args: argparse.Namespace) -> int:
+    sessions = load_sessions(args.log, args.prefix, args.seed, args.history_turns, args.task, args.limit)
+    if not sessions:
+        print(f"no sessions found in {args.log}")
+        return 1
+    first_start = min(s.start for s in sessions)
+    delays = {s.session_id: (s.start - first_start if args.align == "recorded" else 0.0) for s in sessions}
+    total_events = sum(len(s.events) for s in sessions)
+    span = max(delays[s.session_id] + (s.events[-1].offset if s.events else 0.0) for s in sessions)
+    print(f"replaying {len(sessions)} sessions, {total_events} requests, "
+          f"~{span / args.time_scale:.0f}s at {args.time_scale:g}x")
+
+    stats: Dict[str, EndpointStats] = defaultdict(EndpointStats)
+    lag: List[float] = []
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout) as client:
+        run_start = time.monotonic()
+        await asyncio.gather(*(
+            replay_session(client, s, run_start, delays[s.session_id], args.time_scale, stats, lag, args.seed)
+            for s in sessions
+        ))
+        elapsed = time.monotonic() - run_start
+
+    print(f"\n{len(sessions)} sessions, {elapsed:.1f}s\n")
+    print_report(stats, elapsed)
+    lag.sort()
+    print(f"\nschedule lag: {len(lag)} late requests, p50 {percentile(lag, 50) * 1000:.0f} ms, "
+          f"max {(lag[-1] if lag else 0.0) * 1000:.0f} ms")
+
+    mock_stats = None
+    if args.mock_url:
+        try:
+            mock_stats = httpx.get(f"{args.mock_url.rstrip('/')}/mock/stats", timeout=5).json()
+            print(f"mock backend: {mock_stats}")
+        except httpx.HTTPError as e:
+            print(f"could not read mock stats: {e}")
+
+    report = {
+        "config": {
+            "log": args.log, "log_sha256": _file_digest(args.log), "seed": args.seed,
+            "time_scale": args.time_scale, "align": args.align, "task": args.task,
+            "sessions": len(sessions), "requests": total_events,
+        },
+        "elapsed_s": round(elapsed, 2),
+        "endpoints": summarize(stats),
+        "schedule_lag_ms": {"late": len(lag), "p50": round(percentile(lag, 50) * 1000, 1) if lag else 0.0},
+        "mock": mock_stats,
+    }
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config", {}).get("log_sha256") != report["config"]["log_sha256"]:
+            print("warning: baseline was recorded from a different session log")
+        regressions = compare(report["endpoints"], baseline["endpoints"], args.threshold)
+        if regressions:
+            print("\nregressions:\n  " + "\n  ".join(regressions))
+            return 1
+        print("\nno regressions")
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="按时间缩放重放 session_logs.jsonl 中的真实会话并生成性能回归报告。")
+    parser.add_argument("--log", default="session_logs.jsonl")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--time-scale", type=float, default=10.0, help="时间压缩倍数，10 表示以 10 倍速重放")
+    parser.add_argument("--align", choices=("recorded", "together"), default="recorded",
+                        help="recorded: 保留会话之间的实际开始时间差；together: 所有会话同时开始")
+    parser.add_argument("--task", default=None, help="只重放该任务 (例如 TaskA) 的会话")
+    parser.add_argument("--limit", type=int, default=None, help="最多重放的会话数")
+    parser.add_argument("--history-turns", type=int, default=10, help="/chat 携带的最近对话条数")
+    parser.add_argument("--prefix", default="replay", help="重放会话 ID 的前缀，避免与真实会话的记忆混在一起")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--mock-url", default=None, help="bench.mock_azure 的地址，用于在报告中附上其请求统计")
+    parser.add_argument("--json-out", default=None, help="把报告写入该 JSON 文件，可作为之后的 --baseline")
+    parser.add_argument("--baseline", default=None, help="与之比较的上一次报告")
+    parser.add_argument("--threshold", type=float, default=0.1, help="p50/p95 变慢超过该比例视为回归")
+    sys.exit(asyncio.run(run(parser.parse_args(argv))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# bench/retrieval_bench.py
+"""
+版本记忆检索基准 (Retrieval Benchmark)
+
+比较 /chat 的两种检索后端在集合总规模增长时的延迟：
+- chroma: 在共享集合上带 {session_id == s, version_id != v} 过滤条件的 query (RETRIEVAL_BACKEND=chroma)；
+- session_index: 每会话 NumPy 矩阵上的精确暴力 top-k (RETRIEVAL_BACKEND=session_index)，
+  另外单独报告首次检索时从 Chroma 懒加载一个会话的耗时。
+向量为按会话聚类的随机单位向量 (模拟同一会话中相近的版本)，两种后端都跳过 Embedding 调用，只比较检索本身。
+同时报告 chroma 结果与精确 top-k 的重合率 (HNSW 是近似检索)。
+
+用法:
+    python -m bench.retrieval_bench --sizes 1000,5000,20000 --versions-per-session 30 --dim 1536
+"""
+import argparse
+import shutil
+import statistics
+import tempfile
+import time
+from typing import List, Optional
+
+import chromadb
+import numpy as np
+
+from bench.loadgen import percentile
+from services.session_index import SessionVectorIndex
+
+
+class _Store:
+    """SessionVectorIndex 只用到 vector_store._collection。"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+
+def _vectors(rng: np.random.Generator, sessions: int, per_session: int, dim: int) -> np.ndarray:
+    centroids = rng.standard_normal((sessions, 1, dim)).astype(np.float32)
+    vectors = centroids + 0.6 * rng.standard_normal((sessions, per_session, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors
+
+
+def _timed(func, repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="比较 Chroma 过滤检索与每会话 NumPy 精确检索的延迟。")
+    parser.add_argument("--sizes", default="1000,5000,20000", help="逐步增长到的集合总版本数")
+    parser.add_argument("--versions-per-session", type=int, default=30)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200, help="每个规模下的检索次数")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    per_session = args.versions_per_session
+    rng = np.random.default_rng(args.seed)
+    workdir = tempfile.mkdtemp(prefix="retrieval-bench-")
+    try:
+        client = chromadb.PersistentClient(path=workdir)
+        collection = client.create_collection("version_graph_memory")
+        store = _Store(collection)
+        stored_sessions = 0
+
+        print(f"{'versions':>9}{'chroma p50':>12}{'p95':>9}{'index p50':>11}{'p95':>8}"
+              f"{'load p50':>10}{'speedup':>9}{'recall@k':>10}   (µs)")
+        for size in sizes:
+            # 把集合增长到 size 个版本
+            target_sessions = max(1, size // per_session)
+            while stored_sessions < target_sessions:
+                batch = min(100, target_sessions - stored_sessions)
+                vectors = _vectors(rng, batch, per_session, args.dim)
+                ids, metadatas = [], []
+                for s in range(stored_sessions, stored_sessions + batch):
+                    for v in range(per_session):
+                        ids.append(f"s{s}_v{v}")
+                        metadatas.append({"session_id": f"s{s}", "version_id": f"v{v}", "ai_summary": f"版本 {v}"})
+                collection.add(ids=ids, embeddings=vectors.reshape(-1, args.dim), metadatas=metadatas,
+                               documents=[f"doc {doc_id}" for doc_id in ids])
+                stored_sessions += batch
+
+            sessions = [f"s{i}" for i in rng.integers(0, stored_sessions, args.queries)]
+            versions = [f"v{i}" for i in rng.integers(0, per_session, args.queries)]
+            queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+            queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+            chroma_us, chroma_ids = [], []
+            for q, session_id, version_id in zip(queries, sessions, versions):
+                where = {"$and": [{"session_id": {"$eq": session_id}}, {"version_id": {"$ne": version_id}}]}
+                start = time.perf_counter()
+                result = collection.query(query_embeddings=[q], n_results=args.k, where=where, include=["metadatas"])
+                chroma_us.append((time.perf_counter() - start) * 1e6)
+                chroma_ids.append(result["ids"][0])
+
+            index = SessionVectorIndex()
+            load_us, index_us, recall = [], [], []
+            for q, session_id, version_id, found in zip(queries, sessions, versions, chroma_ids):
+                index.clear()
+                start = time.perf_counter()
+                entry = index._get(store, session_id)
+                load_us.append((time.perf_counter() - start) * 1e6)
+                index_us.append(statistics.median(_timed(lambda: entry.top_k(q, args.k, version_id), 5)))
+                exact = {entry.ids[row] for row in entry.top_k(q, args.k, version_id)}
+                recall.append(len(exact & set(found)) / max(1, len(exact)))
+
+            chroma_us, index_us, load_us = sorted(chroma_us), sorted(index_us), sorted(load_us)
+            chroma_p50, index_p50 = percentile(chroma_us, 50), percentile(index_us, 50)
+            print(f"{collection.count():>9}{chroma_p50:>12.0f}{percentile(chroma_us, 95):>9.0f}"
+                  f"{index_p50:>11.1f}{percentile(index_us, 95):>8.1f}{percentile(load_us, 50):>10.0f}"
+                  f"{chroma_p50 / index_p50:>8.0f}x{statistics.mean(recall):>10.3f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
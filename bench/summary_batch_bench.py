@@ -0,0 +1,120 @@
+# bench/summary_batch_bench.py
+"""
+摘要合批基准 (Summary Batching Benchmark)
+
+对 CodeSummarizerService.summarize_code 施加同样的到达负载 (泊松到达，或 --rate 0 时一次性全部到达)，
+依次以不同的 SUMMARY_BATCH_SIZE 运行，报告:
+- 吞吐量 (摘要/秒) 和单个摘要的 p50 / p95 延迟；
+- LLM 调用次数，以及每个摘要平均分摊的 Prompt / Completion token 数；
+- 合批结果中逐个回退的摘要数 (配合 bench.mock_azure --batch-summary-error-rate 验证部分失败)。
+代码片段取自灵感库 services/data/p5_examples.json。
+
+用法:
+    # 先启动 python -m bench.mock_azure，并在环境变量中把 AZURE_OPENAI_* 指向它 (见 bench.mock_azure)
+    python -m bench.summary_batch_bench --versions 200 --rate 20 --batch-sizes 1,4,8
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Dict, List, Optional
+
+from langchain_community.callbacks import get_openai_callback
+
+from bench.loadgen import percentile
+from services.services import CodeSummarizerService
+from utility.config import settings
+from utility.metrics import SUMMARY_REQUESTS
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "services", "data", "p5_examples.json")
+
+
+def _fallbacks() -> float:
+    return SUMMARY_REQUESTS.labels(path="fallback")._value.get()
+
+
+async def run_once(batch_size: int, codes: List[str], rate: float, seed: int) -> Dict[str, float]:
+    settings.SUMMARY_BATCH_SIZE = batch_size
+    summarizer = CodeSummarizerService()
+    rng = random.Random(seed)
+    latencies: List[float] = []
+    fallbacks_before = _fallbacks()
+
+    async def one(code: str, delay: float) -> None:
+        await asyncio.sleep(delay)
+        start = time.perf_counter()
+        await summarizer.summarize_code(code)
+        latencies.append(time.perf_counter() - start)
+
+    arrivals, t = [], 0.0
+    for _ in codes:
+        arrivals.append(t)
+        if rate > 0:
+            t += rng.expovariate(rate)
+
+    with get_openai_callback() as usage:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(code, delay) for code, delay in zip(codes, arrivals)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "batch_size": batch_size,
+        "throughput": len(codes) / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "calls": usage.successful_requests,
+        "prompt_per_summary": usage.prompt_tokens / len(codes),
+        "completion_per_summary": usage.completion_tokens / len(codes),
+        "fallbacks": _fallbacks() - fallbacks_before,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="比较不同 SUMMARY_BATCH_SIZE 下的摘要吞吐量和 token 开销。")
+    parser.add_argument("--versions", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=20.0, help="每秒到达的摘要请求数 (泊松)，0 表示一次性全部到达")
+    parser.add_argument("--batch-sizes", default="1,4,8")
+    parser.add_argument("--window", type=float, default=settings.SUMMARY_BATCH_WINDOW, help="SUMMARY_BATCH_WINDOW")
+    parser.add_argument("--max-in-flight", type=int, default=settings.SUMMARY_BATCH_MAX_IN_FLIGHT,
+                        help="SUMMARY_BATCH_MAX_IN_FLIGHT")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    with open(EXAMPLES_PATH, "r", encoding="utf-8") as f:
+        examples = [example["code"] for example in json.load(f)]
+    codes = [examples[i % len(examples)] for i in range(args.versions)]
+    settings.SUMMARY_BATCH_WINDOW = args.window
+    settings.SUMMARY_BATCH_MAX_IN_FLIGHT = args.max_in_flight
+
+    print(f"{args.versions} summaries, arrival rate {args.rate or 'all at once'}/s, "
+          f"LLM_MAX_CONCURRENCY={settings.LLM_MAX_CONCURRENCY}, window {args.window * 1000:.0f} ms, "
+          f"max in flight {args.max_in_flight}")
+    print(f"{'batch':>6}{'summ/s':>9}{'p50 s':>8}{'p95 s':>8}{'calls':>7}{'prompt tok':>12}{'compl tok':>11}{'fallback':>10}")
+
+    async def run_all() -> List[Dict[str, float]]:
+        # 所有配置在同一个事件循环中运行 (全局 LLM 信号量绑定在第一次使用它的事件循环上)
+        results = []
+        for batch_size in (int(size) for size in args.batch_sizes.split(",")):
+            result = await run_once(batch_size, codes, args.rate, args.seed)
+            results.append(result)
+            print(f"{batch_size:>6}{result['throughput']:>9.2f}{result['p50']:>8.2f}{result['p95']:>8.2f}"
+                  f"{result['calls']:>7}{result['prompt_per_summary']:>12.0f}{result['completion_per_summary']:>11.1f}"
+                  f"{result['fallbacks']:>10.0f}")
+        return results
+
+    results = asyncio.run(run_all())
+    baseline = results[0]
+    if not baseline["calls"]:
+        raise SystemExit("no successful LLM calls; check AZURE_OPENAI_* (see bench.mock_azure)")
+    baseline_tokens = baseline["prompt_per_summary"] + baseline["completion_per_summary"]
+    for result in results[1:]:
+        tokens = result["prompt_per_summary"] + result["completion_per_summary"]
+        print(f"batch {result['batch_size']}: {result['throughput'] / baseline['throughput']:.2f}x throughput, "
+              f"{tokens / baseline_tokens:.2f}x tokens per summary vs batch {baseline['batch_size']}")
+
+
+if __name__ == "__main__":
+    main()
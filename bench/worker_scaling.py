@@ -0,0 +1,114 @@
+# bench/worker_scaling.py
+"""
+多 worker 扩展性压测 (Worker Scaling Benchmark)
+
+依次以不同的 worker 数通过 tools.serve 启动后端 (Chroma 由唯一的属主进程持有)，
+对每种配置运行同样的 bench.loadgen 负载，报告总吞吐量、相对单 worker 的加速比和延迟分位数。
+LLM / Embedding 后端应指向 bench.mock_azure，使结果只反映本服务自身的 CPU 开销。
+
+用法:
+    # 先启动 python -m bench.mock_azure，并在环境变量中把 AZURE_OPENAI_* 指向它 (见 bench.mock_azure)
+    python -m bench.worker_scaling --workers 1,2,4 --duration 60 --concurrency 32
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from bench.loadgen import percentile
+
+
+def wait_until_ready(base_url: str, process: subprocess.Popen, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    raise TimeoutError(f"{base_url} not ready after {timeout:.0f}s")
+
+
+def run_once(workers: int, args: argparse.Namespace) -> Dict[str, float]:
+    """以给定 worker 数启动后端并运行一次 loadgen，返回汇总结果。"""
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "tools.serve", "--workers", str(workers), "--port", str(args.port),
+         "--host", "127.0.0.1"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL if args.quiet else None,
+    )
+    try:
+        wait_until_ready(base_url, server, args.startup_timeout)
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+            out_path = f.name
+        subprocess.run(
+            [sys.executable, "-m", "bench.loadgen", "--base-url", base_url,
+             "--duration", str(args.duration), "--concurrency", str(args.concurrency),
+             "--mix", args.mix, "--seed", str(args.seed), "--json-out", out_path],
+            check=True, stdout=subprocess.DEVNULL if args.quiet else None,
+        )
+        with open(out_path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        os.unlink(out_path)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(60)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    latencies = sorted(v for endpoint in raw.values() for v in endpoint["latencies"])
+    return {
+        "workers": workers,
+        "ok": len(latencies),
+        "errors": sum(endpoint["errors"] for endpoint in raw.values()),
+        "rps": len(latencies) / args.duration,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="比较不同 worker 数下后端的吞吐量和延迟。")
+    parser.add_argument("--workers", default="1,2,4", help="逗号分隔的 worker 数列表")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mix", default="chat=0.5,add_version_node=0.3,merge=0.1,modify=0.1")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--json-out", default=None)
+    parser.add_argument("--quiet", action="store_true", help="不显示服务端和每次 loadgen 的输出")
+    args = parser.parse_args(argv)
+
+    results = []
+    for workers in (int(w) for w in args.workers.split(",")):
+        print(f"running with {workers} worker(s)...", file=sys.stderr)
+        results.append(run_once(workers, args))
+
+    print(f"\n{os.cpu_count()} CPUs, {args.concurrency} concurrent sessions, {args.duration:g}s per run\n")
+    header = f"{'workers':>8}{'ok':>8}{'err':>6}{'rps':>9}{'speedup':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    print(header)
+    print("-" * len(header))
+    baseline_rps = results[0]["rps"] or 1.0
+    for r in results:
+        print(f"{r['workers']:>8}{r['ok']:>8}{r['errors']:>6}{r['rps']:>9.2f}{r['rps'] / baseline_rps:>8.2f}x"
+              f"{r['p50_ms']:>9.0f}{r['p95_ms']:>9.0f}{r['p99_ms']:>9.0f}")
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({"cpus": os.cpu_count(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,32 @@
 # main.py
+import asyncio
+import logging
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from contextlib import asynccontextmanager
 
 # --- 从新的 services.py 文件中导入初始化函数 ---
-from services.services import initialize_services
+from services.services import get_vector_store, get_warmup_steps, initialize_services
 # --- 从新的 api 模块导入主路由 ---
 from routes.routes import api_router
 # --- 假设的导入路径 ---
 from utility.config import settings
+from utility.metrics import MetricsMiddleware, monitor_event_loop_lag
+from utility.tracing import TracingMiddleware, shutdown_tracing
+from utility.logging_config import RequestContextMiddleware, setup_logging, shutdown_logging
+from services.usage_store import usage_store
+from services.analytics_store import analytics_store
+from services.retention import retention
+from services.summary_jobs import summary_jobs
+from utility.lifecycle import DrainMiddleware, lifecycle
+from utility.deadline import DeadlineMiddleware
+from utility.codec import GzipRequestMiddleware, ORJSONResponse
+
+# --- 日志配置：JSON 结构化日志，由后台线程写出 ---
+setup_logging()
+logger = logging.getLogger(__name__)
 
 # --- 应用的生命周期管理 (Lifespan) ---
 @asynccontextmanager
@@ -17,18 +34,47 @@ async def lifespan(app: FastAPI):
     """
     在应用启动时，调用独立的初始化函数来设置所有服务。
     """
-    print("--- 应用启动，开始初始化服务 ---")
+    logger.info("--- 应用启动，开始初始化服务 ---")
     initialize_services()
+    # SIGTERM 时先排空在途请求，再交给 uvicorn 关闭
+    lifecycle.install_signal_handler()
+    # 后台预热，完成后 /ready 才返回 200
+    if settings.WARMUP_ENABLED:
+        lifecycle.start_warmup(get_warmup_steps())
+    else:
+        lifecycle.state = "ready"
+    # 后台持续测量事件循环延迟，供 /metrics 暴露
+    loop_lag_task = asyncio.create_task(monitor_event_loop_lag())
+    # 后台刷新会话访问记录，按计划执行会话过期和 Chroma 压缩
+    retention_task = asyncio.create_task(retention.run_scheduler(lambda: get_vector_store()._collection))
+    # 重新执行上次退出时未完成的异步摘要作业
+    await summary_jobs.resume()
     yield
+    # 等待 (或在超时后取消) 剩余的请求和后台任务
+    await lifecycle.shutdown()
+    loop_lag_task.cancel()
+    retention_task.cancel()
+    # 写完尚未落盘的追踪数据
+    shutdown_tracing()
+    # 写完尚未入库的 token 用量
+    usage_store.flush()
+    # 写完尚未入库的会话分析记录
+    analytics_store.flush()
+    # 写完尚未入库的会话访问记录
+    retention.flush_access()
     # 这里可以放置应用关闭时需要执行的清理代码
-    print("--- 应用正在关闭 ---")
+    logger.info("--- 应用正在关闭 ---")
+    # 写完队列中剩余的日志
+    shutdown_logging()
 
 
 # --- FastAPI 应用实例配置 ---
 app = FastAPI(
     title="Design Loop AI Backend",
     version="1.0.0",
-    lifespan=lifespan  # 附加生命周期事件
+    lifespan=lifespan,  # 附加生命周期事件
+    # 所有路由默认用 orjson 序列化响应
+    default_response_class=ORJSONResponse,
 )
 
 # --- 中间件配置 ---
@@ -38,13 +84,30 @@ origins = [
     "http://localhost:5173", # 假设这是你的前端地址
     # "http://your-production-domain.com",
 ]
+# 超过 GZIP_MIN_SIZE 的响应按 Accept-Encoding 进行 gzip 压缩 (流式响应逐块压缩)
+app.add_middleware(GZipMiddleware, minimum_size=settings.GZIP_MIN_SIZE, compresslevel=settings.GZIP_COMPRESS_LEVEL)
+# 解压 Content-Encoding: gzip 的请求体
+app.add_middleware(GzipRequestMiddleware)
+# 登记在途请求；排空期间以 503 拒绝新请求
+app.add_middleware(DrainMiddleware)
+# 按路由的延迟预算和客户端的截止时间请求头设置请求截止时间，客户端断开时取消 LLM 路由的请求
+# (依赖外层 MetricsMiddleware 解析的路由模板)
+app.add_middleware(DeadlineMiddleware)
+# CORS 必须在 DrainMiddleware 外层：排空时直接返回的 503 也要带上 CORS 头，浏览器才能读到状态码和 Retry-After
 app.add_middleware(
     CORSMiddleware, 
     allow_origins=origins, 
     allow_credentials=True,
     allow_methods=["*"], 
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id", "traceparent", "X-Request-Id", "Retry-After"],
 )
+# 记录每个路由的延迟和进行中的请求数
+app.add_middleware(MetricsMiddleware)
+# 为每个请求分配 request_id，所有日志记录都会带上它
+app.add_middleware(RequestContextMiddleware)
+# 为每个请求创建根 span，并通过 X-Trace-Id 响应头返回 trace ID (最外层，覆盖其余中间件)
+app.add_middleware(TracingMiddleware)
 
 # --- 注册 API 路由 ---
 # 将所有 API 路由包含进来，可以加一个统一的前缀，如 /api/v1
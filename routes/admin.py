@@ -0,0 +1,64 @@
+# api/admin.py
+import asyncio
+import hmac
+import logging
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+
+from services.retention import retention
+from services.services import get_vector_store
+from utility.config import settings
+from utility.codec import ORJSONRoute
+
+logger = logging.getLogger(__name__)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """
+    要求请求头 X-Admin-Token 与 ADMIN_TOKEN 相同。未配置 ADMIN_TOKEN 时 /admin 端点一律不可用 (404)，
+    而不是对所有人开放：这些端点可以删除全部会话的版本记忆。
+    """
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode("utf-8"),
+                                                        settings.ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid admin token.")
+
+
+router = APIRouter(route_class=ORJSONRoute, dependencies=[Depends(require_admin)])
+
+
+def _check_busy(report: dict) -> dict:
+    if report.get("skipped") == "busy":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail="Another expiry or compaction run is in progress.")
+    return report
+
+
+@router.get("/admin/retention")
+def retention_status(ttl_days: Optional[float] = Query(None, gt=0, description="按该 TTL 统计过期会话，默认 RETENTION_TTL_DAYS")):
+    """会话访问记录概况、按 TTL 已过期的会话数，以及最近一次过期和压缩的结果。"""
+    return retention.status(ttl_days)
+
+
+@router.post("/admin/retention/expire")
+async def run_expiry(
+    ttl_days: Optional[float] = Query(None, gt=0, description="默认 RETENTION_TTL_DAYS"),
+    dry_run: bool = Query(False, description="只统计将被删除的会话和版本，不删除"),
+):
+    """
+    立即删除最后访问早于 ttl_days 的会话的全部版本记忆，返回删除的会话数和版本数。
+    删除在线程中分批执行，不阻塞其他请求。
+    """
+    collection = get_vector_store()._collection
+    try:
+        report = await asyncio.to_thread(retention.expire, collection, ttl_days, dry_run)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return _check_busy(report)
+
+
+@router.post("/admin/retention/compact")
+async def run_compaction():
+    """立即回收 chroma.sqlite3 的空闲页 (在线增量压缩)，返回回收的字节数。"""
+    return _check_busy(await asyncio.to_thread(retention.compact))
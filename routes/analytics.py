@@ -0,0 +1,50 @@
+# api/analytics.py
+import logging
+from typing import Optional
+from fastapi import APIRouter, Query
+
+from services.analytics_store import analytics_store
+from utility.codec import ORJSONRoute
+
+router = APIRouter(route_class=ORJSONRoute)
+logger = logging.getLogger(__name__)
+
+# 以下都是同步端点：sqlite 查询由 FastAPI 放到线程池中执行，不阻塞事件循环。
+# 只按任务过滤 (或不过滤) 时读取预聚合的汇总表；按用户过滤时走 (user_id, task) 索引。
+
+
+@router.get("/analytics/regions")
+def query_region_durations(
+    task: Optional[str] = Query(None, description="任务 (e.g., TaskA)"),
+    user_id: Optional[str] = None,
+):
+    """各区域 (timingData 的键) 的总停留时长 (毫秒)、时间段数和会话数，按总时长降序。"""
+    return {"task": task, "user_id": user_id, "results": analytics_store.region_totals(task=task, user_id=user_id)}
+
+
+@router.get("/analytics/actions")
+def query_action_counts(
+    task: Optional[str] = Query(None, description="任务 (e.g., TaskA)"),
+    user_id: Optional[str] = None,
+):
+    """按任务汇总 actionCounts (delete / modify / merge / duplicate) 和预览点击次数。"""
+    return {"task": task, "user_id": user_id, "results": analytics_store.action_totals(task=task, user_id=user_id)}
+
+
+@router.get("/analytics/versions")
+def query_version_counts(
+    task: Optional[str] = Query(None, description="任务 (e.g., TaskA)"),
+    user_id: Optional[str] = None,
+):
+    """按任务统计每个会话的版本数：总数、平均值、最大值和分布。"""
+    return {"task": task, "user_id": user_id, "results": analytics_store.version_counts(task=task, user_id=user_id)}
+
+
+@router.get("/analytics/sessions")
+def query_sessions(
+    task: Optional[str] = Query(None, description="任务 (e.g., TaskA)"),
+    user_id: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=10000),
+):
+    """按接收时间倒序列出会话的分析字段。"""
+    return {"results": analytics_store.sessions(task=task, user_id=user_id, limit=limit)}
@@ -1,11 +1,18 @@
 # api/chat.py
+import logging
 from fastapi import APIRouter, HTTPException, status, Depends
 from langchain_community.vectorstores import Chroma
-from langchain_openai import AzureChatOpenAI
 from langchain.prompts import SystemMessagePromptTemplate, HumanMessagePromptTemplate, ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
 
 from services.services import get_vector_store
+from services.llm_runtime import invoke_chain
+from services.model_routing import chat_model
+from services.session_index import aretrieve_version_memories
+from services.retention import retention
+from utility.metrics import observe_vector_op, set_request_mode
+from utility.tracing import span
+from utility.logging_config import bind_session, log_payload
 from utility.schemas import ChatRequest
 from utility.config import settings
 from utility.prompt import (
@@ -23,17 +30,16 @@ from utility.deep_chat import (
     DEEP_REFLECTION_KEYWORDS,
     generate_vague_deep_reflection_response # 导入重构后的函数
 )
+from utility.codec import ORJSONRoute
+from utility.deadline import DeadlineExceeded
 
-router = APIRouter()
+router = APIRouter(route_class=ORJSONRoute)
+logger = logging.getLogger(__name__)
 
-# --- LLM 设置 (保持不变) ---
-llm = AzureChatOpenAI(
-    openai_api_version=settings.AZURE_OPENAI_API_VERSION,
-    azure_deployment=settings.AZURE_OPENAI_MODEL_NAME,
-    azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
-    api_key=settings.AZURE_OPENAI_API_KEY,
-    temperature=0.7
-)
+# --- LLM 设置：各类回复按任务路由到各自的部署 (services.model_routing) ---
+llm = chat_model("chat")
+transition_llm = chat_model("transition")
+reflection_llm = chat_model("reflection")
 
 # --- 辅助函数 (保持不变) ---
 def format_memories_for_prompt(memories: list) -> str:
@@ -62,46 +68,50 @@ async def chat(
     处理聊天请求。
     根据交互模式和次数，路由到普通聊天、过渡层或深度反思。
     """
+    set_request_mode(request.type)
+    bind_session(request.session_id)
+    retention.touch(request.session_id)
     try:
         # --- 数据准备 (保持不变) ---
         retrieval_query = f"{request.code_description}\n{request.user_question}"
-        where_clause = {
-            "$and": [
-                {"session_id": {"$eq": request.session_id}},
-                {"version_id": {"$ne": request.version_id}}
-            ]
-        }
-        results = vector_store.similarity_search(query=retrieval_query, k=3, filter=where_clause)
-        retrieved_metadatas = [doc.metadata for doc in results]
-        formatted_memories = format_memories_for_prompt(retrieved_metadatas)
-        formatted_history = format_history_for_prompt(request.short_term_history)
+        with span("chroma.retrieve", k=3, backend=settings.RETRIEVAL_BACKEND), observe_vector_op("query"):
+            # 在线程中检索，受请求预算约束，客户端断开时随请求一起取消
+            results = await aretrieve_version_memories(
+                vector_store, retrieval_query, k=3,
+                session_id=request.session_id, exclude_version_id=request.version_id,
+            )
+        with span("memory.format", memories=len(results), history=len(request.short_term_history)):
+            retrieved_metadatas = [doc.metadata for doc in results]
+            formatted_memories = format_memories_for_prompt(retrieved_metadatas)
+            formatted_history = format_history_for_prompt(request.short_term_history)
 
         # --- 核心路由逻辑 ---
         if request.type in ['explainable', 'explorative', 'transformative']:
             
             # --- 第二次交互: 过渡层 (保持不变) ---
             if request.interaction_count == 2:
-                print(f"🌀 [会话: {request.session_id}] 进入过渡反思层 (第 {request.interaction_count} 次)。")
-                transition_response = await generate_transition_response(
-                    user_question=request.user_question,
-                    current_code=request.code,
-                    memory=formatted_memories,
-                    history=formatted_history,
-                    llm=llm
-                )
+                logger.info("🌀 [会话: %s] 进入过渡反思层 (第 %s 次)。", request.session_id, request.interaction_count)
+                with span("chat.transition", mode=request.type):
+                    transition_response = await generate_transition_response(
+                        user_question=request.user_question,
+                        current_code=request.code,
+                        memory=formatted_memories,
+                        history=formatted_history,
+                        llm=transition_llm
+                    )
                 transition_sentences = {
                     "explainable": "💡如果你愿意，我们可以从**动机说明**,**阐明目标**或**细节决策说明**选择一个方向继续进行思考",
                     "explorative": "💡如果你愿意，我们可以从**概念联系探索**,**模块体验关系**或**情感视觉一致性**选择一个方向继续进行思考",
                     "transformative": "💡如果你愿意，我们可以从**创意方法改变**,**功能方法重思**或**视觉风格调整**选择一个方向继续进行思考"
                 }
                 transition_response['advice'] = transition_sentences.get(request.type, "")
-                print(f"✅ [会话: {request.session_id}] 过渡层响应已生成。")
-                print(transition_response)
+                logger.info("✅ [会话: %s] 过渡层响应已生成。", request.session_id)
+                log_payload(logger, "transition response", transition_response)
                 return transition_response
 
             # --- ‼️ 第三次及以上交互: 深度反思 (核心修改点) ---
             elif request.interaction_count >= 3:
-                print(f"🚀 [会话: {request.session_id}] 进入深度反思模式 (第 {request.interaction_count} 次)。")
+                logger.info("🚀 [会话: %s] 进入深度反思模式 (第 %s 次)。", request.session_id, request.interaction_count)
                 
                 # --- 情况1: 明确意图 - 通过关键词直接匹配 ---
                 matched_category = None
@@ -109,68 +119,73 @@ async def chat(
                 for keyword, category in keywords_for_mode.items():
                     if keyword in request.user_question:
                         matched_category = category
-                        print(f"🎯 [会话: {request.session_id}] 匹配到关键词 '{keyword}'，意图明确为 '{category}'。")
+                        logger.info("🎯 [会话: %s] 匹配到关键词 '%s'，意图明确为 '%s'。", request.session_id, keyword, category)
                         break
                 
                 if matched_category:
-                    reflection_string = await generate_deep_reflection_response(
-                        mode=request.type,
-                        category=matched_category,
-                        history= formatted_history,
-                        memory = formatted_memories,
-                        llm=llm,
-                        
-                    )
-                    print(f"💬 [会话: {request.session_id}] 已生成模板化反思问题。")
+                    with span("chat.deep_reflection", mode=request.type, category=matched_category):
+                        reflection_string = await generate_deep_reflection_response(
+                            mode=request.type,
+                            category=matched_category,
+                            history= formatted_history,
+                            memory = formatted_memories,
+                            llm=reflection_llm,
+                            
+                        )
+                    logger.info("💬 [会话: %s] 已生成模板化反思问题。", request.session_id)
                     return {"reflection": reflection_string}
 
                 # --- 情况2: 模糊意图 - 调用新的结构化响应生成器 ---
                 else:
-                    print(f"🌀 [会话: {request.session_id}] 未匹配到关键词，启动模糊意图结构化响应。")
+                    logger.info("🌀 [会话: %s] 未匹配到关键词，启动模糊意图结构化响应。", request.session_id)
                     
                     # 直接调用重构后的函数，它将处理所有逻辑
-                    structured_response = await generate_vague_deep_reflection_response(
-                        user_question=request.user_question,
-                        current_code=request.code,
-                        mode=request.type,
-                        llm=llm,
-                        history = formatted_history,
-                        memory = formatted_memories
-                    )
+                    with span("chat.vague_reflection", mode=request.type):
+                        structured_response = await generate_vague_deep_reflection_response(
+                            user_question=request.user_question,
+                            current_code=request.code,
+                            mode=request.type,
+                            llm=reflection_llm,
+                            history = formatted_history,
+                            memory = formatted_memories
+                        )
                     
-                    print(f"✅ [会话: {request.session_id}] 已生成四段式模糊反思响应。")
+                    logger.info("✅ [会话: %s] 已生成四段式模糊反思响应。", request.session_id)
                     return structured_response
 
         # --- 普通聊天流程 (保持不变) ---
-        print(f"💬 [会话: {request.session_id}] 普通聊天模式 (第 {request.interaction_count} 次)。")
+        logger.info("💬 [会话: %s] 普通聊天模式 (第 %s 次)。", request.session_id, request.interaction_count)
         system_prompts = {
             'explainable': EXPLAINABLE_SYSTEM_PROMPT,
             'explorative': EXPLORATIVE_SYSTEM_PROMPT,
             'transformative': TRANSFORMATIVE_SYSTEM_PROMPT,
             'general': GENERAL_SYSTEM_PROMPT
         }
-        system_prompt = system_prompts.get(request.type, GENERAL_SYSTEM_PROMPT)
-        chat_prompt = ChatPromptTemplate.from_messages([
-            SystemMessagePromptTemplate.from_template(system_prompt),
-            HumanMessagePromptTemplate.from_template(USER_PROMPT)
-        ])
-        chain = chat_prompt | llm | JsonOutputParser()
-        chain_input = {
-            "retrieved_memories": formatted_memories,
-            "short_term_history": formatted_history,
-            "code_description": request.code_description,
-            "current_code": request.code,
-            "user_question": request.user_question,
-        }
-        response = await chain.ainvoke(chain_input)
-        print(f"✅ [会话: {request.session_id}] 普通聊天响应已生成。")
-        print(response)
+        with span("prompt.build", mode=request.type):
+            system_prompt = system_prompts.get(request.type, GENERAL_SYSTEM_PROMPT)
+            chat_prompt = ChatPromptTemplate.from_messages([
+                SystemMessagePromptTemplate.from_template(system_prompt),
+                HumanMessagePromptTemplate.from_template(USER_PROMPT)
+            ])
+            chain = chat_prompt | llm | JsonOutputParser()
+            chain_input = {
+                "retrieved_memories": formatted_memories,
+                "short_term_history": formatted_history,
+                "code_description": request.code_description,
+                "current_code": request.code,
+                "user_question": request.user_question,
+            }
+        with span("chat.general", mode=request.type):
+            response = await invoke_chain(chain, chain_input)
+        logger.info("✅ [会话: %s] 普通聊天响应已生成。", request.session_id)
+        log_payload(logger, "chat response", response)
         return response
 
+    except DeadlineExceeded as e:
+        logger.warning("⏱️ 请求超出延迟预算: %s", e)
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
     except Exception as e:
-        print(f"❌ 在 /chat 端点发生严重错误: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ 在 /chat 端点发生严重错误: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
             detail=f"An internal error occurred while processing the chat: {str(e)}"
@@ -0,0 +1,17 @@
+# api/health.py
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from utility.lifecycle import lifecycle
+from utility.codec import ORJSONRoute
+
+router = APIRouter(route_class=ORJSONRoute)
+
+@router.get("/ready", summary="Readiness Check")
+def ready():
+    """
+    就绪探针：预热完成后返回 200；启动预热中或收到 SIGTERM 开始排空后返回 503。
+    存活检查请使用根路径 /。
+    """
+    body = {"status": lifecycle.state, "warmup": lifecycle.warmup_steps}
+    return JSONResponse(status_code=200 if lifecycle.ready else 503, content=body)
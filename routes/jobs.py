@@ -0,0 +1,71 @@
+# api/jobs.py
+import asyncio
+import logging
+from typing import AsyncIterator, Optional
+
+import orjson
+from fastapi import APIRouter, Header, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+
+from services.summary_jobs import summary_jobs
+from utility.codec import ORJSONRoute
+
+router = APIRouter(route_class=ORJSONRoute)
+logger = logging.getLogger(__name__)
+
+
+async def _job_events(session_id: str, after: int) -> AsyncIterator[bytes]:
+    # 事件 id 为作业的结束序号 seq，EventSource 重连时以 Last-Event-ID 传回
+    yield b"retry: 3000\n\n"
+    async for job in summary_jobs.events(session_id, after):
+        if job is None:
+            yield b": keep-alive\n\n"
+            continue
+        yield (f"id: {job['seq']}\nevent: {job['status']}\n".encode()
+               + b"data: " + orjson.dumps(job) + b"\n\n")
+
+
+@router.get("/jobs/events")
+async def job_events(
+    session_id: str = Query(..., description="订阅的会话"),
+    after: Optional[int] = Query(None, ge=0, description="从该事件 id 之后开始推送，0 表示推送保留期内全部已结束的作业"),
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    以 Server-Sent Events 推送会话中异步摘要作业的结果 (event: done / failed，data 为作业记录)。
+    每个结束的作业推送一次，事件 id 为作业的结束序号 seq。默认只推送订阅之后结束的作业，
+    所以应先订阅再提交；EventSource 断线重连时带上 Last-Event-ID，从断点继续推送。
+    """
+    if last_event_id:
+        try:
+            after = int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid Last-Event-ID.")
+    if after is None:
+        # 在返回响应头之前确定起点，客户端收到响应后提交的作业都会被推送
+        after = await asyncio.to_thread(summary_jobs.store.last_seq)
+    return StreamingResponse(
+        _job_events(session_id, after),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/jobs")
+async def list_jobs(
+    session_id: str = Query(...),
+    since: float = Query(0.0, description="只返回 updated_at 晚于该时间 (Unix 秒) 的作业"),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """轮询回退：列出会话中的异步摘要作业及其状态 (pending / running / done / failed)。"""
+    jobs = await asyncio.to_thread(summary_jobs.store.session_jobs, session_id, since, limit)
+    return {"jobs": jobs}
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """轮询回退：查询单个异步摘要作业；完成后 summary 为生成的摘要，失败时 error 为原因。"""
+    job = await asyncio.to_thread(summary_jobs.store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job '{job_id}' not found.")
+    return job
@@ -1,28 +1,40 @@
 # api/merge.py
+import asyncio
+import json
+import logging
 from fastapi import APIRouter, HTTPException, status
-from utility.schemas import MergeRequest
-from typing import Dict
+from fastapi.responses import StreamingResponse
+from utility.schemas import MergeRequest, MergeVersion, MultiMergeRequest
+from typing import AsyncIterator, Dict, List, Tuple
 
 # --- LangChain 和自定义模块导入 ---
-from langchain_openai import AzureChatOpenAI
 from langchain.prompts import SystemMessagePromptTemplate, HumanMessagePromptTemplate, ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
 from utility.config import settings
+from services.llm_runtime import invoke_chain
+from services.model_routing import chat_model
+from services.retention import retention
+from utility.metrics import set_request_mode
+from utility.logging_config import bind_session, log_payload
+from utility.code_diff import (
+    MergeHunks,
+    compute_merge_hunks,
+    render_skeleton,
+    render_hunks,
+    assemble_merged_code
+)
+from utility.codec import ORJSONRoute
+from utility.deadline import DeadlineExceeded
 
 # --- Pydantic 模型定义 ---
 
 # --- 初始化 Router ---
-router = APIRouter()
+router = APIRouter(route_class=ORJSONRoute)
+logger = logging.getLogger(__name__)
 
 # --- LLM 和 Prompt 设置 ---
-# 复用现有的 llm 实例，或根据需要创建一个新的
-llm = AzureChatOpenAI(
-    openai_api_version=settings.AZURE_OPENAI_API_VERSION,
-    azure_deployment=settings.AZURE_OPENAI_MODEL_NAME,
-    azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
-    api_key=settings.AZURE_OPENAI_API_KEY,
-    temperature=0.2 # 对于代码合并，使用较低的温度以获得更可预测的结果
-)
+# 部署与温度由 services.model_routing 的 "merge" 任务决定 (默认较低的温度，使合并结果更可预测)
+llm = chat_model("merge")
 
 
 # --- User Prompt: 提供了所有需要合并的信息 ---
@@ -52,64 +64,260 @@ USER_PROMPT_TEMPLATE = """
 
 
 
+# --- 差异块模式的 User Prompt: 只包含一次共享骨架和差异块 ---
+HUNK_USER_PROMPT_TEMPLATE = """
+这是需要合并的两个代码版本。它们共享大部分代码，因此下面只给出一次**共享骨架**，以及两个版本存在差异的**差异块**。
+
+**代码版本1 (ID: {version_id_1})**
+*描述*: {description_1}
+
+**代码版本2 (ID: {version_id_2})**
+*描述*: {description_2}
+
+**共享骨架** (`<<<HUNK Hn>>>` 表示差异块所在的位置，`/* ... 省略 N 行共享代码 ... */` 表示未展示的共享代码):
+```javascript
+{skeleton}
+```
+
+**差异块:**
+{hunks}
+
+**合并指令：**
+"{instruction}"
+
+**本次为差异块合并模式，输出格式以此处为准：**
+- 不要输出完整的 `code`。
+- 输出 `hunks`：一个 JSON 对象，键为差异块 ID（{hunk_ids}），值为该位置合并后的代码字符串；每个差异块都必须给出，若该位置不需要代码则给出空字符串。
+- 输出 `additions`：需要追加到程序末尾的新代码（例如新的全局变量、函数或类），没有则为空字符串。
+- 其余字段（如 `rationale`、`reflection`）的要求保持不变。
+
+请根据我的指令合并这两个版本，并以上述JSON格式返回。
+"""
+
+
+def _select_system_prompt(mode: str) -> str:
+    """根据交互模式选择合并使用的 System Prompt。"""
+    mode = mode.strip()
+    if mode == 'explroative':
+        logger.info("Use explorative mode!")
+        return EXPLO_SYSTEM_PROMPT
+    elif mode == 'transformative':
+        return T_SYSTEM_PROMPT
+    elif mode == 'explainable':
+        return EXPLA_SYSTEM_PROMPT
+    return GENE_SYSTEM_PROMPT
+
+
+def _should_use_hunks(request: MergeRequest, merge_hunks: MergeHunks) -> bool:
+    """只有当代码足够长且两个版本共享大部分代码时，差异块模式才划算。"""
+    if not merge_hunks.hunks:
+        return False
+    if max(len(request.code_1), len(request.code_2)) < settings.MERGE_HUNK_MIN_CHARS:
+        return False
+    return merge_hunks.shared_ratio >= settings.MERGE_HUNK_MIN_SHARED_RATIO
+
+
+async def _merge_full(request: MergeRequest, system_prompt: str) -> Dict[str, str]:
+    """把两个完整版本发送给 LLM 进行合并。"""
+    merge_prompt = ChatPromptTemplate.from_messages([
+        SystemMessagePromptTemplate.from_template(system_prompt),
+        HumanMessagePromptTemplate.from_template(USER_PROMPT_TEMPLATE)
+    ])
+
+    # 使用 .with_structured_output 来确保返回的是我们期望的 JSON 结构
+    # 注意：这需要较新版本的 langchain-openai
+    # 如果不可用，则使用 JsonOutputParser
+    chain = merge_prompt | llm | JsonOutputParser()
+    chain_input = {
+        "version_id_1": request.version_id_1,
+        "code_1": request.code_1,
+        "description_1": request.description_1,
+        "version_id_2": request.version_id_2,
+        "code_2": request.code_2,
+        "description_2": request.description_2,
+        "instruction": request.instruction,
+    }
+    return await invoke_chain(chain, chain_input)
+
+
+async def _merge_by_hunks(request: MergeRequest, system_prompt: str, merge_hunks: MergeHunks) -> Dict[str, str]:
+    """只把共享骨架和差异块发送给 LLM，再由服务端拼装完整代码。"""
+    merge_prompt = ChatPromptTemplate.from_messages([
+        SystemMessagePromptTemplate.from_template(system_prompt),
+        HumanMessagePromptTemplate.from_template(HUNK_USER_PROMPT_TEMPLATE)
+    ])
+    chain = merge_prompt | llm | JsonOutputParser()
+    chain_input = {
+        "version_id_1": request.version_id_1,
+        "description_1": request.description_1,
+        "version_id_2": request.version_id_2,
+        "description_2": request.description_2,
+        "skeleton": render_skeleton(merge_hunks, settings.MERGE_HUNK_CONTEXT_LINES),
+        "hunks": render_hunks(merge_hunks),
+        "hunk_ids": ", ".join(hunk.hunk_id for hunk in merge_hunks.hunks),
+        "instruction": request.instruction,
+    }
+    response = await invoke_chain(chain, chain_input)
+
+    resolved = response.pop("hunks", None)
+    if not isinstance(resolved, dict):
+        raise ValueError("LLM 未返回 hunks 对象。")
+    additions = response.pop("additions", "") or ""
+    response["code"] = assemble_merged_code(
+        merge_hunks,
+        {str(k): str(v) if v is not None else "" for k, v in resolved.items()},
+        additions=str(additions),
+    )
+    return response
+
+
+async def _merge_two(request: MergeRequest) -> Dict[str, str]:
+    """
+    合并两个版本并校验 LLM 返回结果。
+    当两个版本共享大部分代码时，只发送差异块以缩短 Prompt。
+    """
+    logger.debug("Merge mode: %s", request.mode)
+    system_prompt = _select_system_prompt(request.mode)
+
+    merge_hunks = compute_merge_hunks(request.code_1, request.code_2)
+    response = None
+    if _should_use_hunks(request, merge_hunks):
+        logger.info("Using hunk merge: %s hunks, shared ratio %.2f",
+                    len(merge_hunks.hunks), merge_hunks.shared_ratio)
+        try:
+            response = await _merge_by_hunks(request, system_prompt, merge_hunks)
+        except Exception as e:
+            # 差异块结果不完整时，回退到完整合并
+            logger.warning("⚠️ Hunk merge failed, falling back to full merge: %s", e)
+            response = None
+    if response is None:
+        response = await _merge_full(request, system_prompt)
+
+    # 验证返回结果
+    if "code" not in response or "rationale" not in response:
+        raise ValueError("Invalid response format from LLM.")
+    return response
+
+
 @router.post("/merge", response_model=Dict[str, str])
 async def merge_code_versions(request: MergeRequest):
     """
     接收两个代码版本和一条指令，使用 LLM 进行智能合并。
     """
-    print(f"Received merge request for session: {request.session_id}")
+    logger.info("Received merge request for session: %s", request.session_id)
+    set_request_mode(request.mode)
+    bind_session(request.session_id)
+    retention.touch(request.session_id)
     try:
-        SYSTEM_PROMPT = ''
-        print(request.mode)
-        mode = request.mode
-        mode = request.mode.strip()
-        if mode == 'explroative':
-            SYSTEM_PROMPT = EXPLO_SYSTEM_PROMPT
-            
-            print("Use explorative mode!")
-        elif mode == 'transformative':
-            SYSTEM_PROMPT= T_SYSTEM_PROMPT
-        elif mode == 'explainable':SYSTEM_PROMPT = EXPLA_SYSTEM_PROMPT
-        else: SYSTEM_PROMPT = GENE_SYSTEM_PROMPT
-    
-        merge_prompt = ChatPromptTemplate.from_messages([
-            SystemMessagePromptTemplate.from_template(SYSTEM_PROMPT),
-            HumanMessagePromptTemplate.from_template(USER_PROMPT_TEMPLATE)
-        ])
-
-        # 使用 .with_structured_output 来确保返回的是我们期望的 JSON 结构
-        # 注意：这需要较新版本的 langchain-openai
-        # 如果不可用，则使用 JsonOutputParser
-        chain = merge_prompt | llm | JsonOutputParser()
-        chain_input = {
-            "version_id_1": request.version_id_1,
-            "code_1": request.code_1,
-            "description_1": request.description_1,
-            "version_id_2": request.version_id_2,
-            "code_2": request.code_2,
-            "description_2": request.description_2,
-            "instruction": request.instruction,
-        }
-
-        # 调用 LLM chain
-        response = await chain.ainvoke(chain_input)
-        
-        # 验证返回结果
-        if "code" not in response or "rationale" not in response:
-            raise HTTPException(status_code=500, detail="Invalid response format from LLM.")
-
-        print("Successfully merged code.")
-        print(response)
+        response = await _merge_two(request)
+        logger.info("Successfully merged code.")
+        log_payload(logger, "merge response", response)
         return response
 
+    except DeadlineExceeded as e:
+        logger.warning("⏱️ 请求超出延迟预算: %s", e)
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
     except Exception as e:
-        print(f"❌ Error during merge process: {e}")
+        logger.exception("❌ Error during merge process: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An internal error occurred during the merge process: {str(e)}"
         )
 
 
+async def _merge_pair(request: MultiMergeRequest, left: MergeVersion, right: MergeVersion, mode: str) -> Tuple[MergeVersion, Dict[str, str]]:
+    """合并树中的一次两两合并，返回合并后的新节点。"""
+    response = await _merge_two(MergeRequest(
+        session_id=request.session_id,
+        version_id_1=left.version_id,
+        code_1=left.code,
+        description_1=left.description,
+        version_id_2=right.version_id,
+        code_2=right.code,
+        description_2=right.description,
+        instruction=request.instruction,
+        mode=mode,
+    ))
+    merged = MergeVersion(
+        version_id=f"merge({left.version_id}+{right.version_id})",
+        code=response["code"],
+        description=f"{left.description} + {right.description}",
+    )
+    return merged, response
+
+
+async def _merge_tree_events(request: MultiMergeRequest) -> AsyncIterator[str]:
+    """
+    以平衡二叉树的方式两两合并所有版本，每一层的合并并发执行（受全局 LLM 并发上限约束），
+    每完成一次合并就以 NDJSON 的形式推送一条中间结果，最后推送最终结果。
+    """
+    nodes: List[MergeVersion] = list(request.versions)
+    level = 0
+    while len(nodes) > 1:
+        level += 1
+        pairs = [(nodes[i], nodes[i + 1]) for i in range(0, len(nodes) - 1, 2)]
+        carry = nodes[-1] if len(nodes) % 2 else None
+        # 只有最后一次合并使用请求的反思模式，中间层只需要代码和阐述
+        mode = request.mode if len(nodes) == 2 else "general"
+
+        async def run(index: int, left: MergeVersion, right: MergeVersion, mode: str):
+            merged, response = await _merge_pair(request, left, right, mode)
+            return index, left, right, merged, response
+
+        tasks = [asyncio.create_task(run(i, left, right, mode)) for i, (left, right) in enumerate(pairs)]
+        merged_nodes: List[MergeVersion] = [None] * len(pairs)
+        try:
+            for finished in asyncio.as_completed(tasks):
+                index, left, right, merged, response = await finished
+                merged_nodes[index] = merged
+                yield json.dumps({
+                    "event": "intermediate",
+                    "level": level,
+                    "index": index,
+                    "sources": [left.version_id, right.version_id],
+                    "version_id": merged.version_id,
+                    **response,
+                }, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.exception("❌ Error during N-way merge at level %s: %s", level, e)
+            yield json.dumps({"event": "error", "level": level, "detail": str(e)}, ensure_ascii=False) + "\n"
+            return
+        finally:
+            # 客户端断开或出错时，取消这一层尚未完成的合并
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        nodes = merged_nodes + ([carry] if carry is not None else [])
+
+    logger.info("Successfully merged %s versions in %s levels.", len(request.versions), level)
+    yield json.dumps({
+        "event": "final",
+        "levels": level,
+        "version_id": nodes[0].version_id,
+        **response,
+    }, ensure_ascii=False) + "\n"
+
+
+@router.post("/merge/many")
+async def merge_many_versions(request: MultiMergeRequest):
+    """
+    接收多个版本和一条指令，按平衡树两两合并。
+    以 NDJSON 流式返回每一次中间合并结果（event=intermediate）和最终结果（event=final）。
+    """
+    logger.info("Received N-way merge request for session: %s (%s versions)",
+                request.session_id, len(request.versions))
+    set_request_mode(request.mode)
+    bind_session(request.session_id)
+    retention.touch(request.session_id)
+    if len(request.versions) < 2:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="At least two versions are required for a merge."
+        )
+    return StreamingResponse(_merge_tree_events(request), media_type="application/x-ndjson")
+
+
 
 GENE_SYSTEM_PROMPT = """
 
@@ -0,0 +1,19 @@
+# api/metrics.py
+import os
+
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest
+from prometheus_client import multiprocess
+
+from utility.codec import ORJSONRoute
+
+router = APIRouter(route_class=ORJSONRoute)
+
+@router.get("/metrics", include_in_schema=False)
+def metrics():
+    """以 Prometheus 文本格式暴露所有指标。多 worker 部署 (tools.serve) 时汇总所有 worker 的指标。"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
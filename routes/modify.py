@@ -1,30 +1,30 @@
 # api/modify.py
+import logging
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
 from typing import List
 
 # --- LangChain, Azure OpenAI, 和配置导入 ---
-from langchain_openai import AzureChatOpenAI
 from langchain.prompts import SystemMessagePromptTemplate, HumanMessagePromptTemplate, ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
-from utility.config import settings
 
 # --- 自定义服务和依赖注入 ---
 from services.services import get_inspiration_service
 from services.inspiration_service import InspirationService
+from services.llm_runtime import invoke_chain
+from services.model_routing import chat_model
+from utility.metrics import set_request_mode
+from utility.logging_config import log_payload
+from utility.codec import ORJSONRoute
+from utility.deadline import DeadlineExceeded
 
 # --- 初始化 FastAPI Router ---
-router = APIRouter()
+router = APIRouter(route_class=ORJSONRoute)
+logger = logging.getLogger(__name__)
 
 # --- 初始化LLM实例 ---
-# 为保证创意性与稳定性之间的平衡，我们将温度(temperature)设置为0.3
-llm = AzureChatOpenAI(
-    openai_api_version=settings.AZURE_OPENAI_API_VERSION,
-    azure_deployment=settings.AZURE_OPENAI_MODEL_NAME,
-    azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
-    api_key=settings.AZURE_OPENAI_API_KEY,
-    temperature=0.7, # 稍微提高温度以增加阐述的创意性
-)
+# 部署与温度由 services.model_routing 的 "style" 任务决定
+llm = chat_model("style")
 
 
 
@@ -85,7 +85,7 @@ async def recommend_modification_styles(
     从灵感库中随机获取3个风格（包含标签和预览图）。
     这个端点的功能保持不变，为前端提供风格选项。
     """
-    print("Received request for random style recommendations.")
+    logger.info("Received request for random style recommendations.")
     try:
         styles = inspiration_service.get_random_styles(count=3)
         if not styles:
@@ -93,10 +93,10 @@ async def recommend_modification_styles(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="No inspiration styles available in the library."
             )
-        print(f"✅ Recommended styles: {[s['tag'] for s in styles]}")
+        logger.info("✅ Recommended styles: %s", [s["tag"] for s in styles])
         return styles
     except Exception as e:
-        print(f"❌ Error during style recommendation: {e}")
+        logger.exception("❌ Error during style recommendation: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An internal error occurred while fetching styles: {str(e)}"
@@ -114,7 +114,8 @@ async def apply_style_to_code(
     接收用户当前的代码和选择的风格标签，
     使用LLM将灵感库中对应标签的代码风格智能地融入到用户代码中，并返回融合后的代码和创作阐述。
     """
-    print(f"Received apply style request for tag: '{request.style_tag}'")
+    logger.info("Received apply style request for tag: '%s'", request.style_tag)
+    set_request_mode(request.mode)
     try:
         # 1. 根据标签从灵感服务获取灵感代码
         inspiration_code = inspiration_service.get_code_by_tag(request.style_tag)
@@ -124,12 +125,12 @@ async def apply_style_to_code(
                 detail=f"Could not find an inspiration style matching the tag: '{request.style_tag}'"
             )
         SYSTEM_PROMPT = ''
-        print(request.mode)
+        logger.debug("Apply style mode: %s", request.mode)
         mode = request.mode
         mode = request.mode.strip()
         if mode == 'explorative':
             SYSTEM_PROMPT = EXPLO_SYSTEM_PROMPT
-            print("Use explorative mode!")
+            logger.info("Use explorative mode!")
         elif mode == 'transformative':
             SYSTEM_PROMPT= T_SYSTEM_PROMPT
         elif mode =='explainable':  SYSTEM_PROMPT = EXPLAIN_SYSTEM_PROMPT
@@ -147,16 +148,17 @@ async def apply_style_to_code(
             "inspiration_code": inspiration_code
         }
 
-        print("Invoking LLM for intelligent code modification and rationale generation...")
+        logger.info("Invoking LLM for intelligent code modification and rationale generation...")
         # 3. 异步调用LLM chain进行代码融合和阐述生成
-        response = await chain.ainvoke(chain_input)
+        response = await invoke_chain(chain, chain_input)
 
         # 4. 【修改】验证LLM的返回结果，现在需要同时检查code和rationale
         if "code" not in response or "rationale" not in response:
-            print(f"❌ LLM response is invalid: {response}")
+            logger.error("❌ LLM response is invalid, keys: %s", list(response))
+            log_payload(logger, "invalid apply-style response", response)
             raise HTTPException(status_code=500, detail="Invalid response format from LLM.")
 
-        print(f"✅ Successfully modified code for tag '{request.style_tag}'.")
+        logger.info("✅ Successfully modified code for tag '%s'.", request.style_tag)
         # 5. 【修改】返回成功融合后的代码和创作阐述
         if mode =='general': return ApplyStyleResponseGENE(code=response["code"], rationale=response["rationale"]) 
         else:    return ApplyStyleResponse(code=response["code"], rationale=response["rationale"], reflection=response["reflection"])
@@ -164,8 +166,11 @@ async def apply_style_to_code(
     except HTTPException as http_exc:
         # 重新抛出已知的HTTP异常，以便FastAPI正确处理
         raise http_exc
+    except DeadlineExceeded as e:
+        logger.warning("⏱️ 请求超出延迟预算: %s", e)
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
     except Exception as e:
-        print(f"❌ Error during style application process: {e}")
+        logger.exception("❌ Error during style application process: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An internal error occurred during style application: {str(e)}"
@@ -1,12 +1,18 @@
 # api/router.py
 from fastapi import APIRouter
-from . import chat, versions, merge,modify,timing
+from . import chat, versions, merge,modify,timing, metrics, usage, health, analytics, admin, jobs
 
 api_router = APIRouter()
 
 # 将各个模块的路由包含进来
 api_router.include_router(chat.router, tags=["Chat"])
 api_router.include_router(versions.router,  tags=["Version Management"])
+api_router.include_router(jobs.router, tags=["Version Management"])
 api_router.include_router(merge.router, tags=["Code Merging"])
 api_router.include_router(modify.router, tags=["Code Modification"]) 
-api_router.include_router(timing.router, tags=["User Behavior"])
\ No newline at end of file
+api_router.include_router(timing.router, tags=["User Behavior"])
+api_router.include_router(metrics.router, tags=["System"])
+api_router.include_router(health.router, tags=["System"])
+api_router.include_router(usage.router, tags=["Usage"])
+api_router.include_router(analytics.router, tags=["User Behavior"])
+api_router.include_router(admin.router, tags=["Admin"])
\ No newline at end of file
@@ -1,9 +1,19 @@
 # api/timing.py
-import json
-from fastapi import APIRouter, HTTPException, status
-from pydantic import BaseModel, Field
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+from fastapi import APIRouter, HTTPException, Request, status
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 from typing import List, Dict, Any, Optional
 
+from utility.config import settings
+from utility.logging_config import bind_session
+from utility.json_envelope import JsonEnvelopeError, JsonEnvelopeScanner
+from utility.codec import ORJSONRoute
+from services.analytics_store import analytics_store, build_session_record
+
 # --- Pydantic 数据模型定义 ---
 
 class TimeSegment(BaseModel):
@@ -31,7 +41,9 @@ class UsageData(BaseModel):
 
 class SessionDataRequest(BaseModel):
     """
-    定义接收完整会话数据的请求体模型
+    定义接收完整会话数据的请求体模型。
+    /timing 不再把请求体物化为该模型 (见 save_session_data)：信封字段、timingData 和 usageData 中的分析字段
+    仍按该模型校验，versionCodes / versionConversations 只校验 JSON 语法。
     """
     session_id: str = Field(..., description="当前会话的唯一ID")
     user_id: str = Field(..., description="用户的ID")
@@ -43,38 +55,160 @@ class SessionDataRequest(BaseModel):
 
 # --- FastAPI 路由 ---
 
-router = APIRouter()
+router = APIRouter(route_class=ORJSONRoute)
+logger = logging.getLogger(__name__)
 
 # 日志文件路径
 LOG_FILE_PATH = "session_logs.jsonl" 
 
+try:
+    import fcntl
+except ImportError:  # Windows: 只在单进程内串行追加
+    fcntl = None
+
+# 信封字段：必须是字符串的顶层字段，以及可选的对象字段
+_REQUIRED_STRING_FIELDS = ("session_id", "user_id", "task")
+_OPTIONAL_OBJECT_FIELDS = ("timingData", "usageData")
+# 会话分析需要的子树，由扫描器在流式读取时收集并按 SessionDataRequest 校验
+# (不包括体积大的 versionCodes / versionConversations)
+_ANALYTICS_PATHS = {
+    "timing_data": ("timingData",),
+    "action_counts": ("usageData", "actionCounts"),
+    "total_versions": ("usageData", "totalVersions"),
+    "preview_clicks": ("usageData", "previewClicks"),
+}
+_ANALYTICS_ADAPTERS = {
+    "timing_data": TypeAdapter(Optional[Dict[str, List[TimeSegment]]]),
+    "action_counts": TypeAdapter(ActionCounts),
+    "total_versions": TypeAdapter(int),
+    "preview_clicks": TypeAdapter(int),
+}
+
+
+def _validate_envelope(scanner: JsonEnvelopeScanner) -> Dict[str, Any]:
+    """
+    校验信封字段的类型，并按 SessionDataRequest 校验扫描时收集的分析字段，返回校验后的分析字段。
+    timingData 超过 ANALYTICS_MAX_TIMING_BYTES 时没有被收集，不做校验，也不统计区域时长。
+    """
+    errors = []
+    for field in _REQUIRED_STRING_FIELDS:
+        kind = scanner.types.get(field)
+        if kind is None:
+            errors.append({"loc": ["body", field], "msg": "Field required"})
+        elif kind != "string":
+            errors.append({"loc": ["body", field], "msg": f"Input should be a valid string, got {kind}"})
+    for field in _OPTIONAL_OBJECT_FIELDS:
+        kind = scanner.types.get(field)
+        if kind not in (None, "object", "null"):
+            errors.append({"loc": ["body", field], "msg": f"Input should be an object, got {kind}"})
+
+    analytics: Dict[str, Any] = {}
+    has_usage = scanner.types.get("usageData") == "object"
+    for name, path in _ANALYTICS_PATHS.items():
+        if path in scanner.truncated:
+            continue
+        if path not in scanner.collected:
+            # usageData 存在时其中的分析字段是必需的；timingData 可以省略
+            if has_usage and path[0] == "usageData":
+                errors.append({"loc": ["body", *path], "msg": "Field required"})
+            continue
+        adapter = _ANALYTICS_ADAPTERS[name]
+        try:
+            analytics[name] = adapter.dump_python(adapter.validate_python(scanner.collected[path]))
+        except ValidationError as e:
+            errors.extend({"loc": ["body", *path, *error["loc"]], "msg": error["msg"]} for error in e.errors())
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+    return analytics
+
+
+def _append_to_log(spool_path: str) -> None:
+    """把暂存文件整体追加到日志文件。多 worker 时用文件锁保证每条记录不被其他进程的写入打断。"""
+    with open(spool_path, "rb") as src, open(LOG_FILE_PATH, "ab") as dst:
+        if fcntl is not None:
+            fcntl.flock(dst, fcntl.LOCK_EX)
+        try:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(dst, fcntl.LOCK_UN)
+
+
 @router.post("/timing", status_code=status.HTTP_200_OK)
-async def save_session_data(request: SessionDataRequest):
+async def save_session_data(request: Request):
     """
-    接收并记录前端发送的完整会话数据（计时、埋点、代码快照）。
+    接收并记录前端发送的完整会话数据（计时、埋点、代码快照），请求体格式见 SessionDataRequest。
+
+    长会话的请求体可达数 MB，这里不把它物化为 Pydantic 模型：
+    请求体按块流式读取，一边由 JsonEnvelopeScanner 校验 JSON 语法和信封字段，一边写入暂存文件
+    (去掉 JSON 结构之间的换行，使其成为一行)；校验通过后再整体追加到 session_logs.jsonl。
+    分析字段 (timingData、actionCounts 等) 在扫描时顺带收集并按 SessionDataRequest 校验，不合法时返回 422
+    且不写入日志；校验通过后写入 analytics_store 供 /analytics 查询。
+    每个请求的内存占用与请求体大小无关，请求体 (解压后) 超过 MAX_REQUEST_BODY_BYTES 时返回 413。
     """
-    print(f"接收到来自会话 {request.session_id} (用户: {request.user_id}) 的完整会话数据。")
-    
+    limit = settings.MAX_REQUEST_BODY_BYTES
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > limit:
+        raise HTTPException(status_code=413, detail="Request body too large.")
+
+    scanner = JsonEnvelopeScanner(
+        capture=_REQUIRED_STRING_FIELDS,
+        collect=_ANALYTICS_PATHS.values(),
+        max_collect=settings.ANALYTICS_MAX_TIMING_BYTES,
+    )
+    log_dir = os.path.dirname(os.path.abspath(LOG_FILE_PATH))
+    spool = tempfile.NamedTemporaryFile(dir=log_dir, prefix=".timing-", suffix=".part", delete=False)
     try:
-        # 将 Pydantic 模型转换为字典，以便序列化
-        # 使用 by_alias=True 来确保字段名与前端发送的一致
-        log_entry = request.dict(by_alias=True, exclude_none=True)
-        
+        try:
+            async for chunk in request.stream():
+                if scanner.bytes_seen + len(chunk) > limit:
+                    raise HTTPException(status_code=413, detail="Request body too large.")
+                scanner.feed(chunk)
+                # 合法 JSON 的字符串内部不会出现原始换行，去掉的只是结构之间的空白
+                spool.write(chunk.translate(None, b"\r\n"))
+            scanner.close()
+        except JsonEnvelopeError as e:
+            raise HTTPException(
+                status_code=422,
+                detail=[{"loc": ["body"], "msg": str(e)}],
+            )
+        analytics = _validate_envelope(scanner)
+        spool.write(b"\n")
+        spool.close()
+
+        session_id, user_id = scanner.values["session_id"], scanner.values["user_id"]
+        bind_session(session_id)
+        logger.info(
+            "接收到来自会话 %s (用户: %s) 的完整会话数据。", session_id, user_id,
+            extra={"fields": {"bytes": scanner.bytes_seen}},
+        )
+
         # 将日志条目以 JSON Lines 格式追加到文件中
-        with open(LOG_FILE_PATH, "a", encoding="utf-8") as f:
-            f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
-            
-        print(f"✅ 完整会话数据已成功记录到 {LOG_FILE_PATH}")
+        await asyncio.to_thread(_append_to_log, spool.name)
+        logger.info("✅ 完整会话数据已成功记录到 %s", LOG_FILE_PATH)
+
+        if settings.ANALYTICS_ENABLED:
+            if scanner.truncated:
+                logger.warning("⚠️ 会话 %s 的 timingData 超过 %s 字节，未统计区域时长",
+                               session_id, settings.ANALYTICS_MAX_TIMING_BYTES)
+            analytics_store.record(build_session_record(
+                session_id, user_id, scanner.values["task"],
+                **analytics,
+            ))
 
         return {
             "message": "Session data received and logged successfully."
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"❌ 记录会话数据时发生错误: {e}")
+        logger.exception("❌ 记录会话数据时发生错误: %s", e)
         # 抛出标准的 HTTP 异常
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to log session data: {str(e)}"
         )
-
+    finally:
+        spool.close()
+        os.unlink(spool.name)
@@ -0,0 +1,34 @@
+# api/usage.py
+import logging
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, status
+
+from services.usage_store import GROUP_BY_COLUMNS, usage_store
+from utility.codec import ORJSONRoute
+
+router = APIRouter(route_class=ORJSONRoute)
+logger = logging.getLogger(__name__)
+
+@router.get("/usage")
+def query_usage(
+    group_by: str = Query("session", description=f"聚合维度: {', '.join(GROUP_BY_COLUMNS)}"),
+    session_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    endpoint: Optional[str] = None,
+    mode: Optional[str] = None,
+    since: Optional[float] = Query(None, description="起始时间 (Unix 秒)"),
+    until: Optional[float] = Query(None, description="结束时间 (Unix 秒)"),
+    limit: int = Query(100, ge=1, le=10000),
+):
+    """
+    按会话、用户、端点或模式聚合 LLM token 用量和估算成本，按成本降序返回。
+    这是同步端点，sqlite 查询由 FastAPI 放到线程池中执行，不阻塞事件循环。
+    """
+    try:
+        rows = usage_store.query(
+            group_by=group_by, session_id=session_id, user_id=user_id,
+            endpoint=endpoint, mode=mode, since=since, until=until, limit=limit,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {"group_by": group_by, "results": rows}
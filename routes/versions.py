@@ -1,50 +1,66 @@
 # api/versions.py
-from fastapi import APIRouter, HTTPException, status, Depends
+import asyncio
+import logging
+from typing import AsyncIterator, Dict, List
+
+import orjson
+from fastapi import APIRouter, HTTPException, Query, status, Depends
+from fastapi.responses import StreamingResponse
 from langchain_community.vectorstores import Chroma
 
 # --- 从核心服务和工具模块导入 ---
-from services.services import get_summarizer, get_vector_store, CodeSummarizerService
-from utility.schemas import AddVersionRequest, DeleteVersionRequest
-
-router = APIRouter()
+from services.services import get_summarizer, get_vector_store, CodeSummarizerService, version_doc_id, version_document
+from services.session_index import session_index
+from services.retention import retention
+from services.summary_jobs import summary_jobs
+from utility.schemas import AddVersionRequest, BulkAddVersionsRequest, BulkDeleteVersionsRequest, DeleteVersionRequest
+from utility.metrics import observe_vector_op
+from utility.logging_config import bind_session
+from utility.codec import ORJSONResponse, ORJSONRoute
+from utility.config import settings
 
-def _generate_doc_id(session_id: str, version_id: str) -> str:
-    """生成用于向量数据库的唯一文档 ID。"""
-    return f"{session_id}_{version_id}"
+router = APIRouter(route_class=ORJSONRoute)
+logger = logging.getLogger(__name__)
 
 @router.post("/add_version_node", status_code=status.HTTP_200_OK) # ‼️【修改点】: 状态码从 202 改为 200
 async def add_version_node(
     request: AddVersionRequest, 
     # ‼️【修改点】: 移除 BackgroundTasks
     summarizer: CodeSummarizerService = Depends(get_summarizer),
-    vector_store: Chroma = Depends(get_vector_store)
+    vector_store: Chroma = Depends(get_vector_store),
+    async_mode: bool = Query(False, alias="async", description="立即返回作业 ID，摘要在后台生成并通过 /jobs/events 推送"),
 ):
     """
     接收一个新版本，为其生成摘要，存入数据库，然后同步返回生成的摘要。
+    async=true 时只持久化作业并返回 202 和 job_id，摘要生成和写入向量库在后台进行。
     """
-    print(f"同步处理版本: {request.session_id}_{request.version_id}")
+    bind_session(request.session_id)
+    retention.touch(request.session_id)
+    if async_mode:
+        job = await summary_jobs.submit(request.session_id, request.version_id, request.code)
+        logger.info("异步处理版本: %s_%s，作业 %s", request.session_id, request.version_id, job["job_id"])
+        return ORJSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content={"message": "Version accepted; summary will be generated in the background.",
+                     "job_id": job["job_id"], "status": job["status"]},
+        )
+    logger.info("同步处理版本: %s_%s", request.session_id, request.version_id)
     try:
         # 1. 生成 AI 摘要 (这是主要的耗时操作)
         ai_summary = await summarizer.summarize_code(request.code)
         
         # 2. 准备文档和元数据
-        doc_id = _generate_doc_id(request.session_id, request.version_id)
-        document_content = (
-           
-            f"代码内容总结: {ai_summary}\n\n"
-            f"--- 源代码 ---\n{request.code}"
+        doc_id, document_content, metadata = version_document(
+            request.session_id, request.version_id, request.code, ai_summary
         )
-        metadata = {
-            "session_id": request.session_id, 
-            "version_id": request.version_id, 
-           
-            "ai_summary": ai_summary
-        }
         
         # 3. 将数据存入向量数据库
-        vector_store.add_texts(ids=[doc_id], texts=[document_content], metadatas=[metadata])
-        print(ai_summary)
-        print(f"✅ 版本记忆已存入/更新，ID: {doc_id}")
+        with observe_vector_op("upsert"):
+            # add_texts 同步调用 Embedding (可能要等配额) 并写入 Chroma，放到线程中执行，不阻塞事件循环
+            await asyncio.to_thread(vector_store.add_texts, ids=[doc_id], texts=[document_content],
+                                    metadatas=[metadata])
+            await asyncio.to_thread(session_index.refresh, vector_store, request.session_id, [doc_id])
+        logger.info("✅ 版本记忆已存入/更新，ID: %s", doc_id, extra={"fields": {"summary": ai_summary}})
 
         # 4. ‼️【修改点】: 在响应中返回生成的摘要
         return {
@@ -53,7 +69,7 @@ async def add_version_node(
         }
 
     except Exception as e:
-        print(f"❌ 同步处理版本失败，版本 ID {request.version_id}: {e}")
+        logger.exception("❌ 同步处理版本失败，版本 ID %s: %s", request.version_id, e)
         # 在出错时抛出标准的 HTTP 异常
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -67,14 +83,147 @@ async def delete_version_node(
     vector_store: Chroma = Depends(get_vector_store)
 ):
     """从后端删除特定版本的记忆。"""
+    bind_session(request.session_id)
+    retention.touch(request.session_id)
     try:
-        doc_id = _generate_doc_id(request.session_id, request.version_id)
-        vector_store.delete(ids=[doc_id])
-        print(f"✅ 版本记忆已删除，ID: {doc_id}")
+        doc_id = version_doc_id(request.session_id, request.version_id)
+        with observe_vector_op("delete"):
+            await asyncio.to_thread(vector_store.delete, ids=[doc_id])
+            session_index.remove(request.session_id, [doc_id])
+        logger.info("✅ 版本记忆已删除，ID: %s", doc_id)
         return {"message": f"Version '{request.version_id}' deleted successfully."}
     except Exception as e:
-        print(f"❌ 删除版本失败，ID {request.version_id}: {e}")
+        logger.exception("❌ 删除版本失败，ID %s: %s", request.version_id, e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to delete version '{request.version_id}': {e}"
-        )
\ No newline at end of file
+        )
+
+
+def _event(payload: Dict) -> bytes:
+    return orjson.dumps(payload) + b"\n"
+
+
+async def _bulk_add_events(
+    request: BulkAddVersionsRequest,
+    summarizer: CodeSummarizerService,
+    vector_store: Chroma,
+) -> AsyncIterator[bytes]:
+    """
+    并发生成摘要 (每个请求最多 BULK_SUMMARY_CONCURRENCY 个)，每完成一个推送一条 summarized 事件；
+    摘要每凑满 BULK_EMBED_BATCH 个就发起一次批量 Embedding，与剩余的摘要调用重叠进行；
+    全部完成后一次 upsert 写入 Chroma，推送 stored 事件。
+    """
+    # 摘要合批时每次 LLM 调用包含多个版本，按调用数限制并发
+    semaphore = asyncio.Semaphore(settings.BULK_SUMMARY_CONCURRENCY * max(1, settings.SUMMARY_BATCH_SIZE))
+    total = len(request.versions)
+
+    async def summarize(index: int):
+        async with semaphore:
+            return index, await summarizer.summarize_code(request.versions[index].code)
+
+    summary_tasks = [asyncio.create_task(summarize(i)) for i in range(total)]
+    embed_tasks: List[asyncio.Task] = []
+    ids: List[str] = []
+    documents: List[str] = []
+    metadatas: List[Dict] = []
+    try:
+        for done, finished in enumerate(asyncio.as_completed(summary_tasks), start=1):
+            index, ai_summary = await finished
+            version = request.versions[index]
+            doc_id, document_content, metadata = version_document(
+                request.session_id, version.version_id, version.code, ai_summary
+            )
+            ids.append(doc_id)
+            documents.append(document_content)
+            metadatas.append(metadata)
+            if len(documents) % settings.BULK_EMBED_BATCH == 0 or done == total:
+                start = len(documents) - (len(documents) % settings.BULK_EMBED_BATCH or settings.BULK_EMBED_BATCH)
+                embed_tasks.append(asyncio.create_task(
+                    vector_store.embeddings.aembed_documents(documents[start:])
+                ))
+            yield _event({
+                "event": "summarized", "version_id": version.version_id,
+                "summary": ai_summary, "done": done, "total": total,
+            })
+
+        embeddings = [vector for batch in await asyncio.gather(*embed_tasks) for vector in batch]
+        with observe_vector_op("upsert"):
+            await asyncio.to_thread(
+                vector_store._collection.upsert,
+                ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents,
+            )
+            await asyncio.to_thread(session_index.refresh, vector_store, request.session_id, ids)
+        logger.info("✅ 批量导入 %s 个版本记忆，Embedding 请求 %s 次", total, len(embed_tasks))
+        yield _event({"event": "stored", "stored": total, "embedding_batches": len(embed_tasks)})
+    except Exception as e:
+        logger.exception("❌ 批量导入版本失败: %s", e)
+        yield _event({"event": "error", "detail": str(e)})
+    finally:
+        # 客户端断开或出错时，取消尚未完成的摘要和 Embedding 调用
+        for task in (*summary_tasks, *embed_tasks):
+            if not task.done():
+                task.cancel()
+
+
+@router.post("/add_versions")
+async def add_version_nodes(
+    request: BulkAddVersionsRequest,
+    summarizer: CodeSummarizerService = Depends(get_summarizer),
+    vector_store: Chroma = Depends(get_vector_store)
+):
+    """
+    一次导入一个会话的多个版本 (例如恢复历史会话)。
+    以 NDJSON 流式返回每个版本的摘要 (event=summarized)，全部写入后返回 event=stored，失败时返回 event=error。
+    """
+    bind_session(request.session_id)
+    retention.touch(request.session_id)
+    version_ids = [version.version_id for version in request.versions]
+    if not version_ids:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No versions to import.")
+    if len(set(version_ids)) != len(version_ids):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Duplicate version_id in request.")
+    logger.info("批量导入 %s 个版本: %s", len(version_ids), request.session_id)
+    return StreamingResponse(_bulk_add_events(request, summarizer, vector_store), media_type="application/x-ndjson")
+
+
+@router.post("/delete_versions", status_code=status.HTTP_200_OK)
+async def delete_version_nodes(
+    request: BulkDeleteVersionsRequest,
+    vector_store: Chroma = Depends(get_vector_store)
+):
+    """按会话删除多个版本的记忆；省略 version_ids 时删除整个会话。返回实际删除的版本数。"""
+    bind_session(request.session_id)
+    if request.version_ids is None:
+        where = {"session_id": request.session_id}
+    elif request.version_ids:
+        where = {"$and": [
+            {"session_id": {"$eq": request.session_id}},
+            {"version_id": {"$in": request.version_ids}},
+        ]}
+    else:
+        return {"message": "No versions to delete.", "deleted": 0}
+
+    def delete() -> List[str]:
+        collection = vector_store._collection
+        doc_ids = collection.get(where=where, include=[])["ids"]
+        if doc_ids:
+            collection.delete(ids=doc_ids)
+        return doc_ids
+
+    try:
+        with observe_vector_op("delete"):
+            doc_ids = await asyncio.to_thread(delete)
+        if request.version_ids is None:
+            session_index.drop(request.session_id)
+        else:
+            retention.touch(request.session_id)
+            session_index.remove(request.session_id, doc_ids)
+        logger.info("✅ 已删除 %s 个版本记忆: %s", len(doc_ids), request.session_id)
+        return {"message": f"Deleted {len(doc_ids)} versions.", "deleted": len(doc_ids)}
+    except Exception as e:
+        logger.exception("❌ 批量删除版本失败，会话 %s: %s", request.session_id, e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to delete versions of session '{request.session_id}': {e}"
+        )
@@ -0,0 +1,416 @@
+# services/analytics_store.py
+import logging
+import math
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from utility.config import settings
+
+"""
+会话分析存储 (Session Analytics Store)
+
+职责:
+session_logs.jsonl 是原始会话快照的归档，分析时需要整文件扫描。这里把每个会话的分析字段
+(各区域停留时长、操作计数、版本数) 写入本地 sqlite，以 (session_id, user_id, task) 为键，
+聚合查询在毫秒级完成，与会话总数无关。
+
+实现:
+- sessions / region_durations 保存每个会话的明细，同一会话再次上报时整体替换 (前端每次发送完整快照)。
+- task_totals / task_region_totals / task_version_hist 是按任务预聚合的汇总表，
+  由触发器在明细插入和删除时增量维护；不按用户过滤的查询只读汇总表。
+- 按用户过滤的查询走 (user_id, task) 索引，只读取该用户的会话。
+- /timing 的写入经队列由后台线程批量完成；tools/import_sessions.py 直接调用 write_many 导入历史日志。
+"""
+
+logger = logging.getLogger(__name__)
+
+ACTION_NAMES = ("delete", "modify", "merge", "duplicate")
+
+_SCHEMA = """
+PRAGMA journal_mode = WAL;
+
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    task TEXT NOT NULL,
+    received_at REAL NOT NULL,
+    total_versions INTEGER NOT NULL DEFAULT 0,
+    preview_clicks INTEGER NOT NULL DEFAULT 0,
+    delete_count INTEGER NOT NULL DEFAULT 0,
+    modify_count INTEGER NOT NULL DEFAULT 0,
+    merge_count INTEGER NOT NULL DEFAULT 0,
+    duplicate_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (session_id, user_id, task)
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions (user_id, task);
+CREATE INDEX IF NOT EXISTS idx_sessions_task ON sessions (task, received_at);
+CREATE INDEX IF NOT EXISTS idx_sessions_received ON sessions (received_at);
+
+CREATE TABLE IF NOT EXISTS region_durations (
+    session_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    task TEXT NOT NULL,
+    region TEXT NOT NULL,
+    duration_ms INTEGER NOT NULL,
+    segments INTEGER NOT NULL,
+    PRIMARY KEY (session_id, user_id, task, region)
+);
+CREATE INDEX IF NOT EXISTS idx_region_durations_user ON region_durations (user_id, task, region);
+
+CREATE TABLE IF NOT EXISTS task_totals (
+    task TEXT PRIMARY KEY,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    total_versions INTEGER NOT NULL DEFAULT 0,
+    preview_clicks INTEGER NOT NULL DEFAULT 0,
+    delete_count INTEGER NOT NULL DEFAULT 0,
+    modify_count INTEGER NOT NULL DEFAULT 0,
+    merge_count INTEGER NOT NULL DEFAULT 0,
+    duplicate_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS task_region_totals (
+    task TEXT NOT NULL,
+    region TEXT NOT NULL,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    duration_ms INTEGER NOT NULL DEFAULT 0,
+    segments INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (task, region)
+);
+
+CREATE TABLE IF NOT EXISTS task_version_hist (
+    task TEXT NOT NULL,
+    versions INTEGER NOT NULL,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (task, versions)
+);
+
+-- 增量导入 JSONL 日志的进度
+CREATE TABLE IF NOT EXISTS import_offsets (
+    path TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_sessions_insert AFTER INSERT ON sessions BEGIN
+    INSERT INTO task_totals (task) VALUES (NEW.task) ON CONFLICT (task) DO NOTHING;
+    UPDATE task_totals SET
+        sessions = sessions + 1,
+        total_versions = total_versions + NEW.total_versions,
+        preview_clicks = preview_clicks + NEW.preview_clicks,
+        delete_count = delete_count + NEW.delete_count,
+        modify_count = modify_count + NEW.modify_count,
+        merge_count = merge_count + NEW.merge_count,
+        duplicate_count = duplicate_count + NEW.duplicate_count
+    WHERE task = NEW.task;
+    INSERT INTO task_version_hist (task, versions, sessions) VALUES (NEW.task, NEW.total_versions, 1)
+        ON CONFLICT (task, versions) DO UPDATE SET sessions = sessions + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_sessions_delete AFTER DELETE ON sessions BEGIN
+    UPDATE task_totals SET
+        sessions = sessions - 1,
+        total_versions = total_versions - OLD.total_versions,
+        preview_clicks = preview_clicks - OLD.preview_clicks,
+        delete_count = delete_count - OLD.delete_count,
+        modify_count = modify_count - OLD.modify_count,
+        merge_count = merge_count - OLD.merge_count,
+        duplicate_count = duplicate_count - OLD.duplicate_count
+    WHERE task = OLD.task;
+    DELETE FROM task_totals WHERE task = OLD.task AND sessions <= 0;
+    UPDATE task_version_hist SET sessions = sessions - 1 WHERE task = OLD.task AND versions = OLD.total_versions;
+    DELETE FROM task_version_hist WHERE task = OLD.task AND versions = OLD.total_versions AND sessions <= 0;
+    DELETE FROM region_durations
+        WHERE session_id = OLD.session_id AND user_id = OLD.user_id AND task = OLD.task;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_region_durations_insert AFTER INSERT ON region_durations BEGIN
+    INSERT INTO task_region_totals (task, region, sessions, duration_ms, segments)
+        VALUES (NEW.task, NEW.region, 1, NEW.duration_ms, NEW.segments)
+        ON CONFLICT (task, region) DO UPDATE SET
+            sessions = sessions + 1,
+            duration_ms = duration_ms + excluded.duration_ms,
+            segments = segments + excluded.segments;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_region_durations_delete AFTER DELETE ON region_durations BEGIN
+    UPDATE task_region_totals SET
+        sessions = sessions - 1,
+        duration_ms = duration_ms - OLD.duration_ms,
+        segments = segments - OLD.segments
+    WHERE task = OLD.task AND region = OLD.region;
+    DELETE FROM task_region_totals WHERE task = OLD.task AND region = OLD.region AND sessions <= 0;
+END;
+"""
+
+# (sessions 行, [(region, duration_ms, segments), ...])
+SessionRecord = Tuple[tuple, List[Tuple[str, int, int]]]
+
+
+# 单个计数 / 时长的取值范围。SQLite INTEGER 是 64 位有符号整数，触发器和 SUM() 在此之上累加：
+# 每个值限制在 32 位以内，2^32 个会话的总和仍不会溢出 (SUM() 溢出时报错，触发器中的加法会变成 REAL)
+_VALUE_MIN, _VALUE_MAX = -(2 ** 31), 2 ** 31 - 1
+
+
+def _as_int(value: Any) -> int:
+    """前端埋点字段未经模型校验：非数字和 inf / nan 按 0 计，超出 [_VALUE_MIN, _VALUE_MAX] 的值截断到边界。"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return 0
+    if isinstance(value, float) and not math.isfinite(value):
+        return 0
+    return max(_VALUE_MIN, min(_VALUE_MAX, int(value)))
+
+
+def summarize_regions(timing_data: Any) -> List[Tuple[str, int, int]]:
+    """把 timingData ({区域: [{start, end, duration}, ...]}) 汇总为每个区域的总时长 (毫秒) 和时间段数。"""
+    if not isinstance(timing_data, dict):
+        return []
+    regions = []
+    for region, segments in timing_data.items():
+        if not isinstance(segments, list):
+            continue
+        total, count = 0, 0
+        for segment in segments:
+            if not isinstance(segment, dict):
+                continue
+            duration = segment.get("duration")
+            if duration is None:
+                duration = _as_int(segment.get("end")) - _as_int(segment.get("start"))
+            total = min(_VALUE_MAX, total + max(0, _as_int(duration)))
+            count += 1
+        regions.append((str(region), total, count))
+    return regions
+
+
+def build_session_record(session_id: str, user_id: str, task: str, timing_data: Any = None,
+                         action_counts: Any = None, total_versions: Any = None, preview_clicks: Any = None,
+                         received_at: Optional[float] = None) -> SessionRecord:
+    """从会话快照的各个字段构造一条分析记录。/timing 和导入工具共用这一转换。"""
+    counts = action_counts if isinstance(action_counts, dict) else {}
+    row = (
+        session_id, user_id, task, received_at if received_at is not None else time.time(),
+        _as_int(total_versions), _as_int(preview_clicks),
+        *(_as_int(counts.get(name)) for name in ACTION_NAMES),
+    )
+    return row, summarize_regions(timing_data)
+
+
+def record_from_snapshot(snapshot: Dict[str, Any], received_at: Optional[float] = None) -> Optional[SessionRecord]:
+    """从一条完整的会话快照 (session_logs.jsonl 的一行) 构造分析记录；信封字段不合法时返回 None。"""
+    keys = [snapshot.get(field) for field in ("session_id", "user_id", "task")]
+    if not all(isinstance(key, str) for key in keys):
+        return None
+    usage = snapshot.get("usageData")
+    usage = usage if isinstance(usage, dict) else {}
+    return build_session_record(
+        *keys, timing_data=snapshot.get("timingData"), action_counts=usage.get("actionCounts"),
+        total_versions=usage.get("totalVersions"), preview_clicks=usage.get("previewClicks"),
+        received_at=received_at,
+    )
+
+
+class AnalyticsStore:
+    """sqlite 会话分析存储：/timing 的写入经队列由后台线程批量完成，查询在调用方线程中执行。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: "queue.SimpleQueue[Optional[SessionRecord]]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        # WAL 模式下 NORMAL 不会损坏数据库，只可能丢失断电前最后几个事务
+        conn.execute("PRAGMA synchronous = NORMAL")
+        if not self._schema_ready:
+            conn.executescript(_SCHEMA)
+            self._schema_ready = True
+        return conn
+
+    # --- 写入 ---
+    def record(self, record: SessionRecord) -> None:
+        """记录一个会话的分析字段。只做一次入队，不会阻塞调用方。"""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="analytics-writer", daemon=True)
+                    self._thread.start()
+        self._queue.put(record)
+
+    def _run(self) -> None:
+        conn = self._connect()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                batch = [item]
+                stop = False
+                # 合并队列中已有的记录，一次事务写入
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+                try:
+                    with conn:
+                        self.write_many(conn, batch)
+                except Exception as e:
+                    logger.error("❌ 写入会话分析记录失败 (%s 条): %s", len(batch), e)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    @staticmethod
+    def write_many(conn: sqlite3.Connection, records: Iterable[SessionRecord]) -> int:
+        """
+        在调用方的事务中写入一批记录。同一会话已存在时先删除旧记录 (触发器同步扣减汇总表)，再插入新记录。
+        每条记录在自己的 savepoint 中写入：写不进去的记录只回滚它自己 (记录日志后跳过)，不影响同批的其他会话。
+        返回成功写入的记录数。
+        """
+        if not conn.in_transaction:
+            # 显式开始外层事务，否则释放第一个 savepoint 就会提交
+            conn.execute("BEGIN")
+        count = 0
+        for row, regions in records:
+            key = row[:3]
+            conn.execute("SAVEPOINT session_record")
+            try:
+                conn.execute("DELETE FROM sessions WHERE session_id = ? AND user_id = ? AND task = ?", key)
+                conn.execute(
+                    "INSERT INTO sessions (session_id, user_id, task, received_at, total_versions, preview_clicks, "
+                    "delete_count, modify_count, merge_count, duplicate_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    row,
+                )
+                conn.executemany(
+                    "INSERT INTO region_durations (session_id, user_id, task, region, duration_ms, segments) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(*key, region, duration, segments) for region, duration, segments in regions],
+                )
+            except (sqlite3.Error, OverflowError) as e:
+                conn.execute("ROLLBACK TO session_record")
+                conn.execute("RELEASE session_record")
+                logger.error("❌ 跳过无法写入的会话分析记录 %r: %s", key, e)
+                continue
+            conn.execute("RELEASE session_record")
+            count += 1
+        return count
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """写完队列中剩余的记录后停止后台线程。"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    # --- 查询 ---
+    def _query(self, sql: str, params: List[Any]) -> List[tuple]:
+        conn = self._connect()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _where(**filters: Optional[str]) -> Tuple[str, List[Any]]:
+        conditions, params = [], []
+        for name, value in filters.items():
+            if value is not None:
+                conditions.append(f"{name} = ?")
+                params.append(value)
+        return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+    def region_totals(self, task: Optional[str] = None, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """各区域的总停留时长、时间段数和出现该区域的会话数，按总时长降序。"""
+        if user_id is None:
+            where, params = self._where(task=task)
+            table = "task_region_totals"
+            columns = "region, SUM(sessions), SUM(duration_ms), SUM(segments)"
+        else:
+            where, params = self._where(user_id=user_id, task=task)
+            table = "region_durations"
+            columns = "region, COUNT(*), SUM(duration_ms), SUM(segments)"
+        rows = self._query(
+            f"SELECT {columns} FROM {table} {where} GROUP BY region ORDER BY 3 DESC", params,
+        )
+        return [
+            {"region": region, "sessions": sessions, "duration_ms": duration, "segments": segments}
+            for region, sessions, duration, segments in rows
+        ]
+
+    def action_totals(self, task: Optional[str] = None, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """每个任务的操作计数 (delete / modify / merge / duplicate) 和预览点击总数。"""
+        columns = ", ".join(
+            f"SUM({name})" for name in ("preview_clicks", *(f"{action}_count" for action in ACTION_NAMES))
+        )
+        if user_id is None:
+            where, params = self._where(task=task)
+            table, sessions = "task_totals", "SUM(sessions)"
+        else:
+            where, params = self._where(user_id=user_id, task=task)
+            table, sessions = "sessions", "COUNT(*)"
+        rows = self._query(f"SELECT task, {sessions}, {columns} FROM {table} {where} GROUP BY task ORDER BY task",
+                           params)
+        return [
+            {
+                "task": row[0],
+                "sessions": row[1],
+                "preview_clicks": row[2],
+                "actions": dict(zip(ACTION_NAMES, row[3:])),
+            }
+            for row in rows
+        ]
+
+    def version_counts(self, task: Optional[str] = None, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """每个任务的版本数统计：会话数、总数、平均值、最大值和分布 (版本数 -> 会话数)。"""
+        if user_id is None:
+            where, params = self._where(task=task)
+            rows = self._query(
+                f"SELECT task, versions, sessions FROM task_version_hist {where} ORDER BY task, versions", params,
+            )
+        else:
+            where, params = self._where(user_id=user_id, task=task)
+            rows = self._query(
+                f"SELECT task, total_versions, COUNT(*) FROM sessions {where} "
+                f"GROUP BY task, total_versions ORDER BY task, total_versions", params,
+            )
+        results: Dict[str, Dict[str, Any]] = {}
+        for task_name, versions, sessions in rows:
+            entry = results.setdefault(task_name, {
+                "task": task_name, "sessions": 0, "total_versions": 0, "max_versions": 0, "histogram": {},
+            })
+            entry["sessions"] += sessions
+            entry["total_versions"] += versions * sessions
+            entry["max_versions"] = max(entry["max_versions"], versions)
+            entry["histogram"][versions] = sessions
+        for entry in results.values():
+            entry["avg_versions"] = round(entry["total_versions"] / entry["sessions"], 3) if entry["sessions"] else 0
+        return list(results.values())
+
+    def sessions(self, task: Optional[str] = None, user_id: Optional[str] = None,
+                 limit: int = 100) -> List[Dict[str, Any]]:
+        """按接收时间倒序列出会话的分析字段。"""
+        where, params = self._where(user_id=user_id, task=task)
+        rows = self._query(
+            f"SELECT session_id, user_id, task, received_at, total_versions, preview_clicks, "
+            f"delete_count, modify_count, merge_count, duplicate_count "
+            f"FROM sessions {where} ORDER BY received_at DESC LIMIT ?", [*params, limit],
+        )
+        return [
+            {
+                "session_id": row[0], "user_id": row[1], "task": row[2], "received_at": row[3],
+                "total_versions": row[4], "preview_clicks": row[5], "actions": dict(zip(ACTION_NAMES, row[6:])),
+            }
+            for row in rows
+        ]
+
+
+analytics_store = AnalyticsStore(settings.ANALYTICS_DB_PATH)
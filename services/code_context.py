@@ -1,4 +1,5 @@
 # services/code_context.py
+import logging
 from typing import Dict, Optional
 
 """
@@ -13,6 +14,8 @@ from typing import Dict, Optional
 使用一个全局字典作为内存存储。在生产环境中，可以替换为 Redis 等外部缓存系统以支持多实例部署。
 """
 
+logger = logging.getLogger(__name__)
+
 # 使用一个简单的字典作为内存缓存。key: session_id, value: code_string
 _code_context_cache: Dict[str, str] = {}
 
@@ -25,7 +28,7 @@ def update_code(session_id: str, code: str) -> None:
         code (str): 当前的完整代码字符串。
     """
     _code_context_cache[session_id] = code
-    print(f"Code context updated for session: {session_id}")
+    logger.info("Code context updated for session: %s", session_id)
 
 def get_code(session_id: str) -> Optional[str]:
     """
@@ -48,7 +51,7 @@ def clear_code(session_id: str) -> None:
     """
     if session_id in _code_context_cache:
         del _code_context_cache[session_id]
-        print(f"Code context cleared for session: {session_id}")
+        logger.info("Code context cleared for session: %s", session_id)
 
 
 
@@ -1,8 +1,11 @@
 # services/inspiration_service.py
 import json
+import logging
 import random
 from typing import List, Dict, Optional
 
+logger = logging.getLogger(__name__)
+
 class InspirationService:
     """
     一个轻量级的服务，用于管理和提供预设的p5.js灵感代码。
@@ -12,17 +15,17 @@ class InspirationService:
         """
         初始化灵感服务。
         """
-        print("Initializing Inspiration Service...")
+        logger.info("Initializing Inspiration Service...")
         self._examples: List[Dict] = []
         self._tag_to_code: Dict[str, str] = {}
-        print("✅ Inspiration Service initialized.")
+        logger.info("✅ Inspiration Service initialized.")
 
     def load_examples(self, filepath: str):
         """
         从指定的JSON文件加载代码示例。
         这个函数应该在应用启动时被调用一次。
         """
-        print(f"Loading inspiration examples from: {filepath}")
+        logger.info("Loading inspiration examples from: %s", filepath)
         try:
             with open(filepath, 'r', encoding='utf-8') as f:
                 self._examples = json.load(f)
@@ -30,13 +33,13 @@ class InspirationService:
             # 创建一个从标签到代码的快速查找字典
             self._tag_to_code = {example['tag']: example['code'] for example in self._examples}
             
-            print(f"✅ Successfully loaded {len(self._examples)} inspiration examples.")
+            logger.info("✅ Successfully loaded %s inspiration examples.", len(self._examples))
         except FileNotFoundError:
-            print(f"❌ Error: Inspiration data file not found at {filepath}")
+            logger.error("❌ Error: Inspiration data file not found at %s", filepath)
         except json.JSONDecodeError:
-            print(f"❌ Error: Failed to decode JSON from {filepath}")
+            logger.error("❌ Error: Failed to decode JSON from %s", filepath)
         except Exception as e:
-            print(f"❌ An unexpected error occurred while loading examples: {e}")
+            logger.error("❌ An unexpected error occurred while loading examples: %s", e)
 
     def get_random_styles(self, count: int = 3) -> List[Dict[str, str]]:
         """
@@ -45,7 +48,7 @@ class InspirationService:
         返回一个字典列表，每个字典包含 'tag' 和 'image'。
         """
         if not self._examples:
-            print("⚠️ No examples loaded, cannot provide random styles.")
+            logger.warning("⚠️ No examples loaded, cannot provide random styles.")
             return []
         
         # 确保示例包含 'tag' 和 'image' 键，避免运行时错误
@@ -55,7 +58,8 @@ class InspirationService:
 
         if len(valid_examples) <= count:
             # 如果可用示例不足，返回所有有效示例
-            print(f"⚠️ Not enough valid examples to provide {count} unique styles. Returning all {len(valid_examples)}.")
+            logger.warning("⚠️ Not enough valid examples to provide %s unique styles. Returning all %s.",
+                           count, len(valid_examples))
             return [{'tag': ex['tag'], 'image': ex['image']} for ex in valid_examples]
             
         # 随机选择不重复的示例
@@ -63,7 +67,7 @@ class InspirationService:
         
         # 提取 tag 和 image 字段
         result = [{'tag': sample['tag'], 'image': sample['image']} for sample in random_samples]
-        print(f"Provided random styles: {result}")
+        logger.info("Provided random styles: %s", result)
         return result
 
     def get_code_by_tag(self, tag: str) -> Optional[str]:
@@ -72,7 +76,7 @@ class InspirationService:
         """
         code = self._tag_to_code.get(tag)
         if code:
-            print(f"Found code for tag: '{tag}'")
+            logger.info("Found code for tag: '%s'", tag)
         else:
-            print(f"⚠️ Could not find code for tag: '{tag}'")
+            logger.warning("⚠️ Could not find code for tag: '%s'", tag)
         return code
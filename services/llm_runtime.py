@@ -0,0 +1,180 @@
+# services/llm_runtime.py
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional
+
+from utility.config import settings
+from utility.metrics import (
+    LLM_CALL_DURATION,
+    LLM_CALLS_CANCELLED,
+    LLM_DEADLINE_EXCEEDED,
+    LLM_HEDGE_EVENTS,
+    LLMUsageCallback,
+    llm_in_flight,
+    llm_labels,
+    llm_queued,
+)
+from utility.deadline import DeadlineExceeded, abandoned, check_deadline, remaining
+from utility.tracing import TracingCallback, span
+from services.usage_store import UsageCallback
+from services.llm_scheduler import LLMScheduler
+
+"""
+LLM 调用运行时 (LLM Runtime)
+
+职责:
+所有 LLM 调用（chain.ainvoke / llm.ainvoke）的统一入口。
+在这里施加全局并发上限，使 /chat、/merge、/modify 和版本摘要共享同一份 Azure 并发额度，
+而不是各自无限制地并发请求；名额由 LLMScheduler 按优先级类别 (interactive / background) 加权公平分配。
+每次调用以当前请求的剩余预算为超时，慢调用可以发送对冲请求；同时记录排队数、耗时、token 用量和重试次数等指标，
+并为每次调用及其内部阶段 (Prompt 构建、LLM、输出解析) 生成追踪 span，把 token 用量计入 usage_store。
+"""
+
+# 优先级类别：用户正在等待结果的调用，以及版本摘要等后台调用
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+# 全局 LLM 调度器，在第一次使用时按配置创建
+_llm_scheduler: LLMScheduler = None
+
+# 每个路由最近 LLM_HEDGE_WINDOW 次成功调用的延迟 (不含排队)，用于计算对冲延迟
+_latency_windows: Dict[str, Deque[float]] = {}
+
+
+def _get_scheduler() -> LLMScheduler:
+    global _llm_scheduler
+    if _llm_scheduler is None:
+        _llm_scheduler = LLMScheduler(settings.LLM_MAX_CONCURRENCY, {
+            INTERACTIVE: (settings.LLM_INTERACTIVE_WEIGHT, settings.LLM_INTERACTIVE_MAX_CONCURRENCY),
+            BACKGROUND: (settings.LLM_BACKGROUND_WEIGHT, settings.LLM_BACKGROUND_MAX_CONCURRENCY),
+        })
+    return _llm_scheduler
+
+
+@asynccontextmanager
+async def llm_slot(priority: str = INTERACTIVE):
+    """占用一个 priority 类别的 LLM 并发名额，直到退出上下文。"""
+    scheduler = _get_scheduler()
+    with llm_queued():
+        await scheduler.acquire(priority)
+    try:
+        with llm_in_flight():
+            yield
+    finally:
+        scheduler.release(priority)
+
+
+def _hedge_delay(route: str, priority: str) -> Optional[float]:
+    """该路由的对冲延迟 (近期 LLM 调用延迟的分位数)；不对冲或样本不足时返回 None。"""
+    if priority != INTERACTIVE or route not in settings.LLM_HEDGE_ROUTES:
+        return None
+    window = _latency_windows.get(route)
+    if window is None or len(window) < settings.LLM_HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(window)
+    index = min(len(ordered) - 1, int(settings.LLM_HEDGE_QUANTILE * len(ordered)))
+    return max(settings.LLM_HEDGE_MIN_DELAY, ordered[index])
+
+
+async def _attempt(runnable: Any, chain_input: Any, priority: str, labels: Dict[str, str], hedge: bool) -> Any:
+    """一次实际的 LLM 调用：占用并发名额、记录指标和追踪 span。"""
+    with span("llm.invoke", **labels, priority=priority, hedge=hedge) as invoke_span:
+        queued_at = time.perf_counter()
+        stage = "queued"
+        try:
+            async with llm_slot(priority):
+                stage = "in_flight"
+                start = time.perf_counter()
+                invoke_span.set_attribute("queue_wait_ms", round((start - queued_at) * 1000, 2))
+                outcome = "error"
+                callbacks = [LLMUsageCallback(labels), TracingCallback(invoke_span), UsageCallback()]
+                try:
+                    result = await runnable.ainvoke(chain_input, config={"callbacks": callbacks})
+                    outcome = "success"
+                    return result
+                except asyncio.CancelledError:
+                    outcome = "cancelled"
+                    raise
+                finally:
+                    elapsed = time.perf_counter() - start
+                    LLM_CALL_DURATION.labels(**labels, outcome=outcome).observe(elapsed)
+                    if outcome == "success":
+                        window = _latency_windows.get(labels["route"])
+                        if window is None:
+                            window = _latency_windows[labels["route"]] = deque(maxlen=settings.LLM_HEDGE_WINDOW)
+                        window.append(elapsed)
+        except asyncio.CancelledError:
+            # 请求被放弃 (客户端断开或截止时间已过) 时记录取消的调用；对冲中输掉的一方不计
+            if abandoned():
+                LLM_CALLS_CANCELLED.labels(route=labels["route"], stage=stage).inc()
+            raise
+
+
+async def _hedged(runnable: Any, chain_input: Any, priority: str, labels: Dict[str, str], delay: float) -> Any:
+    """先发送一次调用；delay 秒后仍未返回时再发送一个相同的调用，返回先成功的结果并取消另一个。"""
+    primary = asyncio.create_task(_attempt(runnable, chain_input, priority, labels, hedge=False))
+    tasks = {primary}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            return primary.result()
+        hedge = asyncio.create_task(_attempt(runnable, chain_input, priority, labels, hedge=True))
+        tasks.add(hedge)
+        LLM_HEDGE_EVENTS.labels(route=labels["route"], event="fired").inc()
+        pending, error = set(tasks), None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    event = "hedge_won" if task is hedge else "primary_won"
+                    LLM_HEDGE_EVENTS.labels(route=labels["route"], event=event).inc()
+                    return task.result()
+                error = task.exception()
+        LLM_HEDGE_EVENTS.labels(route=labels["route"], event="failed").inc()
+        raise error
+    finally:
+        # 输掉的一方 (或调用方离开时的两方) 立即取消，释放并发名额
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def invoke_chain(runnable: Any, chain_input: Any, priority: str = INTERACTIVE) -> Any:
+    """
+    在全局并发上限和当前请求的剩余预算内调用一个 LangChain Runnable (chain 或 llm)。
+    LLM_HEDGE_ROUTES 中的路由在调用超过近期延迟分位数仍未返回时发送对冲请求。
+
+    Args:
+        runnable: 任意支持 ainvoke 的 LangChain 对象。
+        chain_input: 传给 ainvoke 的输入。
+        priority: 调度类别，INTERACTIVE 或 BACKGROUND。
+
+    Returns:
+        ainvoke 的返回值。
+
+    Raises:
+        DeadlineExceeded: 请求的延迟预算在调用完成前耗尽。
+    """
+    labels = llm_labels()
+    budget = remaining()
+    try:
+        check_deadline()
+        # 超时包含排队、配额等待和 openai 客户端内部的重试
+        async with asyncio.timeout(budget):
+            delay = _hedge_delay(labels["route"], priority)
+            if delay is None or (budget is not None and budget <= delay):
+                return await _attempt(runnable, chain_input, priority, labels, hedge=False)
+            return await _hedged(runnable, chain_input, priority, labels, delay)
+    except (DeadlineExceeded, TimeoutError) as e:
+        LLM_DEADLINE_EXCEEDED.labels(route=labels["route"]).inc()
+        if isinstance(e, DeadlineExceeded):
+            raise
+        raise DeadlineExceeded(f"LLM call exceeded the {labels['route']} budget") from e
+    except Exception as e:
+        # 配额等待超出预算时传输层抛出 DeadlineExceeded，openai 客户端会把它包装成连接错误
+        if budget is not None and remaining() <= 0:
+            LLM_DEADLINE_EXCEEDED.labels(route=labels["route"]).inc()
+            raise DeadlineExceeded(f"LLM call exceeded the {labels['route']} budget") from e
+        raise
@@ -0,0 +1,95 @@
+# services/llm_scheduler.py
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+from utility.metrics import LLM_SCHEDULER_IN_FLIGHT, LLM_SCHEDULER_QUEUE_DEPTH, LLM_SCHEDULER_WAIT
+
+"""
+LLM 优先级调度器 (LLM Scheduler)
+
+所有 LLM 调用共享 LLM_MAX_CONCURRENCY 个并发名额。只用一个 FIFO 信号量时，一批版本保存产生的摘要调用
+会排在 /chat 前面，聊天延迟随之升高。调度器按优先级类别分别排队：
+- interactive: 用户正在等待结果的调用 (/chat、/modify、/merge)；
+- background: 用户不直接等待的调用 (版本摘要、预热)。
+名额空出时按加权公平排队 (stride scheduling) 选择下一个类别：每个类别有一个虚拟时间 pass，
+被选中一次前进 1 / weight，总是选 pass 最小且有排队请求的类别；类别从空闲转为排队时 pass 追平全局虚拟时间，
+空闲期间不积累额度。此外每个类别有自己的并发上限，保证 background 再多也给 interactive 留出名额。
+"""
+
+
+class LLMScheduler:
+    """加权公平的 LLM 并发名额分配。必须在同一个事件循环中使用。"""
+
+    def __init__(self, max_concurrency: int, classes: Dict[str, Tuple[float, int]]):
+        """
+        Args:
+            max_concurrency: 全局并发上限。
+            classes: 类别名 -> (权重, 该类别的并发上限)。
+        """
+        self.max_concurrency = max_concurrency
+        self.weights = {name: weight for name, (weight, _) in classes.items()}
+        self.caps = {name: cap for name, (_, cap) in classes.items()}
+        self._queues: Dict[str, Deque[Tuple[asyncio.Future, float]]] = {name: deque() for name in classes}
+        self._running: Dict[str, int] = {name: 0 for name in classes}
+        self._pass: Dict[str, float] = {name: 0.0 for name in classes}
+        self._virtual_time = 0.0
+        self._total = 0
+
+    def _eligible(self, priority: str) -> bool:
+        return self._total < self.max_concurrency and self._running[priority] < self.caps[priority]
+
+    def _grant(self, priority: str, queued_at: float) -> None:
+        self._running[priority] += 1
+        self._total += 1
+        self._virtual_time = self._pass[priority]
+        self._pass[priority] += 1.0 / self.weights[priority]
+        LLM_SCHEDULER_WAIT.labels(priority=priority).observe(time.perf_counter() - queued_at)
+        LLM_SCHEDULER_IN_FLIGHT.labels(priority=priority).inc()
+
+    async def acquire(self, priority: str) -> None:
+        """等待一个 priority 类别的并发名额。被取消时不占用名额。"""
+        queued_at = time.perf_counter()
+        queue = self._queues[priority]
+        if not queue:
+            # 类别从空闲转为活跃：不能用空闲期间的额度插队
+            self._pass[priority] = max(self._pass[priority], self._virtual_time)
+            if self._eligible(priority):
+                self._grant(priority, queued_at)
+                return
+        future = asyncio.get_running_loop().create_future()
+        queue.append((future, queued_at))
+        LLM_SCHEDULER_QUEUE_DEPTH.labels(priority=priority).inc()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 名额已分配但等待者已离开：归还名额
+                self.release(priority)
+            else:
+                try:
+                    queue.remove((future, queued_at))
+                    LLM_SCHEDULER_QUEUE_DEPTH.labels(priority=priority).dec()
+                except ValueError:
+                    pass
+            raise
+
+    def release(self, priority: str) -> None:
+        self._running[priority] -= 1
+        self._total -= 1
+        LLM_SCHEDULER_IN_FLIGHT.labels(priority=priority).dec()
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._total < self.max_concurrency:
+            candidates = [name for name, queue in self._queues.items() if queue and self._eligible(name)]
+            if not candidates:
+                return
+            priority = min(candidates, key=lambda name: self._pass[name])
+            future, queued_at = self._queues[priority].popleft()
+            LLM_SCHEDULER_QUEUE_DEPTH.labels(priority=priority).dec()
+            if future.done():
+                continue
+            self._grant(priority, queued_at)
+            future.set_result(None)
@@ -0,0 +1,79 @@
+# services/model_routing.py
+from functools import lru_cache
+from typing import Any, Dict, Tuple
+
+from langchain_openai import AzureChatOpenAI
+
+from utility.config import settings
+from services.rate_limiter import azure_http_clients
+
+"""
+任务级模型路由 (Per-Task Model Routing)
+
+不同的 LLM 调用对模型能力的要求差别很大：30 字以内的版本摘要、过渡层回复用小而快的部署即可，
+完整的代码合并和风格融合仍需要主部署。这里把每类任务映射到一个 (部署, 温度)，
+路由和服务通过 chat_model(task) 取得对应的 AzureChatOpenAI 客户端，而不是各自写死 AZURE_OPENAI_MODEL_NAME。
+
+部署别名：
+- "default": AZURE_OPENAI_MODEL_NAME
+- "fast": AZURE_OPENAI_FAST_MODEL_NAME，未配置时退回 "default" (行为与不做路由时一致)
+其他取值视为具体的部署名。
+"""
+
+# 各任务的默认路由；settings.LLM_TASK_ROUTES 按任务、按字段覆盖
+DEFAULT_TASK_ROUTES: Dict[str, Dict[str, Any]] = {
+    # 版本摘要 (含合批摘要)
+    "summary": {"model": "fast", "temperature": 0.7},
+    # /chat 第二轮的过渡层回复
+    "transition": {"model": "fast", "temperature": 0.7},
+    # /chat 深度反思 (明确意图 / 模糊意图的四段式回复)
+    "reflection": {"model": "default", "temperature": 0.7},
+    # /chat 普通聊天
+    "chat": {"model": "default", "temperature": 0.7},
+    # /modify/apply-style
+    "style": {"model": "default", "temperature": 0.7},
+    # /merge 与 /merge/many，较低的温度使合并结果更可预测
+    "merge": {"model": "default", "temperature": 0.2},
+}
+
+
+def _deployment(model: str) -> str:
+    if model == "default":
+        return settings.AZURE_OPENAI_MODEL_NAME
+    if model == "fast":
+        return settings.AZURE_OPENAI_FAST_MODEL_NAME or settings.AZURE_OPENAI_MODEL_NAME
+    return model
+
+
+def task_route(task: str) -> Tuple[str, float]:
+    """返回任务使用的 (部署名, 温度)。"""
+    if task not in DEFAULT_TASK_ROUTES:
+        raise ValueError(f"未知的 LLM 任务: '{task}'")
+    route = {**DEFAULT_TASK_ROUTES[task], **settings.LLM_TASK_ROUTES.get(task, {})}
+    return _deployment(route["model"]), float(route["temperature"])
+
+
+@lru_cache
+def _chat_client(deployment: str, temperature: float) -> AzureChatOpenAI:
+    return AzureChatOpenAI(
+        openai_api_version=settings.AZURE_OPENAI_API_VERSION,
+        azure_deployment=deployment,
+        azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+        api_key=settings.AZURE_OPENAI_API_KEY,
+        **azure_http_clients(),
+        temperature=temperature,
+    )
+
+
+def chat_model(task: str) -> AzureChatOpenAI:
+    """返回任务对应的 AzureChatOpenAI 客户端；路由到同一 (部署, 温度) 的任务共享一个客户端。"""
+    return _chat_client(*task_route(task))
+
+
+def deployment_clients() -> Dict[str, AzureChatOpenAI]:
+    """当前路由表用到的每个部署各一个客户端 (按任务顺序)，用于预热。"""
+    clients: Dict[str, AzureChatOpenAI] = {}
+    for task in DEFAULT_TASK_ROUTES:
+        deployment, temperature = task_route(task)
+        clients.setdefault(deployment, _chat_client(deployment, temperature))
+    return clients
@@ -0,0 +1,411 @@
+# services/rate_limiter.py
+import asyncio
+import logging
+import random
+import threading
+import time
+from functools import lru_cache
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import httpx
+import openai
+import orjson
+
+from utility.config import settings
+from utility.deadline import abandoned, check_deadline
+from utility.metrics import LLM_TOKENS_SAVED, RATE_LIMIT_THROTTLED, RATE_LIMIT_WAIT, current_route, record_llm_retry
+
+"""
+Azure OpenAI 配额限流 (Quota-aware Rate Limiting)
+
+Azure 部署有每分钟 token 数 (TPM) 和请求数 (RPM) 配额。超出时各个 chain 各自收到 429、各自重试，
+重试又同时撞上配额，形成重试风暴和很长的尾延迟。这里在 httpx 传输层统一限流，
+chat 和 embedding 客户端共用同一份预算：
+- 发送前用 tiktoken 估算请求的 token 数 (Prompt + max_tokens，未设置时按 RATE_LIMIT_COMPLETION_ESTIMATE)，
+  TPM / RPM 令牌桶额度足够时扣除并发送，不够时按到达顺序排队，等到差额按配额速率恢复后再检查
+  (先到的大请求不会被后到的小请求一直插队)；请求因此按配额速率均匀放行，而不是一起冲上去、一起被 429、一起退避；
+- 响应返回后按 usage 中的实际 token 数结算差额 (估算偏高的部分立即退还给等待者)，
+  并用 x-ratelimit-remaining-* 响应头向下校准 (多 worker 共享同一配额时，以服务端的剩余额度为准)；
+- 收到 429 时按 Retry-After (没有时按指数退避) 暂停整个限流器，所有调用方在暂停结束后加随机抖动错开，
+  再由本层重试最多 RATE_LIMIT_MAX_RETRIES 次；
+- 本层是唯一的重试层：客户端以 max_retries=0 创建 (见 azure_http_clients)，
+  openai SDK 原本重试的 408 / 409 / 5xx 和连接错误也由本层按指数退避重试 (不暂停限流器)，
+  避免两层重试相乘 (SDK 默认的 2 次 × 本层 4 次 = 最多 12 次请求)；
+- 配额等待 (含 429 后的暂停) 会超出当前请求的剩余预算时立即抛出 DeadlineExceeded，不再等待；
+- 请求被放弃 (客户端断开、截止时间已过) 而取消调用时，把省下的估算 token 数计入 LLM_TOKENS_SAVED：
+  还在等配额的请求没有发出，省下全部估算值；已发出的请求省下 completion 部分 (上限)。
+AZURE_OPENAI_TPM / AZURE_OPENAI_RPM 为 0 时不在客户端限流，只统一处理 429。
+"""
+
+logger = logging.getLogger(__name__)
+
+# openai 默认客户端的连接池上限 (传入 transport 时 httpx 会忽略客户端的 limits 参数)
+_CONNECTION_LIMITS = httpx.Limits(max_connections=1000, max_keepalive_connections=100)
+
+
+class TokenBucket:
+    """每分钟 per_minute 的令牌桶，容量为 burst_seconds 秒的配额。"""
+
+    def __init__(self, per_minute: float, burst_seconds: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def shortfall(self, amount: float, now: float) -> float:
+        """距离余额足够扣除 amount 还需等待的秒数。单个请求超过桶容量时按容量计，否则它永远等不到。"""
+        self._refill(now)
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount: float, now: float) -> None:
+        """结算：amount 为正表示退还，为负表示补扣。"""
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+    def clamp(self, remaining: float, now: float) -> None:
+        """服务端报告的剩余额度比本地少时，以服务端为准。"""
+        self._refill(now)
+        self.level = min(self.level, remaining)
+
+
+_encoding = None
+_encoding_failed = False
+
+
+def _count_tokens(text: str) -> int:
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(settings.RATE_LIMIT_TIKTOKEN_ENCODING)
+        except Exception as e:
+            # 离线环境下 tiktoken 无法下载编码表，退回到按字符估算
+            _encoding_failed = True
+            logger.warning("⚠️ tiktoken 编码 %s 不可用，按字符数估算 token: %s", settings.RATE_LIMIT_TIKTOKEN_ENCODING, e)
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # 中文约 1 字 1 token，其余约 4 字符 1 token
+    cjk = sum(1 for ch in text if "一" <= ch <= "鿿")
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+def _content_text(content: Any) -> str:
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+def _completion_tokens(api: str, body: Dict[str, Any]) -> int:
+    if api == "embeddings":
+        return 0
+    return body.get("max_completion_tokens") or body.get("max_tokens") or settings.RATE_LIMIT_COMPLETION_ESTIMATE
+
+
+def estimate_request_tokens(api: str, body: Dict[str, Any]) -> int:
+    """按 Azure 计算配额的方式估算一个请求消耗的 token 数。"""
+    if api == "embeddings":
+        inputs = body.get("input") or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        # check_embedding_ctx_length=True 时输入已经是 token id 列表
+        return sum(len(item) if isinstance(item, list) else _count_tokens(item) for item in inputs) or 1
+    prompt = sum(_count_tokens(_content_text(message.get("content"))) + 4 for message in body.get("messages") or []) + 3
+    return prompt + _completion_tokens(api, body)
+
+
+def _retry_after(headers: httpx.Headers) -> Optional[float]:
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value:
+            try:
+                return float(value) * scale
+            except ValueError:
+                continue
+    return None
+
+
+def _backoff(attempt: int) -> float:
+    return settings.RATE_LIMIT_BACKOFF_BASE * (2 ** attempt)
+
+
+class AzureRateLimiter:
+    """chat 和 embedding 共用的 TPM / RPM 预算。线程安全 (同步 Embedding 调用在线程中执行)。"""
+
+    def __init__(self, tpm: int, rpm: int, burst_seconds: float):
+        self._lock = threading.Lock()
+        self._tokens = TokenBucket(tpm, burst_seconds) if tpm > 0 else None
+        self._requests = TokenBucket(rpm, burst_seconds) if rpm > 0 else None
+        self._paused_until = 0.0
+        # 排队等待配额的请求 (ticket, cost)，只有队首可以取得配额
+        self._waiters: Deque[Tuple[object, int]] = deque()
+
+    def _shortfall(self, cost: int, now: float) -> float:
+        buckets = ((self._tokens, cost), (self._requests, 1))
+        return max((bucket.shortfall(amount, now) for bucket, amount in buckets if bucket is not None), default=0.0)
+
+    def try_acquire(self, cost: int, ticket: Optional[object] = None) -> float:
+        """
+        额度足够且轮到该请求 (没有排队者，或 ticket 是队首) 时扣除一次请求的配额并返回 0；
+        否则不扣除，返回至少还要等待的秒数。
+        """
+        with self._lock:
+            now = time.monotonic()
+            paused = self._paused_until - now
+            if paused > 0:
+                # 暂停结束时所有等待者错开一点，避免同时再撞上配额
+                return paused + random.uniform(0, settings.RATE_LIMIT_JITTER)
+            if self._waiters and self._waiters[0][0] is not ticket:
+                # 排在后面：大约在队首取得配额之后再检查
+                return max(0.01, self._shortfall(self._waiters[0][1], now))
+            delay = self._shortfall(cost, now)
+            if delay > 0:
+                return delay
+            for bucket, amount in ((self._tokens, cost), (self._requests, 1)):
+                if bucket is not None:
+                    bucket.take(amount)
+            return 0.0
+
+    def _enqueue(self, cost: int) -> object:
+        ticket = object()
+        with self._lock:
+            self._waiters.append((ticket, cost))
+        return ticket
+
+    def _dequeue(self, ticket: object) -> None:
+        with self._lock:
+            for i, (waiter, _) in enumerate(self._waiters):
+                if waiter is ticket:
+                    del self._waiters[i]
+                    break
+
+    def settle(self, estimated: int, actual: Optional[int], headers: httpx.Headers) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self._tokens is not None:
+                if actual is not None:
+                    self._tokens.adjust(estimated - actual, now)
+                remaining = headers.get("x-ratelimit-remaining-tokens")
+                if remaining and remaining.isdigit():
+                    self._tokens.clamp(float(remaining), now)
+            if self._requests is not None:
+                remaining = headers.get("x-ratelimit-remaining-requests")
+                if remaining and remaining.isdigit():
+                    self._requests.clamp(float(remaining), now)
+
+    def acquire(self, cost: int) -> float:
+        """阻塞直到取得配额 (同步客户端在线程中调用)，返回等待的秒数。"""
+        delay = self.try_acquire(cost)
+        if delay == 0:
+            return 0.0
+        ticket = self._enqueue(cost)
+        waited = 0.0
+        try:
+            while delay > 0:
+                # 等不到配额就会超出请求预算时立即放弃
+                check_deadline(delay)
+                time.sleep(delay)
+                waited += delay
+                delay = self.try_acquire(cost, ticket)
+            return waited
+        finally:
+            self._dequeue(ticket)
+
+    async def acquire_async(self, cost: int) -> float:
+        """等待直到取得配额，返回等待的秒数。被取消时离开队列。"""
+        delay = self.try_acquire(cost)
+        if delay == 0:
+            return 0.0
+        ticket = self._enqueue(cost)
+        waited = 0.0
+        try:
+            while delay > 0:
+                check_deadline(delay)
+                await asyncio.sleep(delay)
+                waited += delay
+                delay = self.try_acquire(cost, ticket)
+            return waited
+        finally:
+            self._dequeue(ticket)
+
+    def refund(self, estimated: int) -> None:
+        """请求失败、服务端没有处理它：退还这次扣除的配额。"""
+        with self._lock:
+            now = time.monotonic()
+            if self._tokens is not None:
+                self._tokens.adjust(estimated, now)
+            if self._requests is not None:
+                self._requests.adjust(1, now)
+
+    def throttled(self, estimated: int, headers: httpx.Headers, attempt: int) -> None:
+        """收到 429：退还这次扣除的配额 (服务端没有处理它)，并暂停整个限流器。"""
+        delay = _retry_after(headers)
+        if delay is None:
+            delay = _backoff(attempt)
+        self.refund(estimated)
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+
+rate_limiter = AzureRateLimiter(settings.AZURE_OPENAI_TPM, settings.AZURE_OPENAI_RPM,
+                                settings.RATE_LIMIT_BURST_SECONDS)
+
+
+def _classify(request: httpx.Request) -> Tuple[str, int, int]:
+    """返回 (api, 估算的总 token 数, 其中 completion 部分)。"""
+    api = "embeddings" if request.url.path.endswith("/embeddings") else "chat"
+    try:
+        body = orjson.loads(request.content)
+    except Exception:
+        return api, settings.RATE_LIMIT_COMPLETION_ESTIMATE, 0
+    return api, estimate_request_tokens(api, body), _completion_tokens(api, body)
+
+
+def _usage_tokens(response: httpx.Response) -> Optional[int]:
+    try:
+        usage = orjson.loads(response.content).get("usage") or {}
+    except Exception:
+        return None
+    return usage.get("total_tokens")
+
+
+def _is_json(response: httpx.Response) -> bool:
+    return response.headers.get("content-type", "").startswith("application/json")
+
+
+# openai SDK 会重试的状态码 (429 单独处理：暂停整个限流器)
+_TRANSIENT_STATUSES = {408, 409}
+# openai SDK 会重试的连接错误 (不包括超时：超时由请求预算和对冲请求处理)
+_TRANSIENT_ERRORS = (httpx.ConnectError, httpx.RemoteProtocolError)
+
+
+def _is_transient(status_code: int) -> bool:
+    return status_code in _TRANSIENT_STATUSES or status_code >= 500
+
+
+def _retry_delay(attempt: int) -> float:
+    """408 / 409 / 5xx 和连接错误的退避时间 (只影响本次请求，不暂停限流器)；超出请求预算时抛出 DeadlineExceeded。"""
+    delay = _backoff(attempt) + random.uniform(0, settings.RATE_LIMIT_JITTER)
+    check_deadline(delay)
+    record_llm_retry()
+    return delay
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    def __init__(self, inner: httpx.BaseTransport):
+        self.inner = inner
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        api, cost, _ = _classify(request)
+        for attempt in range(settings.RATE_LIMIT_MAX_RETRIES + 1):
+            last = attempt == settings.RATE_LIMIT_MAX_RETRIES
+            RATE_LIMIT_WAIT.labels(api=api).observe(rate_limiter.acquire(cost))
+            try:
+                response = self.inner.handle_request(request)
+            except _TRANSIENT_ERRORS:
+                rate_limiter.refund(cost)
+                if last:
+                    raise
+                time.sleep(_retry_delay(attempt))
+                continue
+            if response.status_code == 429:
+                RATE_LIMIT_THROTTLED.labels(api=api).inc()
+                rate_limiter.throttled(cost, response.headers, attempt)
+                if last:
+                    return response
+                response.close()
+                record_llm_retry()
+                continue
+            if _is_transient(response.status_code) and not last:
+                rate_limiter.refund(cost)
+                response.close()
+                time.sleep(_retry_delay(attempt))
+                continue
+            actual = None
+            if response.status_code == 200 and _is_json(response):
+                response.read()
+                actual = _usage_tokens(response)
+            rate_limiter.settle(cost, actual, response.headers)
+            return response
+        return response
+
+    def close(self) -> None:
+        self.inner.close()
+
+
+class RateLimitedAsyncTransport(httpx.AsyncBaseTransport):
+    def __init__(self, inner: httpx.AsyncBaseTransport):
+        self.inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        api, cost, completion = _classify(request)
+        # 此刻取消能省下的估算 token 数
+        unspent = cost
+        try:
+            for attempt in range(settings.RATE_LIMIT_MAX_RETRIES + 1):
+                last = attempt == settings.RATE_LIMIT_MAX_RETRIES
+                RATE_LIMIT_WAIT.labels(api=api).observe(await rate_limiter.acquire_async(cost))
+                unspent = completion
+                try:
+                    response = await self.inner.handle_async_request(request)
+                except _TRANSIENT_ERRORS:
+                    unspent = cost
+                    rate_limiter.refund(cost)
+                    if last:
+                        raise
+                    await asyncio.sleep(_retry_delay(attempt))
+                    continue
+                if response.status_code == 429:
+                    unspent = cost
+                    RATE_LIMIT_THROTTLED.labels(api=api).inc()
+                    rate_limiter.throttled(cost, response.headers, attempt)
+                    if last:
+                        return response
+                    await response.aclose()
+                    record_llm_retry()
+                    continue
+                if _is_transient(response.status_code) and not last:
+                    unspent = cost
+                    rate_limiter.refund(cost)
+                    await response.aclose()
+                    await asyncio.sleep(_retry_delay(attempt))
+                    continue
+                actual = None
+                # 流式响应 (text/event-stream) 不读取响应体，按估算值计
+                if response.status_code == 200 and _is_json(response):
+                    await response.aread()
+                    actual = _usage_tokens(response)
+                unspent = 0
+                rate_limiter.settle(cost, actual, response.headers)
+                return response
+            return response
+        except asyncio.CancelledError:
+            if unspent and abandoned():
+                LLM_TOKENS_SAVED.labels(route=current_route.get()).inc(unspent)
+            raise
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+@lru_cache
+def azure_http_clients() -> Dict[str, Any]:
+    """
+    所有 AzureChatOpenAI / AzureOpenAIEmbeddings 共用的限流 httpx 客户端，
+    以 http_client / http_async_client 关键字参数传入。共用同一组客户端也使它们共享连接池。
+    重试全部由传输层完成，同时传入 max_retries=0 关闭 openai SDK 自己的重试。
+    """
+    return {
+        "max_retries": 0,
+        "http_client": openai.DefaultHttpxClient(
+            transport=RateLimitedTransport(httpx.HTTPTransport(limits=_CONNECTION_LIMITS))),
+        "http_async_client": openai.DefaultAsyncHttpxClient(
+            transport=RateLimitedAsyncTransport(httpx.AsyncHTTPTransport(limits=_CONNECTION_LIMITS))),
+    }
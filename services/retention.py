@@ -0,0 +1,360 @@
+# services/retention.py
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from utility.config import settings
+from utility.metrics import RETENTION_EVENTS
+from .session_index import session_index
+
+"""
+会话保留、过期与压缩 (Session Retention)
+
+除了显式的 /delete_version，版本记忆从不会被删除，chroma_db_store 随会话数无限增长。
+这里负责:
+- 访问记录: 会话相关的路由调用 touch(session_id)，只更新内存中的字典；
+  后台按 RETENTION_FLUSH_INTERVAL 批量写入 sqlite 表 session_access (取较大的时间戳，多 worker 共享)。
+  首次运行时把 Chroma 中已有但没有访问记录的会话登记为"现在"，从上线时刻开始计算 TTL。
+- 过期: 最后访问早于 RETENTION_TTL_DAYS 的会话，按会话分批从 Chroma 删除其全部版本
+  (每次 delete 最多 RETENTION_DELETE_BATCH 个 ID，批次之间让出 Chroma 的写锁)，并淘汰会话矩阵缓存。
+  删除前重新检查访问时间，期间被再次访问的会话不会被删除。
+- 压缩: Chroma 删除后 sqlite 只把页放回空闲列表，文件不会变小。chroma.sqlite3 处于
+  auto_vacuum=INCREMENTAL 时按 RETENTION_COMPACT_STEP_PAGES 分步执行 incremental_vacuum，每步只短暂持有写锁；
+  否则需要在服务停止时运行一次 `python -m tools.retention compact --offline` 完成转换 (整库 VACUUM)。
+  HNSW 索引文件不会在线缩小，已删除的槽位由之后写入的向量复用。
+过期和压缩都在线程中执行，由 lifespan 启动的调度任务按 RETENTION_CHECK_INTERVAL / RETENTION_COMPACT_INTERVAL 触发，
+也可以通过 /admin/retention 端点或 tools/retention.py 手动触发。多 worker 时用文件锁保证同一时刻只有一个进程在执行。
+"""
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows: 只在单进程内互斥
+    fcntl = None
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_access (
+    session_id TEXT PRIMARY KEY,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_session_access_last ON session_access (last_access);
+CREATE TABLE IF NOT EXISTS retention_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_UPSERT = (
+    "INSERT INTO session_access (session_id, last_access) VALUES (?, ?) "
+    "ON CONFLICT (session_id) DO UPDATE SET last_access = MAX(last_access, excluded.last_access)"
+)
+
+# sqlite 的 auto_vacuum 取值: 0 = NONE, 1 = FULL, 2 = INCREMENTAL
+_AUTO_VACUUM_INCREMENTAL = 2
+
+
+def dir_size(path: str) -> int:
+    """目录下所有文件的总字节数。"""
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    )
+
+
+def _chunks(items: List[str], size: int) -> Iterable[List[str]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class _RunLock:
+    """进程内 + 跨进程互斥：保证同一时刻只有一个过期 / 压缩任务在执行。拿不到锁时立即返回 False。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def acquire(self) -> bool:
+        if not self._lock.acquire(blocking=False):
+            return False
+        if fcntl is None:
+            return True
+        self._file = open(self.path, "a")
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            self._file = None
+            self._lock.release()
+            return False
+        return True
+
+    def release(self) -> None:
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+
+class RetentionManager:
+    """会话访问记录 (sqlite) 和过期 / 压缩任务。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._pending: Dict[str, float] = {}
+        self._pending_lock = threading.Lock()
+        self._run_lock = _RunLock(f"{path}.lock")
+        self._schema_ready = False
+        self.last_expiry: Optional[Dict[str, Any]] = None
+        self.last_compaction: Optional[Dict[str, Any]] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._schema_ready:
+            conn.executescript(_SCHEMA)
+            self._schema_ready = True
+        return conn
+
+    # --- 访问记录 ---
+    def touch(self, session_id: Optional[str]) -> None:
+        """记录一次会话访问。只更新内存字典，不做 I/O。"""
+        if not session_id:
+            return
+        now = time.time()
+        with self._pending_lock:
+            self._pending[session_id] = now
+
+    def flush_access(self) -> int:
+        """把内存中的访问记录批量写入 sqlite，返回写入的会话数。"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(_UPSERT, pending.items())
+        except Exception as e:
+            logger.error("❌ 写入会话访问记录失败 (%s 条): %s", len(pending), e)
+            # 放回内存，下次刷新时重试 (保留较新的时间戳)
+            with self._pending_lock:
+                for session_id, ts in pending.items():
+                    self._pending[session_id] = max(ts, self._pending.get(session_id, 0.0))
+            return 0
+        finally:
+            conn.close()
+        return len(pending)
+
+    def _bootstrap(self, conn: sqlite3.Connection, collection, page_size: int = 5000) -> int:
+        """首次运行时把 Chroma 中没有访问记录的会话登记为现在，避免上线即删除全部历史会话。"""
+        if conn.execute("SELECT 1 FROM retention_meta WHERE key = 'bootstrapped'").fetchone():
+            return 0
+        sessions = set()
+        offset = 0
+        while True:
+            page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+            metadatas = page.get("metadatas") or []
+            sessions.update(m["session_id"] for m in metadatas if m and m.get("session_id"))
+            if len(metadatas) < page_size:
+                break
+            offset += page_size
+        now = time.time()
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO session_access (session_id, last_access) VALUES (?, ?)",
+                ((session_id, now) for session_id in sessions),
+            )
+            conn.execute("INSERT OR REPLACE INTO retention_meta (key, value) VALUES ('bootstrapped', ?)", (str(now),))
+        logger.info("🗂️ 已为 %s 个已有会话登记访问时间", len(sessions))
+        return len(sessions)
+
+    def status(self, ttl_days: Optional[float] = None) -> Dict[str, Any]:
+        """访问记录概况：登记的会话数、最早访问时间、按 TTL 已过期的会话数，以及最近一次过期 / 压缩的结果。"""
+        self.flush_access()
+        ttl_days = settings.RETENTION_TTL_DAYS if ttl_days is None else ttl_days
+        conn = self._connect()
+        try:
+            tracked, oldest = conn.execute("SELECT COUNT(*), MIN(last_access) FROM session_access").fetchone()
+            expired = 0
+            if ttl_days > 0:
+                cutoff = time.time() - ttl_days * 86400
+                expired = conn.execute(
+                    "SELECT COUNT(*) FROM session_access WHERE last_access < ?", (cutoff,)
+                ).fetchone()[0]
+        finally:
+            conn.close()
+        return {
+            "ttl_days": ttl_days,
+            "tracked_sessions": tracked,
+            "oldest_access": oldest,
+            "expired_sessions": expired,
+            "last_expiry": self.last_expiry,
+            "last_compaction": self.last_compaction,
+        }
+
+    # --- 过期 ---
+    def expire(self, collection, ttl_days: Optional[float] = None, dry_run: bool = False,
+               batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        删除最后访问早于 ttl_days 的会话的全部版本记忆。同步执行，应在线程中调用。
+        另一个过期 / 压缩任务正在执行时直接返回 {"skipped": "busy"}。
+
+        Raises:
+            ValueError: 如果 ttl_days 不为正数。
+        """
+        ttl_days = settings.RETENTION_TTL_DAYS if ttl_days is None else ttl_days
+        if ttl_days <= 0:
+            raise ValueError("ttl_days must be positive (RETENTION_TTL_DAYS=0 disables expiry)")
+        batch_size = batch_size or settings.RETENTION_DELETE_BATCH
+        if not self._run_lock.acquire():
+            return {"skipped": "busy"}
+        started = time.perf_counter()
+        cutoff = time.time() - ttl_days * 86400
+        report: Dict[str, Any] = {
+            "ttl_days": ttl_days, "cutoff": cutoff, "dry_run": dry_run,
+            "expired_sessions": 0, "deleted_versions": 0,
+        }
+        conn = self._connect()
+        try:
+            self.flush_access()
+            report["bootstrapped_sessions"] = self._bootstrap(conn, collection)
+            # 每轮取一批过期会话；dry_run 时不删除，用 offset 翻页
+            offset = 0
+            while True:
+                candidates = [row[0] for row in conn.execute(
+                    "SELECT session_id FROM session_access WHERE last_access < ? "
+                    "ORDER BY last_access LIMIT ? OFFSET ?",
+                    (cutoff, settings.RETENTION_SESSION_BATCH, offset),
+                )]
+                if not candidates:
+                    break
+                # 把期间的访问写入后再确认一次，被再次访问的会话不删除
+                self.flush_access()
+                with self._pending_lock:
+                    candidates = [s for s in candidates if s not in self._pending]
+                placeholders = ",".join("?" * len(candidates))
+                expired = [row[0] for row in conn.execute(
+                    f"SELECT session_id FROM session_access WHERE last_access < ? AND session_id IN ({placeholders})",
+                    (cutoff, *candidates),
+                )] if candidates else []
+
+                ids = collection.get(where={"session_id": {"$in": expired}}, include=[])["ids"] if expired else []
+                report["expired_sessions"] += len(expired)
+                report["deleted_versions"] += len(ids)
+                if dry_run:
+                    offset += settings.RETENTION_SESSION_BATCH
+                    continue
+                for chunk in _chunks(ids, batch_size):
+                    collection.delete(ids=chunk)
+                    # 批次之间让出 Chroma 的写锁，避免请求路径上的写入长时间排队
+                    time.sleep(settings.RETENTION_BATCH_PAUSE)
+                for session_id in expired:
+                    session_index.drop(session_id)
+                # 被再次访问而跳过的会话在下一轮刷新后不再满足条件，不会被反复选中
+                with conn:
+                    conn.executemany(
+                        "DELETE FROM session_access WHERE session_id = ? AND last_access < ?",
+                        ((session_id, cutoff) for session_id in expired),
+                    )
+                RETENTION_EVENTS.labels(event="expired_session").inc(len(expired))
+                RETENTION_EVENTS.labels(event="deleted_version").inc(len(ids))
+        finally:
+            conn.close()
+            self._run_lock.release()
+        report["duration_s"] = round(time.perf_counter() - started, 3)
+        if not dry_run:
+            self.last_expiry = {**report, "finished_at": time.time()}
+        logger.info(
+            "🧹 会话过期%s完成: %s 个会话, %s 个版本", "预演" if dry_run else "",
+            report["expired_sessions"], report["deleted_versions"], extra={"fields": report},
+        )
+        return report
+
+    # --- 压缩 ---
+    def compact(self, chroma_path: Optional[str] = None, offline: bool = False) -> Dict[str, Any]:
+        """
+        回收 chroma.sqlite3 的空闲页，返回回收的字节数。同步执行，应在线程中调用。
+        在线模式只在 auto_vacuum=INCREMENTAL 时分步执行 incremental_vacuum；
+        offline=True 时 (服务必须已停止) 把数据库转换为 INCREMENTAL 并执行整库 VACUUM。
+        """
+        chroma_path = chroma_path or settings.CHROMA_PATH
+        db_path = os.path.join(chroma_path, "chroma.sqlite3")
+        if not os.path.exists(db_path):
+            return {"skipped": f"{db_path} not found"}
+        if not self._run_lock.acquire():
+            return {"skipped": "busy"}
+        started = time.perf_counter()
+        size_before = dir_size(chroma_path)
+        report: Dict[str, Any] = {"path": chroma_path, "offline": offline, "size_before": size_before}
+        conn = sqlite3.connect(db_path, timeout=settings.RETENTION_COMPACT_LOCK_TIMEOUT, isolation_level=None)
+        try:
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+            report.update(free_pages_before=free_pages, page_size=page_size)
+            if offline:
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+                report["mode"] = "vacuum"
+            elif auto_vacuum == _AUTO_VACUUM_INCREMENTAL:
+                # 每步只回收少量页，其间 Chroma 的写入可以插进来
+                while free_pages > 0:
+                    # execute() 只单步执行该 pragma (每次回收一页)，executescript 会执行到底
+                    conn.executescript(f"PRAGMA incremental_vacuum({settings.RETENTION_COMPACT_STEP_PAGES});")
+                    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                    time.sleep(settings.RETENTION_BATCH_PAUSE)
+                report["mode"] = "incremental"
+            else:
+                report["mode"] = "none"
+                report["hint"] = ("chroma.sqlite3 is not in auto_vacuum=INCREMENTAL mode; "
+                                  "run `python -m tools.retention compact --offline` once while the service is stopped")
+            report["free_pages_after"] = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        except sqlite3.OperationalError as e:
+            report["error"] = str(e)
+            logger.warning("⚠️ 压缩 Chroma 数据库失败: %s", e)
+        finally:
+            conn.close()
+            self._run_lock.release()
+        report["size_after"] = dir_size(chroma_path)
+        report["reclaimed_bytes"] = max(0, size_before - report["size_after"])
+        report["duration_s"] = round(time.perf_counter() - started, 3)
+        if "error" not in report:
+            self.last_compaction = {**report, "finished_at": time.time()}
+            RETENTION_EVENTS.labels(event="compaction").inc()
+        logger.info("🗜️ Chroma 压缩完成 (%s): 回收 %s 字节", report.get("mode"), report["reclaimed_bytes"],
+                    extra={"fields": report})
+        return report
+
+    # --- 调度 ---
+    async def run_scheduler(self, get_collection) -> None:
+        """
+        后台任务：按 RETENTION_FLUSH_INTERVAL 刷新访问记录，按 RETENTION_CHECK_INTERVAL 执行过期，
+        按 RETENTION_COMPACT_INTERVAL 执行压缩。所有 sqlite / Chroma 操作都在线程中进行。
+        """
+        loop = asyncio.get_running_loop()
+        next_expiry = loop.time() + settings.RETENTION_CHECK_INTERVAL
+        next_compaction = loop.time() + settings.RETENTION_COMPACT_INTERVAL
+        while True:
+            await asyncio.sleep(settings.RETENTION_FLUSH_INTERVAL)
+            try:
+                await asyncio.to_thread(self.flush_access)
+                now = loop.time()
+                if settings.RETENTION_TTL_DAYS > 0 and now >= next_expiry:
+                    next_expiry = now + settings.RETENTION_CHECK_INTERVAL
+                    await asyncio.to_thread(self.expire, get_collection())
+                if settings.RETENTION_COMPACT_INTERVAL > 0 and now >= next_compaction:
+                    next_compaction = now + settings.RETENTION_COMPACT_INTERVAL
+                    await asyncio.to_thread(self.compact)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("❌ 会话保留任务失败: %s", e)
+
+
+retention = RetentionManager(settings.RETENTION_DB_PATH)
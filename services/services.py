@@ -1,17 +1,30 @@
 # services/services.py
+import asyncio
 import chromadb
-from typing import Dict, List
+import logging
+import re
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 import os
 
+import orjson
+
 # --- 核心依赖：从 LangChain 和项目配置导入 ---
 from langchain_community.vectorstores import Chroma
-from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
+from langchain_openai import AzureOpenAIEmbeddings
 from langchain.schema.messages import SystemMessage, HumanMessage
 
 # --- 假设的导入路径，请根据你的项目结构进行调整 ---
 from utility.config import settings
 # --- ‼️【修改】导入新的 InspirationService，移除旧的 RAGService ---
 from .inspiration_service import InspirationService
+from .llm_runtime import BACKGROUND, invoke_chain, llm_slot
+from .model_routing import chat_model, deployment_clients
+from .rate_limiter import azure_http_clients
+from .session_index import QUANTIZATION_MODES
+from .summary_batcher import SummaryBatcher
+from utility.metrics import SUMMARY_REQUESTS, InstrumentedEmbeddings
+
+logger = logging.getLogger(__name__)
 
 SUMMARY_PROPMT = """
 # 你是一个P5.js代码分析专家。
@@ -28,6 +41,18 @@ SUMMARY_PROPMT = """
 - **摘要内容只能使用中文，严禁使用任何其他语言！**
 - **摘要长度严格限制在40字以内！**
 """
+
+# 合批摘要：同样的要求，一次处理多个代码片段
+SUMMARY_BATCH_PROMPT = SUMMARY_PROPMT + """
+# 批量摘要：
+- 用户会给出多个代码片段，每个片段以 `### 片段 N` 开头，彼此独立。
+- 为每个片段分别生成摘要，要求与上面完全相同。
+- 只返回一个 JSON 数组：第 N 个元素是片段 N 的摘要字符串，数组长度必须等于片段数，不要返回任何其他内容。
+"""
+
+SUMMARY_FAILED = "生成 AI 摘要失败。"
+_JSON_ARRAY = re.compile(r"\[.*\]", re.S)
+
 # --- 全局变量定义，用于持有初始化后的服务实例 ---
 # 这些变量将由 initialize_services 函数在应用启动时填充
 vector_store: Chroma = None
@@ -40,17 +65,28 @@ class CodeSummarizerService:
     """封装与代码摘要相关的 LLM 调用。(这个类保持不变)"""
     def __init__(self):
         """初始化 Azure Chat LLM 客户端。"""
-        self._llm = AzureChatOpenAI(
-            openai_api_version=settings.AZURE_OPENAI_API_VERSION,
-            azure_deployment=settings.AZURE_OPENAI_MODEL_NAME,
-            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
-            api_key=settings.AZURE_OPENAI_API_KEY,
-            temperature=0.7
-        )
-        print("✅ Azure Chat LLM for Summarizer 已初始化。")
+        self._llm = chat_model("summary")
+        logger.info("✅ Azure Chat LLM for Summarizer 已初始化。")
+        self._batcher: Optional[SummaryBatcher] = None
+        if settings.SUMMARY_BATCH_SIZE > 1:
+            self._batcher = SummaryBatcher(
+                self._summarize_one, self.summarize_many,
+                max_batch=settings.SUMMARY_BATCH_SIZE, window=settings.SUMMARY_BATCH_WINDOW,
+                max_in_flight=settings.SUMMARY_BATCH_MAX_IN_FLIGHT,
+            )
 
     async def summarize_code(self, code: str) -> str:
+        """
+        为提供的代码生成简洁的摘要。
+        SUMMARY_BATCH_SIZE > 1 时与短时间内到达的其他摘要请求合并为一次 LLM 调用。
+        """
+        if self._batcher is not None:
+            return await self._batcher.summarize(code)
+        return await self._summarize_one(code)
+
+    async def _summarize_one(self, code: str) -> str:
         """调用 LLM 为提供的代码生成简洁的摘要。"""
+        SUMMARY_REQUESTS.labels(path="single").inc()
         messages = [
             SystemMessage(
                 content=SUMMARY_PROPMT
@@ -60,13 +96,71 @@ class CodeSummarizerService:
             )
         ]
         try:
-            response = await self._llm.ainvoke(messages)
+            response = await invoke_chain(self._llm, messages, priority=BACKGROUND)
             summary = response.content
-            print("✅ 成功生成代码摘要。")
+            logger.info("✅ 成功生成代码摘要。")
             return summary
         except Exception as e:
-            print(f"❌ 在代码摘要过程中发生错误: {e}")
-            return "生成 AI 摘要失败。"
+            logger.error("❌ 在代码摘要过程中发生错误: %s", e)
+            return SUMMARY_FAILED
+
+    async def summarize_many(self, codes: List[str]) -> List[str]:
+        """
+        一次 LLM 调用为多个代码片段生成摘要，返回值与 codes 一一对应。
+        整体失败、返回的不是等长的字符串数组时全部回退为逐个调用；个别元素无效时只回退这些片段。
+        """
+        body = "\n\n".join(
+            f"### 片段 {i}\n```javascript\n{code}\n```" for i, code in enumerate(codes, start=1)
+        )
+        messages = [
+            SystemMessage(content=SUMMARY_BATCH_PROMPT),
+            HumanMessage(content=f"请为以下 {len(codes)} 个代码片段分别生成摘要:\n\n{body}"),
+        ]
+        summaries: List[Optional[str]] = [None] * len(codes)
+        try:
+            response = await invoke_chain(self._llm, messages, priority=BACKGROUND)
+            match = _JSON_ARRAY.search(response.content)
+            parsed = orjson.loads(match.group(0)) if match else None
+            if isinstance(parsed, list) and len(parsed) == len(codes):
+                summaries = [item.strip() if isinstance(item, str) and item.strip() else None for item in parsed]
+            else:
+                logger.warning("⚠️ 合批摘要返回的不是 %s 个元素的数组，逐个重试", len(codes))
+        except Exception as e:
+            logger.warning("⚠️ 合批摘要失败，逐个重试: %s", e)
+
+        SUMMARY_REQUESTS.labels(path="batched").inc(sum(summary is not None for summary in summaries))
+        missing = [i for i, summary in enumerate(summaries) if summary is None]
+        if missing:
+            SUMMARY_REQUESTS.labels(path="fallback").inc(len(missing))
+            retried = await asyncio.gather(*(self._summarize_one(codes[i]) for i in missing))
+            for i, summary in zip(missing, retried):
+                summaries[i] = summary
+        logger.info("✅ 合批生成 %s 个代码摘要 (逐个回退 %s 个)。", len(codes), len(missing))
+        return summaries
+
+def version_doc_id(session_id: str, version_id: str) -> str:
+    """生成用于向量数据库的唯一文档 ID。"""
+    return f"{session_id}_{version_id}"
+
+def version_document(session_id: str, version_id: str, code: str, ai_summary: str) -> Tuple[str, str, Dict]:
+    """构造一个版本在向量数据库中的 (文档 ID, 文档内容, 元数据)。"""
+    document_content = (
+        f"代码内容总结: {ai_summary}\n\n"
+        f"--- 源代码 ---\n{code}"
+    )
+    metadata = {
+        "session_id": session_id,
+        "version_id": version_id,
+        "ai_summary": ai_summary
+    }
+    return version_doc_id(session_id, version_id), document_content, metadata
+
+def vector_collection_name() -> str:
+    """版本记忆所在的 Chroma 集合名。"""
+    if settings.EMBEDDING_DIMENSIONS:
+        # Chroma 集合的维度在首次写入时固定，降维后的向量使用单独的集合
+        return f"version_graph_memory_{settings.EMBEDDING_DIMENSIONS}d"
+    return "version_graph_memory"
 
 # --- 集中初始化函数 ---
 def initialize_services():
@@ -77,33 +171,51 @@ def initialize_services():
     # --- ‼️【修改】将 inspiration_service 加入 global ---
     global vector_store, summarizer_service, inspiration_service
     
-    print("--- 核心服务初始化开始 ---")
+    logger.info("--- 核心服务初始化开始 ---")
     
     # 1. 初始化 Embedding 模型 (供 ChromaDB 使用)
     try:
-        embeddings_model = AzureOpenAIEmbeddings(
+        embeddings_model = InstrumentedEmbeddings(AzureOpenAIEmbeddings(
             model=settings.AZURE_OPENAI_EMBEDDING_MODEL,
             api_key=settings.AZURE_OPENAI_API_KEY,
+            **azure_http_clients(),
             azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
-            api_version=settings.AZURE_OPENAI_API_VERSION
-        )
-        print("✅ Azure OpenAI Embedding 模型已初始化。")
+            api_version=settings.AZURE_OPENAI_API_VERSION,
+            check_embedding_ctx_length=settings.EMBEDDING_CHECK_CTX_LENGTH,
+            dimensions=settings.EMBEDDING_DIMENSIONS or None
+        ))
+        logger.info("✅ Azure OpenAI Embedding 模型已初始化。")
     except Exception as e:
-        print(f"❌ 初始化 Embedding 模型失败: {e}")
+        logger.error("❌ 初始化 Embedding 模型失败: %s", e)
         raise e
 
     # 2. 连接到 ChromaDB
     try:
-        chroma_client = chromadb.PersistentClient(path="./chroma_db_store")
-        collection_name = "version_graph_memory"
+        if settings.CHROMA_MODE == "server":
+            # 多 worker 模式：向量库由唯一的属主进程持有，这里只是它的客户端
+            chroma_client = chromadb.HttpClient(host=settings.CHROMA_HOST, port=settings.CHROMA_PORT)
+        elif settings.CHROMA_MODE == "embedded":
+            chroma_client = chromadb.PersistentClient(path=settings.CHROMA_PATH)
+        else:
+            raise ValueError(f"Unsupported CHROMA_MODE '{settings.CHROMA_MODE}', expected 'embedded' or 'server'")
+        collection_name = vector_collection_name()
         vector_store = Chroma(
             client=chroma_client, 
             collection_name=collection_name,
             embedding_function=embeddings_model
         )
-        print(f"✅ ChromaDB 向量数据库已连接。正在使用集合: '{collection_name}'")
+        logger.info("✅ ChromaDB 向量数据库已连接 (%s)。正在使用集合: '%s'", settings.CHROMA_MODE, collection_name)
+        if settings.RETRIEVAL_BACKEND not in ("chroma", "session_index"):
+            raise ValueError(
+                f"Unsupported RETRIEVAL_BACKEND '{settings.RETRIEVAL_BACKEND}', expected 'chroma' or 'session_index'"
+            )
+        if settings.SESSION_INDEX_QUANTIZATION not in QUANTIZATION_MODES:
+            raise ValueError(
+                f"Unsupported SESSION_INDEX_QUANTIZATION '{settings.SESSION_INDEX_QUANTIZATION}', "
+                f"expected one of {list(QUANTIZATION_MODES)}"
+            )
     except Exception as e:
-        print(f"❌ 连接到 ChromaDB 时出错: {e}")
+        logger.error("❌ 连接到 ChromaDB 时出错: %s", e)
         raise e
         
     # 3. ‼️【修改】初始化新的 InspirationService
@@ -112,19 +224,46 @@ def initialize_services():
         # 假设 data/ 文件夹在项目根目录
         data_path = os.path.join(os.path.dirname(__file__),  "data", "p5_examples.json")
         inspiration_service.load_examples(filepath=data_path)
-        print("✅ Inspiration 服务已初始化并加载p5.js灵感库。")
+        logger.info("✅ Inspiration 服务已初始化并加载p5.js灵感库。")
     except Exception as e:
-        print(f"❌ 初始化 InspirationService 时出错: {e}")
+        logger.error("❌ 初始化 InspirationService 时出错: %s", e)
         raise e
 
     # 4. 初始化代码摘要服务
     try:
         summarizer_service = CodeSummarizerService()
     except Exception as e:
-        print(f"❌ 初始化 CodeSummarizerService 时出错: {e}")
+        logger.error("❌ 初始化 CodeSummarizerService 时出错: %s", e)
         raise e
         
-    print("--- 核心服务初始化完成 ---")
+    logger.info("--- 核心服务初始化完成 ---")
+
+# --- 预热 ---
+def get_warmup_steps() -> Dict[str, Callable[[], Awaitable[None]]]:
+    """
+    返回按顺序执行的预热步骤，由 lifecycle 在启动后于后台执行。
+    让首批真实请求不必再承担 TLS 握手、tokenizer 加载和 Chroma 索引加载的开销。
+    (灵感库在 initialize_services 中已同步加载，无需预热。)
+    """
+    warmup_vector: List[List[float]] = []
+
+    async def embeddings():
+        # 路由中的检索走同步客户端，这里也用同步调用以预热同一个连接池
+        warmup_vector.append(await asyncio.to_thread(vector_store.embeddings.embed_query, "warm-up"))
+
+    async def llm():
+        # 各路由的 AzureChatOpenAI 共享同一个 httpx 连接池，每个路由到的部署各发一次 1 token 的调用即可完成预连接
+        for client in deployment_clients().values():
+            async with llm_slot(BACKGROUND):
+                await client.bind(max_tokens=1).ainvoke("ping")
+
+    async def chroma():
+        collection = vector_store._collection
+        count = await asyncio.to_thread(collection.count)
+        if count and warmup_vector:
+            await asyncio.to_thread(collection.query, query_embeddings=warmup_vector, n_results=1)
+
+    return {"embeddings": embeddings, "llm": llm, "chroma": chroma}
 
 # --- 依赖注入函数 (供路由使用) ---
 
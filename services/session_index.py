@@ -0,0 +1,290 @@
+# services/session_index.py
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+
+from utility.config import settings
+from utility.deadline import DeadlineExceeded, check_deadline, remaining
+from utility.metrics import SESSION_INDEX_EVENTS
+
+"""
+按会话划分的进程内向量索引 (Per-session Vector Index)
+
+所有会话共用 Chroma 集合 version_graph_memory，/chat 每次检索都要带 session_id 过滤条件，
+过滤开销随集合中的版本总数增长，而一个会话通常只有几十个版本。
+
+这里为每个会话缓存一个小的 NumPy 向量矩阵：
+- 首次检索某个会话时按 session_id 从 Chroma 一次性加载该会话的全部向量 (懒加载)；
+- 之后的检索在矩阵上做精确的暴力 top-k (与 Chroma 默认的 l2 距离一致)，只需几十微秒；
+- /add_version_node、/delete_version 写入 Chroma 后同步更新已缓存的矩阵 (按 ID 读取，不走过滤)；
+- 空闲超过 SESSION_INDEX_IDLE_TTL 或超出 SESSION_INDEX_MAX_SESSIONS 的会话被淘汰，下次检索时重新加载；
+- 矩阵可按 SESSION_INDEX_QUANTIZATION 以 float16 或 int8 存储，在量化向量上做精确检索，
+  SESSION_INDEX_RERANK > 1 时再从 Chroma 取回 k * RERANK 个候选的全精度向量重新排序。
+Chroma 仍是持久化的唯一数据源，缓存丢失不影响正确性。由 RETRIEVAL_BACKEND=session_index 启用。
+"""
+
+logger = logging.getLogger(__name__)
+
+
+QUANTIZATION_MODES = ("none", "float16", "int8")
+
+
+def quantize(embeddings: np.ndarray, mode: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    按行量化向量矩阵，返回 (编码, 每行缩放系数)。
+    float16 直接降低精度；int8 为对称标量量化，每行按最大绝对值缩放到 [-127, 127]。
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if mode == "float16":
+        return embeddings.astype(np.float16), None
+    if mode == "int8":
+        scales = np.abs(embeddings).max(axis=1) / 127.0 if embeddings.size else np.zeros(len(embeddings))
+        scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+        return np.round(embeddings / scales[:, None]).astype(np.int8), scales
+    return embeddings, None
+
+
+def dequantize(codes: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+    vectors = codes.astype(np.float32)
+    return vectors * scales[:, None] if scales is not None else vectors
+
+
+class _SessionMatrix:
+    """一个会话的全部版本向量，按 SESSION_INDEX_QUANTIZATION 量化存储。行顺序与 ids 一致。"""
+
+    def __init__(self, ids: List[str], embeddings: np.ndarray, metadatas: List[Dict], documents: List[str],
+                 mode: str = "none"):
+        if embeddings.ndim != 2:
+            embeddings = np.zeros((0, 0), dtype=np.float32)
+        self.mode = mode
+        self.ids = ids
+        self.codes, self.scales = quantize(embeddings, mode)
+        # 距离按量化后的向量计算，范数也取量化后的值，保证在量化空间内是精确检索
+        self.sq_norms = self._sq_norms(self.codes, self.scales)
+        self.metadatas = metadatas
+        self.documents = documents
+        self.loaded_at = time.monotonic()
+        self.last_used = self.loaded_at
+
+    @staticmethod
+    def _sq_norms(codes: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+        vectors = dequantize(codes, scales)
+        return np.einsum("ij,ij->i", vectors, vectors)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0) + self.sq_norms.nbytes
+
+    def upsert(self, doc_id: str, embedding: np.ndarray, metadata: Dict, document: str) -> None:
+        codes, scales = quantize(embedding[None, :], self.mode)
+        sq_norm = self._sq_norms(codes, scales)
+        if doc_id in self.ids:
+            row = self.ids.index(doc_id)
+            self.codes[row] = codes[0]
+            if scales is not None:
+                self.scales[row] = scales[0]
+            self.sq_norms[row] = sq_norm[0]
+            self.metadatas[row] = metadata
+            self.documents[row] = document
+            return
+        self.ids.append(doc_id)
+        self.codes = np.vstack([self.codes.reshape(-1, codes.shape[1]).astype(codes.dtype), codes])
+        if scales is not None:
+            self.scales = np.append(self.scales, scales)
+        self.sq_norms = np.append(self.sq_norms, sq_norm)
+        self.metadatas.append(metadata)
+        self.documents.append(document)
+
+    def remove(self, doc_id: str) -> None:
+        if doc_id not in self.ids:
+            return
+        row = self.ids.index(doc_id)
+        del self.ids[row], self.metadatas[row], self.documents[row]
+        self.codes = np.delete(self.codes, row, axis=0)
+        if self.scales is not None:
+            self.scales = np.delete(self.scales, row)
+        self.sq_norms = np.delete(self.sq_norms, row)
+
+    def top_k(self, query: np.ndarray, k: int, exclude_version_id: Optional[str]) -> List[int]:
+        """按 l2 距离返回最近的 k 行 (排除指定版本)。"""
+        if not self.ids:
+            return []
+        # ||x - q||² = ||x||² - 2 x·q + ||q||²，最后一项对排序无影响；int8 的缩放系数在点积之后再乘。
+        # 会话矩阵只有几十行，临时转为 float32 走 BLAS 比 float16 / int8 上的原生运算更快
+        dots = np.asarray(self.codes, dtype=np.float32) @ query
+        if self.scales is not None:
+            dots = dots * self.scales
+        distances = self.sq_norms - 2.0 * dots
+        if exclude_version_id is not None:
+            for row, metadata in enumerate(self.metadatas):
+                if metadata.get("version_id") == exclude_version_id:
+                    distances[row] = np.inf
+        k = min(k, int(np.isfinite(distances).sum()))
+        if k <= 0:
+            return []
+        candidates = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+        return candidates[np.argsort(distances[candidates], kind="stable")].tolist()
+
+
+class SessionVectorIndex:
+    """按 session_id 缓存 _SessionMatrix 的 LRU 缓存，带空闲淘汰。"""
+
+    def __init__(self):
+        self._sessions: "OrderedDict[str, _SessionMatrix]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return settings.RETRIEVAL_BACKEND == "session_index"
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    # --- 缓存管理 ---
+    def _evict(self, now: float) -> None:
+        """淘汰空闲超时的会话和超出容量的最久未使用会话。调用方持有锁。"""
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            idle = now - entry.last_used > settings.SESSION_INDEX_IDLE_TTL
+            if not idle and len(self._sessions) <= settings.SESSION_INDEX_MAX_SESSIONS:
+                break
+            del self._sessions[session_id]
+            SESSION_INDEX_EVENTS.labels(event="evict").inc()
+
+    def _load(self, vector_store: Chroma, session_id: str) -> _SessionMatrix:
+        result = vector_store._collection.get(
+            where={"session_id": session_id}, include=["embeddings", "metadatas", "documents"],
+        )
+        embeddings = result.get("embeddings")
+        ids = list(result.get("ids") or [])
+        matrix = np.asarray(embeddings if ids else [], dtype=np.float32)
+        SESSION_INDEX_EVENTS.labels(event="load").inc()
+        return _SessionMatrix(ids, matrix, list(result.get("metadatas") or []), list(result.get("documents") or []),
+                              mode=settings.SESSION_INDEX_QUANTIZATION)
+
+    def _get(self, vector_store: Chroma, session_id: str) -> _SessionMatrix:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            max_age = settings.SESSION_INDEX_MAX_AGE
+            if entry is not None and (max_age <= 0 or now - entry.loaded_at <= max_age):
+                self._sessions.move_to_end(session_id)
+                entry.last_used = now
+                SESSION_INDEX_EVENTS.labels(event="hit").inc()
+                return entry
+        # 加载在锁外进行：并发加载同一会话时以后完成者为准，结果相同
+        entry = self._load(vector_store, session_id)
+        with self._lock:
+            self._sessions[session_id] = entry
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+        return entry
+
+    # --- 检索 ---
+    def similarity_search(self, vector_store: Chroma, query: str, k: int, session_id: str,
+                          exclude_version_id: Optional[str] = None) -> List[Document]:
+        """在会话矩阵上检索与 query 最相近的 k 个版本，返回值与 Chroma.similarity_search 相同。"""
+        embedding = np.asarray(vector_store.embeddings.embed_query(query), dtype=np.float32)
+        entry = self._get(vector_store, session_id)
+        rerank = settings.SESSION_INDEX_RERANK
+        if entry.mode != "none" and rerank > 1:
+            rows = self._rerank(vector_store, entry, embedding, entry.top_k(embedding, k * rerank, exclude_version_id), k)
+        else:
+            rows = entry.top_k(embedding, k, exclude_version_id)
+        return [
+            Document(page_content=entry.documents[row] or "", metadata=entry.metadatas[row] or {}, id=entry.ids[row])
+            for row in rows
+        ]
+
+    @staticmethod
+    def _rerank(vector_store: Chroma, entry: _SessionMatrix, query: np.ndarray, rows: List[int], k: int) -> List[int]:
+        """按 ID 从 Chroma 取回候选的全精度向量，重新计算距离后取前 k 个。"""
+        if len(rows) <= k:
+            return rows
+        ids = [entry.ids[row] for row in rows]
+        result = vector_store._collection.get(ids=ids, include=["embeddings"])
+        full = dict(zip(result["ids"], np.asarray(result["embeddings"], dtype=np.float32)))
+        distances = [
+            float(np.sum((full[doc_id] - query) ** 2)) if doc_id in full else np.inf
+            for doc_id in ids
+        ]
+        order = sorted(range(len(rows)), key=distances.__getitem__)
+        return [rows[i] for i in order[:k]]
+
+    # --- 写入同步 ---
+    def refresh(self, vector_store: Chroma, session_id: str, doc_ids: List[str]) -> None:
+        """Chroma 写入后调用：会话已缓存时按 ID 读取新向量并更新矩阵；未缓存时什么也不做。"""
+        if not self.enabled or session_id not in self._sessions:
+            return
+        result = vector_store._collection.get(ids=doc_ids, include=["embeddings", "metadatas", "documents"])
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return
+            for doc_id, embedding, metadata, document in zip(
+                result["ids"], result["embeddings"], result["metadatas"], result["documents"],
+            ):
+                entry.upsert(doc_id, np.asarray(embedding, dtype=np.float32), metadata or {}, document)
+
+    def remove(self, session_id: str, doc_ids: List[str]) -> None:
+        """Chroma 删除后调用：从已缓存的会话矩阵中删除对应的行。"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                for doc_id in doc_ids:
+                    entry.remove(doc_id)
+
+    def drop(self, session_id: str) -> None:
+        """会话的版本记忆被整体删除 (过期) 后调用：丢弃缓存的会话矩阵。"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._sessions.clear()
+
+
+session_index = SessionVectorIndex()
+
+
+def retrieve_version_memories(vector_store: Chroma, query: str, k: int, session_id: str,
+                              exclude_version_id: str) -> List[Document]:
+    """按 RETRIEVAL_BACKEND 检索同一会话中除当前版本外最相关的 k 个版本记忆。"""
+    if session_index.enabled:
+        return session_index.similarity_search(vector_store, query, k, session_id, exclude_version_id)
+    where_clause = {
+        "$and": [
+            {"session_id": {"$eq": session_id}},
+            {"version_id": {"$ne": exclude_version_id}}
+        ]
+    }
+    return vector_store.similarity_search(query=query, k=k, filter=where_clause)
+
+
+async def aretrieve_version_memories(vector_store: Chroma, query: str, k: int, session_id: str,
+                                     exclude_version_id: str) -> List[Document]:
+    """
+    请求路径上使用的 retrieve_version_memories：检索 (含 Embedding 调用及其配额等待) 在线程中执行，不阻塞事件循环；
+    以当前请求的剩余预算为超时，预算耗尽时抛出 DeadlineExceeded。请求被取消 (客户端断开) 时立即返回，
+    线程中已经发出的调用在后台结束。
+    """
+    check_deadline()
+    budget = remaining()
+    try:
+        async with asyncio.timeout(budget):
+            return await asyncio.to_thread(retrieve_version_memories, vector_store, query, k,
+                                           session_id, exclude_version_id)
+    except TimeoutError as e:
+        raise DeadlineExceeded("version memory retrieval exceeded the request budget") from e
+    except Exception as e:
+        # 配额等待超出预算时传输层抛出 DeadlineExceeded，openai 客户端会把它包装成连接错误
+        if budget is not None and remaining() <= 0 and not isinstance(e, DeadlineExceeded):
+            raise DeadlineExceeded("version memory retrieval exceeded the request budget") from e
+        raise
@@ -1,7 +1,10 @@
 # services/summarizer.py
-from langchain_openai import AzureChatOpenAI
+import logging
 from langchain.schema.messages import SystemMessage, HumanMessage
-from utility.config import settings
+from services.llm_runtime import BACKGROUND, invoke_chain
+from services.model_routing import chat_model
+
+logger = logging.getLogger(__name__)
 
 SUMMARY_PROPMT = """
 # 你是一个P5.js代码分析专家。
@@ -21,13 +24,7 @@ SUMMARY_PROPMT = """
 
 class CodeSummarizerService:
     def __init__(self):
-        self._llm = AzureChatOpenAI(
-            openai_api_version=settings.AZURE_OPENAI_API_VERSION,
-            azure_deployment=settings.AZURE_OPENAI_MODEL_NAME,
-            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
-            api_key=settings.AZURE_OPENAI_API_KEY,
-            temperature=0.2 # Lower temperature for more factual summaries
-        )
+        self._llm = chat_model("summary")
     
 
     async def summarize_code(self, code: str) -> str:
@@ -43,12 +40,12 @@ class CodeSummarizerService:
             )
         ]
         try:
-            response = await self._llm.ainvoke(messages)
+            response = await invoke_chain(self._llm, messages, priority=BACKGROUND)
             summary = response.content
-            print("Successfully generated code summary.")
+            logger.info("Successfully generated code summary.")
             return summary
         except Exception as e:
-            print(f"Error during code summarization: {e}")
+            logger.error("Error during code summarization: %s", e)
             return "Failed to generate AI summary." # Return a fallback string
 
 # Singleton instance
@@ -0,0 +1,90 @@
+# services/summary_batcher.py
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from utility.deadline import detach_from_request
+from utility.logging_config import session_id_var
+
+"""
+摘要请求合批 (Summary Batcher)
+
+多个版本几乎同时到达时 (批量导入、多个用户同时保存)，逐个调用 LLM 生成摘要，
+每次都要付出一次请求开销和一整份 SUMMARY_PROPMT 的 Prompt token。
+SummaryBatcher 把 SUMMARY_BATCH_WINDOW 秒内到达的摘要请求收集起来，最多 SUMMARY_BATCH_SIZE 个
+合成一次调用 (由 batch_fn 完成，一次请求返回一个 JSON 数组)，再把结果分发给各个等待者：
+- 攒满 max_batch 个立即发送，否则在第一个请求到达后 window 秒发送；
+- 同时进行的合批调用最多 max_in_flight 个，达到上限时新请求继续排队，任一调用完成后立即发送排队的请求。
+  负载低时每批只等 window 秒，负载高时批次自然变大，LLM 调用次数随之减少；
+- 窗口内只有一个请求时直接走单个调用，不改变单个摘要的 Prompt；
+- 合批调用由独立任务执行，某个等待者断开 (被取消) 不会影响同批的其他请求。
+部分失败时的逐个回退由 batch_fn 负责。
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class SummaryBatcher:
+    """按时间窗口合并摘要请求。必须在事件循环中使用。"""
+
+    def __init__(self, single_fn: Callable[[str], Awaitable[str]],
+                 batch_fn: Callable[[List[str]], Awaitable[List[str]]],
+                 max_batch: int, window: float, max_in_flight: int):
+        self.single_fn = single_fn
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.window = window
+        self.max_in_flight = max_in_flight
+        self._pending: List[Tuple[str, Optional[str], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # 进行中的合批任务 (同时也持有引用，避免被垃圾回收)
+        self._tasks = set()
+
+    async def summarize(self, code: str) -> str:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((code, session_id_var.get(), future))
+        if len(self._pending) >= self.max_batch:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._dispatch)
+        return await future
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending and len(self._tasks) < self.max_in_flight:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if self._pending:
+            self._dispatch()
+
+    async def _run(self, batch: List[Tuple[str, Optional[str], asyncio.Future]]) -> None:
+        # 等待者已全部离开的条目不再发送
+        batch = [item for item in batch if not item[2].done()]
+        if not batch:
+            return
+        # 任务复制了触发者的上下文：同批的其他请求不受触发者的截止时间和断开影响；
+        # 同批包含多个会话时，token 用量不归到其中任何一个会话
+        detach_from_request()
+        if len({session_id for _, session_id, _ in batch}) > 1:
+            session_id_var.set(None)
+        codes = [code for code, _, _ in batch]
+        try:
+            if len(codes) == 1:
+                results = [await self.single_fn(codes[0])]
+            else:
+                results = await self.batch_fn(codes)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
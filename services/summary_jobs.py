@@ -0,0 +1,303 @@
+# services/summary_jobs.py
+import asyncio
+import logging
+import sqlite3
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set
+
+from utility.config import settings
+from utility.deadline import detach_from_request
+from utility.lifecycle import lifecycle
+from utility.logging_config import bind_session
+from utility.metrics import SUMMARY_JOB_EVENTS, observe_vector_op
+from .session_index import session_index
+
+"""
+异步摘要作业 (Async Summary Jobs)
+
+/add_version_node?async=true 不再等待 LLM 摘要和向量写入完成：
+- 请求只把版本写入 sqlite 作业表 (status=pending) 并返回 job_id，通常在几毫秒内完成；
+- 作业在后台以最多 SUMMARY_JOB_WORKERS 个并发执行 (生成摘要 → 写入 Chroma → status=done)，
+  每个作业都登记到 lifecycle，SIGTERM 排空时等待其完成；被取消或进程崩溃时作业仍是 pending / running，
+  下次启动时由 resume() 重新执行 (running 超过 SUMMARY_JOB_LEASE 秒视为执行者已退出)；
+- 完成的摘要通过 GET /jobs/events (SSE，按会话订阅) 推送给客户端，GET /jobs/{job_id} 作为轮询回退。
+作业表是唯一的数据源：SSE 流按结束序号 seq 增量查询作业表，进程内的通知只用于尽早唤醒，
+所以多 worker 部署时由其他 worker 执行完成的作业同样会被推送 (最迟 SUMMARY_JOB_POLL_INTERVAL 秒)。
+"""
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ("done", "failed")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS summary_jobs (
+    job_id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    version_id TEXT NOT NULL,
+    code TEXT,
+    status TEXT NOT NULL,
+    summary TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    seq INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_summary_jobs_session ON summary_jobs (session_id, updated_at);
+CREATE INDEX IF NOT EXISTS idx_summary_jobs_seq ON summary_jobs (session_id, seq);
+CREATE INDEX IF NOT EXISTS idx_summary_jobs_status ON summary_jobs (status, updated_at);
+"""
+
+_FIELDS = ("job_id", "session_id", "version_id", "status", "summary", "error", "created_at", "updated_at", "seq")
+_COLUMNS = ", ".join(_FIELDS)
+
+
+def _row_to_job(row: tuple) -> Dict[str, Any]:
+    return dict(zip(_FIELDS, row))
+
+
+class SummaryJobStore:
+    """sqlite 作业表。所有方法都是同步的，由调用方放到线程中执行。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._schema_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._schema_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._schema_ready = True
+        return conn
+
+    def create(self, session_id: str, version_id: str, code: str) -> Dict[str, Any]:
+        now = time.time()
+        job = {"job_id": uuid.uuid4().hex, "session_id": session_id, "version_id": version_id,
+               "status": "pending", "summary": None, "error": None, "created_at": now, "updated_at": now,
+               "seq": None}
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO summary_jobs (job_id, session_id, version_id, code, status, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, 'pending', ?, ?)",
+                    (job["job_id"], session_id, version_id, code, now, now),
+                )
+        finally:
+            conn.close()
+        return job
+
+    def claim(self, job_id: str) -> Optional[str]:
+        """把 pending 作业标记为 running 并返回其代码；已被其他执行者领取时返回 None。"""
+        conn = self._connect()
+        try:
+            with conn:
+                claimed = conn.execute(
+                    "UPDATE summary_jobs SET status = 'running', updated_at = ? WHERE job_id = ? AND status = 'pending'",
+                    (time.time(), job_id),
+                ).rowcount
+                if not claimed:
+                    return None
+                return conn.execute("SELECT code FROM summary_jobs WHERE job_id = ?", (job_id,)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def finish(self, job_id: str, status: str, summary: Optional[str] = None, error: Optional[str] = None) -> None:
+        """
+        记录作业结果。代码已写入向量库 (或作业失败)，不再保留在作业表中。
+        seq 在写事务内分配，按提交顺序严格递增，推送流以它为游标不会漏掉并发结束的作业。
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "UPDATE summary_jobs SET status = ?, summary = ?, error = ?, code = NULL, updated_at = ?, "
+                    "seq = (SELECT COALESCE(MAX(seq), 0) + 1 FROM summary_jobs) WHERE job_id = ?",
+                    (status, summary, error, time.time(), job_id),
+                )
+        finally:
+            conn.close()
+
+    def release(self, job_id: str) -> None:
+        """执行被中断 (例如排空超时被取消)：放回 pending，下次启动时重新执行。"""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("UPDATE summary_jobs SET status = 'pending', updated_at = ? WHERE job_id = ? "
+                             "AND status = 'running'", (time.time(), job_id))
+        finally:
+            conn.close()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            row = conn.execute(f"SELECT {_COLUMNS} FROM summary_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return _row_to_job(row) if row else None
+
+    def session_jobs(self, session_id: str, since: float = 0.0, limit: int = 100) -> List[Dict[str, Any]]:
+        """会话中 updated_at 晚于 since 的作业，按 updated_at 升序。"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT {_COLUMNS} FROM summary_jobs WHERE session_id = ? AND updated_at > ? "
+                f"ORDER BY updated_at LIMIT ?",
+                (session_id, since, limit),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [_row_to_job(row) for row in rows]
+
+    def finished_after(self, session_id: str, after: int, limit: int = 100) -> List[Dict[str, Any]]:
+        """会话中 seq 大于 after 的已结束作业，按结束顺序。"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT {_COLUMNS} FROM summary_jobs WHERE session_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (session_id, after, limit),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [_row_to_job(row) for row in rows]
+
+    def last_seq(self) -> int:
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM summary_jobs").fetchone()[0]
+        finally:
+            conn.close()
+
+    def recoverable(self, lease: float) -> List[Dict[str, Any]]:
+        """需要重新执行的作业：pending，以及 running 超过 lease 秒 (执行者已退出) 的作业 (重置为 pending)。"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("UPDATE summary_jobs SET status = 'pending', updated_at = ? "
+                             "WHERE status = 'running' AND updated_at < ?", (now, now - lease))
+            rows = conn.execute(f"SELECT {_COLUMNS} FROM summary_jobs WHERE status = 'pending' "
+                                f"ORDER BY created_at").fetchall()
+        finally:
+            conn.close()
+        return [_row_to_job(row) for row in rows]
+
+    def purge(self, older_than: float) -> int:
+        """删除早于 older_than (Unix 秒) 结束的作业记录。"""
+        conn = self._connect()
+        try:
+            with conn:
+                return conn.execute(
+                    f"DELETE FROM summary_jobs WHERE status IN {FINISHED_STATUSES} AND updated_at < ?", (older_than,)
+                ).rowcount
+        finally:
+            conn.close()
+
+
+class SummaryJobRunner:
+    """在后台执行摘要作业，并在作业结束时唤醒订阅了该会话的 SSE 流。"""
+
+    def __init__(self, store: SummaryJobStore):
+        self.store = store
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._subscribers: Dict[str, Set[asyncio.Event]] = {}
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.SUMMARY_JOB_WORKERS)
+        return self._semaphore
+
+    # --- 提交与执行 ---
+    async def submit(self, session_id: str, version_id: str, code: str) -> Dict[str, Any]:
+        """持久化作业并在后台开始执行，立即返回作业记录。"""
+        job = await asyncio.to_thread(self.store.create, session_id, version_id, code)
+        SUMMARY_JOB_EVENTS.labels(event="submitted").inc()
+        self._start(job["job_id"], session_id, version_id)
+        return job
+
+    def _start(self, job_id: str, session_id: str, version_id: str) -> None:
+        lifecycle.track(asyncio.create_task(self._run(job_id, session_id, version_id)))
+
+    async def _run(self, job_id: str, session_id: str, version_id: str) -> None:
+        # 延迟导入：services.services 在初始化时才创建摘要服务和向量库
+        from . import services
+
+        # 作业由请求派生时复制了请求的上下文，不能继承它的截止时间 (例如很短的 X-Request-Timeout)
+        detach_from_request()
+        bind_session(session_id)
+        async with self._get_semaphore():
+            code = await asyncio.to_thread(self.store.claim, job_id)
+            if code is None:
+                return
+            started = time.perf_counter()
+            try:
+                ai_summary = await services.summarizer_service.summarize_code(code)
+                doc_id, document_content, metadata = services.version_document(session_id, version_id, code, ai_summary)
+                vector_store = services.vector_store
+                with observe_vector_op("upsert"):
+                    await asyncio.to_thread(vector_store.add_texts, ids=[doc_id], texts=[document_content],
+                                            metadatas=[metadata])
+                    await asyncio.to_thread(session_index.refresh, vector_store, session_id, [doc_id])
+            except asyncio.CancelledError:
+                # 排空超时：放回 pending，下次启动时由 resume() 重新执行
+                await asyncio.shield(asyncio.to_thread(self.store.release, job_id))
+                raise
+            except Exception as e:
+                logger.exception("❌ 摘要作业失败，版本 %s: %s", version_id, e)
+                await asyncio.to_thread(self.store.finish, job_id, "failed", error=str(e))
+                SUMMARY_JOB_EVENTS.labels(event="failed").inc()
+            else:
+                await asyncio.to_thread(self.store.finish, job_id, "done", summary=ai_summary)
+                SUMMARY_JOB_EVENTS.labels(event="done").inc()
+                logger.info("✅ 摘要作业完成，ID: %s，用时 %.2fs", doc_id, time.perf_counter() - started,
+                            extra={"fields": {"job_id": job_id, "summary": ai_summary}})
+        self._notify(session_id)
+
+    async def resume(self) -> int:
+        """启动时重新执行未完成的作业，并清理过期的作业记录。"""
+        await asyncio.to_thread(self.store.purge, time.time() - settings.SUMMARY_JOB_RETENTION)
+        jobs = await asyncio.to_thread(self.store.recoverable, settings.SUMMARY_JOB_LEASE)
+        for job in jobs:
+            self._start(job["job_id"], job["session_id"], job["version_id"])
+        if jobs:
+            logger.info("🔁 重新执行 %s 个未完成的摘要作业", len(jobs))
+        return len(jobs)
+
+    # --- 推送 ---
+    def _notify(self, session_id: str) -> None:
+        for event in self._subscribers.get(session_id, ()):
+            event.set()
+
+    async def events(self, session_id: str, after: int):
+        """
+        按结束顺序产出会话中 seq 大于 after 的已结束作业；没有新作业时每隔
+        SUMMARY_JOB_HEARTBEAT 秒产出 None (供调用方发送心跳)。服务开始排空时结束。
+        """
+        wakeup = asyncio.Event()
+        self._subscribers.setdefault(session_id, set()).add(wakeup)
+        last_sent = time.monotonic()
+        try:
+            while not lifecycle.draining:
+                jobs = await asyncio.to_thread(self.store.finished_after, session_id, after)
+                for job in jobs:
+                    after = job["seq"]
+                    last_sent = time.monotonic()
+                    yield job
+                if time.monotonic() - last_sent >= settings.SUMMARY_JOB_HEARTBEAT:
+                    last_sent = time.monotonic()
+                    yield None
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=settings.SUMMARY_JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                wakeup.clear()
+        finally:
+            subscribers = self._subscribers.get(session_id)
+            if subscribers is not None:
+                subscribers.discard(wakeup)
+                if not subscribers:
+                    del self._subscribers[session_id]
+
+
+summary_jobs = SummaryJobRunner(SummaryJobStore(settings.SUMMARY_JOB_DB_PATH))
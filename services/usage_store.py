@@ -0,0 +1,220 @@
+# services/usage_store.py
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from utility.config import settings
+from utility.logging_config import session_id_var, user_id_var
+from utility.metrics import current_mode, current_route
+
+"""
+Token 用量与成本统计 (Usage Accounting)
+
+职责:
+记录每一次 LLM 调用的 Prompt/Completion token 数和估算成本，并按会话、用户、端点和模式聚合查询，
+用来找出哪些会话或模式最昂贵。
+
+实现:
+- UsageCallback 在 LLM 返回时读取 token 用量，连同当前请求的 session_id / user_id / 路由 / 模式
+  放入内存队列，请求路径上只有一次入队操作。
+- 后台线程按 USAGE_FLUSH_INTERVAL 把队列中的记录批量写入本地 sqlite。
+"""
+
+logger = logging.getLogger(__name__)
+
+GROUP_BY_COLUMNS = {
+    "session": "session_id",
+    "user": "user_id",
+    "endpoint": "endpoint",
+    "mode": "mode",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_usage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    session_id TEXT,
+    user_id TEXT,
+    endpoint TEXT,
+    mode TEXT,
+    model TEXT,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    cost REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_llm_usage_session ON llm_usage (session_id, ts);
+CREATE INDEX IF NOT EXISTS idx_llm_usage_user ON llm_usage (user_id, ts);
+CREATE INDEX IF NOT EXISTS idx_llm_usage_endpoint ON llm_usage (endpoint, mode, ts);
+"""
+
+
+def estimate_cost(prompt_tokens: int, completion_tokens: int) -> float:
+    """按配置的每千 token 单价估算一次调用的成本。"""
+    return (
+        prompt_tokens / 1000 * settings.LLM_PROMPT_COST_PER_1K
+        + completion_tokens / 1000 * settings.LLM_COMPLETION_COST_PER_1K
+    )
+
+
+class UsageStore:
+    """sqlite 用量存储：写入经队列由后台线程批量完成，查询在调用方线程中执行。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: "queue.SimpleQueue[Optional[tuple]]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._schema_ready:
+            conn.executescript(_SCHEMA)
+            self._schema_ready = True
+        return conn
+
+    def record(self, session_id: Optional[str], user_id: Optional[str], endpoint: str, mode: str,
+               model: Optional[str], prompt_tokens: int, completion_tokens: int) -> None:
+        """记录一次 LLM 调用的用量。只做一次入队，不会阻塞调用方。"""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="usage-writer", daemon=True)
+                    self._thread.start()
+        self._queue.put((
+            time.time(), session_id, user_id, endpoint, mode, model,
+            prompt_tokens, completion_tokens, estimate_cost(prompt_tokens, completion_tokens),
+        ))
+
+    def _run(self) -> None:
+        conn = self._connect()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                batch = [item]
+                # 在刷新间隔内继续收集记录，合并为一次事务写入
+                deadline = time.monotonic() + settings.USAGE_FLUSH_INTERVAL
+                stop = False
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+                self._write(conn, batch)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _write(self, conn: sqlite3.Connection, batch: List[tuple]) -> None:
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO llm_usage (ts, session_id, user_id, endpoint, mode, model, "
+                    "prompt_tokens, completion_tokens, cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    batch,
+                )
+        except Exception as e:
+            logger.error("❌ 写入 token 用量失败 (%s 条): %s", len(batch), e)
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """写完队列中剩余的记录后停止后台线程。"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def query(self, group_by: str, session_id: Optional[str] = None, user_id: Optional[str] = None,
+              endpoint: Optional[str] = None, mode: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None,
+              limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        按 group_by (session / user / endpoint / mode) 聚合用量，按成本和 token 总数降序返回。
+
+        Raises:
+            ValueError: 如果 group_by 不受支持。
+        """
+        column = GROUP_BY_COLUMNS.get(group_by)
+        if column is None:
+            raise ValueError(f"Unsupported group_by '{group_by}', expected one of {list(GROUP_BY_COLUMNS)}")
+
+        conditions, params = [], []
+        for name, value in (("session_id", session_id), ("user_id", user_id),
+                            ("endpoint", endpoint), ("mode", mode)):
+            if value is not None:
+                conditions.append(f"{name} = ?")
+                params.append(value)
+        if since is not None:
+            conditions.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("ts < ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        sql = (
+            f"SELECT {column} AS key, COUNT(*) AS calls, SUM(prompt_tokens) AS prompt_tokens, "
+            f"SUM(completion_tokens) AS completion_tokens, SUM(cost) AS cost "
+            f"FROM llm_usage {where} GROUP BY {column} "
+            f"ORDER BY cost DESC, prompt_tokens + completion_tokens DESC LIMIT ?"
+        )
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, [*params, limit]).fetchall()
+        finally:
+            conn.close()
+        return [
+            {
+                group_by: key,
+                "calls": calls,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "cost": round(cost, 6),
+            }
+            for key, calls, prompt_tokens, completion_tokens, cost in rows
+        ]
+
+
+usage_store = UsageStore(settings.USAGE_DB_PATH)
+
+
+class UsageCallback(AsyncCallbackHandler):
+    """LangChain 回调：在 LLM 返回时把 token 用量连同请求上下文写入 usage_store。"""
+
+    def __init__(self):
+        # 在调用发起时捕获请求上下文，回调可能在其他任务中执行
+        self.session_id = session_id_var.get()
+        self.user_id = user_id_var.get()
+        self.endpoint = current_route.get()
+        self.mode = current_mode.get()
+
+    async def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        llm_output = response.llm_output or {}
+        usage = llm_output.get("token_usage") or {}
+        if not usage:
+            return
+        usage_store.record(
+            session_id=self.session_id,
+            user_id=self.user_id,
+            endpoint=self.endpoint,
+            mode=self.mode,
+            model=llm_output.get("model_name"),
+            prompt_tokens=int(usage.get("prompt_tokens") or 0),
+            completion_tokens=int(usage.get("completion_tokens") or 0),
+        )
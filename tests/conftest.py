@@ -0,0 +1,8 @@
+# tests/conftest.py
+import os
+import tempfile
+
+# 测试中产生的追踪和 token 用量写到临时目录，而不是仓库根目录
+_scratch = tempfile.mkdtemp(prefix="tests-")
+os.environ.setdefault("TRACE_EXPORT_PATH", os.path.join(_scratch, "traces.jsonl"))
+os.environ.setdefault("USAGE_DB_PATH", os.path.join(_scratch, "usage.sqlite3"))
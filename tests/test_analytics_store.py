@@ -0,0 +1,78 @@
+# tests/test_analytics_store.py
+import sqlite3
+
+from services.analytics_store import ACTION_NAMES, AnalyticsStore, build_session_record
+
+
+def _sessions(path: str):
+    conn = sqlite3.connect(path)
+    try:
+        return {
+            row[0]: row[1:]
+            for row in conn.execute(
+                "SELECT s.session_id, s.total_versions, r.duration_ms FROM sessions s "
+                "LEFT JOIN region_durations r USING (session_id, user_id, task)"
+            )
+        }
+    finally:
+        conn.close()
+
+
+def test_oversized_values_are_clamped_and_do_not_drop_the_batch(tmp_path):
+    path = str(tmp_path / "analytics.sqlite3")
+    store = AnalyticsStore(path)
+    valid = build_session_record("good", "u1", "t1", timing_data={"editor": [{"duration": 1500}]},
+                                 total_versions=3)
+    oversized = build_session_record("huge", "u2", "t1", timing_data={"editor": [{"duration": 1e30}]},
+                                     total_versions=float("inf"))
+    store.record(valid)
+    store.record(oversized)
+    store.flush()
+
+    sessions = _sessions(path)
+    assert sessions["good"] == (3, 1500)
+    assert sessions["huge"] == (0, 2 ** 31 - 1)
+
+
+def test_unwritable_record_only_costs_its_own_row(tmp_path):
+    path = str(tmp_path / "analytics.sqlite3")
+    store = AnalyticsStore(path)
+    valid = build_session_record("good", "u1", "t1", timing_data={"editor": [{"duration": 10}]})
+    # sqlite 无法绑定的字段值，写入时报错
+    broken = build_session_record("broken", "u2", "t1", total_versions=1)
+    broken = ((*broken[0][:4], object(), *broken[0][5:]), broken[1])
+    store.record(broken)
+    store.record(valid)
+    store.flush()
+
+    assert set(_sessions(path)) == {"good"}
+
+
+def test_aggregates_stay_in_range_after_extreme_values(tmp_path):
+    path = str(tmp_path / "analytics.sqlite3")
+    store = AnalyticsStore(path)
+    extreme = 2 ** 63 - 1
+    for session_id, value in (("huge", extreme), ("small", 5)):
+        store.record(build_session_record(
+            session_id, "u1", "t1", timing_data={"editor": [{"duration": value}]},
+            action_counts={name: value for name in ACTION_NAMES}, total_versions=value, preview_clicks=value,
+        ))
+    store.flush()
+
+    expected = 2 ** 31 - 1 + 5
+    for user_id in (None, "u1"):
+        [region] = store.region_totals(user_id=user_id)
+        assert region["duration_ms"] == expected
+        [actions] = store.action_totals(user_id=user_id)
+        assert actions["preview_clicks"] == expected
+        assert actions["actions"] == {name: expected for name in ACTION_NAMES}
+        [versions] = store.version_counts(user_id=user_id)
+        assert versions["total_versions"] == expected
+
+    # 触发器维护的汇总表仍是整数，而不是溢出后的 REAL
+    conn = sqlite3.connect(path)
+    try:
+        types = conn.execute("SELECT DISTINCT typeof(total_versions), typeof(preview_clicks) FROM task_totals").fetchall()
+    finally:
+        conn.close()
+    assert types == [("integer", "integer")]
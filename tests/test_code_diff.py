@@ -0,0 +1,122 @@
+# tests/test_code_diff.py
+import asyncio
+
+import pytest
+
+from routes import merge
+from utility.code_diff import (
+    HUNK_PLACEHOLDER,
+    assemble_merged_code,
+    compute_merge_hunks,
+    render_hunks,
+    render_skeleton,
+)
+from utility.config import settings
+from utility.schemas import MergeRequest
+
+BASE = [f"let v{i} = {i};" for i in range(20)]
+
+
+def _code(lines):
+    return "\n".join(lines) + "\n"
+
+
+def _edit(lines, **changes):
+    edited = list(lines)
+    for index, line in changes.items():
+        edited[int(index[1:])] = line
+    return edited
+
+
+def _resolve(merge_hunks, version):
+    """每个差异块都取某一个版本的写法。"""
+    return {hunk.hunk_id: "\n".join(hunk.lines_1 if version == 1 else hunk.lines_2) for hunk in merge_hunks.hunks}
+
+
+def test_disjoint_edits_become_separate_hunks():
+    code_1 = _code(_edit(BASE, i2="let v2 = 'one';"))
+    code_2 = _code(_edit(BASE, i15="let v15 = 'two';"))
+    merge_hunks = compute_merge_hunks(code_1, code_2)
+
+    assert [(h.lines_1, h.lines_2) for h in merge_hunks.hunks] == [
+        (["let v2 = 'one';"], ["let v2 = 2;"]),
+        (["let v15 = 15;"], ["let v15 = 'two';"]),
+    ]
+    assert merge_hunks.skeleton[2] == HUNK_PLACEHOLDER.format(hunk_id="H1")
+    assert merge_hunks.skeleton[15] == HUNK_PLACEHOLDER.format(hunk_id="H2")
+    assert merge_hunks.shared_lines == 18 and merge_hunks.total_lines == 20
+
+    # 每个差异块取同一版本的写法时还原出该版本；分别取两边的修改得到合并结果
+    assert assemble_merged_code(merge_hunks, _resolve(merge_hunks, 1)) == code_1
+    assert assemble_merged_code(merge_hunks, _resolve(merge_hunks, 2)) == code_2
+    merged = assemble_merged_code(merge_hunks, {"H1": "let v2 = 'one';", "H2": "let v15 = 'two';"})
+    assert merged == _code(_edit(BASE, i2="let v2 = 'one';", i15="let v15 = 'two';"))
+
+
+def test_overlapping_edits_share_one_hunk():
+    code_1 = _code(_edit(BASE, i5="let v5 = 'one';", i6="let v6 = 'one';"))
+    code_2 = _code(_edit(BASE, i5="let v5 = 'two';") + ["let extra = true;"])
+    merge_hunks = compute_merge_hunks(code_1, code_2)
+
+    assert merge_hunks.hunks[0].lines_1 == ["let v5 = 'one';", "let v6 = 'one';"]
+    assert merge_hunks.hunks[0].lines_2 == ["let v5 = 'two';", "let v6 = 6;"]
+    # 末尾只在版本2中存在的代码是一个版本1为空的差异块
+    assert merge_hunks.hunks[-1].lines_1 == [] and merge_hunks.hunks[-1].lines_2 == ["let extra = true;"]
+    assert "(此处无代码)" in render_hunks(merge_hunks)
+
+    resolved = _resolve(merge_hunks, 2)
+    resolved[merge_hunks.hunks[-1].hunk_id] = ""
+    assert assemble_merged_code(merge_hunks, resolved, additions="let added = 1;") == _code(
+        _edit(BASE, i5="let v5 = 'two';") + ["", "let added = 1;"])
+
+
+def test_identical_code_has_no_hunks():
+    code = _code(BASE)
+    merge_hunks = compute_merge_hunks(code, code)
+    assert merge_hunks.hunks == []
+    assert merge_hunks.shared_ratio == 1.0
+    assert assemble_merged_code(merge_hunks, {}) == code
+    assert compute_merge_hunks("", "").shared_ratio == 1.0
+
+    request = MergeRequest(session_id="s1", version_id_1="v1", code_1=code, description_1="",
+                           version_id_2="v2", code_2=code, description_2="", instruction="", mode="general")
+    assert not merge._should_use_hunks(request, merge_hunks)
+
+
+def test_skeleton_folds_shared_code_far_from_hunks():
+    merge_hunks = compute_merge_hunks(_code(BASE), _code(_edit(BASE, i10="let v10 = 'x';")))
+    rendered = render_skeleton(merge_hunks, context_lines=2).splitlines()
+    assert rendered == [
+        "/* ... 省略 8 行共享代码 ... */",
+        "let v8 = 8;", "let v9 = 9;", HUNK_PLACEHOLDER.format(hunk_id="H1"), "let v11 = 11;", "let v12 = 12;",
+        "/* ... 省略 7 行共享代码 ... */",
+    ]
+    assert render_skeleton(merge_hunks, context_lines=-1).splitlines() == merge_hunks.skeleton
+
+
+def test_missing_hunk_raises():
+    merge_hunks = compute_merge_hunks(_code(BASE), _code(_edit(BASE, i1="x", i18="y")))
+    with pytest.raises(ValueError):
+        assemble_merged_code(merge_hunks, {"H1": "x"})
+
+
+def test_incomplete_hunk_response_falls_back_to_full_merge(monkeypatch):
+    prompts = []
+
+    async def fake_invoke_chain(chain, chain_input, priority=None):
+        prompts.append("hunks" if "skeleton" in chain_input else "full")
+        if "skeleton" in chain_input:
+            # 只返回了部分差异块
+            return {"hunks": {"H1": "let v2 = 'one';"}, "rationale": "partial"}
+        return {"code": "full merge", "rationale": "full"}
+
+    monkeypatch.setattr(merge, "invoke_chain", fake_invoke_chain)
+    monkeypatch.setattr(settings, "MERGE_HUNK_MIN_CHARS", 0)
+    request = MergeRequest(
+        session_id="s1", version_id_1="v1", code_1=_code(_edit(BASE, i2="let v2 = 'one';")), description_1="",
+        version_id_2="v2", code_2=_code(_edit(BASE, i15="let v15 = 'two';")), description_2="",
+        instruction="combine", mode="general",
+    )
+    response = asyncio.run(merge._merge_two(request))
+    assert prompts == ["hunks", "full"]
+    assert response == {"code": "full merge", "rationale": "full"}
@@ -0,0 +1,132 @@
+# tests/test_deadline.py
+import asyncio
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from services import services
+from services.summary_batcher import SummaryBatcher
+from services.session_index import aretrieve_version_memories
+from services.summary_jobs import SummaryJobRunner, SummaryJobStore, session_index
+from utility.config import settings
+from utility.deadline import (
+    DeadlineExceeded, DeadlineMiddleware, abandoned, current_deadline, current_disconnect, remaining,
+)
+
+
+class _Summarizer:
+    """记录摘要执行时看到的剩余预算；执行时请求早已返回。"""
+
+    def __init__(self):
+        self.seen = []
+
+    async def summarize_code(self, code: str) -> str:
+        await asyncio.sleep(0.3)
+        self.seen.append((remaining(), abandoned()))
+        return f"summary of {code}"
+
+
+class _VectorStore:
+    def __init__(self):
+        self.added = []
+
+    def add_texts(self, ids, texts, metadatas):
+        self.added.extend(ids)
+
+
+def test_summary_job_does_not_inherit_the_client_deadline(tmp_path, monkeypatch):
+    summarizer, vector_store = _Summarizer(), _VectorStore()
+    monkeypatch.setattr(services, "summarizer_service", summarizer)
+    monkeypatch.setattr(services, "vector_store", vector_store)
+    monkeypatch.setattr(session_index, "refresh", lambda *args: None)
+    runner = SummaryJobRunner(SummaryJobStore(str(tmp_path / "jobs.sqlite3")))
+
+    app = FastAPI()
+
+    @app.post("/submit")
+    async def submit():
+        job = await runner.submit("s1", "v1", "code")
+        return {"job_id": job["job_id"]}
+
+    @app.get("/job/{job_id}")
+    async def job(job_id: str):
+        await asyncio.sleep(0.5)
+        return runner.store.get(job_id)
+
+    app.add_middleware(DeadlineMiddleware)
+    with TestClient(app) as client:
+        job_id = client.post("/submit", headers={"X-Request-Timeout": "0.1"}).json()["job_id"]
+        job = client.get(f"/job/{job_id}").json()
+
+    assert summarizer.seen == [(None, None)]
+    assert job["status"] == "done" and job["summary"] == "summary of code"
+    assert vector_store.added
+
+
+def test_batch_is_not_bound_by_one_callers_deadline():
+    seen = []
+
+    async def single(code: str) -> str:
+        seen.append((remaining(), abandoned()))
+        return code.upper()
+
+    async def batch(codes):
+        seen.append((remaining(), abandoned()))
+        return [code.upper() for code in codes]
+
+    async def caller(code: str, deadline, disconnect) -> str:
+        current_deadline.set(deadline)
+        current_disconnect.set(disconnect)
+        return await batcher.summarize(code)
+
+    async def main():
+        disconnected = asyncio.Event()
+        disconnected.set()
+        # 第二个请求攒满一批、由它的上下文创建合批任务：它的截止时间已过、客户端已断开
+        return await asyncio.gather(
+            caller("a", None, None),
+            caller("b", time.monotonic() - 0.2, disconnected),
+        )
+
+    batcher = SummaryBatcher(single, batch, max_batch=2, window=0.05, max_in_flight=1)
+    assert asyncio.run(main()) == ["A", "B"]
+    assert seen == [(None, None)]
+
+
+class _SlowVectorStore:
+    """同步检索，模拟一次很慢的 Embedding 调用 (例如在等配额)。"""
+
+    def similarity_search(self, query, k, filter):
+        time.sleep(0.5)
+        return []
+
+
+def test_retrieval_is_bounded_by_the_request_budget(monkeypatch):
+    monkeypatch.setattr(settings, "RETRIEVAL_BACKEND", "chroma")
+
+    async def main():
+        current_deadline.set(time.monotonic() + 0.1)
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await aretrieve_version_memories(_SlowVectorStore(), "q", k=3, session_id="s1", exclude_version_id="v1")
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) < 0.3
+
+
+def test_retrieval_is_cancelled_with_the_request(monkeypatch):
+    monkeypatch.setattr(settings, "RETRIEVAL_BACKEND", "chroma")
+
+    async def main():
+        task = asyncio.create_task(
+            aretrieve_version_memories(_SlowVectorStore(), "q", k=3, session_id="s1", exclude_version_id="v1"))
+        await asyncio.sleep(0.05)
+        started = time.monotonic()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) < 0.1
@@ -0,0 +1,119 @@
+# tests/test_llm_runtime.py
+import asyncio
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from langchain_core.runnables import RunnableLambda
+
+from routes import chat
+from services import llm_runtime
+from services.llm_runtime import invoke_chain
+from services.services import get_vector_store
+from utility.deadline import DeadlineExceeded, DeadlineMiddleware, current_deadline
+from utility.metrics import current_route
+
+HEDGE_DELAY = 0.05
+
+
+class _Runnable:
+    """按顺序为每次 ainvoke 返回 (延迟, 结果或异常)，记录被取消的调用序号。"""
+
+    def __init__(self, *behaviors):
+        self.behaviors = list(behaviors)
+        self.started = 0
+        self.cancelled = []
+
+    async def ainvoke(self, chain_input, config=None):
+        index = self.started
+        self.started += 1
+        delay, outcome = self.behaviors[index]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(index)
+            raise
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture(autouse=True)
+def _hedging(monkeypatch):
+    monkeypatch.setattr(llm_runtime, "_llm_scheduler", None)
+    monkeypatch.setattr(llm_runtime, "_hedge_delay", lambda route, priority: HEDGE_DELAY)
+
+
+def _invoke(runnable, budget=None):
+    async def main():
+        current_route.set("/chat")
+        if budget is not None:
+            current_deadline.set(time.monotonic() + budget)
+        try:
+            return await invoke_chain(runnable, {})
+        finally:
+            # 让被取消的一方处理完 CancelledError
+            await asyncio.sleep(0.01)
+
+    return asyncio.run(main())
+
+
+def test_primary_wins_before_the_hedge_fires():
+    runnable = _Runnable((0.01, "primary"))
+    assert _invoke(runnable) == "primary"
+    assert runnable.started == 1
+
+
+def test_hedge_wins_and_the_primary_is_cancelled():
+    runnable = _Runnable((0.5, "primary"), (0.01, "hedge"))
+    assert _invoke(runnable) == "hedge"
+    assert runnable.started == 2
+    assert runnable.cancelled == [0]
+
+
+def test_both_attempts_fail():
+    runnable = _Runnable((0.1, RuntimeError("primary failed")), (0.01, RuntimeError("hedge failed")))
+    with pytest.raises(RuntimeError):
+        _invoke(runnable)
+    assert runnable.started == 2
+    assert runnable.cancelled == []
+
+
+def test_budget_exhausted_cancels_both_attempts():
+    runnable = _Runnable((1.0, "primary"), (1.0, "hedge"))
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        _invoke(runnable, budget=0.15)
+    assert time.monotonic() - started < 0.5
+    assert sorted(runnable.cancelled) == [0, 1]
+
+
+def test_spent_budget_fails_without_calling_the_llm():
+    runnable = _Runnable((0.01, "primary"))
+    with pytest.raises(DeadlineExceeded):
+        _invoke(runnable, budget=-0.01)
+    assert runnable.started == 0
+
+
+def test_chat_returns_504_when_the_budget_runs_out(monkeypatch):
+    async def slow_llm(prompt_value):
+        await asyncio.sleep(1.0)
+        return '{"response": "too late"}'
+
+    async def no_memories(*args, **kwargs):
+        return []
+
+    monkeypatch.setattr(chat, "llm", RunnableLambda(lambda _: None, afunc=slow_llm))
+    monkeypatch.setattr(chat, "aretrieve_version_memories", no_memories)
+    app = FastAPI()
+    app.include_router(chat.router)
+    app.dependency_overrides[get_vector_store] = lambda: None
+    app.add_middleware(DeadlineMiddleware)
+
+    body = {"session_id": "s1", "version_id": "v1", "code": "", "code_description": "", "short_term_history": [],
+            "user_question": "hi", "type": "general", "interaction_count": 1}
+    started = time.monotonic()
+    response = TestClient(app).post("/chat", json=body, headers={"X-Request-Timeout": "0.2"})
+    assert response.status_code == 504
+    assert time.monotonic() - started < 0.8
@@ -0,0 +1,95 @@
+# tests/test_llm_scheduler.py
+import asyncio
+
+from services.llm_scheduler import LLMScheduler
+
+
+def _scheduler(interactive_weight: float = 3.0, background_weight: float = 1.0) -> LLMScheduler:
+    return LLMScheduler(1, {"interactive": (interactive_weight, 1), "background": (background_weight, 1)})
+
+
+async def _admission_order(scheduler: LLMScheduler, priorities, cancel=()):
+    """占住唯一的名额，让 priorities 依次排队 (取消 cancel 中的序号)，再逐个放行，返回被放行的顺序。"""
+    await scheduler.acquire("interactive")
+    admitted = []
+
+    async def waiter(index: int, priority: str) -> None:
+        await scheduler.acquire(priority)
+        admitted.append(index)
+        # 让出一次事件循环，模拟一次调用
+        await asyncio.sleep(0)
+        scheduler.release(priority)
+
+    tasks = []
+    for index, priority in enumerate(priorities):
+        tasks.append(asyncio.create_task(waiter(index, priority)))
+        await asyncio.sleep(0)
+    for index in cancel:
+        tasks[index].cancel()
+    await asyncio.sleep(0)
+    scheduler.release("interactive")
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return admitted
+
+
+def test_classes_are_admitted_by_weight():
+    scheduler = _scheduler()
+    priorities = ["background"] * 4 + ["interactive"] * 6
+    admitted = asyncio.run(_admission_order(scheduler, priorities))
+    # 权重 3 : 1：每放行 3 个 interactive 放行 1 个 background，同一类别内保持 FIFO
+    assert [priorities[i] for i in admitted] == [
+        "background", "interactive", "interactive", "interactive",
+        "background", "interactive", "interactive", "interactive",
+        "background", "background",
+    ]
+    assert [i for i in admitted if priorities[i] == "background"] == [0, 1, 2, 3]
+    assert [i for i in admitted if priorities[i] == "interactive"] == [4, 5, 6, 7, 8, 9]
+
+
+def test_background_is_not_starved():
+    scheduler = _scheduler(interactive_weight=10.0)
+    priorities = ["background"] + ["interactive"] * 30
+    admitted = asyncio.run(_admission_order(scheduler, priorities))
+    # 源源不断的 interactive 调用也不能让 background 无限等待
+    assert admitted.index(0) <= 11
+
+
+def test_cancelled_waiter_releases_its_place():
+    async def main():
+        scheduler = _scheduler()
+        await scheduler.acquire("interactive")
+        waiters = [asyncio.create_task(scheduler.acquire(priority)) for priority in ("background", "interactive")]
+        await asyncio.sleep(0)
+        waiters[0].cancel()
+        await asyncio.sleep(0)
+        # 被取消的等待者立即离开队列，不占用排队位置
+        queued = {name: len(queue) for name, queue in scheduler._queues.items()}
+        scheduler.release("interactive")
+        await waiters[1]
+        return scheduler, queued
+
+    scheduler, queued = asyncio.run(main())
+    assert queued == {"interactive": 1, "background": 0}
+    assert scheduler._running == {"interactive": 1, "background": 0}
+
+
+def test_cancelled_waiter_is_skipped_in_admission_order():
+    scheduler = _scheduler()
+    priorities = ["interactive", "background", "interactive"]
+    admitted = asyncio.run(_admission_order(scheduler, priorities, cancel=[1]))
+    assert admitted == [0, 2]
+    assert scheduler._total == 0 and scheduler._running == {"interactive": 0, "background": 0}
+
+
+def test_idle_class_does_not_bank_credit():
+    async def main():
+        scheduler = _scheduler(interactive_weight=1.0, background_weight=1.0)
+        # background 长时间空闲，interactive 连续被放行多次
+        for _ in range(5):
+            await scheduler.acquire("interactive")
+            scheduler.release("interactive")
+        # background 重新活跃时 pass 追平全局虚拟时间，不能用空闲期间的额度连续插队
+        admitted = await _admission_order(scheduler, ["background", "background", "interactive", "interactive"])
+        return admitted
+
+    assert asyncio.run(main()) == [0, 2, 1, 3]
@@ -0,0 +1,23 @@
+# tests/test_middleware.py
+from fastapi.testclient import TestClient
+
+from main import app
+from utility.lifecycle import lifecycle
+
+ORIGIN = "http://localhost:5173"
+
+
+def test_draining_503_carries_cors_headers(monkeypatch):
+    monkeypatch.setattr(lifecycle, "state", "draining")
+    response = TestClient(app).get("/jobs/missing", headers={"Origin": ORIGIN})
+    assert response.status_code == 503
+    assert response.headers["access-control-allow-origin"] == ORIGIN
+    assert "Retry-After" in response.headers["access-control-expose-headers"]
+
+
+def test_preflight_is_answered_while_draining(monkeypatch):
+    monkeypatch.setattr(lifecycle, "state", "draining")
+    response = TestClient(app).options("/chat", headers={
+        "Origin": ORIGIN, "Access-Control-Request-Method": "POST", "Access-Control-Request-Headers": "content-type"})
+    assert response.status_code == 200
+    assert response.headers["access-control-allow-origin"] == ORIGIN
@@ -0,0 +1,55 @@
+# tests/test_rate_limiter.py
+import asyncio
+
+import httpx
+import pytest
+from langchain_openai import AzureChatOpenAI
+from openai import DefaultAsyncHttpxClient
+
+from services import rate_limiter
+from services.rate_limiter import AzureRateLimiter, RateLimitedAsyncTransport, azure_http_clients
+from utility.config import settings
+
+COMPLETION = {
+    "id": "c1", "object": "chat.completion", "created": 0, "model": "mock",
+    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "ok"}}],
+    "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6},
+}
+
+
+@pytest.fixture(autouse=True)
+def _no_waiting(monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_BACKOFF_BASE", 0.0)
+    monkeypatch.setattr(settings, "RATE_LIMIT_JITTER", 0.0)
+    monkeypatch.setattr(rate_limiter, "rate_limiter", AzureRateLimiter(0, 0, 1.0))
+
+
+def _chat(statuses):
+    """按 statuses 依次返回响应的 AzureChatOpenAI 客户端，与线上一样经过限流传输层；返回 (客户端, 请求计数)。"""
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        status = statuses[min(len(calls), len(statuses) - 1)]
+        calls.append(status)
+        if status != 200:
+            return httpx.Response(status, headers={"retry-after-ms": "0"}, json={"error": {"message": "busy"}})
+        return httpx.Response(200, json=COMPLETION)
+
+    clients = {**azure_http_clients(), "http_async_client": DefaultAsyncHttpxClient(
+        transport=RateLimitedAsyncTransport(httpx.MockTransport(handler)))}
+    llm = AzureChatOpenAI(openai_api_version="2024-06-01", azure_deployment="mock",
+                          azure_endpoint="http://mock", api_key="mock", **clients)
+    return llm, calls
+
+
+def test_429_is_retried_by_the_transport_only():
+    llm, calls = _chat([429])
+    with pytest.raises(Exception):
+        asyncio.run(llm.ainvoke("hi"))
+    assert len(calls) == settings.RATE_LIMIT_MAX_RETRIES + 1
+
+
+def test_transient_errors_are_retried_by_the_transport():
+    llm, calls = _chat([500, 503, 200])
+    assert asyncio.run(llm.ainvoke("hi")).content == "ok"
+    assert calls == [500, 503, 200]
@@ -0,0 +1,120 @@
+# tests/test_session_index.py
+import numpy as np
+import pytest
+
+from services.session_index import SessionVectorIndex, _SessionMatrix, dequantize, quantize
+from utility.config import settings
+
+
+def _vectors(rows: int, dim: int = 16, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(rows, dim)).astype(np.float32)
+
+
+def test_float16_round_trip():
+    vectors = _vectors(8)
+    codes, scales = quantize(vectors, "float16")
+    assert codes.dtype == np.float16 and scales is None
+    np.testing.assert_allclose(dequantize(codes, scales), vectors, rtol=1e-3, atol=1e-3)
+
+
+def test_int8_round_trip_is_within_half_a_step():
+    vectors = _vectors(8)
+    codes, scales = quantize(vectors, "int8")
+    assert codes.dtype == np.int8 and scales.shape == (8,)
+    assert np.abs(codes).max() == 127
+    error = np.abs(dequantize(codes, scales) - vectors)
+    assert (error <= scales[:, None] / 2 + 1e-6).all()
+
+
+def test_int8_zero_vector_uses_unit_scale():
+    vectors = np.zeros((2, 4), dtype=np.float32)
+    vectors[1] = [1.0, -2.0, 0.5, 0.0]
+    codes, scales = quantize(vectors, "int8")
+    assert scales[0] == 1.0
+    assert not codes[0].any()
+    assert np.isfinite(dequantize(codes, scales)).all()
+
+
+@pytest.mark.parametrize("mode", ["none", "float16", "int8"])
+def test_upsert_into_empty_matrix_and_remove(mode):
+    matrix = _SessionMatrix([], np.asarray([], dtype=np.float32), [], [], mode=mode)
+    vectors = _vectors(3, dim=4)
+    for i, vector in enumerate(vectors):
+        matrix.upsert(f"d{i}", vector, {"version_id": f"v{i}"}, f"doc {i}")
+    assert matrix.codes.shape == (3, 4) and len(matrix.sq_norms) == 3
+
+    # 已有的 ID 原地更新，不追加新行
+    matrix.upsert("d1", vectors[0], {"version_id": "v1"}, "doc 1 updated")
+    assert matrix.codes.shape == (3, 4) and matrix.documents[1] == "doc 1 updated"
+    assert matrix.top_k(vectors[0], 2, exclude_version_id=None) in ([0, 1], [1, 0])
+
+    matrix.remove("d0")
+    matrix.remove("missing")
+    assert matrix.ids == ["d1", "d2"] and matrix.codes.shape == (2, 4) and len(matrix.sq_norms) == 2
+    if matrix.scales is not None:
+        assert len(matrix.scales) == 2
+    assert matrix.top_k(vectors[2], 1, exclude_version_id=None) == [1]
+
+
+def test_top_k_orders_by_distance_and_excludes_the_current_version():
+    vectors = _vectors(10, seed=1)
+    metadatas = [{"version_id": f"v{i}"} for i in range(10)]
+    matrix = _SessionMatrix([f"d{i}" for i in range(10)], vectors, metadatas, [""] * 10)
+    query = _vectors(1, seed=2)[0]
+    expected = np.argsort(((vectors - query) ** 2).sum(axis=1)).tolist()
+
+    assert matrix.top_k(query, 4, exclude_version_id=None) == expected[:4]
+    assert matrix.top_k(query, 4, exclude_version_id=f"v{expected[0]}") == expected[1:5]
+    assert matrix.top_k(query, 50, exclude_version_id=None) == expected
+    assert _SessionMatrix([], np.asarray([]), [], []).top_k(query, 3, exclude_version_id=None) == []
+
+
+class _Collection:
+    def __init__(self, ids, embeddings, metadatas):
+        self.rows = dict(zip(ids, zip(embeddings, metadatas)))
+
+    def get(self, ids=None, where=None, include=()):
+        if ids is None:
+            ids = [doc_id for doc_id, (_, metadata) in self.rows.items()
+                   if metadata["session_id"] == where["session_id"]]
+        return {
+            "ids": ids,
+            "embeddings": [self.rows[doc_id][0].tolist() for doc_id in ids],
+            "metadatas": [self.rows[doc_id][1] for doc_id in ids],
+            "documents": [doc_id for doc_id in ids],
+        }
+
+
+class _Embeddings:
+    def __init__(self, vector):
+        self.vector = vector
+
+    def embed_query(self, query):
+        return self.vector.tolist()
+
+
+class _VectorStore:
+    def __init__(self, vectors, query):
+        ids = [f"d{i}" for i in range(len(vectors))]
+        metadatas = [{"session_id": "s1", "version_id": f"v{i}"} for i in range(len(vectors))]
+        self._collection = _Collection(ids, vectors, metadatas)
+        self.embeddings = _Embeddings(query)
+
+
+def test_rerank_restores_full_precision_order(monkeypatch):
+    # 彼此很接近的向量：int8 量化误差足以打乱顺序，重排后应与全精度的精确排序一致
+    base = _vectors(1, dim=32, seed=3)[0]
+    vectors = base + _vectors(40, dim=32, seed=4) * 0.01
+    query = base + _vectors(1, dim=32, seed=5)[0] * 0.01
+    expected = [f"d{i}" for i in np.argsort(((vectors - query) ** 2).sum(axis=1))[:5]]
+    store = _VectorStore(vectors, query)
+    monkeypatch.setattr(settings, "RETRIEVAL_BACKEND", "session_index")
+    monkeypatch.setattr(settings, "SESSION_INDEX_QUANTIZATION", "int8")
+
+    monkeypatch.setattr(settings, "SESSION_INDEX_RERANK", 8)
+    reranked = [doc.id for doc in SessionVectorIndex().similarity_search(store, "q", 5, "s1")]
+    assert reranked == expected
+
+    monkeypatch.setattr(settings, "SESSION_INDEX_RERANK", 1)
+    quantized = [doc.id for doc in SessionVectorIndex().similarity_search(store, "q", 5, "s1")]
+    assert quantized != expected
@@ -0,0 +1,96 @@
+# tests/test_summary_batching.py
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from services import services
+from services.services import SUMMARY_BATCH_PROMPT, SUMMARY_FAILED, CodeSummarizerService
+from services.summary_batcher import SummaryBatcher
+from utility.config import settings
+
+
+class _StubLLM:
+    """替代 invoke_chain：合批调用返回 batch_reply (或抛出它)，逐个调用返回 "single:<代码>"。"""
+
+    def __init__(self, batch_reply, failing_codes=()):
+        self.batch_reply = batch_reply
+        self.failing_codes = set(failing_codes)
+        self.batch_calls = 0
+        self.single_calls = []
+
+    async def __call__(self, runnable, messages, priority=None):
+        if messages[0].content == SUMMARY_BATCH_PROMPT:
+            self.batch_calls += 1
+            if isinstance(self.batch_reply, Exception):
+                raise self.batch_reply
+            return SimpleNamespace(content=self.batch_reply)
+        code = messages[1].content.split("```javascript\n", 1)[1].rsplit("\n```", 1)[0]
+        self.single_calls.append(code)
+        if code in self.failing_codes:
+            raise RuntimeError("LLM unavailable")
+        return SimpleNamespace(content=f"single:{code}")
+
+
+@pytest.fixture
+def summarizer(monkeypatch):
+    monkeypatch.setattr(settings, "SUMMARY_BATCH_SIZE", 1)
+    return CodeSummarizerService()
+
+
+def _summarize_many(summarizer, monkeypatch, llm, codes):
+    monkeypatch.setattr(services, "invoke_chain", llm)
+    return asyncio.run(summarizer.summarize_many(codes))
+
+
+def test_array_reply_is_used_as_is(summarizer, monkeypatch):
+    llm = _StubLLM('好的：\n["网格动画", " 粒子效果 ", "鼠标绘图"]')
+    assert _summarize_many(summarizer, monkeypatch, llm, ["a", "b", "c"]) == ["网格动画", "粒子效果", "鼠标绘图"]
+    assert llm.batch_calls == 1 and llm.single_calls == []
+
+
+@pytest.mark.parametrize("reply", [
+    '["网格动画", "粒子效果"]',          # 长度不对
+    '{"summaries": ["网格动画"]}',        # 不是数组
+    "无法生成摘要",                        # 不是 JSON
+    '["网格动画", "粒子效果", ',           # JSON 不完整
+])
+def test_unusable_reply_falls_back_for_every_item(summarizer, monkeypatch, reply):
+    llm = _StubLLM(reply)
+    assert _summarize_many(summarizer, monkeypatch, llm, ["a", "b", "c"]) == ["single:a", "single:b", "single:c"]
+    assert sorted(llm.single_calls) == ["a", "b", "c"]
+
+
+def test_batch_failure_falls_back_for_every_item(summarizer, monkeypatch):
+    llm = _StubLLM(RuntimeError("batch failed"))
+    assert _summarize_many(summarizer, monkeypatch, llm, ["a", "b"]) == ["single:a", "single:b"]
+
+
+def test_only_invalid_items_are_retried(summarizer, monkeypatch):
+    llm = _StubLLM('["网格动画", "", 42, "鼠标绘图"]', failing_codes={"c"})
+    summaries = _summarize_many(summarizer, monkeypatch, llm, ["a", "b", "c", "d"])
+    assert summaries == ["网格动画", "single:b", SUMMARY_FAILED, "鼠标绘图"]
+    assert sorted(llm.single_calls) == ["b", "c"]
+
+
+def test_batcher_coalesces_concurrent_requests():
+    calls = []
+
+    async def single(code):
+        calls.append(("single", [code]))
+        return code.upper()
+
+    async def batch(codes):
+        calls.append(("batch", list(codes)))
+        return [code.upper() for code in codes]
+
+    async def main():
+        batcher = SummaryBatcher(single, batch, max_batch=3, window=0.05, max_in_flight=1)
+        together = await asyncio.gather(*(batcher.summarize(code) for code in ("a", "b", "c", "d")))
+        alone = await batcher.summarize("e")
+        return together, alone
+
+    together, alone = asyncio.run(main())
+    assert together == ["A", "B", "C", "D"] and alone == "E"
+    # 攒满 3 个立即发送，剩下的 1 个在窗口结束后单独调用；之后窗口内只有一个请求时同样走单个调用
+    assert calls == [("batch", ["a", "b", "c"]), ("single", ["d"]), ("single", ["e"])]
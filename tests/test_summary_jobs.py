@@ -0,0 +1,143 @@
+# tests/test_summary_jobs.py
+import asyncio
+import time
+
+import orjson
+import pytest
+
+from routes import jobs
+from services.summary_jobs import SummaryJobRunner, SummaryJobStore
+from utility.config import settings
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SummaryJobStore(str(tmp_path / "summary_jobs.sqlite3"))
+
+
+def _finished(store, session_id, version_id, status="done"):
+    job = store.create(session_id, version_id, f"code {version_id}")
+    store.claim(job["job_id"])
+    store.finish(job["job_id"], status, summary=f"summary {version_id}" if status == "done" else None,
+                 error="boom" if status == "failed" else None)
+    return store.get(job["job_id"])
+
+
+def test_create_claim_finish(store):
+    job = store.create("s1", "v1", "let a = 1;")
+    assert store.get(job["job_id"])["status"] == "pending"
+
+    assert store.claim(job["job_id"]) == "let a = 1;"
+    assert store.get(job["job_id"])["status"] == "running"
+    # 已被领取的作业不能再次领取
+    assert store.claim(job["job_id"]) is None
+
+    store.finish(job["job_id"], "done", summary="摘要")
+    finished = store.get(job["job_id"])
+    assert (finished["status"], finished["summary"], finished["seq"]) == ("done", "摘要", 1)
+    assert store.claim(job["job_id"]) is None
+    assert store.get("missing") is None
+
+
+def test_release_returns_running_job_to_pending(store):
+    job = store.create("s1", "v1", "code")
+    store.claim(job["job_id"])
+    store.release(job["job_id"])
+    assert store.get(job["job_id"])["status"] == "pending"
+    assert store.claim(job["job_id"]) == "code"
+
+    # 已结束的作业不会被放回
+    store.finish(job["job_id"], "done", summary="摘要")
+    store.release(job["job_id"])
+    assert store.get(job["job_id"])["status"] == "done"
+
+
+def test_recoverable_resets_running_jobs_after_the_lease(store):
+    pending = store.create("s1", "v1", "a")
+    running = store.create("s1", "v2", "b")
+    store.claim(running["job_id"])
+    _finished(store, "s1", "v3")
+
+    # 租约未过期：正在执行的作业不会被其他执行者重新领取
+    assert [job["job_id"] for job in store.recoverable(lease=60)] == [pending["job_id"]]
+    assert store.get(running["job_id"])["status"] == "running"
+
+    time.sleep(0.01)
+    recovered = store.recoverable(lease=0)
+    assert [job["job_id"] for job in recovered] == [pending["job_id"], running["job_id"]]
+    assert store.claim(running["job_id"]) == "b"
+
+
+def test_resume_restarts_recoverable_jobs_and_purges_old_ones(store, monkeypatch):
+    old = _finished(store, "s1", "v1")
+    running = store.create("s1", "v2", "code")
+    store.claim(running["job_id"])
+    time.sleep(0.01)
+    monkeypatch.setattr(settings, "SUMMARY_JOB_LEASE", 0)
+    monkeypatch.setattr(settings, "SUMMARY_JOB_RETENTION", 0)
+    runner = SummaryJobRunner(store)
+    started = []
+    monkeypatch.setattr(runner, "_start", lambda job_id, session_id, version_id: started.append(job_id))
+
+    assert asyncio.run(runner.resume()) == 1
+    assert started == [running["job_id"]]
+    assert store.get(old["job_id"]) is None
+
+
+def test_finished_after_replays_in_seq_order(store):
+    first = _finished(store, "s1", "v1")
+    _finished(store, "s2", "v2")
+    third = _finished(store, "s1", "v3", status="failed")
+    store.create("s1", "v4", "still pending")
+
+    assert store.last_seq() == 3
+    assert [job["job_id"] for job in store.finished_after("s1", 0)] == [first["job_id"], third["job_id"]]
+    assert [job["seq"] for job in store.finished_after("s1", first["seq"])] == [3]
+    assert store.finished_after("s1", 3) == []
+    assert [job["seq"] for job in store.finished_after("s1", 0, limit=1)] == [1]
+
+
+async def _read_events(response, count):
+    """读取 SSE 响应中的前 count 个作业事件，返回 (id, event, data) 列表。"""
+    events = []
+    body = response.body_iterator
+    try:
+        async for chunk in body:
+            fields = dict(line.split(": ", 1) for line in chunk.decode().splitlines() if ": " in line)
+            if "id" in fields:
+                events.append((int(fields["id"]), fields["event"], orjson.loads(fields["data"])))
+                if len(events) == count:
+                    break
+    finally:
+        await body.aclose()
+    return events
+
+
+def test_sse_replays_from_last_event_id(store, monkeypatch):
+    monkeypatch.setattr(jobs, "summary_jobs", SummaryJobRunner(store))
+    monkeypatch.setattr(settings, "SUMMARY_JOB_POLL_INTERVAL", 0.01)
+    for version_id in ("v1", "v2"):
+        _finished(store, "s1", version_id)
+    _finished(store, "s1", "v3", status="failed")
+
+    async def main():
+        # 断线重连：Last-Event-ID 优先于 after，只推送之后结束的作业
+        resumed = await jobs.job_events(session_id="s1", after=0, last_event_id="1")
+        replayed = await _read_events(resumed, 2)
+        # 不带游标订阅：只推送订阅之后结束的作业
+        live = await jobs.job_events(session_id="s1", after=None, last_event_id=None)
+        reader = asyncio.create_task(_read_events(live, 1))
+        await asyncio.sleep(0.05)
+        await asyncio.to_thread(_finished, store, "s1", "v4")
+        return replayed, await asyncio.wait_for(reader, timeout=2)
+
+    replayed, live = asyncio.run(main())
+    assert [(seq, event, data["version_id"]) for seq, event, data in replayed] == [
+        (2, "done", "v2"), (3, "failed", "v3")]
+    assert [(seq, event, data["version_id"]) for seq, event, data in live] == [(4, "done", "v4")]
+
+
+def test_invalid_last_event_id_is_rejected():
+    with pytest.raises(jobs.HTTPException) as excinfo:
+        asyncio.run(jobs.job_events(session_id="s1", after=None, last_event_id="abc"))
+    assert excinfo.value.status_code == 400
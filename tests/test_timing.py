@@ -0,0 +1,51 @@
+# tests/test_timing.py
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routes import timing
+
+
+def _client(tmp_path, monkeypatch):
+    recorded = []
+    monkeypatch.setattr(timing, "LOG_FILE_PATH", str(tmp_path / "session_logs.jsonl"))
+    monkeypatch.setattr(timing.analytics_store, "record", recorded.append)
+    app = FastAPI()
+    app.include_router(timing.router)
+    return TestClient(app), recorded
+
+
+def _body(timing_data, usage_data):
+    return {"session_id": "s1", "user_id": "u1", "task": "TaskA",
+            "timingData": timing_data, "usageData": usage_data}
+
+
+USAGE = {
+    "totalVersions": 3, "previewClicks": 2, "versionConversations": {}, "versionCodes": {},
+    "actionCounts": {"delete": 0, "modify": 1, "merge": 0, "duplicate": 0},
+}
+
+
+def test_valid_session_is_logged_and_recorded(tmp_path, monkeypatch):
+    client, recorded = _client(tmp_path, monkeypatch)
+    response = client.post("/timing", json=_body({"editor": [{"start": 0, "end": 10, "duration": 10}]}, USAGE))
+
+    assert response.status_code == 200
+    assert (tmp_path / "session_logs.jsonl").read_text().count("\n") == 1
+    row, regions = recorded[0]
+    assert regions == [("editor", 10, 1)]
+
+
+def test_malformed_analytics_fields_are_rejected(tmp_path, monkeypatch):
+    client, recorded = _client(tmp_path, monkeypatch)
+    bad_bodies = [
+        _body({"editor": [{"start": "soon", "end": 10, "duration": 10}]}, USAGE),
+        _body({"editor": ["not a segment"]}, USAGE),
+        _body(None, {**USAGE, "totalVersions": "many"}),
+        _body(None, {key: value for key, value in USAGE.items() if key != "actionCounts"}),
+    ]
+    for body in bad_bodies:
+        response = client.post("/timing", json=body)
+        assert response.status_code == 422, body
+
+    assert not (tmp_path / "session_logs.jsonl").exists()
+    assert recorded == []
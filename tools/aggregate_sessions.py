@@ -0,0 +1,364 @@
+# tools/aggregate_sessions.py
+"""
+会话日志离线聚合 (Offline Session Aggregator)
+
+流式读取一个或多个 /timing 会话日志 (session_logs.jsonl，可以是 .gz / .bz2 / .xz 压缩文件)，
+按任务和 (任务, 用户) 计算研究分析用的统计量，结果写入列式的 .npz 文件：
+- 各区域停留时长 (TimeSegment.duration，缺失时用 end - start) 的总和、时间段数、出现该区域的会话数，
+  以及按任务、区域划分的停留时长直方图 (对数分桶，桶边界固定，分片结果可以直接相加)；
+- 预览点击次数、delete / modify / merge / duplicate 操作计数、每个会话版本数的分布；
+- 每个 (任务, 用户) 的会话数、操作计数和各区域停留总时长。
+
+实现:
+- 每个日志文件是一个分片；未压缩的大文件按 --split-bytes 切成按行对齐的字节区间，分片由进程池并行处理。
+- 每个分片按 --chunk-lines 行一批解析，时间段展开为 NumPy 数组后用 bincount 向量化累加；
+  内存占用只与单批大小和任务/区域/用户数有关，与日志总大小无关。
+- 各分片的部分结果按名字对齐后相加，得到与串行处理相同的结果。
+同一会话多次上报的每条快照都会计入；需要按会话去重的查询请用 /analytics (services/analytics_store.py)。
+
+用法:
+    python -m tools.aggregate_sessions session_logs.jsonl archive/*.jsonl.gz --out stats.npz --workers 4
+    python -c "import numpy as np; print(dict(np.load('stats.npz')))"
+"""
+import argparse
+import bz2
+import gzip
+import lzma
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, IO, List, Optional, Tuple
+
+import numpy as np
+import orjson
+
+ACTION_NAMES = ("delete", "modify", "merge", "duplicate")
+# 版本数分布的上限，超过的会话计入最后一个桶
+MAX_VERSIONS = 100
+
+_OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+# (路径, 起始字节, 结束字节)；结束字节为 None 表示读到文件末尾
+Shard = Tuple[str, int, Optional[int]]
+
+
+def dwell_edges(bins: int, max_ms: float) -> np.ndarray:
+    """停留时长直方图的桶边界 (毫秒)：[0, 10ms, ..., max_ms] 对数分布，最后一个桶收纳更长的时间段。"""
+    return np.concatenate(([0.0], np.geomspace(10.0, max_ms, bins - 1)))
+
+
+def _open(path: str) -> IO[bytes]:
+    opener = _OPENERS.get(os.path.splitext(path)[1].lower())
+    return opener(path, "rb") if opener else open(path, "rb")
+
+
+def plan_shards(paths: List[str], split_bytes: int) -> List[Shard]:
+    """把输入文件切成分片：压缩文件不能随机访问，整体作为一个分片。"""
+    shards: List[Shard] = []
+    for path in paths:
+        size = os.path.getsize(path)
+        if path.lower().endswith(tuple(_OPENERS)) or size <= split_bytes:
+            shards.append((path, 0, None))
+            continue
+        for start in range(0, size, split_bytes):
+            shards.append((path, start, min(start + split_bytes, size)))
+    return shards
+
+
+def _read_lines(shard: Shard):
+    """逐行读取分片。区间内的行指起始字节落在 [start, end) 内的行，相邻区间不重不漏。"""
+    path, start, end = shard
+    with _open(path) as f:
+        pos = start
+        if start > 0:
+            f.seek(start - 1)
+            # 上一个区间负责以 start 之前字节开头的行
+            pos = start - 1 + len(f.readline())
+        for line in f:
+            if end is not None and pos >= end:
+                break
+            pos += len(line)
+            yield line
+
+
+def _as_number(value: Any) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return 0.0
+    return float(value)
+
+
+class Aggregate:
+    """可合并的部分聚合结果。任务、区域和 (任务, 用户) 各自维护名字到下标的映射，数组随之增长。"""
+
+    def __init__(self, edges: np.ndarray):
+        self.edges = edges
+        self.tasks: Dict[str, int] = {}
+        self.regions: Dict[str, int] = {}
+        self.pairs: Dict[Tuple[str, str], int] = {}
+        self.lines = 0
+        self.skipped = 0
+        bins = len(edges)
+        self.task_sessions = np.zeros(0, np.int64)
+        self.task_preview_clicks = np.zeros(0, np.int64)
+        self.task_actions = np.zeros((0, len(ACTION_NAMES)), np.int64)
+        self.task_version_hist = np.zeros((0, MAX_VERSIONS + 1), np.int64)
+        self.region_duration_ms = np.zeros((0, 0), np.float64)
+        self.region_segments = np.zeros((0, 0), np.int64)
+        self.region_sessions = np.zeros((0, 0), np.int64)
+        self.dwell_hist = np.zeros((0, 0, bins), np.int64)
+        self.pair_sessions = np.zeros(0, np.int64)
+        self.pair_preview_clicks = np.zeros(0, np.int64)
+        self.pair_actions = np.zeros((0, len(ACTION_NAMES)), np.int64)
+        self.pair_versions = np.zeros(0, np.int64)
+        self.pair_duration_ms = np.zeros((0, 0), np.float64)
+
+    # --- 维度管理 ---
+    @staticmethod
+    def _index(vocab: Dict, key) -> int:
+        index = vocab.get(key)
+        if index is None:
+            index = vocab[key] = len(vocab)
+        return index
+
+    def _resize(self) -> None:
+        """按当前的任务、区域、用户数扩展所有数组 (新增部分填 0)。"""
+        T, R, P = len(self.tasks), len(self.regions), len(self.pairs)
+
+        def grow(arr: np.ndarray, shape: Tuple[int, ...]) -> np.ndarray:
+            if arr.shape == shape:
+                return arr
+            return np.pad(arr, [(0, new - old) for old, new in zip(arr.shape, shape)])
+
+        bins = len(self.edges)
+        self.task_sessions = grow(self.task_sessions, (T,))
+        self.task_preview_clicks = grow(self.task_preview_clicks, (T,))
+        self.task_actions = grow(self.task_actions, (T, len(ACTION_NAMES)))
+        self.task_version_hist = grow(self.task_version_hist, (T, MAX_VERSIONS + 1))
+        self.region_duration_ms = grow(self.region_duration_ms, (T, R))
+        self.region_segments = grow(self.region_segments, (T, R))
+        self.region_sessions = grow(self.region_sessions, (T, R))
+        self.dwell_hist = grow(self.dwell_hist, (T, R, bins))
+        self.pair_sessions = grow(self.pair_sessions, (P,))
+        self.pair_preview_clicks = grow(self.pair_preview_clicks, (P,))
+        self.pair_actions = grow(self.pair_actions, (P, len(ACTION_NAMES)))
+        self.pair_versions = grow(self.pair_versions, (P,))
+        self.pair_duration_ms = grow(self.pair_duration_ms, (P, R))
+
+    # --- 累加 ---
+    def add_chunk(self, lines: List[bytes]) -> None:
+        """解析一批日志行，展开为数组后向量化累加。"""
+        sess_task, sess_pair, sess_preview, sess_versions, sess_actions = [], [], [], [], []
+        # 每个 (会话, 区域) 一项；每个时间段一项，seg_owner 指向所属的 (会话, 区域)
+        sr_task, sr_region, sr_pair = [], [], []
+        seg_owner, seg_duration = [], []
+
+        for line in lines:
+            self.lines += 1
+            try:
+                snapshot = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                self.skipped += 1
+                continue
+            if not isinstance(snapshot, dict):
+                self.skipped += 1
+                continue
+            task, user = snapshot.get("task"), snapshot.get("user_id")
+            if not isinstance(task, str) or not isinstance(user, str):
+                self.skipped += 1
+                continue
+            t = self._index(self.tasks, task)
+            p = self._index(self.pairs, (task, user))
+            usage = snapshot.get("usageData")
+            usage = usage if isinstance(usage, dict) else {}
+            counts = usage.get("actionCounts")
+            counts = counts if isinstance(counts, dict) else {}
+            sess_task.append(t)
+            sess_pair.append(p)
+            sess_preview.append(_as_number(usage.get("previewClicks")))
+            sess_versions.append(_as_number(usage.get("totalVersions")))
+            sess_actions.append([_as_number(counts.get(name)) for name in ACTION_NAMES])
+
+            timing = snapshot.get("timingData")
+            if not isinstance(timing, dict):
+                continue
+            for region, segments in timing.items():
+                if not isinstance(segments, list):
+                    continue
+                owner = len(sr_task)
+                sr_task.append(t)
+                sr_region.append(self._index(self.regions, str(region)))
+                sr_pair.append(p)
+                for segment in segments:
+                    if not isinstance(segment, dict):
+                        continue
+                    duration = segment.get("duration")
+                    if duration is None:
+                        duration = _as_number(segment.get("end")) - _as_number(segment.get("start"))
+                    seg_owner.append(owner)
+                    seg_duration.append(_as_number(duration))
+
+        if not sess_task:
+            return
+        self._resize()
+        T, R, P = len(self.tasks), len(self.regions), len(self.pairs)
+
+        t = np.asarray(sess_task, np.int64)
+        p = np.asarray(sess_pair, np.int64)
+        preview = np.asarray(sess_preview, np.int64)
+        versions = np.clip(np.asarray(sess_versions, np.int64), 0, MAX_VERSIONS)
+        actions = np.asarray(sess_actions, np.int64).reshape(-1, len(ACTION_NAMES))
+
+        self.task_sessions += np.bincount(t, minlength=T)
+        self.task_preview_clicks += np.bincount(t, weights=preview, minlength=T).astype(np.int64)
+        self.task_version_hist += np.bincount(
+            t * (MAX_VERSIONS + 1) + versions, minlength=T * (MAX_VERSIONS + 1)
+        ).reshape(T, MAX_VERSIONS + 1)
+        self.pair_sessions += np.bincount(p, minlength=P)
+        self.pair_preview_clicks += np.bincount(p, weights=preview, minlength=P).astype(np.int64)
+        self.pair_versions += np.bincount(p, weights=versions, minlength=P).astype(np.int64)
+        for k in range(len(ACTION_NAMES)):
+            self.task_actions[:, k] += np.bincount(t, weights=actions[:, k], minlength=T).astype(np.int64)
+            self.pair_actions[:, k] += np.bincount(p, weights=actions[:, k], minlength=P).astype(np.int64)
+
+        if not sr_task:
+            return
+        sr_t = np.asarray(sr_task, np.int64)
+        sr_r = np.asarray(sr_region, np.int64)
+        sr_p = np.asarray(sr_pair, np.int64)
+        owner = np.asarray(seg_owner, np.int64)
+        duration = np.maximum(np.asarray(seg_duration, np.float64), 0.0)
+
+        # 时间段 -> (任务, 区域) 的扁平下标
+        seg_tr = (sr_t * R + sr_r)[owner]
+        self.region_segments += np.bincount(seg_tr, minlength=T * R).reshape(T, R)
+        self.region_duration_ms += np.bincount(seg_tr, weights=duration, minlength=T * R).reshape(T, R)
+        self.region_sessions += np.bincount(sr_t * R + sr_r, minlength=T * R).reshape(T, R)
+        bins = len(self.edges)
+        bucket = np.searchsorted(self.edges, duration, side="right") - 1
+        self.dwell_hist += np.bincount(seg_tr * bins + bucket, minlength=T * R * bins).reshape(T, R, bins)
+        # 每个 (会话, 区域) 的停留总时长，再按 (任务, 用户) 累加
+        sr_total = np.bincount(owner, weights=duration, minlength=len(sr_t))
+        self.pair_duration_ms += np.bincount(sr_p * R + sr_r, weights=sr_total, minlength=P * R).reshape(P, R)
+
+    def merge(self, other: "Aggregate") -> None:
+        """把另一个分片的结果按名字对齐后加到本对象上。"""
+        t_map = np.array([self._index(self.tasks, name) for name in other.tasks], np.int64)
+        r_map = np.array([self._index(self.regions, name) for name in other.regions], np.int64)
+        p_map = np.array([self._index(self.pairs, key) for key in other.pairs], np.int64)
+        self._resize()
+        self.lines += other.lines
+        self.skipped += other.skipped
+        # 映射是单射，花式索引的 += 不会丢失重复下标上的累加
+        self.task_sessions[t_map] += other.task_sessions
+        self.task_preview_clicks[t_map] += other.task_preview_clicks
+        self.task_actions[t_map] += other.task_actions
+        self.task_version_hist[t_map] += other.task_version_hist
+        self.region_duration_ms[np.ix_(t_map, r_map)] += other.region_duration_ms
+        self.region_segments[np.ix_(t_map, r_map)] += other.region_segments
+        self.region_sessions[np.ix_(t_map, r_map)] += other.region_sessions
+        self.dwell_hist[np.ix_(t_map, r_map)] += other.dwell_hist
+        self.pair_sessions[p_map] += other.pair_sessions
+        self.pair_preview_clicks[p_map] += other.pair_preview_clicks
+        self.pair_actions[p_map] += other.pair_actions
+        self.pair_versions[p_map] += other.pair_versions
+        self.pair_duration_ms[np.ix_(p_map, r_map)] += other.pair_duration_ms
+
+    # --- 输出 ---
+    def save(self, path: str) -> None:
+        """写入列式 .npz：名字列为 Unicode 数组，np.load 读取时不需要 allow_pickle。"""
+        task_names = list(self.tasks)
+        np.savez_compressed(
+            path,
+            tasks=np.array(task_names, dtype=str),
+            regions=np.array(list(self.regions), dtype=str),
+            actions=np.array(ACTION_NAMES, dtype=str),
+            dwell_edges_ms=self.edges,
+            task_sessions=self.task_sessions,
+            task_preview_clicks=self.task_preview_clicks,
+            task_actions=self.task_actions,
+            task_version_hist=self.task_version_hist,
+            region_duration_ms=self.region_duration_ms,
+            region_segments=self.region_segments,
+            region_sessions=self.region_sessions,
+            dwell_hist=self.dwell_hist,
+            pair_task=np.array([self.tasks[task] for task, _ in self.pairs], np.int64),
+            pair_user=np.array([user for _, user in self.pairs], dtype=str),
+            pair_sessions=self.pair_sessions,
+            pair_preview_clicks=self.pair_preview_clicks,
+            pair_actions=self.pair_actions,
+            pair_versions=self.pair_versions,
+            pair_duration_ms=self.pair_duration_ms,
+        )
+
+
+def aggregate_shard(shard: Shard, edges: np.ndarray, chunk_lines: int) -> Aggregate:
+    """进程池中的任务：聚合一个分片。"""
+    result = Aggregate(edges)
+    chunk: List[bytes] = []
+    for line in _read_lines(shard):
+        if not line.strip():
+            continue
+        chunk.append(line)
+        if len(chunk) >= chunk_lines:
+            result.add_chunk(chunk)
+            chunk = []
+    result.add_chunk(chunk)
+    return result
+
+
+def print_summary(result: Aggregate) -> None:
+    regions = list(result.regions)
+    for task, t in result.tasks.items():
+        sessions = int(result.task_sessions[t])
+        actions = ", ".join(f"{name}={result.task_actions[t, k] / sessions:.2f}" for k, name in enumerate(ACTION_NAMES))
+        versions = np.arange(MAX_VERSIONS + 1) @ result.task_version_hist[t] / sessions
+        print(f"{task}: {sessions} sessions, {len([1 for key in result.pairs if key[0] == task])} users, "
+              f"avg versions {versions:.2f}, avg preview clicks {result.task_preview_clicks[t] / sessions:.2f}, "
+              f"avg actions ({actions})")
+        for r in np.argsort(-result.region_duration_ms[t]):
+            if result.region_sessions[t, r] == 0:
+                continue
+            hist = result.dwell_hist[t, r]
+            # 中位数所在桶的下边界，粗略反映单个时间段的典型长度
+            median_bucket = int(np.searchsorted(np.cumsum(hist), hist.sum() / 2))
+            print(f"  {regions[r]:<16} total {result.region_duration_ms[t, r] / 1000:>12.1f}s  "
+                  f"per session {result.region_duration_ms[t, r] / 1000 / result.region_sessions[t, r]:>9.1f}s  "
+                  f"segments {result.region_segments[t, r]:>9}  median segment >= {result.edges[median_bucket]:.0f}ms")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="流式聚合 /timing 会话日志，输出列式 .npz 统计文件。")
+    parser.add_argument("paths", nargs="+", help="会话日志文件 (.jsonl，可为 .gz / .bz2 / .xz 压缩)")
+    parser.add_argument("--out", default="session_stats.npz")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-lines", type=int, default=2000, help="每批解析的行数")
+    parser.add_argument("--split-bytes", type=int, default=256 * 1024 * 1024,
+                        help="未压缩文件超过该大小时切成多个分片")
+    parser.add_argument("--bins", type=int, default=48, help="停留时长直方图的桶数")
+    parser.add_argument("--max-dwell-ms", type=float, default=3_600_000.0, help="直方图最后一个桶的下边界")
+    parser.add_argument("--quiet", action="store_true", help="不打印汇总")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    edges = dwell_edges(args.bins, args.max_dwell_ms)
+    shards = plan_shards(args.paths, args.split_bytes)
+    total = Aggregate(edges)
+    if args.workers <= 1 or len(shards) == 1:
+        for shard in shards:
+            total.merge(aggregate_shard(shard, edges, args.chunk_lines))
+    else:
+        with ProcessPoolExecutor(max_workers=min(args.workers, len(shards))) as pool:
+            futures = [pool.submit(aggregate_shard, shard, edges, args.chunk_lines) for shard in shards]
+            for future in as_completed(futures):
+                total.merge(future.result())
+    total.save(args.out)
+
+    if not args.quiet:
+        print_summary(total)
+    print(f"{total.lines} lines ({total.skipped} skipped) from {len(shards)} shards -> {args.out} "
+          f"in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
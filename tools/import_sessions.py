@@ -0,0 +1,102 @@
+# tools/import_sessions.py
+"""
+会话日志增量导入 (Session Log Importer)
+
+把 session_logs.jsonl 中的历史会话快照导入会话分析存储 (services/analytics_store.py)。
+导入进度 (已处理的字节偏移) 与记录写在同一个事务里，重复运行只处理上次之后追加的行；
+中断后重跑不会重复计数，同一会话的多次快照以最后一次为准。
+文件变短 (被轮转或截断) 时从头重新导入。末尾尚未写完的半行留到下次处理。
+
+用法:
+    python -m tools.import_sessions --file session_logs.jsonl --db analytics.sqlite3
+    python -m tools.import_sessions --reset     # 忽略已记录的进度，从头导入
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from typing import List, Optional
+
+import orjson
+
+from services.analytics_store import AnalyticsStore, record_from_snapshot
+from utility.config import settings
+
+DEFAULT_LOG_PATH = "session_logs.jsonl"
+
+
+def import_log(store: AnalyticsStore, path: str, batch_size: int = 500, reset: bool = False) -> dict:
+    """从上次记录的偏移处继续导入，返回本次的统计。"""
+    key = os.path.abspath(path)
+    conn = store._connect()
+    stats = {"imported": 0, "skipped": 0, "start_offset": 0, "end_offset": 0}
+    try:
+        row = conn.execute("SELECT offset FROM import_offsets WHERE path = ?", (key,)).fetchone()
+        offset = 0 if reset or row is None else row[0]
+        size = os.path.getsize(path)
+        if offset > size:
+            print(f"{path} is shorter than the recorded offset ({size} < {offset}), re-importing from the start",
+                  file=sys.stderr)
+            offset = 0
+        stats["start_offset"] = offset
+
+        with open(path, "rb") as f:
+            f.seek(offset)
+            received_at = os.path.getmtime(path)
+            batch: List = []
+
+            def commit() -> None:
+                with conn:
+                    store.write_many(conn, batch)
+                    conn.execute(
+                        "INSERT INTO import_offsets (path, offset, updated_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT (path) DO UPDATE SET offset = excluded.offset, updated_at = excluded.updated_at",
+                        (key, offset, time.time()),
+                    )
+                stats["imported"] += len(batch)
+                batch.clear()
+
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # 写入中的半行
+                offset += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    record = record_from_snapshot(orjson.loads(line), received_at=received_at)
+                except orjson.JSONDecodeError:
+                    record = None
+                if record is None:
+                    stats["skipped"] += 1
+                    continue
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    commit()
+            commit()
+        stats["end_offset"] = offset
+    finally:
+        conn.close()
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="把 session_logs.jsonl 增量导入会话分析存储。")
+    parser.add_argument("--file", default=DEFAULT_LOG_PATH)
+    parser.add_argument("--db", default=settings.ANALYTICS_DB_PATH)
+    parser.add_argument("--batch-size", type=int, default=500, help="每个事务写入的会话数")
+    parser.add_argument("--reset", action="store_true", help="忽略已记录的进度，从头导入")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    try:
+        stats = import_log(AnalyticsStore(args.db), args.file, args.batch_size, args.reset)
+    except (OSError, sqlite3.Error) as e:
+        sys.exit(f"import failed: {e}")
+    elapsed = time.perf_counter() - started
+    print(f"imported {stats['imported']} sessions, skipped {stats['skipped']} lines, "
+          f"bytes {stats['start_offset']} -> {stats['end_offset']} in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# tools/retention.py
+"""
+会话保留命令行 (Retention CLI)
+
+触发会话过期和 Chroma 压缩，并报告删除的会话 / 版本数和回收的磁盘空间。
+默认通过运行中服务的 /admin/retention 端点执行 (服务持有 Chroma，其他进程不能同时打开 embedded 存储)；
+服务停止时可以用 --direct 在本进程内直接打开向量库执行。
+
+compact --offline 必须在服务 (以及 tools.serve 启动的 Chroma 属主进程) 停止时运行：
+把 chroma.sqlite3 转换为 auto_vacuum=INCREMENTAL 并执行一次整库 VACUUM。
+转换一次之后，服务中的定时压缩即可在线分步回收空闲页。
+
+用法:
+    python -m tools.retention status
+    python -m tools.retention expire --ttl-days 30 --dry-run
+    python -m tools.retention expire --ttl-days 30 --url http://127.0.0.1:8000 --token $ADMIN_TOKEN
+    python -m tools.retention expire --ttl-days 30 --direct
+    python -m tools.retention compact
+    python -m tools.retention compact --offline
+"""
+import argparse
+import json
+import sys
+from typing import List, Optional
+
+import httpx
+
+from utility.config import settings
+
+
+def _remote(args: argparse.Namespace) -> dict:
+    headers = {"X-Admin-Token": args.token} if args.token else {}
+    params = {}
+    if getattr(args, "ttl_days", None):
+        params["ttl_days"] = args.ttl_days
+    if args.command == "status":
+        method, path = "GET", "/admin/retention"
+    elif args.command == "expire":
+        method, path = "POST", "/admin/retention/expire"
+        params["dry_run"] = str(args.dry_run).lower()
+    else:
+        method, path = "POST", "/admin/retention/compact"
+    response = httpx.request(method, args.url.rstrip("/") + path, params=params, headers=headers, timeout=None)
+    if response.status_code != 200:
+        raise RuntimeError(f"{method} {path} returned {response.status_code}: {response.text}")
+    return response.json()
+
+
+def _direct(args: argparse.Namespace) -> dict:
+    from services.retention import retention
+
+    if args.command == "compact":
+        return retention.compact(args.chroma_path, offline=args.offline)
+    if args.command == "status":
+        return retention.status(args.ttl_days)
+
+    import chromadb
+    from services.services import vector_collection_name
+
+    client = chromadb.PersistentClient(path=args.chroma_path)
+    collection = client.get_or_create_collection(vector_collection_name())
+    return retention.expire(collection, args.ttl_days, args.dry_run)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="触发会话过期和 Chroma 压缩，报告回收的空间。")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="运行中服务的地址")
+    parser.add_argument("--token", default=settings.ADMIN_TOKEN or None, help="X-Admin-Token")
+    parser.add_argument("--direct", action="store_true", help="不经过服务，直接打开向量库 (服务必须已停止)")
+    parser.add_argument("--chroma-path", default=settings.CHROMA_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    status = commands.add_parser("status", help="访问记录概况和最近一次过期 / 压缩结果")
+    status.add_argument("--ttl-days", type=float, default=None)
+
+    expire = commands.add_parser("expire", help="删除超过 TTL 未访问的会话")
+    expire.add_argument("--ttl-days", type=float, default=None, help="默认 RETENTION_TTL_DAYS")
+    expire.add_argument("--dry-run", action="store_true", help="只统计，不删除")
+
+    compact = commands.add_parser("compact", help="回收 chroma.sqlite3 的空闲页")
+    compact.add_argument("--offline", action="store_true",
+                         help="服务停止时转换为 auto_vacuum=INCREMENTAL 并执行整库 VACUUM")
+
+    args = parser.parse_args(argv)
+    direct = args.direct or getattr(args, "offline", False)
+    try:
+        report = _direct(args) if direct else _remote(args)
+    except (httpx.HTTPError, RuntimeError, ValueError) as e:
+        sys.exit(f"retention {args.command} failed: {e}")
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if "reclaimed_bytes" in report:
+        print(f"reclaimed {report['reclaimed_bytes'] / 1024 / 1024:.2f} MiB "
+              f"({report['size_before']} -> {report['size_after']} bytes)", file=sys.stderr)
+    if report.get("skipped"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# tools/serve.py
+"""
+多 worker 部署启动器 (Multi-worker Launcher)
+
+chromadb.PersistentClient 不能被多个进程同时打开，所以默认的 embedded 模式只能单 worker 运行。
+这个启动器提供受支持的多 worker 部署方式：
+1. 启动唯一的 Chroma 属主进程 (`chroma run --path CHROMA_PATH`)，由它独占 ./chroma_db_store；
+2. 等待其心跳就绪后，以 CHROMA_MODE=server 启动 N 个 uvicorn worker，所有 worker 通过本地回环连接它；
+3. 为 Prometheus 设置多进程目录，使 /metrics 汇总所有 worker 的指标；
+4. 收到 SIGINT / SIGTERM 时先停止 uvicorn，再停止 Chroma 属主进程。
+
+用法:
+    python -m tools.serve --workers 4 --port 8000
+"""
+import argparse
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+import chromadb
+
+from utility.config import settings
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_for_chroma(host: str, port: int, timeout: float, owner: subprocess.Popen) -> None:
+    """轮询 Chroma 心跳直到就绪。"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if owner.poll() is not None:
+            raise RuntimeError(f"chroma server exited with code {owner.returncode}")
+        try:
+            chromadb.HttpClient(host=host, port=port).heartbeat()
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise TimeoutError(f"chroma server on {host}:{port} not ready after {timeout:.0f}s")
+
+
+def _stop(process: Optional[subprocess.Popen], timeout: float) -> None:
+    if process is None or process.poll() is not None:
+        return
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="启动 Chroma 属主进程和多个 uvicorn worker。")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--chroma-path", default=settings.CHROMA_PATH)
+    parser.add_argument("--chroma-port", type=int, default=settings.CHROMA_PORT)
+    parser.add_argument("--chroma-bin", default=shutil.which("chroma") or "chroma",
+                        help="chroma 命令行工具 (随 chromadb 安装)")
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    env.update({
+        "CHROMA_MODE": "server",
+        "CHROMA_HOST": settings.CHROMA_HOST,
+        "CHROMA_PORT": str(args.chroma_port),
+    })
+    metrics_dir = None
+    if args.workers > 1 and "PROMETHEUS_MULTIPROC_DIR" not in env:
+        metrics_dir = tempfile.mkdtemp(prefix="prometheus-")
+        env["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+
+    owner = subprocess.Popen([
+        args.chroma_bin, "run", "--path", args.chroma_path,
+        "--host", settings.CHROMA_HOST, "--port", str(args.chroma_port),
+    ], stdout=subprocess.DEVNULL)
+    server = None
+    try:
+        wait_for_chroma(settings.CHROMA_HOST, args.chroma_port, args.startup_timeout, owner)
+        print(f"chroma owner (pid {owner.pid}) holding {args.chroma_path} on "
+              f"{settings.CHROMA_HOST}:{args.chroma_port}", file=sys.stderr)
+
+        server = subprocess.Popen([
+            sys.executable, "-m", "uvicorn", "main:app", "--app-dir", APP_DIR,
+            "--host", args.host, "--port", str(args.port), "--workers", str(args.workers),
+        ], env=env)
+
+        # 把终止信号转交给 uvicorn，由它优雅地停止各个 worker
+        def forward(signum, frame):
+            if server.poll() is None:
+                server.send_signal(signum)
+
+        signal.signal(signal.SIGTERM, forward)
+        signal.signal(signal.SIGINT, forward)
+        return server.wait()
+    finally:
+        _stop(server, timeout=30)
+        _stop(owner, timeout=10)
+        if metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# tools/trace_report.py
+"""
+追踪报告 (Trace Report)
+
+读取 utility/tracing.py 导出的 JSONL span 文件，找出最慢的 N 个请求，
+打印每个请求的分阶段耗时树，以及这些请求中各阶段的平均耗时汇总。
+
+用法:
+    python -m tools.trace_report --file traces.jsonl --top 10
+"""
+import argparse
+import json
+from collections import defaultdict
+from typing import Dict, List
+
+
+def _duration_ms(span: Dict) -> float:
+    return (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+
+
+def load_traces(path: str) -> Dict[str, List[Dict]]:
+    """按 traceId 分组读取所有 span。"""
+    traces: Dict[str, List[Dict]] = defaultdict(list)
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                span = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            traces[span["traceId"]].append(span)
+    return traces
+
+
+def find_root(spans: List[Dict]) -> Dict:
+    """根 span 是父 span 不在本 trace 中的那个（可能来自上游的 traceparent）。"""
+    span_ids = {s["spanId"] for s in spans}
+    roots = [s for s in spans if not s.get("parentSpanId") or s["parentSpanId"] not in span_ids]
+    return max(roots or spans, key=_duration_ms)
+
+
+def print_tree(spans: List[Dict], root: Dict) -> None:
+    children: Dict[str, List[Dict]] = defaultdict(list)
+    for s in spans:
+        children[s.get("parentSpanId", "")].append(s)
+    root_ms = _duration_ms(root) or 1.0
+
+    def walk(node: Dict, depth: int) -> None:
+        ms = _duration_ms(node)
+        status = " [ERROR]" if node.get("status", {}).get("code") == "STATUS_CODE_ERROR" else ""
+        print(f"  {'  ' * depth}{node['name']:<{48 - 2 * depth}} {ms:>10.1f} ms {ms / root_ms:>6.1%}{status}")
+        for child in sorted(children.get(node["spanId"], []), key=lambda s: int(s["startTimeUnixNano"])):
+            walk(child, depth + 1)
+
+    walk(root, 0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="打印最慢 N 个请求的分阶段耗时。")
+    parser.add_argument("--file", default="traces.jsonl", help="span JSONL 文件路径")
+    parser.add_argument("--top", type=int, default=10, help="显示最慢的请求数")
+    parser.add_argument("--route", default=None, help="只统计根 span 名称包含该字符串的请求，例如 /chat")
+    args = parser.parse_args()
+
+    traces = load_traces(args.file)
+    ranked = []
+    for trace_id, spans in traces.items():
+        root = find_root(spans)
+        if args.route and args.route not in root["name"]:
+            continue
+        ranked.append((_duration_ms(root), trace_id, root, spans))
+    ranked.sort(key=lambda item: item[0], reverse=True)
+    slowest = ranked[: args.top]
+
+    print(f"共 {len(ranked)} 个请求，显示最慢的 {len(slowest)} 个。\n")
+    stage_totals: Dict[str, List[float]] = defaultdict(list)
+    for duration, trace_id, root, spans in slowest:
+        print(f"trace {trace_id}  {root['name']}  {duration:.1f} ms")
+        print_tree(spans, root)
+        print()
+        for s in spans:
+            if s is not root:
+                stage_totals[s["name"]].append(_duration_ms(s))
+
+    if stage_totals:
+        print("各阶段汇总 (最慢请求中):")
+        print(f"  {'stage':<48} {'count':>6} {'mean ms':>10} {'max ms':>10}")
+        for name, values in sorted(stage_totals.items(), key=lambda item: -sum(item[1])):
+            print(f"  {name:<48} {len(values):>6} {sum(values) / len(values):>10.1f} {max(values):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# utility/code_diff.py
+import difflib
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+"""
+代码差异块工具 (Code Hunk Utilities)
+
+职责:
+为 /merge 计算两个版本的“共享骨架 + 差异块 (hunk)”表示。
+提示词中只放一次共享骨架（离差异块较远的共享代码会被折叠），再加上每个差异块在两个版本中的写法；
+LLM 只需要返回每个差异块的合并结果，完整程序由服务端根据骨架重新拼装。
+这样 Prompt 的长度主要取决于两个版本的差异大小，而不是代码总长度。
+"""
+
+# 骨架中差异块占位符的格式，例如: <<<HUNK H1>>>
+HUNK_PLACEHOLDER = "<<<HUNK {hunk_id}>>>"
+_PLACEHOLDER_PATTERN = re.compile(r"^<<<HUNK (H\d+)>>>$")
+
+
+@dataclass
+class Hunk:
+    """一个差异块：两个版本在同一位置的不同写法。"""
+    hunk_id: str
+    lines_1: List[str]
+    lines_2: List[str]
+
+
+@dataclass
+class MergeHunks:
+    """两个版本的共享骨架和差异块。"""
+    # 骨架按行存储，差异块的位置用占位符行表示
+    skeleton: List[str] = field(default_factory=list)
+    hunks: List[Hunk] = field(default_factory=list)
+    shared_lines: int = 0
+    total_lines: int = 0
+
+    @property
+    def shared_ratio(self) -> float:
+        """两个版本共享的行数占比 (按较长版本计算)。"""
+        if self.total_lines == 0:
+            return 1.0
+        return self.shared_lines / self.total_lines
+
+
+def compute_merge_hunks(code_1: str, code_2: str) -> MergeHunks:
+    """
+    按行比较两个版本，返回共享骨架和差异块。
+
+    Args:
+        code_1 (str): 版本1的完整代码。
+        code_2 (str): 版本2的完整代码。
+
+    Returns:
+        MergeHunks: 骨架中的每个差异块都由一个占位符行代替。
+    """
+    lines_1 = code_1.splitlines()
+    lines_2 = code_2.splitlines()
+    matcher = difflib.SequenceMatcher(a=lines_1, b=lines_2, autojunk=False)
+
+    result = MergeHunks(total_lines=max(len(lines_1), len(lines_2)))
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            result.skeleton.extend(lines_1[i1:i2])
+            result.shared_lines += i2 - i1
+            continue
+        hunk_id = f"H{len(result.hunks) + 1}"
+        result.hunks.append(Hunk(hunk_id=hunk_id, lines_1=lines_1[i1:i2], lines_2=lines_2[j1:j2]))
+        result.skeleton.append(HUNK_PLACEHOLDER.format(hunk_id=hunk_id))
+    return result
+
+
+def render_skeleton(merge_hunks: MergeHunks, context_lines: int) -> str:
+    """
+    渲染用于 Prompt 的骨架。离任何差异块超过 context_lines 行的共享代码会被折叠为一行注释。
+
+    Args:
+        merge_hunks (MergeHunks): compute_merge_hunks 的结果。
+        context_lines (int): 每个差异块前后保留的共享代码行数；小于 0 表示不折叠。
+    """
+    skeleton = merge_hunks.skeleton
+    if context_lines < 0:
+        return "\n".join(skeleton)
+
+    keep = [False] * len(skeleton)
+    for index, line in enumerate(skeleton):
+        if _PLACEHOLDER_PATTERN.match(line):
+            start = max(0, index - context_lines)
+            end = min(len(skeleton), index + context_lines + 1)
+            for k in range(start, end):
+                keep[k] = True
+
+    rendered: List[str] = []
+    omitted = 0
+    for line, kept in zip(skeleton, keep):
+        if kept:
+            if omitted:
+                rendered.append(f"/* ... 省略 {omitted} 行共享代码 ... */")
+                omitted = 0
+            rendered.append(line)
+        else:
+            omitted += 1
+    if omitted:
+        rendered.append(f"/* ... 省略 {omitted} 行共享代码 ... */")
+    return "\n".join(rendered)
+
+
+def render_hunks(merge_hunks: MergeHunks) -> str:
+    """把所有差异块渲染为 Prompt 中的文本，每个差异块列出两个版本的写法。"""
+    blocks = []
+    for hunk in merge_hunks.hunks:
+        code_1 = "\n".join(hunk.lines_1) or "(此处无代码)"
+        code_2 = "\n".join(hunk.lines_2) or "(此处无代码)"
+        blocks.append(
+            f"### {hunk.hunk_id}\n"
+            f"版本1:\n```javascript\n{code_1}\n```\n"
+            f"版本2:\n```javascript\n{code_2}\n```"
+        )
+    return "\n\n".join(blocks)
+
+
+def assemble_merged_code(merge_hunks: MergeHunks, resolved: Dict[str, str], additions: str = "") -> str:
+    """
+    用 LLM 返回的差异块合并结果替换骨架中的占位符，拼装出完整程序。
+
+    Args:
+        merge_hunks (MergeHunks): compute_merge_hunks 的结果。
+        resolved (Dict[str, str]): 差异块 ID -> 合并后的代码。
+        additions (str): 需要追加到程序末尾的新增代码（新的全局变量、函数等），可为空。
+
+    Raises:
+        ValueError: 如果有差异块没有给出合并结果。
+    """
+    missing = [hunk.hunk_id for hunk in merge_hunks.hunks if hunk.hunk_id not in resolved]
+    if missing:
+        raise ValueError(f"LLM 未返回以下差异块的合并结果: {', '.join(missing)}")
+
+    lines: List[str] = []
+    for line in merge_hunks.skeleton:
+        match = _PLACEHOLDER_PATTERN.match(line)
+        if not match:
+            lines.append(line)
+            continue
+        resolved_code = resolved[match.group(1)] or ""
+        if resolved_code.strip():
+            lines.extend(resolved_code.rstrip("\n").splitlines())
+    if additions and additions.strip():
+        lines.append("")
+        lines.extend(additions.rstrip("\n").splitlines())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,100 @@
+# utility/codec.py
+import zlib
+from typing import Any, Callable
+
+import orjson
+from fastapi import HTTPException, Request, Response, status
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+
+from utility.config import settings
+
+"""
+请求/响应编解码 (Codec)
+
+本服务的请求和响应以大字符串为主 (完整 p5.js 代码、versionCodes、对话历史)，这里提供：
+- ORJSONResponse / ORJSONRoute: 用 orjson 代替标准库 json 完成响应序列化和请求体解析。
+  所有路由模块都以 `APIRouter(route_class=ORJSONRoute)` 创建 router。
+- GzipRequestMiddleware: 支持 `Content-Encoding: gzip` 的请求体 (例如 /timing 上传的完整会话)，
+  按块流式解压，解压后的大小超过 MAX_REQUEST_BODY_BYTES 时返回 413。
+响应压缩由 Starlette 的 GZipMiddleware 完成 (见 main.py)。
+"""
+
+
+class ORJSONResponse(JSONResponse):
+    """用 orjson 序列化的 JSON 响应。"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+class ORJSONRequest(Request):
+    """用 orjson 解析请求体的 Request。orjson.JSONDecodeError 是 json.JSONDecodeError 的子类，错误处理不变。"""
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = orjson.loads(await self.body())
+        return self._json
+
+
+class ORJSONRoute(APIRoute):
+    """把请求包装为 ORJSONRequest 的路由类。"""
+
+    def get_route_handler(self) -> Callable:
+        original_handler = super().get_route_handler()
+
+        async def orjson_route_handler(request: Request) -> Response:
+            return await original_handler(ORJSONRequest(request.scope, request.receive))
+
+        return orjson_route_handler
+
+
+class GzipRequestMiddleware:
+    """纯 ASGI 中间件：流式解压 `Content-Encoding: gzip` 的请求体，对下游透明。"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = scope.get("headers") or []
+        encoding = next((value for name, value in headers if name == b"content-encoding"), b"")
+        if encoding.strip().lower() != b"gzip":
+            await self.app(scope, receive, send)
+            return
+
+        # 解压后长度未知：去掉 Content-Encoding 和 Content-Length，下游按流读取
+        scope = {
+            **scope,
+            "headers": [(name, value) for name, value in headers
+                        if name not in (b"content-encoding", b"content-length")],
+        }
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        limit = settings.MAX_REQUEST_BODY_BYTES
+        total = 0
+
+        async def receive_decompressed():
+            nonlocal total
+            message = await receive()
+            if message["type"] != "http.request":
+                return message
+            more_body = message.get("more_body", False)
+            try:
+                # max_length 限制单次解压输出，防止压缩炸弹一次性占满内存
+                data = decompressor.decompress(message.get("body", b""), limit - total + 1)
+                if decompressor.unconsumed_tail:
+                    raise HTTPException(413, "Request body too large.")
+                if not more_body:
+                    data += decompressor.flush()
+            except zlib.error:
+                raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid gzip request body.")
+            total += len(data)
+            if total > limit:
+                raise HTTPException(413, "Request body too large.")
+            if not more_body and not decompressor.eof:
+                raise HTTPException(status.HTTP_400_BAD_REQUEST, "Truncated gzip request body.")
+            return {"type": "http.request", "body": data, "more_body": more_body}
+
+        await self.app(scope, receive_decompressed, send)
@@ -1,4 +1,6 @@
 # core/config.py
+from typing import Any, Dict, List
+
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -8,6 +10,187 @@ class Settings(BaseSettings):
     AZURE_OPENAI_MODEL_NAME: str
     AZURE_OPENAI_EMBEDDING_MODEL: str
 
+    # Embedding 前是否用 tiktoken 按上下文长度切分文本；离线压测 (bench.mock_azure) 时可关闭
+    EMBEDDING_CHECK_CTX_LENGTH: bool = True
+
+    # --- LLM 调用 ---
+    # 所有路由共享的全局 LLM 并发上限
+    LLM_MAX_CONCURRENCY: int = 8
+    # 优先级调度：interactive (/chat、/modify、/merge) 与 background (版本摘要、预热) 按权重公平分配空出的名额，
+    # 各自的并发上限保证 background 再多也给 interactive 留出名额
+    LLM_INTERACTIVE_WEIGHT: float = 4.0
+    LLM_INTERACTIVE_MAX_CONCURRENCY: int = 8
+    LLM_BACKGROUND_WEIGHT: float = 1.0
+    LLM_BACKGROUND_MAX_CONCURRENCY: int = 6
+
+    # 版本摘要合批：SUMMARY_BATCH_WINDOW 秒内到达的摘要请求最多 SUMMARY_BATCH_SIZE 个合成一次 LLM 调用，1 表示不合批
+    SUMMARY_BATCH_SIZE: int = 8
+    SUMMARY_BATCH_WINDOW: float = 0.05
+    # 同时进行的合批摘要调用数上限；达到上限时新请求排队并并入下一批 (为其他路由保留 LLM 并发名额)
+    SUMMARY_BATCH_MAX_IN_FLIGHT: int = 4
+    # /add_versions 批量导入时单个请求同时进行的摘要调用数 (仍受 LLM_MAX_CONCURRENCY 约束)
+    BULK_SUMMARY_CONCURRENCY: int = 8
+    # /add_versions 每次 Embedding 请求包含的版本数
+    BULK_EMBED_BATCH: int = 64
+
+    # --- 任务级模型路由 ---
+    # 轻量任务 (版本摘要、过渡层回复) 使用的小而快的部署；为空时与 AZURE_OPENAI_MODEL_NAME 相同
+    AZURE_OPENAI_FAST_MODEL_NAME: str = ""
+    # 按任务覆盖 services.model_routing.DEFAULT_TASK_ROUTES，环境变量中以 JSON 对象给出，只需列出要改的任务和字段，
+    # 例如 {"merge": {"model": "fast"}, "chat": {"temperature": 0.5}}；model 为 "default" / "fast" 或具体的部署名
+    LLM_TASK_ROUTES: Dict[str, Dict[str, Any]] = {}
+
+    # --- 截止时间与对冲请求 ---
+    # 各路由的整体延迟预算 (秒)，超出后 LLM 调用被取消、路由返回 504；环境变量中以 JSON 对象给出，未列出的路由不限
+    LLM_ROUTE_BUDGETS: Dict[str, float] = {
+        "/chat": 45.0, "/merge": 90.0, "/merge/many": 300.0, "/modify/apply-style": 60.0,
+    }
+    # 对冲请求：这些路由的 interactive 调用超过该路由近期 LLM 延迟的 LLM_HEDGE_QUANTILE 分位数仍未返回时，
+    # 再发送一个相同的请求，先成功者胜出，另一个被取消；空列表表示不对冲
+    LLM_HEDGE_ROUTES: List[str] = ["/chat", "/modify/apply-style"]
+    LLM_HEDGE_QUANTILE: float = 0.95
+    # 统计分位数的最近调用数，以及开始对冲前至少需要的样本数
+    LLM_HEDGE_WINDOW: int = 200
+    LLM_HEDGE_MIN_SAMPLES: int = 20
+    # 对冲延迟的下限 (秒)
+    LLM_HEDGE_MIN_DELAY: float = 1.0
+    # 客户端可以用该请求头 (秒数) 给出更短的截止时间，与路由预算取较小者；适用于所有路由
+    CLIENT_DEADLINE_HEADER: str = "X-Request-Timeout"
+    # 这些路由在客户端断开 (离开页面、重新提交) 时立即取消请求，不再等待没人读取的 LLM 调用和检索；
+    # 流式响应的路由 (/merge/many、/add_versions、/jobs/events) 由 StreamingResponse 自行处理断开
+    CANCEL_ON_DISCONNECT_ROUTES: List[str] = ["/chat", "/merge", "/modify/apply-style"]
+
+    # --- Azure 配额限流 ---
+    # 部署的每分钟 token 数 / 请求数配额，chat 和 embedding 共用；0 表示不在客户端限流 (仍统一处理 429)
+    AZURE_OPENAI_TPM: int = 0
+    AZURE_OPENAI_RPM: int = 0
+    # 令牌桶容量 (秒)：允许的突发量为该秒数内的配额，与 Azure 按 10 秒窗口计算配额一致
+    RATE_LIMIT_BURST_SECONDS: float = 10.0
+    # 请求未设置 max_tokens 时按该值估算 completion token 数
+    RATE_LIMIT_COMPLETION_ESTIMATE: int = 500
+    # 估算 Prompt token 数的 tiktoken 编码
+    RATE_LIMIT_TIKTOKEN_ENCODING: str = "o200k_base"
+    # 收到 429 / 408 / 409 / 5xx 或连接错误后在传输层重试的次数 (openai SDK 的重试已关闭)；
+    # 没有 Retry-After 时按 RATE_LIMIT_BACKOFF_BASE * 2^n 秒退避
+    RATE_LIMIT_MAX_RETRIES: int = 3
+    RATE_LIMIT_BACKOFF_BASE: float = 1.0
+    # 暂停结束后各等待者随机错开的最大秒数
+    RATE_LIMIT_JITTER: float = 0.5
+
+    # --- 异步摘要作业 ---
+    # /add_version_node?async=true 的作业表 (sqlite)，多 worker 共享
+    SUMMARY_JOB_DB_PATH: str = "summary_jobs.sqlite3"
+    # 同时执行的摘要作业数
+    SUMMARY_JOB_WORKERS: int = 8
+    # SSE 推送流查询作业表的间隔 (秒)；本进程完成的作业会立即唤醒推送流
+    SUMMARY_JOB_POLL_INTERVAL: float = 1.0
+    # SSE 推送流没有新事件时发送心跳注释的间隔 (秒)
+    SUMMARY_JOB_HEARTBEAT: float = 15.0
+    # 启动时 running 超过该秒数的作业视为执行者已退出，重新执行
+    SUMMARY_JOB_LEASE: float = 300.0
+    # 已结束作业的保留时间 (秒)，启动时清理
+    SUMMARY_JOB_RETENTION: float = 86400.0
+
+    # --- 日志 ---
+    LOG_LEVEL: str = "INFO"
+    # json: 每行一条 JSON 记录；text: 便于本地开发阅读的纯文本
+    LOG_FORMAT: str = "json"
+    # 完整载荷日志 (LLM 响应、代码) 的采样率，需要 LOG_LEVEL=DEBUG 才会输出
+    LOG_PAYLOAD_SAMPLE_RATE: float = 0.1
+    # 关闭时载荷日志只记录结构摘要 (长度、键名)，不记录完整代码和响应正文
+    LOG_INCLUDE_BODIES: bool = False
+
+    # --- Token 用量统计 ---
+    USAGE_DB_PATH: str = "usage.sqlite3"
+    # 后台线程批量写入 sqlite 的时间窗口 (秒)
+    USAGE_FLUSH_INTERVAL: float = 1.0
+    # 每千 token 的单价，用于估算成本
+    LLM_PROMPT_COST_PER_1K: float = 0.0
+    LLM_COMPLETION_COST_PER_1K: float = 0.0
+
+    # --- 会话分析 ---
+    # /timing 除了追加 session_logs.jsonl，还把分析字段写入该 sqlite 文件
+    ANALYTICS_ENABLED: bool = True
+    ANALYTICS_DB_PATH: str = "analytics.sqlite3"
+    # /timing 中 timingData 的原始字节超过该值时不校验其内部结构、不统计区域时长 (会话的其他分析字段照常校验和记录)
+    ANALYTICS_MAX_TIMING_BYTES: int = 4 * 1024 * 1024
+
+    # --- 请求追踪 ---
+    TRACING_ENABLED: bool = True
+    # 结束的 span 以 OTLP/JSON 格式逐行追加到该文件
+    TRACE_EXPORT_PATH: str = "traces.jsonl"
+
+    # --- /merge 差异块模式 ---
+    # 两个版本共享行数占比达到该阈值，且代码足够长时，只把差异块发给 LLM
+    MERGE_HUNK_MIN_SHARED_RATIO: float = 0.5
+    MERGE_HUNK_MIN_CHARS: int = 1500
+    # Prompt 中每个差异块前后保留的共享代码行数，小于 0 表示完整发送骨架
+    MERGE_HUNK_CONTEXT_LINES: int = 8
+
+    # --- 传输 ---
+    # 响应体达到该字节数时进行 gzip 压缩
+    GZIP_MIN_SIZE: int = 1024
+    # 1-9，越大压缩率越高但越耗 CPU；代码文本在 5 左右已接近最佳压缩率
+    GZIP_COMPRESS_LEVEL: int = 5
+    # gzip 请求体解压后的最大字节数
+    MAX_REQUEST_BODY_BYTES: int = 20 * 1024 * 1024
+
+    # --- 生命周期 ---
+    # 启动后是否执行预热 (预连接 LLM / Embedding、加载 Chroma 集合)；关闭时初始化完成即就绪
+    WARMUP_ENABLED: bool = True
+    WARMUP_STEP_TIMEOUT: float = 30.0
+    # 收到 SIGTERM 后等待在途请求和后台任务完成的最长时间 (秒)，应小于编排系统的终止宽限期
+    DRAIN_TIMEOUT: float = 25.0
+
+    # --- Chroma 向量库 ---
+    # embedded: 进程内 PersistentClient，只能单 worker 运行；
+    # server: 连接由唯一属主进程 (chroma run) 持有的本地 Chroma 服务，多个 uvicorn worker 可共享
+    CHROMA_MODE: str = "embedded"
+    CHROMA_PATH: str = "./chroma_db_store"
+    CHROMA_HOST: str = "127.0.0.1"
+    CHROMA_PORT: int = 8001
+
+    # --- 版本记忆检索 ---
+    # chroma: 每次 /chat 在共享集合上按 session_id 过滤检索；
+    # session_index: 每个会话在进程内缓存一个 NumPy 向量矩阵做精确检索，Chroma 仍是持久化的数据源
+    RETRIEVAL_BACKEND: str = "chroma"
+    # 会话矩阵空闲超过该秒数后被淘汰
+    SESSION_INDEX_IDLE_TTL: float = 600.0
+    # 最多缓存的会话数，超过时淘汰最久未使用的会话
+    SESSION_INDEX_MAX_SESSIONS: int = 2000
+    # 缓存的会话矩阵在该秒数后重新从 Chroma 加载；多 worker 部署时其他 worker 写入的版本在此之后可见，0 表示不过期
+    SESSION_INDEX_MAX_AGE: float = 0.0
+    # 会话矩阵的存储精度: none (float32) / float16 / int8 (每行一个缩放系数的对称标量量化)
+    SESSION_INDEX_QUANTIZATION: str = "none"
+    # 大于 1 时先在量化向量上取 k * RERANK 个候选，再用 Chroma 中的全精度向量重新排序；量化为 none 时不生效
+    SESSION_INDEX_RERANK: int = 0
+    # Embedding 维度，0 表示模型默认维度。只有支持 dimensions 参数的模型 (text-embedding-3-*) 可以降维；
+    # 不同维度的向量存入不同的集合 (version_graph_memory_<维度>d)，切换后旧集合中的记忆不会被检索到
+    EMBEDDING_DIMENSIONS: int = 0
+
+    # --- 会话保留 ---
+    # 会话最后访问时间的记录 (sqlite)，多 worker 共享
+    RETENTION_DB_PATH: str = "retention.sqlite3"
+    # 会话最后一次访问超过该天数后删除其全部版本记忆，0 表示永不过期
+    RETENTION_TTL_DAYS: float = 0.0
+    # 内存中的访问记录写入 sqlite 的间隔 (秒)，也是后台调度任务的检查粒度
+    RETENTION_FLUSH_INTERVAL: float = 30.0
+    # 执行过期的间隔 (秒)
+    RETENTION_CHECK_INTERVAL: float = 3600.0
+    # 每轮处理的过期会话数，以及每次 Chroma delete 的最大版本数
+    RETENTION_SESSION_BATCH: int = 100
+    RETENTION_DELETE_BATCH: int = 500
+    # 删除批次 / 压缩步骤之间的停顿 (秒)，让请求路径上的 Chroma 写入插进来
+    RETENTION_BATCH_PAUSE: float = 0.05
+    # 压缩 chroma.sqlite3 的间隔 (秒)，0 表示不自动压缩
+    RETENTION_COMPACT_INTERVAL: float = 86400.0
+    # 在线压缩时每步 incremental_vacuum 回收的页数
+    RETENTION_COMPACT_STEP_PAGES: int = 256
+    # 压缩时等待 sqlite 锁的最长时间 (秒)
+    RETENTION_COMPACT_LOCK_TIMEOUT: float = 5.0
+    # /admin 端点要求请求头 X-Admin-Token 与之相同；为空 (默认) 时 /admin 端点不可用，只能用 tools.retention --direct 在服务停止时执行
+    ADMIN_TOKEN: str = ""
+
     class Config:
         env_file = ".env"
 
@@ -0,0 +1,167 @@
+# utility/deadline.py
+import asyncio
+import logging
+import math
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from utility.config import settings
+from utility.metrics import REQUESTS_CANCELLED, current_route
+
+"""
+请求截止时间与取消 (Request Deadlines & Cancellation)
+
+每个路由有一个整体延迟预算 (LLM_ROUTE_BUDGETS)，客户端还可以用 CLIENT_DEADLINE_HEADER 请求头给出更短的截止时间。
+DeadlineMiddleware 在请求开始时把截止时间写入上下文，请求内的 LLM 调用 (invoke_chain)、配额等待和 429 重试
+都以剩余预算为上限：预算耗尽时抛出 DeadlineExceeded，路由返回 504，而不是让一次慢调用或一串重试拖住请求几十秒。
+
+CANCEL_ON_DISCONNECT_ROUTES 中的路由在客户端断开时整体取消：排队中和进行中的 LLM 调用、检索随之取消，
+释放并发名额和配额。被放弃的请求节省的调用数和 token 数计入 LLM_CALLS_CANCELLED / LLM_TOKENS_SAVED。
+"""
+
+logger = logging.getLogger(__name__)
+
+# 当前请求的截止时间 (time.monotonic())，None 表示没有截止时间
+current_deadline: ContextVar[Optional[float]] = ContextVar("current_deadline", default=None)
+# 当前请求的客户端断开事件；只在 CANCEL_ON_DISCONNECT_ROUTES 中的路由上设置
+current_disconnect: ContextVar[Optional[asyncio.Event]] = ContextVar("current_disconnect", default=None)
+
+# 客户端断开、请求被取消时记录的状态码 (沿用 nginx 的 499 Client Closed Request)
+CLIENT_CLOSED_REQUEST = 499
+
+
+class DeadlineExceeded(Exception):
+    """请求的延迟预算已耗尽。"""
+
+
+def remaining() -> Optional[float]:
+    """当前请求剩余的预算 (秒，可能为负)；没有截止时间时返回 None。"""
+    deadline = current_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline(needed: float = 0.0) -> None:
+    """剩余预算不足 needed 秒时抛出 DeadlineExceeded。"""
+    budget = remaining()
+    if budget is not None and budget <= needed:
+        raise DeadlineExceeded(f"request budget exhausted ({budget:.2f}s left, {needed:.2f}s needed)")
+
+
+def abandoned() -> Optional[str]:
+    """当前请求已经没人等待结果时返回原因 ("disconnect" / "deadline")，否则返回 None。"""
+    disconnect = current_disconnect.get()
+    if disconnect is not None and disconnect.is_set():
+        return "disconnect"
+    budget = remaining()
+    if budget is not None and budget <= 0:
+        return "deadline"
+    return None
+
+
+def detach_from_request() -> None:
+    """
+    在请求派生的后台任务 (摘要作业、合批摘要) 开头调用。任务复制了请求的上下文，
+    这里清除其中的截止时间和断开事件：请求已经返回，后台工作不应受它的预算或客户端断开影响。
+    """
+    current_deadline.set(None)
+    current_disconnect.set(None)
+
+
+def _client_budget(scope) -> Optional[float]:
+    """CLIENT_DEADLINE_HEADER 请求头给出的预算 (秒)，没有或无法解析时返回 None。"""
+    name = settings.CLIENT_DEADLINE_HEADER.lower().encode("latin-1")
+    for key, value in scope.get("headers", []):
+        if key == name:
+            try:
+                budget = float(value)
+            except ValueError:
+                return None
+            return budget if math.isfinite(budget) else None
+    return None
+
+
+class DeadlineMiddleware:
+    """
+    纯 ASGI 中间件：按路由模板 (由外层的 MetricsMiddleware 解析) 的预算和客户端的截止时间请求头设置截止时间，
+    并在 CANCEL_ON_DISCONNECT_ROUTES 中的路由上监听客户端断开。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = current_route.get()
+        route_budget = settings.LLM_ROUTE_BUDGETS.get(route) or None
+        client_budget = _client_budget(scope)
+        budget = min((b for b in (route_budget, client_budget) if b is not None), default=None)
+        deadline = None if budget is None else time.monotonic() + budget
+        token = current_deadline.set(deadline)
+        try:
+            if route in settings.CANCEL_ON_DISCONNECT_ROUTES:
+                await self._cancel_on_disconnect(route, scope, receive, send)
+            else:
+                await self.app(scope, receive, send)
+        finally:
+            current_deadline.reset(token)
+            # 由客户端截止时间决定的请求在截止时间之后才结束：调用已被截断，客户端多半也已放弃
+            if client_budget is not None and budget == client_budget and time.monotonic() >= deadline:
+                REQUESTS_CANCELLED.labels(route=route, reason="client_deadline").inc()
+
+    async def _cancel_on_disconnect(self, route, scope, receive, send):
+        """
+        在单独的任务中处理请求；请求体读完后由另一个任务等待 http.disconnect，
+        响应发送完之前收到断开时取消处理任务 (及其中排队、进行中的 LLM 调用和检索)。
+        """
+        body_read = asyncio.Event()
+        disconnect = asyncio.Event()
+        response = {"started": False, "complete": False}
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] != "http.request" or not message.get("more_body", False):
+                body_read.set()
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["started"] = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                response["complete"] = True
+            await send(message)
+
+        async def watch():
+            # 请求体由处理任务读取，读完之后 receive 只会返回 http.disconnect
+            await body_read.wait()
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            # 响应发送完后服务器同样返回 http.disconnect，此时不是客户端断开
+            if not response["complete"]:
+                disconnect.set()
+
+        token = current_disconnect.set(disconnect)
+        handler = asyncio.create_task(self.app(scope, receive_wrapper, send_wrapper))
+        watcher = asyncio.create_task(watch())
+        try:
+            await asyncio.wait({handler, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnect.is_set() and not handler.done():
+                logger.info("🔌 客户端已断开，取消 %s 请求。", route)
+                REQUESTS_CANCELLED.labels(route=route, reason="disconnect").inc()
+                handler.cancel()
+            try:
+                await handler
+            except asyncio.CancelledError:
+                if not disconnect.is_set() or asyncio.current_task().cancelling():
+                    raise
+                # 客户端已经离开，写出的响应会被服务器丢弃；只是让外层的指标和追踪记录为 499 而不是 500
+                if not response["started"]:
+                    await send({"type": "http.response.start", "status": CLIENT_CLOSED_REQUEST, "headers": []})
+                    await send({"type": "http.response.body", "body": b""})
+        finally:
+            current_disconnect.reset(token)
+            watcher.cancel()
+            if not handler.done():
+                handler.cancel()
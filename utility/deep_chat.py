@@ -4,6 +4,9 @@ from langchain.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, H
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
 from typing import Dict
 
+from services.llm_runtime import invoke_chain
+from utility.tracing import span
+
 # ‼️ 修改点: 导入新的、分模式的Vague Prompt
 from .prompt import (
     TRANSITION_SYSTEM_PROMPT,
@@ -161,15 +164,16 @@ async def generate_deep_reflection_response(
     基于以上所有信息（历史记忆、近期对话以及当前代码），继续对话回答我的问题。
     """
     # 4. 组装完整的Chat Prompt
-    chat_prompt = ChatPromptTemplate.from_messages([
-        SystemMessagePromptTemplate.from_template(system_prompt_template),
-        HumanMessagePromptTemplate.from_template(human_prompt)
-    ])
+    with span("prompt.build", mode=mode):
+        chat_prompt = ChatPromptTemplate.from_messages([
+            SystemMessagePromptTemplate.from_template(system_prompt_template),
+            HumanMessagePromptTemplate.from_template(human_prompt)
+        ])
 
-    # 5. 创建并调用LangChain链
-    chain = chat_prompt | llm | JsonOutputParser()
+        # 5. 创建并调用LangChain链
+        chain = chat_prompt | llm | JsonOutputParser()
 
-    response = await chain.ainvoke({
+    response = await invoke_chain(chain, {
         "reflection_templates": formatted_templates,
         "current_code": current_code,
         "user_question": user_question,
@@ -190,14 +194,15 @@ async def generate_transition_response(
     """
     为深度对话的第二轮生成一个包含总结和代码的过渡响应。
     """
-    chat_prompt = ChatPromptTemplate.from_messages([
-        SystemMessagePromptTemplate.from_template(TRANSITION_SYSTEM_PROMPT),
-        HumanMessagePromptTemplate.from_template(USER_PROMPT_TEMPLATE)
-    ])
-    
-    chain = chat_prompt | llm | JsonOutputParser()
+    with span("prompt.build", mode="transition"):
+        chat_prompt = ChatPromptTemplate.from_messages([
+            SystemMessagePromptTemplate.from_template(TRANSITION_SYSTEM_PROMPT),
+            HumanMessagePromptTemplate.from_template(USER_PROMPT_TEMPLATE)
+        ])
+
+        chain = chat_prompt | llm | JsonOutputParser()
     
-    response = await chain.ainvoke({
+    response = await invoke_chain(chain, {
         "current_code": current_code,
         "user_question": user_question,
         "history": history,
@@ -257,15 +262,16 @@ async def generate_vague_deep_reflection_response(
     基于以上所有信息（历史记忆、近期对话以及当前代码），继续对话回答我的问题。
     """
     # 4. 组装完整的Chat Prompt
-    chat_prompt = ChatPromptTemplate.from_messages([
-        SystemMessagePromptTemplate.from_template(system_prompt_template),
-        HumanMessagePromptTemplate.from_template(human_prompt)
-    ])
+    with span("prompt.build", mode=mode):
+        chat_prompt = ChatPromptTemplate.from_messages([
+            SystemMessagePromptTemplate.from_template(system_prompt_template),
+            HumanMessagePromptTemplate.from_template(human_prompt)
+        ])
 
-    # 5. 创建并调用LangChain链
-    chain = chat_prompt | llm | JsonOutputParser()
+        # 5. 创建并调用LangChain链
+        chain = chat_prompt | llm | JsonOutputParser()
 
-    response = await chain.ainvoke({
+    response = await invoke_chain(chain, {
         "reflection_templates": formatted_templates,
         "current_code": current_code,
         "user_question": user_question,
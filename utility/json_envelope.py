@@ -0,0 +1,295 @@
+# utility/json_envelope.py
+import codecs
+import json
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import orjson
+
+"""
+流式 JSON 信封校验 (Streaming JSON Envelope Scanner)
+
+按块接收请求体，在不构建完整对象图的情况下：
+- 校验整个请求体是一个语法正确、UTF-8 编码的 JSON 对象；
+- 记录顶层每个键对应值的类型 (object / array / string / number / true / false / null)；
+- 取出指定顶层字符串字段 (例如 session_id) 的值；
+- 按键路径收集少量指定的子树 (例如 ("usageData", "actionCounts"))，供会话分析使用。
+
+内存占用只与嵌套深度、单个数字/转义序列的长度和收集的子树大小 (max_collect) 有关，与请求体大小无关：
+其余字符串内容 (例如完整的 p5.js 代码) 由正则表达式在 C 层扫描，扫描后即丢弃。
+"""
+
+_WHITESPACE = re.compile(rb"[ \t\n\r]*")
+# 字符串内部：普通字符或合法的转义序列
+_STRING_BODY = re.compile(rb'(?:[^"\\\x00-\x1f]+|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))*')
+_NUMBER = re.compile(rb"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?")
+_NUMBER_CHARS = re.compile(rb"[-+.eE0-9]*")
+# 只含标量的扁平容器 (例如 TimeSegment、对话消息) 用一个正则整体校验，避免逐个记号处理。
+# 字符串用逐字符的交替而不是嵌套量词，保证匹配失败时不会发生回溯爆炸。
+_STRING = rb'"(?:[^"\\\x00-\x1f]|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))*"'
+_SCALAR = rb"(?:" + _STRING + rb"|" + _NUMBER.pattern + rb"|true|false|null)"
+_WS = rb"[ \t\n\r]*"
+_MEMBER = _STRING + _WS + rb":" + _WS + _SCALAR + _WS
+_FLAT_OBJECT = re.compile(rb"\{" + _WS + rb"(?:" + _MEMBER + rb"(?:," + _WS + _MEMBER + rb")*)?\}")
+_FLAT_ARRAY = re.compile(rb"\[" + _WS + rb"(?:" + _SCALAR + _WS + rb"(?:," + _WS + _SCALAR + _WS + rb")*)?\]")
+_LITERALS = {ord("t"): b"true", ord("f"): b"false", ord("n"): b"null"}
+# 跨块的未完成记号 (数字、字面量、转义序列) 的最大长度
+_MAX_CARRY = 64
+
+
+class JsonEnvelopeError(ValueError):
+    """请求体不是合法的 JSON 对象，或信封字段不符合要求。"""
+
+
+class JsonEnvelopeScanner:
+    """
+    增量 JSON 校验器。依次调用 feed(chunk)，最后调用 close()。
+
+    collect 中的键路径只匹配对象成员 (不经过数组)。子树的原始字节超过 max_collect 时放弃收集，
+    路径记入 truncated，不视为错误。
+    """
+
+    def __init__(self, capture: Iterable[str] = (), max_depth: int = 64, max_capture: int = 1024,
+                 collect: Iterable[Tuple[str, ...]] = (), max_collect: int = 4 * 1024 * 1024):
+        self.capture = set(capture)
+        self.max_depth = max_depth
+        self.max_capture = max_capture
+        self.collect = {tuple(path) for path in collect}
+        self.max_collect = max_collect
+        # 顶层键 -> 值的类型；顶层键 -> 取出的字符串值；键路径 -> 收集到的子树
+        self.types: Dict[str, str] = {}
+        self.values: Dict[str, Any] = {}
+        self.collected: Dict[Tuple[str, ...], Any] = {}
+        self.truncated: Set[Tuple[str, ...]] = set()
+        self.bytes_seen = 0
+
+        self._carry = b""
+        self._stack: List[int] = []
+        self._expect = "value"
+        self._in_string = False
+        self._string_is_key = False
+        self._captured: Optional[bytearray] = None
+        # 每层对象当前的键 (数组层为 None)，只记录到收集路径需要的深度
+        self._keys: List[Optional[str]] = []
+        self._key_depth = max((len(path) for path in self.collect), default=1)
+        # 收集路径的真前缀：这些容器需要逐个记号扫描，不能走扁平容器的快速路径
+        self._prefixes = {path[:k] for path in self.collect for k in range(1, len(path))}
+        # 正在收集的子树：原始字节、在当前缓冲区中的起点、路径和开始时的栈深度
+        self._raw: Optional[bytearray] = None
+        self._raw_start = 0
+        self._raw_path: Tuple[str, ...] = ()
+        self._raw_depth = 0
+        self._buf = b""
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+
+    # --- 公开接口 ---
+    def feed(self, chunk: bytes) -> None:
+        self._check_utf8(chunk, final=False)
+        self.bytes_seen += len(chunk)
+        self._scan(self._carry + chunk if self._carry else chunk, final=False)
+
+    def close(self) -> None:
+        self._check_utf8(b"", final=True)
+        self._scan(self._carry, final=True)
+        if self._in_string or self._stack or self._expect != "done":
+            raise JsonEnvelopeError(f"Unexpected end of JSON after {self.bytes_seen} bytes")
+
+    # --- 内部实现 ---
+    def _error(self, message: str) -> JsonEnvelopeError:
+        return JsonEnvelopeError(f"{message} (near byte {self.bytes_seen})")
+
+    def _check_utf8(self, chunk: bytes, final: bool) -> None:
+        try:
+            self._utf8.decode(chunk, final)
+        except UnicodeDecodeError as e:
+            raise JsonEnvelopeError(f"Request body is not valid UTF-8 (near byte {self.bytes_seen + e.start})")
+
+    def _hold(self, buf: bytes, i: int, final: bool) -> None:
+        """把缓冲区末尾不完整的记号留到下一块。"""
+        if final:
+            raise self._error("Unexpected end of JSON")
+        if len(buf) - i > _MAX_CARRY:
+            raise self._error("Token too long")
+        self._spill(i)
+        self._carry = buf[i:]
+
+    def _spill(self, stop: int) -> None:
+        """当前缓冲区处理到 stop 为止：把正在收集的子树的已处理部分移入 _raw。"""
+        if self._raw is None:
+            return
+        self._raw += self._buf[self._raw_start:stop]
+        self._raw_start = 0
+        if len(self._raw) > self.max_collect:
+            self.truncated.add(self._raw_path)
+            self._raw = None
+
+    def _path(self) -> Optional[Tuple[str, ...]]:
+        """即将开始的值的键路径；经过数组或超出记录深度时返回 None。"""
+        if len(self._stack) > self._key_depth or None in self._keys:
+            return None
+        return tuple(self._keys)
+
+    def _after_value(self, end: int) -> None:
+        if self._raw is not None and len(self._stack) == self._raw_depth:
+            raw = self._raw + self._buf[self._raw_start:end]
+            self._raw = None
+            if len(raw) > self.max_collect:
+                self.truncated.add(self._raw_path)
+            else:
+                self.collected[self._raw_path] = orjson.loads(raw)
+        self._expect = "done" if not self._stack else "comma_or_end"
+
+    def _begin_value(self, kind: str, start: int) -> None:
+        if len(self._stack) == 1 and self._keys[0] is not None:
+            self.types[self._keys[0]] = kind
+        if self.collect and self._raw is None and self._stack:
+            path = self._path()
+            if path in self.collect:
+                self._raw = bytearray()
+                self._raw_start = start
+                self._raw_path = path
+                self._raw_depth = len(self._stack)
+
+    def _begin_container(self, c: int) -> None:
+        self._stack.append(c)
+        self._keys.append(None)
+
+    def _end_container(self, end: int) -> None:
+        self._stack.pop()
+        self._keys.pop()
+        self._after_value(end)
+
+    def _begin_string(self, is_key: bool) -> None:
+        self._in_string = True
+        self._string_is_key = is_key
+        depth = len(self._stack)
+        if is_key:
+            capture = depth <= self._key_depth
+        else:
+            capture = depth == 1 and self._keys[0] in self.capture
+        self._captured = bytearray() if capture else None
+
+    def _end_string(self, end: int) -> None:
+        self._in_string = False
+        text = None
+        if self._captured is not None:
+            text = json.loads(b'"' + bytes(self._captured) + b'"')
+            self._captured = None
+        if self._string_is_key:
+            self._keys[-1] = text
+            self._expect = "colon"
+        else:
+            if text is not None:
+                self.values[self._keys[0]] = text
+            self._after_value(end)
+
+    def _scan(self, buf: bytes, final: bool) -> None:
+        self._carry = b""
+        self._buf = buf
+        i, n = 0, len(buf)
+        while i < n:
+            if self._in_string:
+                end = _STRING_BODY.match(buf, i).end()
+                if self._captured is not None:
+                    self._captured += buf[i:end]
+                    if len(self._captured) > self.max_capture:
+                        if self._string_is_key and len(self._stack) > 1:
+                            # 嵌套对象的长键不可能匹配收集路径，不再记录
+                            self._captured = None
+                        else:
+                            raise self._error(f"Field '{self._keys[0]}' is too long")
+                i = end
+                if i == n:
+                    break
+                c = buf[i]
+                if c == 0x22:  # "
+                    i += 1
+                    self._end_string(i)
+                elif c == 0x5C and n - i < 6:  # 跨块的转义序列
+                    self._hold(buf, i, final)
+                    return
+                else:
+                    raise self._error("Invalid character or escape in string")
+                continue
+
+            i = _WHITESPACE.match(buf, i).end()
+            if i == n:
+                break
+            c = buf[i]
+            expect = self._expect
+
+            if expect in ("value", "value_or_end"):
+                if c == 0x5D and expect == "value_or_end":  # ]
+                    i += 1
+                    self._end_container(i)
+                elif not self._stack and c != 0x7B:
+                    raise self._error("Request body must be a JSON object")
+                elif c in (0x7B, 0x5B):  # { [
+                    flat = None
+                    if self._stack and not (self._prefixes and self._path() in self._prefixes):
+                        flat = (_FLAT_OBJECT if c == 0x7B else _FLAT_ARRAY).match(buf, i)
+                    if flat is not None:
+                        self._begin_value("object" if c == 0x7B else "array", i)
+                        i = flat.end()
+                        self._after_value(i)
+                        continue
+                    if len(self._stack) >= self.max_depth:
+                        raise self._error("JSON nested too deeply")
+                    self._begin_value("object" if c == 0x7B else "array", i)
+                    self._begin_container(c)
+                    self._expect = "key_or_end" if c == 0x7B else "value_or_end"
+                    i += 1
+                elif c == 0x22:
+                    self._begin_value("string", i)
+                    self._begin_string(is_key=False)
+                    i += 1
+                elif c == 0x2D or 0x30 <= c <= 0x39:  # - 0-9
+                    # 数字可能在块边界处被截断，等下一块到达后再整体校验
+                    tail = _NUMBER_CHARS.match(buf, i).end()
+                    if tail == n and not final:
+                        self._hold(buf, i, final)
+                        return
+                    number = _NUMBER.match(buf, i)
+                    if number is None or number.end() != tail:
+                        raise self._error("Invalid number")
+                    self._begin_value("number", i)
+                    self._after_value(tail)
+                    i = tail
+                elif c in _LITERALS:
+                    literal = _LITERALS[c]
+                    if buf.startswith(literal, i):
+                        self._begin_value(literal.decode(), i)
+                        self._after_value(i + len(literal))
+                        i += len(literal)
+                    elif literal.startswith(buf[i:]):
+                        self._hold(buf, i, final)
+                        return
+                    else:
+                        raise self._error("Invalid literal")
+                else:
+                    raise self._error("Expected a JSON value")
+            elif expect in ("key_or_end", "key"):
+                if c == 0x7D and expect == "key_or_end":  # }
+                    self._end_container(i + 1)
+                elif c == 0x22:
+                    self._begin_string(is_key=True)
+                else:
+                    raise self._error("Expected an object key")
+                i += 1
+            elif expect == "colon":
+                if c != 0x3A:  # :
+                    raise self._error("Expected ':'")
+                self._expect = "value"
+                i += 1
+            elif expect == "comma_or_end":
+                top = self._stack[-1]
+                if c == 0x2C:  # ,
+                    self._expect = "key" if top == 0x7B else "value"
+                elif (c == 0x7D and top == 0x7B) or (c == 0x5D and top == 0x5B):
+                    self._end_container(i + 1)
+                else:
+                    raise self._error("Expected ',' or end of container")
+                i += 1
+            else:
+                raise self._error("Unexpected data after the JSON object")
+        self._spill(n)
@@ -0,0 +1,209 @@
+# utility/lifecycle.py
+import asyncio
+import logging
+import os
+import signal
+import time
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from utility.config import settings
+
+"""
+应用生命周期管理 (Lifecycle)
+
+职责:
+- 预热 (warm-up): 服务初始化后在后台执行预热步骤 (预连接 LLM 和 Embedding 客户端、加载 Chroma 集合)，
+  全部完成后 /ready 才返回 200，负载均衡器据此决定何时开始转发流量。
+- 排空 (drain): 收到 SIGTERM 后 /ready 立即返回 503，新请求以 503 + Retry-After 拒绝，
+  正在处理的请求和登记的后台任务在 DRAIN_TIMEOUT 内完成，超时则取消；
+  之后再把 SIGTERM 交给 uvicorn 正常关闭，由 lifespan 写完追踪、用量和日志缓冲。
+
+状态: starting -> warming -> ready -> draining -> stopped
+"""
+
+logger = logging.getLogger(__name__)
+
+# 排空期间仍然放行的路径：探针和指标
+_PROBE_PATHS = {"/", "/ready", "/metrics"}
+
+
+class LifecycleManager:
+    """维护应用状态、在途请求和后台任务，负责预热和 SIGTERM 排空。"""
+
+    def __init__(self):
+        self.state = "starting"
+        self.warmup_steps: Dict[str, Dict] = {}
+        self._requests: Set[asyncio.Task] = set()
+        self._background: Set[asyncio.Task] = set()
+        self._idle: Optional[asyncio.Event] = None
+        self._warmup_task: Optional[asyncio.Task] = None
+        self._drain_task: Optional[asyncio.Task] = None
+        self._previous_handler = None
+        self._drain_deadline: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    @property
+    def draining(self) -> bool:
+        return self.state in ("draining", "stopped")
+
+    # --- 预热 ---
+    def start_warmup(self, steps: Dict[str, Callable[[], Awaitable[None]]]) -> None:
+        """在后台依次执行预热步骤。单个步骤失败只记录错误，不阻止服务就绪。"""
+        self.state = "warming"
+        self._warmup_task = asyncio.create_task(self._run_warmup(steps))
+
+    async def _run_warmup(self, steps: Dict[str, Callable[[], Awaitable[None]]]) -> None:
+        started = time.perf_counter()
+        for name, step in steps.items():
+            step_start = time.perf_counter()
+            try:
+                await asyncio.wait_for(step(), timeout=settings.WARMUP_STEP_TIMEOUT)
+                self.warmup_steps[name] = {"ok": True}
+            except Exception as e:
+                self.warmup_steps[name] = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                logger.warning("⚠️ 预热步骤 %s 失败: %s", name, e)
+            self.warmup_steps[name]["duration_ms"] = round((time.perf_counter() - step_start) * 1000, 1)
+        if self.state == "warming":
+            self.state = "ready"
+        logger.info("✅ 预热完成，用时 %.2fs", time.perf_counter() - started,
+                    extra={"fields": {"steps": self.warmup_steps}})
+
+    # --- 在途工作登记 ---
+    def track(self, task: asyncio.Task) -> asyncio.Task:
+        """登记一个后台任务 (例如异步摘要作业)，排空时会等待它完成或在截止时间后取消它。"""
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    def _request_started(self, task: asyncio.Task) -> None:
+        self._requests.add(task)
+
+    def _request_finished(self, task: asyncio.Task) -> None:
+        self._requests.discard(task)
+        if not self._requests and self._idle is not None:
+            self._idle.set()
+
+    # --- 排空 ---
+    def install_signal_handler(self) -> None:
+        """
+        在 uvicorn 已安装的 SIGTERM 处理器外再包一层：先排空，再交给 uvicorn 关闭。
+        必须在 lifespan 启动阶段 (uvicorn 安装信号处理器之后) 调用。
+        """
+        loop = asyncio.get_running_loop()
+        self._previous_handler = signal.getsignal(signal.SIGTERM)
+
+        def handle_sigterm(signum, frame):
+            if self._drain_task is not None:
+                # 第二次 SIGTERM：不再等待，直接交给 uvicorn
+                self._hand_over(signum, frame)
+                return
+            loop.call_soon_threadsafe(self._begin_drain, signum, frame)
+
+        signal.signal(signal.SIGTERM, handle_sigterm)
+
+    def _begin_drain(self, signum, frame) -> None:
+        if self._drain_task is None:
+            self._drain_task = asyncio.create_task(self._drain_then_exit(signum, frame))
+
+    async def _drain_then_exit(self, signum, frame) -> None:
+        await self.drain(settings.DRAIN_TIMEOUT)
+        self._hand_over(signum, frame)
+
+    def _hand_over(self, signum, frame) -> None:
+        previous = self._previous_handler
+        if callable(previous):
+            previous(signum, frame)
+        else:
+            signal.signal(signal.SIGTERM, previous or signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+    async def drain(self, timeout: float) -> None:
+        """停止接收新工作，等待在途请求和后台任务在 timeout 秒内完成，超时后取消剩余的任务。"""
+        if not self.draining:
+            self.state = "draining"
+            self._drain_deadline = time.monotonic() + timeout
+            logger.info("⏳ 开始排空: %s 个在途请求, %s 个后台任务, 截止 %.0fs",
+                        len(self._requests), len(self._background), timeout)
+        if self._warmup_task is not None and not self._warmup_task.done():
+            self._warmup_task.cancel()
+
+        remaining = max(0.0, self._drain_deadline - time.monotonic())
+        if self._requests:
+            self._idle = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+        remaining = max(0.0, self._drain_deadline - time.monotonic())
+        if self._background:
+            await asyncio.wait(set(self._background), timeout=remaining)
+
+        leftovers = [task for task in (*self._requests, *self._background) if not task.done()]
+        for task in leftovers:
+            task.cancel()
+        if leftovers:
+            logger.warning("⚠️ 排空超时，已取消 %s 个未完成的任务", len(leftovers))
+            await asyncio.gather(*leftovers, return_exceptions=True)
+        else:
+            logger.info("✅ 在途工作已全部完成")
+
+    async def shutdown(self) -> None:
+        """lifespan 关闭阶段调用：确保排空已完成 (例如由 SIGINT 直接触发的关闭)。"""
+        if self._drain_task is None:
+            await self.drain(settings.DRAIN_TIMEOUT)
+        self.state = "stopped"
+
+
+lifecycle = LifecycleManager()
+
+
+async def _send_unavailable(send) -> None:
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"retry-after", b"1"),
+            (b"connection", b"close"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": b'{"detail":"Server is shutting down."}'})
+
+
+class DrainMiddleware:
+    """纯 ASGI 中间件：登记每个在途请求，排空期间以 503 拒绝新请求 (探针和指标路径除外)。"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") in _PROBE_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        if lifecycle.draining:
+            await _send_unavailable(send)
+            return
+
+        response_started = False
+
+        async def send_wrapper(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        task = asyncio.current_task()
+        lifecycle._request_started(task)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except asyncio.CancelledError:
+            if not lifecycle.draining or response_started:
+                raise
+            # 排空超时被取消：尚未开始响应时告诉客户端稍后重试
+            await _send_unavailable(send)
+        finally:
+            lifecycle._request_finished(task)
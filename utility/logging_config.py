@@ -0,0 +1,189 @@
+# utility/logging_config.py
+import atexit
+import json
+import logging
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from typing import Any, Optional
+
+from utility.config import settings
+from utility.tracing import current_trace_id
+
+"""
+结构化日志 (Structured Logging)
+
+职责:
+取代散落在各处的 print，提供：
+- JSON 格式的日志记录，每条记录自动带上 request_id、session_id 和 trace_id。
+- 基于队列的处理器：请求路径上只把日志记录放入队列，格式化和写 stdout 都在后台线程完成，
+  不会因为 stdout 阻塞而卡住事件循环。
+- log_payload: 用于记录完整 LLM 响应、代码等大体积内容，按 LOG_PAYLOAD_SAMPLE_RATE 采样，
+  且在 LOG_INCLUDE_BODIES 关闭时只记录内容的摘要（长度、键名），不记录正文。
+
+用法:
+    logger = logging.getLogger(__name__)
+    logger.info("版本记忆已存入", extra={"fields": {"doc_id": doc_id}})
+    logger.info("✅ 已删除 %s 个版本记忆", len(doc_ids))
+
+消息参数用 %-style 传入，而不是 f-string：参数在后台线程格式化 (getMessage)，
+调用方线程只创建 LogRecord；日志级别关闭时连 LogRecord 也不创建。
+"""
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+session_id_var: ContextVar[Optional[str]] = ContextVar("session_id", default=None)
+# 前端通过 X-User-Id 请求头传入的用户 ID
+user_id_var: ContextVar[Optional[str]] = ContextVar("user_id", default=None)
+
+_listener: Optional[QueueListener] = None
+
+# LogRecord 自带的属性，JSON 输出时不重复写入
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None)).keys()) | {"message", "asctime"}
+
+
+def bind_session(session_id: Optional[str]) -> None:
+    """由路由调用，为当前请求后续的所有日志记录绑定 session_id。"""
+    session_id_var.set(session_id)
+
+
+class JsonFormatter(logging.Formatter):
+    """把日志记录格式化为一行 JSON。"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "session_id": getattr(record, "session_id", None),
+            "user_id": getattr(record, "user_id", None),
+            "trace_id": getattr(record, "trace_id", None),
+        }
+        fields = getattr(record, "fields", None)
+        if isinstance(fields, dict):
+            entry.update(fields)
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and key not in entry and key != "fields":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _ContextQueueHandler(QueueHandler):
+    """
+    在调用方线程里只做两件事：附加请求上下文，把记录放入队列。
+    与标准 QueueHandler 不同，这里不在调用方格式化消息，格式化留给后台线程。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = request_id_var.get()
+        record.session_id = session_id_var.get()
+        record.user_id = user_id_var.get()
+        record.trace_id = current_trace_id()
+        return record
+
+
+def setup_logging() -> None:
+    """配置根 logger：所有记录经队列交给后台线程格式化并写入 stdout。可重复调用。"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if settings.LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(
+            "%(asctime)s %(levelname)s %(name)s [%(request_id)s %(session_id)s] %(message)s"
+        ))
+
+    log_queue: SimpleQueue = SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(settings.LOG_LEVEL)
+    root.addHandler(_ContextQueueHandler(log_queue))
+
+    # httpx 会为每个 HTTP 请求打印一条 INFO 日志，默认只保留警告
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """写完队列中剩余的日志后停止后台线程。"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _summarize_payload(payload: Any) -> Any:
+    """关闭正文记录时，只保留载荷的结构信息。"""
+    if isinstance(payload, dict):
+        return {key: _summarize_payload(value) for key, value in payload.items()}
+    if isinstance(payload, (list, tuple)):
+        return {"items": len(payload)}
+    if isinstance(payload, str):
+        return {"chars": len(payload)}
+    return payload
+
+
+def log_payload(logger: logging.Logger, message: str, payload: Any, **fields: Any) -> None:
+    """
+    记录大体积载荷（完整 LLM 响应、代码等）。
+    按 LOG_PAYLOAD_SAMPLE_RATE 采样；LOG_INCLUDE_BODIES 关闭时只记录载荷的结构摘要。
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if random.random() >= settings.LOG_PAYLOAD_SAMPLE_RATE:
+        return
+    body = payload if settings.LOG_INCLUDE_BODIES else _summarize_payload(payload)
+    logger.debug(message, extra={"fields": {**fields, "payload": body}})
+
+
+class RequestContextMiddleware:
+    """
+    纯 ASGI 中间件：为每个请求分配 request_id（或沿用 X-Request-Id 请求头），并写回响应头；
+    同时读取 X-User-Id 请求头作为当前请求的 user_id。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1") or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        session_token = session_id_var.set(None)
+        user_token = user_id_var.set(headers.get(b"x-user-id", b"").decode("utf-8", "replace") or None)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message = {
+                    **message,
+                    "headers": list(message.get("headers") or []) + [(b"x-request-id", request_id.encode("latin-1"))],
+                }
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            logging.getLogger("access").info(
+                "%s %s", scope.get("method", ""), scope.get("path", ""),
+                extra={"fields": {"duration_ms": round((time.perf_counter() - start) * 1000, 2)}},
+            )
+            user_id_var.reset(user_token)
+            session_id_var.reset(session_token)
+            request_id_var.reset(token)
@@ -0,0 +1,297 @@
+# utility/metrics.py
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.embeddings import Embeddings
+from langchain_core.outputs import LLMResult
+from prometheus_client import Counter, Gauge, Histogram
+from starlette.routing import Match
+
+"""
+Prometheus 指标 (Metrics)
+
+职责:
+集中定义后端的所有 Prometheus 指标，并提供记录它们的工具：
+- MetricsMiddleware: 记录每个路由的延迟和进行中的请求数。
+- LLMUsageCallback / llm_queued / llm_in_flight: 记录 LLM 调用耗时、Prompt/Completion token 数和重试次数。
+- observe_vector_op: 记录 Chroma 查询、写入和删除的耗时。
+- InstrumentedEmbeddings: 统计 Embedding 调用次数。
+- monitor_event_loop_lag: 后台任务，持续测量事件循环延迟。
+指标通过 /metrics 端点以 Prometheus 文本格式暴露。
+"""
+
+REFLECTION_MODES = ("explainable", "explorative", "transformative", "general")
+
+# --- 请求上下文：由中间件和路由写入，供 LLM 指标打标签 ---
+current_route: ContextVar[str] = ContextVar("current_route", default="none")
+current_mode: ContextVar[str] = ContextVar("current_mode", default="none")
+# 当前 LLM 调用中的重试次数 (由限流传输层的 record_llm_retry 累加)
+_current_retries: ContextVar[Optional[List[int]]] = ContextVar("current_retries", default=None)
+
+# --- HTTP 路由 ---
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route.",
+    ["route", "method", "status"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120),
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "HTTP requests currently being handled.", ["route"], multiprocess_mode="livesum"
+)
+
+# --- LLM 调用 ---
+LLM_CALL_DURATION = Histogram(
+    "llm_call_duration_seconds", "LLM call latency, excluding time spent queued.",
+    ["route", "mode", "outcome"],
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120),
+)
+LLM_PROMPT_TOKENS = Histogram(
+    "llm_prompt_tokens", "Prompt tokens per LLM call.", ["route", "mode"],
+    buckets=(100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000),
+)
+LLM_COMPLETION_TOKENS = Histogram(
+    "llm_completion_tokens", "Completion tokens per LLM call.", ["route", "mode"],
+    buckets=(10, 50, 100, 250, 500, 1000, 2000, 4000, 8000),
+)
+LLM_RETRIES = Histogram(
+    "llm_retries", "Client-side retries per LLM call.", ["route", "mode"],
+    buckets=(0, 1, 2, 3, 5, 8),
+)
+LLM_REQUESTS_IN_FLIGHT = Gauge(
+    "llm_requests_in_flight", "LLM calls currently running.", ["route", "mode"], multiprocess_mode="livesum"
+)
+LLM_REQUESTS_QUEUED = Gauge(
+    "llm_requests_queued", "LLM calls waiting for a concurrency slot.", ["route", "mode"], multiprocess_mode="livesum"
+)
+LLM_SCHEDULER_QUEUE_DEPTH = Gauge(
+    "llm_scheduler_queue_depth", "LLM calls waiting in the scheduler, by priority class.", ["priority"],
+    multiprocess_mode="livesum",
+)
+LLM_SCHEDULER_IN_FLIGHT = Gauge(
+    "llm_scheduler_in_flight", "LLM calls holding a scheduler slot, by priority class.", ["priority"],
+    multiprocess_mode="livesum",
+)
+LLM_SCHEDULER_WAIT = Histogram(
+    "llm_scheduler_wait_seconds", "Time an LLM call waited for a scheduler slot, by priority class.", ["priority"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+LLM_HEDGE_EVENTS = Counter(
+    "llm_hedge_events_total", "Hedged LLM requests (fired / hedge_won / primary_won / failed).", ["route", "event"]
+)
+LLM_DEADLINE_EXCEEDED = Counter(
+    "llm_deadline_exceeded_total", "LLM calls abandoned because the request budget ran out.", ["route"]
+)
+REQUESTS_CANCELLED = Counter(
+    "requests_cancelled_total", "Requests cancelled early (client disconnect / client deadline).", ["route", "reason"]
+)
+LLM_CALLS_CANCELLED = Counter(
+    "llm_calls_cancelled_total", "LLM calls cancelled because their request was abandoned (queued / in_flight).",
+    ["route", "stage"],
+)
+LLM_TOKENS_SAVED = Counter(
+    "llm_tokens_saved_total", "Estimated tokens not spent on abandoned requests (upper bound for in-flight calls).",
+    ["route"],
+)
+RATE_LIMIT_WAIT = Histogram(
+    "azure_rate_limit_wait_seconds", "Client-side delay before sending an Azure OpenAI request to stay within quota.",
+    ["api"], buckets=(0, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+RATE_LIMIT_THROTTLED = Counter(
+    "azure_rate_limit_throttled_total", "Azure OpenAI responses with status 429.", ["api"]
+)
+
+# --- 向量数据库与 Embedding ---
+VECTOR_OP_DURATION = Histogram(
+    "chroma_operation_duration_seconds", "Chroma operation latency.", ["operation"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+EMBEDDING_CALLS = Counter(
+    "embedding_calls_total", "Embedding API calls.", ["kind"]
+)
+EMBEDDING_TEXTS = Counter(
+    "embedding_texts_total", "Texts sent to the embedding API.", ["kind"]
+)
+SESSION_INDEX_EVENTS = Counter(
+    "session_index_events_total", "Per-session vector index cache events (hit / load / evict).", ["event"]
+)
+SUMMARY_REQUESTS = Counter(
+    "summary_requests_total", "Version summaries by path (single call / batched call / single-call fallback).", ["path"]
+)
+SUMMARY_JOB_EVENTS = Counter(
+    "summary_job_events_total", "Async summary jobs (submitted / done / failed).", ["event"]
+)
+RETENTION_EVENTS = Counter(
+    "retention_events_total", "Session retention work (expired_session / deleted_version / compaction).", ["event"]
+)
+
+# --- 事件循环 ---
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "Delay between a scheduled wake-up and its execution.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+
+def normalize_mode(mode: Optional[str]) -> str:
+    """把请求中的模式字符串归一化为固定的标签值，避免标签基数失控。"""
+    mode = (mode or "").strip()
+    return mode if mode in REFLECTION_MODES else "general"
+
+
+def set_request_mode(mode: Optional[str]) -> None:
+    """由路由调用，为当前请求后续的 LLM 指标设置 mode 标签。"""
+    current_mode.set(normalize_mode(mode))
+
+
+def llm_labels() -> Dict[str, str]:
+    return {"route": current_route.get(), "mode": current_mode.get()}
+
+
+# --- HTTP 中间件 ---
+def _route_template(scope) -> str:
+    """找到与请求匹配的路由模板，未匹配时返回 "unmatched"，避免把任意路径写进标签。"""
+    return _match_routes(getattr(scope.get("app"), "routes", []), scope) or "unmatched"
+
+
+def _match_routes(routes, scope) -> Optional[str]:
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match != Match.FULL:
+            continue
+        # 新版 FastAPI 把 include_router 的子路由包在 _IncludedRouter 里 (没有 path)，需要逐层向下找
+        nested = getattr(route, "routes", None) or getattr(getattr(route, "original_router", None), "routes", None)
+        if nested and not hasattr(route, "path"):
+            return _match_routes(nested, scope)
+        return getattr(route, "path", None)
+    return None
+
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件：记录每个路由的延迟和进行中的请求数。"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = _route_template(scope)
+        current_route.set(route)
+        status_code = {"value": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_code["value"] = message["status"]
+            await send(message)
+
+        in_flight = HTTP_REQUESTS_IN_FLIGHT.labels(route=route)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            HTTP_REQUEST_DURATION.labels(
+                route=route, method=scope.get("method", ""), status=str(status_code["value"])
+            ).observe(time.perf_counter() - start)
+
+
+# --- LLM 调用 ---
+class LLMUsageCallback(AsyncCallbackHandler):
+    """LangChain 回调：在 LLM 返回时记录 token 用量。"""
+
+    def __init__(self, labels: Dict[str, str]):
+        self.labels = labels
+
+    async def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if "prompt_tokens" in usage:
+            LLM_PROMPT_TOKENS.labels(**self.labels).observe(usage["prompt_tokens"])
+        if "completion_tokens" in usage:
+            LLM_COMPLETION_TOKENS.labels(**self.labels).observe(usage["completion_tokens"])
+
+
+@contextmanager
+def llm_queued():
+    """在等待 LLM 并发名额期间计入排队数。"""
+    gauge = LLM_REQUESTS_QUEUED.labels(**llm_labels())
+    gauge.inc()
+    try:
+        yield
+    finally:
+        gauge.dec()
+
+
+@contextmanager
+def llm_in_flight():
+    """在 LLM 调用执行期间计入进行中的调用数，并记录本次调用的重试次数。"""
+    labels = llm_labels()
+    gauge = LLM_REQUESTS_IN_FLIGHT.labels(**labels)
+    retries = [0]
+    token = _current_retries.set(retries)
+    gauge.inc()
+    try:
+        yield
+    finally:
+        gauge.dec()
+        _current_retries.reset(token)
+        LLM_RETRIES.labels(**labels).observe(retries[0])
+
+
+def record_llm_retry() -> None:
+    """限流传输层 (services/rate_limiter.py) 每次重试请求时调用，计入当前 LLM 调用的重试次数。"""
+    retries = _current_retries.get()
+    if retries is not None:
+        retries[0] += 1
+
+
+# --- 向量数据库 ---
+@contextmanager
+def observe_vector_op(operation: str):
+    """记录一次 Chroma 操作 (query / upsert / delete) 的耗时。"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        VECTOR_OP_DURATION.labels(operation=operation).observe(time.perf_counter() - start)
+
+
+class InstrumentedEmbeddings(Embeddings):
+    """包装一个 Embeddings 实例，统计调用次数和文本数量。"""
+
+    def __init__(self, inner: Embeddings):
+        self.inner = inner
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        EMBEDDING_CALLS.labels(kind="documents").inc()
+        EMBEDDING_TEXTS.labels(kind="documents").inc(len(texts))
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        EMBEDDING_CALLS.labels(kind="query").inc()
+        EMBEDDING_TEXTS.labels(kind="query").inc()
+        return self.inner.embed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        EMBEDDING_CALLS.labels(kind="documents").inc()
+        EMBEDDING_TEXTS.labels(kind="documents").inc(len(texts))
+        return await self.inner.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        EMBEDDING_CALLS.labels(kind="query").inc()
+        EMBEDDING_TEXTS.labels(kind="query").inc()
+        return await self.inner.aembed_query(text)
+
+
+# --- 事件循环延迟 ---
+async def monitor_event_loop_lag(interval: float = 0.5) -> None:
+    """后台任务：每隔 interval 秒醒来一次，记录实际醒来时间比预期晚了多少。"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - expected))
@@ -1,6 +1,6 @@
 # utility/schemas.py
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 # --- Schemas for other parts of the application (unchanged) ---
 
@@ -14,6 +14,20 @@ class DeleteVersionRequest(BaseModel):
     session_id: str
     version_id: str
 
+class BulkVersion(BaseModel):
+    version_id: str
+    code: str
+    description: str
+
+class BulkAddVersionsRequest(BaseModel):
+    session_id: str
+    versions: List[BulkVersion]
+
+class BulkDeleteVersionsRequest(BaseModel):
+    session_id: str
+    # 省略时删除整个会话的全部版本
+    version_ids: Optional[List[str]] = None
+
 class ChatRequest(BaseModel):
     session_id: str
     version_id: str
@@ -35,6 +49,17 @@ class MergeRequest(BaseModel):
     instruction: str
     mode: str
 
+class MergeVersion(BaseModel):
+    version_id: str
+    code: str
+    description: str
+
+class MultiMergeRequest(BaseModel):
+    session_id: str
+    versions: List[MergeVersion]
+    instruction: str
+    mode: str
+
 # --- ‼️【修改】Schemas for the 'modify' feature ---
 
 # StyleRecommendRequest is no longer needed as the new endpoint takes no arguments.
@@ -0,0 +1,284 @@
+# utility/tracing.py
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import AsyncCallbackHandler
+
+from utility.config import settings
+
+"""
+请求追踪 (Tracing)
+
+职责:
+为每个 HTTP 请求生成一条 trace，并在其中记录各个阶段的 span（Chroma 检索、记忆格式化、
+Prompt 构建、LLM 调用、JSON 解析、深度反思分支等），用于定位慢请求到底慢在哪一步。
+
+实现:
+- Span 的字段与 OTLP/JSON 保持一致 (traceId / spanId / parentSpanId / startTimeUnixNano ...)，
+  支持 W3C `traceparent` 请求头，trace ID 通过 `X-Trace-Id` 响应头返回给前端。
+- 结束的 span 放入队列，由后台线程追加写入本地 JSONL 文件，不阻塞事件循环。
+- LangChain chain 内部的阶段 (Prompt 模板、LLM、输出解析器) 由 TracingCallback 自动生成 span。
+- `python -m tools.trace_report` 可以打印最慢 N 个请求的分阶段耗时。
+"""
+
+logger = logging.getLogger(__name__)
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """一个追踪阶段。字段命名与 OTLP/JSON 一致，便于导入其他工具。"""
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: Optional[str] = None,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = "OK"
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.status = "ERROR"
+            self.attributes["error"] = f"{type(error).__name__}: {error}"
+        _exporter.export(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id or "",
+            "name": self.name,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()
+            ],
+            "status": {"code": "STATUS_CODE_ERROR" if self.status == "ERROR" else "STATUS_CODE_OK"},
+        }
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class JsonlSpanExporter:
+    """把结束的 span 交给后台线程，以 JSONL 格式追加写入本地文件。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        if not settings.TRACING_ENABLED:
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                    self._thread.start()
+        self._queue.put(span)
+
+    def _run(self) -> None:
+        while True:
+            span = self._queue.get()
+            if span is None:
+                return
+            batch: List[Span] = [span]
+            # 一次取走队列中已有的全部 span，合并为一次写入
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._write(batch)
+                    return
+                batch.append(item)
+            self._write(batch)
+
+    def _write(self, batch: List[Span]) -> None:
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                for span in batch:
+                    f.write(json.dumps(span.to_otlp(), ensure_ascii=False) + "\n")
+        except Exception as e:
+            logger.error("❌ 写入追踪数据失败: %s", e)
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """写完队列中剩余的 span 后停止后台线程。"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+
+_exporter = JsonlSpanExporter(settings.TRACE_EXPORT_PATH)
+
+
+def shutdown_tracing() -> None:
+    _exporter.shutdown()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+def start_span(name: str, parent: Optional[Span] = None, **attributes: Any) -> Span:
+    """创建一个 span（不会设为当前 span），父 span 默认为当前 span。"""
+    parent = parent or _current_span.get()
+    if parent is None:
+        return Span(name, trace_id=secrets.token_hex(16), attributes=attributes)
+    return Span(name, trace_id=parent.trace_id, parent_span_id=parent.span_id, attributes=attributes)
+
+
+@contextmanager
+def span(name: str, **attributes: Any):
+    """
+    在 with 块内记录一个阶段，并把它设为当前 span，块内创建的 span 会成为它的子 span。
+
+    用法:
+        with span("chroma.retrieve", k=3):
+            results = vector_store.similarity_search(...)
+    """
+    current = start_span(name, **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(error=e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+# --- LangChain 回调：为 chain 内部的每个阶段生成 span ---
+class TracingCallback(AsyncCallbackHandler):
+    """
+    把 LangChain 的 run 映射为 span：Prompt 模板、LLM 调用和输出解析器各自成为一个 span，
+    从而区分 Prompt 构建、LLM 调用和 JsonOutputParser 解析的耗时。
+    """
+
+    def __init__(self, parent: Optional[Span]):
+        self.parent = parent
+        self._spans: Dict[UUID, Span] = {}
+
+    def _start(self, kind: str, serialized: Optional[Dict[str, Any]], run_id: UUID,
+               parent_run_id: Optional[UUID], **kwargs: Any) -> None:
+        name = kwargs.get("name") or (serialized or {}).get("name") or ((serialized or {}).get("id") or ["run"])[-1]
+        parent = self._spans.get(parent_run_id) if parent_run_id else None
+        self._spans[run_id] = start_span(f"{kind}.{name}", parent=parent or self.parent)
+
+    def _end(self, run_id: UUID, error: Optional[BaseException] = None) -> None:
+        current = self._spans.pop(run_id, None)
+        if current is not None:
+            current.end(error=error)
+
+    async def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs) -> None:
+        self._start("chain", serialized, run_id, parent_run_id, **kwargs)
+
+    async def on_chain_end(self, outputs, *, run_id, **kwargs) -> None:
+        self._end(run_id)
+
+    async def on_chain_error(self, error, *, run_id, **kwargs) -> None:
+        self._end(run_id, error)
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs) -> None:
+        self._start("llm", serialized, run_id, parent_run_id, **kwargs)
+
+    async def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs) -> None:
+        self._start("llm", serialized, run_id, parent_run_id, **kwargs)
+
+    async def on_llm_end(self, response, *, run_id, **kwargs) -> None:
+        current = self._spans.get(run_id)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if current is not None:
+            for key in ("prompt_tokens", "completion_tokens"):
+                if key in usage:
+                    current.set_attribute(key, usage[key])
+        self._end(run_id)
+
+    async def on_llm_error(self, error, *, run_id, **kwargs) -> None:
+        self._end(run_id, error)
+
+
+# --- HTTP 中间件 ---
+def _parse_traceparent(value: str) -> Optional[tuple]:
+    """解析 W3C traceparent: version-traceid-spanid-flags。"""
+    parts = value.split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2]
+
+
+class TracingMiddleware:
+    """纯 ASGI 中间件：为每个请求创建根 span，并在响应头中返回 trace ID。"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        root = start_span(
+            f"{scope.get('method', '')} {scope.get('path', '')}",
+            **{"http.method": scope.get("method", ""), "http.target": scope.get("path", "")},
+        )
+        incoming = _parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        if incoming:
+            root.trace_id, root.parent_span_id = incoming
+        token = _current_span.set(root)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                root.set_attribute("http.status_code", message["status"])
+                response_headers = list(message.get("headers") or [])
+                response_headers.append((b"x-trace-id", root.trace_id.encode("latin-1")))
+                response_headers.append(
+                    (b"traceparent", f"00-{root.trace_id}-{root.span_id}-01".encode("latin-1"))
+                )
+                message = {**message, "headers": response_headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            root.end(error=e)
+            raise
+        finally:
+            _current_span.reset(token)
+            root.end()